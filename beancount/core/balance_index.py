@@ -0,0 +1,210 @@
+"""An index of the balances of accounts at any date.
+
+Computing the balance of an account at a date normally requires summing up all
+of its postings from the beginning of history. A BalanceIndex is built once from
+a sorted list of entries, and stores for each account the dates and the
+positions of its postings, along with a checkpoint of its running balance every
+few postings. The balance at a date is then looked up by bisecting the dates,
+copying the last checkpoint before it and replaying the few postings which
+follow it.
+
+Balances are computed like summarize.balance_by_account(): postings are added
+with Inventory.add_position(), and the balance at a date includes the postings
+strictly before that date, like a balance assertion.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import array
+import bisect
+
+from beancount.core.data import Transaction
+from beancount.core import inventory
+
+
+# The default number of postings between checkpoints of the running balance.
+DEFAULT_CHECKPOINT_INTERVAL = 64
+
+
+class AccountBalances:
+    """The postings and the checkpointed running balance of a single account.
+
+    Attributes:
+      dates: An array of the date ordinals of the postings.
+      postings: A list of the Posting instances of the account, in order.
+      checkpoints: A list of Inventory instances, the balance after each
+        multiple of the checkpoint interval of postings, starting with an empty
+        one.
+    """
+    __slots__ = ('dates', 'postings', 'checkpoints')
+
+    def __init__(self):
+        self.dates = array.array('l')
+        self.postings = []
+        self.checkpoints = [inventory.Inventory()]
+
+
+class BalanceIndex:
+    """An index of the balances of all the accounts.
+
+    Attributes:
+      interval: An integer, the number of postings between checkpoints.
+      accounts: A dict of account name to its AccountBalances.
+      account_names: A sorted list of the names of the accounts, used to find
+        the subaccounts of an account.
+    """
+    def __init__(self, entries, interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """Build an index from a list of entries.
+
+        Args:
+          entries: A list of directives, sorted by date.
+          interval: An integer, the number of postings between checkpoints.
+        Raises:
+          ValueError: If the entries are not sorted by date.
+        """
+        self.interval = interval
+        self.accounts = {}
+        running_balances = {}
+        last_ordinal = None
+        for entry in entries:
+            if not isinstance(entry, Transaction):
+                continue
+            ordinal = entry.date.toordinal()
+            if last_ordinal is not None and ordinal < last_ordinal:
+                raise ValueError("Entries are not sorted by date at {}".format(
+                    entry.date))
+            last_ordinal = ordinal
+            for posting in entry.postings:
+                try:
+                    balances = self.accounts[posting.account]
+                    balance = running_balances[posting.account]
+                except KeyError:
+                    balances = self.accounts[posting.account] = AccountBalances()
+                    balance = running_balances[posting.account] = (
+                        inventory.new_accumulator())
+                balances.dates.append(ordinal)
+                balances.postings.append(posting)
+                balance.add_position(posting)
+                if len(balances.postings) % interval == 0:
+                    balances.checkpoints.append(balance.to_inventory())
+        self.account_names = sorted(self.accounts)
+
+    def get_accounts(self, account_name, include_children=True):
+        """Get the names of an account and its subaccounts which have postings.
+
+        Args:
+          account_name: A string, the name of an account.
+          include_children: A boolean, true if subaccounts should be included.
+        Returns:
+          A list of account names.
+        """
+        if not include_children:
+            return [account_name] if account_name in self.accounts else []
+        if not account_name:
+            return self.account_names
+        prefix = account_name + ':'
+        names = self.account_names
+        index = bisect.bisect_left(names, account_name)
+        accounts = []
+        for name in names[index:]:
+            if name != account_name and not name.startswith(prefix):
+                break
+            accounts.append(name)
+        return accounts
+
+    def balance_at(self, account_name, date=None, include_children=True):
+        """Get the balance of an account before a date.
+
+        Args:
+          account_name: A string, the name of an account, or the empty string
+            for the total of all the accounts.
+          date: A datetime.date instance; only the postings strictly before
+            this date are included. If None, all the postings are.
+          include_children: A boolean, true if the postings of the subaccounts
+            should be included.
+        Returns:
+          A new Inventory instance.
+        """
+        balance = inventory.Inventory()
+        for name in self.get_accounts(account_name, include_children):
+            balances = self.accounts[name]
+            balance.add_inventory(self._balance_at(balances, self._count(balances, date)))
+        return balance
+
+    def balances_between(self, account_name, begin_date, end_date,
+                         include_children=True):
+        """Get the change in the balance of an account between two dates.
+
+        Args:
+          account_name: A string, the name of an account, or the empty string
+            for the total of all the accounts.
+          begin_date: A datetime.date instance, the first date whose postings
+            are included, or None for the beginning of history.
+          end_date: A datetime.date instance, the date before which postings are
+            included, or None for the end of history.
+          include_children: A boolean, true if the postings of the subaccounts
+            should be included.
+        Returns:
+          A new Inventory instance, the sum of the postings in the period.
+        """
+        balance = inventory.Inventory()
+        for name in self.get_accounts(account_name, include_children):
+            balances = self.accounts[name]
+            begin = self._count(balances, begin_date)
+            end = self._count(balances, end_date)
+            if end - begin <= 2 * self.interval:
+                for posting in balances.postings[begin:end]:
+                    balance.add_position(posting)
+            else:
+                balance.add_inventory(self._balance_at(balances, end))
+                balance.add_inventory(-self._balance_at(balances, begin))
+        return balance
+
+    def balances_at(self, date=None):
+        """Get the balances of all the accounts before a date.
+
+        Args:
+          date: A datetime.date instance; only the postings strictly before
+            this date are included. If None, all the postings are.
+        Returns:
+          A dict of account name to a new Inventory instance, for all the
+          accounts with postings before the date, like
+          summarize.balance_by_account().
+        """
+        balances_map = {}
+        for name in self.account_names:
+            balances = self.accounts[name]
+            count = self._count(balances, date)
+            if count > 0:
+                balances_map[name] = self._balance_at(balances, count)
+        return balances_map
+
+    def _count(self, balances, date):
+        """Count the postings of an account strictly before a date.
+
+        Args:
+          balances: An AccountBalances instance.
+          date: A datetime.date instance, or None for all the postings.
+        Returns:
+          An integer, a number of postings.
+        """
+        if date is None:
+            return len(balances.dates)
+        return bisect.bisect_left(balances.dates, date.toordinal())
+
+    def _balance_at(self, balances, count):
+        """Compute the balance of the first postings of an account.
+
+        Args:
+          balances: An AccountBalances instance.
+          count: An integer, the number of postings to include.
+        Returns:
+          A new Inventory instance.
+        """
+        checkpoint, remainder = divmod(count, self.interval)
+        if not remainder:
+            return inventory.Inventory(balances.checkpoints[checkpoint])
+        balance = inventory.new_accumulator(balances.checkpoints[checkpoint])
+        for posting in balances.postings[count - remainder:count]:
+            balance.add_position(posting)
+        return balance.to_inventory()
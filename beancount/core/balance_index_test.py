@@ -0,0 +1,114 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import datetime
+import unittest
+from os import path
+
+from beancount.core import balance_index
+from beancount.core import inventory
+from beancount.core import realization
+from beancount.ops import summarize
+from beancount.utils import test_utils
+from beancount import loader
+
+
+class TestBalanceIndex(unittest.TestCase):
+
+    @loader.load_doc()
+    def setUp(self, entries, _, __):
+        """
+        2014-01-01 open Assets:Bank
+        2014-01-01 open Assets:Bank:Savings
+        2014-01-01 open Assets:Broker
+        2014-01-01 open Income:Salary
+
+        2014-01-15 * "Salary"
+          Income:Salary        -1000 USD
+          Assets:Bank           1000 USD
+
+        2014-02-01 * "Transfer"
+          Assets:Bank           -300 USD
+          Assets:Bank:Savings    300 USD
+
+        2014-02-15 * "Buy"
+          Assets:Bank           -200 USD
+          Assets:Broker            2 HOOL {100 USD}
+
+        2014-03-15 * "Salary"
+          Income:Salary        -1000 USD
+          Assets:Bank           1000 USD
+        """
+        self.entries = entries
+        self.index = balance_index.BalanceIndex(entries, interval=2)
+
+    def test_balance_at(self):
+        self.assertEqual(inventory.from_string('1000 USD'),
+                         self.index.balance_at('Assets:Bank', datetime.date(2014, 2, 1)))
+        self.assertEqual(inventory.from_string('800 USD'),
+                         self.index.balance_at('Assets:Bank', datetime.date(2014, 3, 1)))
+        self.assertEqual(inventory.from_string('500 USD'),
+                         self.index.balance_at('Assets:Bank', datetime.date(2014, 3, 1),
+                                               include_children=False))
+        self.assertEqual(inventory.from_string('1800 USD'),
+                         self.index.balance_at('Assets:Bank'))
+        self.assertEqual(inventory.Inventory(),
+                         self.index.balance_at('Assets:Bank', datetime.date(2014, 1, 15)))
+        self.assertEqual(inventory.from_string('-200 USD, 2 HOOL {100 USD, 2014-02-15}'),
+                         self.index.balance_at(''))
+        self.assertEqual(inventory.Inventory(), self.index.balance_at('Assets:Unknown'))
+
+    def test_balances_between(self):
+        self.assertEqual(inventory.from_string('-500 USD'),
+                         self.index.balances_between('Assets:Bank',
+                                                     datetime.date(2014, 2, 1),
+                                                     datetime.date(2014, 3, 1),
+                                                     include_children=False))
+        self.assertEqual(inventory.from_string('-1000 USD'),
+                         self.index.balances_between('Income',
+                                                     datetime.date(2014, 2, 1),
+                                                     None))
+
+    def test_get_accounts(self):
+        self.assertEqual(['Assets:Bank', 'Assets:Bank:Savings'],
+                         self.index.get_accounts('Assets:Bank'))
+        self.assertEqual(['Assets:Bank'],
+                         self.index.get_accounts('Assets:Bank', False))
+        self.assertEqual(['Assets:Bank', 'Assets:Bank:Savings', 'Assets:Broker'],
+                         self.index.get_accounts('Assets'))
+        self.assertEqual([], self.index.get_accounts('Assets:Ba'))
+
+    def test_unsorted(self):
+        with self.assertRaises(ValueError):
+            balance_index.BalanceIndex(list(reversed(self.entries)))
+
+
+class TestBalanceIndexExample(unittest.TestCase):
+
+    def test_example(self):
+        filename = path.join(test_utils.find_repository_root(__file__),
+                             'examples', 'example.beancount')
+        entries, errors, _ = loader.load_file(filename)
+        self.assertFalse(errors)
+        index = balance_index.BalanceIndex(entries)
+        real_root = realization.realize(entries)
+        for date in [datetime.date(2014, 1, 1),
+                     datetime.date(2015, 6, 15),
+                     datetime.date(2016, 12, 31)]:
+            balances, _ = summarize.balance_by_account(entries, date)
+            self.assertEqual(balances, index.balances_at(date))
+            for account_name in 'Assets:US:ETrade', 'Expenses:Food', '':
+                real_account = (realization.get(real_root, account_name)
+                                if account_name else real_root)
+                expected = inventory.Inventory()
+                for real_child in realization.iter_children(real_account):
+                    expected.add_inventory(balances.get(real_child.account,
+                                                        inventory.Inventory()))
+                self.assertEqual(expected, index.balance_at(account_name, date))
+
+        begin, end = datetime.date(2014, 3, 1), datetime.date(2016, 3, 1)
+        for account_name in 'Assets:US:ETrade', 'Income', 'Assets:US:BofA:Checking':
+            expected = index.balance_at(account_name, end)
+            expected.add_inventory(-index.balance_at(account_name, begin))
+            self.assertEqual(expected,
+                             index.balances_between(account_name, begin, end))
@@ -6,6 +6,7 @@ __license__ = "GNU GPLv2"
 import collections
 import hashlib
 
+from beancount.core.amount import Amount
 from beancount.core.data import Price
 from beancount.core import data
 
@@ -13,41 +14,79 @@ from beancount.core import data
 CompareError = collections.namedtuple('CompareError', 'source message entry')
 
 # A list of field names that are being ignored for persistence.
-IGNORED_FIELD_NAMES = {'meta', 'diff_amount'}
+IGNORED_FIELD_NAMES = frozenset({'meta', 'diff_amount'})
 
 
 def stable_hash_namedtuple(objtuple, ignore=frozenset()):
     """Hash the given namedtuple and its child fields.
 
-    The hash_obj is updated. This iterates over all the members of objtuple,
-    skipping the attributes from 'ignore', and if the elements are
-    lists or sets, sorts them for stability.
+    This iterates over all the members of objtuple, skipping the attributes
+    from 'ignore', and if the elements are lists or sets, sorts them for
+    stability. The fields are serialized to a single canonical string, which is
+    hashed once.
 
     Args:
       objtuple: A tuple object or other.
       ignore: A set of strings, attribute names to be skipped in
         computing a stable hash. For instance, circular references to objects
         or irrelevant data.
+    Returns:
+      A string, the 128-bit hexadecimal digest of the tuple.
+    """
+    encoded = encode_namedtuple(objtuple, frozenset(ignore)).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+# A dict of (namedtuple class, ignored field names) to the indexes of the fields
+# to serialize.
+_fields_cache = {}
+
+
+def encode_namedtuple(objtuple, ignore=frozenset()):
+    """Serialize the given namedtuple and its child fields to a canonical string.
+
+    Strings and None are kept as they are and the other fields are rendered with
+    str() and tagged with the name of their type, so that e.g. None and 'None',
+    or Decimal('1') and '1', differ. The elements of lists and sets are
+    serialized the same way, recursively if they are tuples, and are sorted and
+    deduplicated, so that their order does not matter. The result is the repr()
+    of the list of rendered fields, so that distinct tuples never produce the
+    same string.
+
+    Args:
+      objtuple: A tuple object or other.
+      ignore: A frozenset of strings, attribute names to be skipped.
+    Returns:
+      A string.
     """
-    # Note: this routine is slow and would stand to be implemented in C.
-    hashobj = hashlib.md5()
-    for attr_name, attr_value in zip(objtuple._fields, objtuple):
-        if attr_name in ignore:
-            continue
-        if isinstance(attr_value, (list, set, frozenset)):
-            subhashes = set()
-            for element in attr_value:
-                if isinstance(element, tuple):
-                    subhashes.add(stable_hash_namedtuple(element, ignore))
-                else:
-                    md5 = hashlib.md5()
-                    md5.update(str(element).encode())
-                    subhashes.add(md5.hexdigest())
-            for subhash in sorted(subhashes):
-                hashobj.update(subhash.encode())
+    cls = type(objtuple)
+    try:
+        indexes = _fields_cache[cls, ignore]
+    except KeyError:
+        indexes = [index
+                   for index, attr_name in enumerate(cls._fields)
+                   if attr_name not in ignore]
+        _fields_cache[cls, ignore] = indexes
+    fields = [cls.__name__]
+    for index in indexes:
+        attr_value = objtuple[index]
+        attr_type = type(attr_value)
+        if attr_type is str or attr_value is None:
+            fields.append(attr_value)
+        elif attr_type is Amount:
+            # Avoid the display context used by Amount.__str__().
+            fields.append(('Amount', '{} {}'.format(attr_value.number,
+                                                    attr_value.currency)))
+        elif attr_type in (list, set, frozenset):
+            fields.append(sorted(set(repr(element)
+                                     if type(element) is str
+                                     else encode_namedtuple(element, ignore)
+                                     if isinstance(element, tuple)
+                                     else repr((type(element).__name__, str(element)))
+                                     for element in attr_value)))
         else:
-            hashobj.update(str(attr_value).encode())
-    return hashobj.hexdigest()
+            fields.append((attr_type.__name__, str(attr_value)))
+    return repr(fields)
 
 
 def hash_entry(entry):
@@ -61,6 +100,24 @@ def hash_entry(entry):
     return stable_hash_namedtuple(entry, IGNORED_FIELD_NAMES)
 
 
+def index_entries(entries):
+    """Build an index of entries by their stable hash.
+
+    This is built once for a list of entries, to look up entries by hash
+    without hashing all of them for every lookup.
+
+    Args:
+      entries: A list of directives.
+    Returns:
+      A dict of hash-value to the list of entries with this hash, in their
+      original order. There is more than one for duplicate entries.
+    """
+    index = collections.defaultdict(list)
+    for entry in entries:
+        index[hash_entry(entry)].append(entry)
+    return dict(index)
+
+
 def hash_entries(entries):
     """Compute unique hashes of each of the entries and return a map of them.
 
@@ -64,6 +64,38 @@ class TestCompare(unittest.TestCase):
         hashes, errors = compare.hash_entries(entries)
         self.assertEqual(1, len(hashes))
 
+    def test_hash_entry(self):
+        entries, _, __ = loader.load_string(TEST_INPUT)
+        txn = entries[5]
+        hash_ = compare.hash_entry(txn)
+        self.assertRegex(hash_, '^[0-9a-f]{32}$')
+        self.assertEqual(hash_, compare.hash_entry(txn))
+
+        # The metadata and the order of the postings are ignored.
+        other = txn._replace(meta={}, postings=list(reversed(txn.postings)))
+        self.assertEqual(hash_, compare.hash_entry(other))
+
+        other = txn._replace(narration='Buying snacks')
+        self.assertNotEqual(hash_, compare.hash_entry(other))
+
+        # Fields are delimited unambiguously.
+        self.assertNotEqual(
+            compare.hash_entry(txn._replace(payee='a', narration='b,c')),
+            compare.hash_entry(txn._replace(payee='a,b', narration='c')))
+
+        # The types of the fields are distinguished.
+        self.assertNotEqual(
+            compare.hash_entry(txn._replace(payee=None)),
+            compare.hash_entry(txn._replace(payee='None')))
+
+    def test_index_entries(self):
+        entries, _, __ = loader.load_string(TEST_INPUT)
+        duplicate = entries[0]._replace(meta={})
+        index = compare.index_entries(entries + [duplicate])
+        self.assertEqual(len(entries), len(index))
+        self.assertEqual([entries[0], duplicate], index[compare.hash_entry(entries[0])])
+        self.assertEqual([entries[-1]], index[compare.hash_entry(entries[-1])])
+
     def test_compare_entries(self):
         entries1, _, __ = loader.load_string(TEST_INPUT)
         entries2, _, __ = loader.load_string(TEST_INPUT)
@@ -169,11 +169,14 @@ def convert_position(pos, target_currency, price_map, date=None):
                           date=date, via=(value_currency,))
 
 
-def convert_amount(amt, target_currency, price_map, date=None, via=None):
+def convert_amount(amt, target_currency, price_map, date=None, via=None,
+                   search_routes=False):
     """Return the market value of an Amount in a particular currency.
 
     In addition, if a conversion rate isn't available, you can provide a list of
-    currencies to attempt to synthesize a rate for via implieds rates.
+    currencies to attempt to synthesize a rate for via implieds rates. Failing
+    that, and if enabled, a rate is implied from a route of the available pairs
+    between the currencies; see prices.find_route().
 
     Args:
       amt: An instance of Amount.
@@ -182,6 +185,8 @@ def convert_amount(amt, target_currency, price_map, date=None, via=None):
       date: A datetime.date instance to evaluate the value at, or None.
       via: A list of currencies to attempt to synthesize an implied rate if the
         direct conversion fails.
+      search_routes: A boolean, true to imply a rate from a route of any number
+        of pairs if all the other conversions fail.
     Returns:
       An Amount, either with a succesful value currency conversion, or if we
       could not convert the value, the amount itself, unmodified.
@@ -210,5 +215,11 @@ def convert_amount(amt, target_currency, price_map, date=None, via=None):
                 if rate2 is not None:
                     return Amount(amt.number * rate1 * rate2, target_currency)
 
+    # Finally, attempt to convert through any route of available pairs.
+    if search_routes:
+        _, rate, _ = prices.get_route_price(price_map, base_quote, date)
+        if rate is not None:
+            return Amount(amt.number * rate, target_currency)
+
     # We failed to infer a conversion rate; return the amt.
     return amt
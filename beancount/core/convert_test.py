@@ -220,6 +220,28 @@ class TestPositionConversions(unittest.TestCase):
                              convert.convert_amount(A('100 USD'), 'CAD', price_map, date))
 
 
+    @loader.load_doc()
+    def test_convert_amount_with_route(self, entries, _, __):
+        """
+        2013-01-01 price  HOOL  500 USD
+        2013-01-01 price  USD   0.80 EUR
+        2014-01-01 price  EUR   0.90 GBP
+        """
+        price_map = prices.build_price_map(entries)
+        self.assertEqual(A('100 HOOL'),
+                         convert.convert_amount(A('100 HOOL'), 'GBP', price_map))
+        self.assertEqual(A('36000.0000 GBP'),
+                         convert.convert_amount(A('100 HOOL'), 'GBP', price_map,
+                                                search_routes=True))
+        self.assertEqual(A('100 HOOL'),
+                         convert.convert_amount(A('100 HOOL'), 'GBP', price_map,
+                                                datetime.date(2013, 6, 1),
+                                                search_routes=True))
+        self.assertEqual(A('100 HOOL'),
+                         convert.convert_amount(A('100 HOOL'), 'JPY', price_map,
+                                                search_routes=True))
+
+
 class TestPostingConversions(TestPositionConversions):
     """Test conversions to units, cost, weight and market-value for Posting objects."""
 
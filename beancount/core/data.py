@@ -4,6 +4,7 @@ __copyright__ = "Copyright (C) 2013-2017  Martin Blais"
 __license__ = "GNU GPLv2"
 
 import builtins
+import collections.abc
 import datetime
 import enum
 import sys
@@ -406,6 +407,143 @@ Directive = Union[
 Entries = List[Directive]
 
 
+# A marker for the 'filename' or 'lineno' keys deleted from a Metadata.
+_MISSING = object()
+
+
+class Metadata(collections.abc.MutableMapping):
+    """A compact metadata container, holding a filename and line number.
+
+    Most directives and postings have no metadata other than their location in
+    the input, and a dict for each of them accounts for a good share of the
+    memory used by a large ledger. This behaves like a dict with the 'filename'
+    and 'lineno' keys, but stores them in slots. The few other keys which may
+    be set later, e.g. by plugins, are stored in a flat list, which is smaller
+    than a dict; metadata with user keys is created as a dict by the parser.
+
+    Attributes:
+      filename: A string, the filename for the creator of this directive, or
+        _MISSING if the key has been deleted.
+      lineno: An integer, the line number where the directive has been created,
+        or _MISSING if the key has been deleted.
+      _extra: A list of the other keys and their values, alternated, or None if
+        there are none.
+    """
+    __slots__ = ('filename', 'lineno', '_extra')
+
+    def __init__(self, filename, lineno):
+        self.filename = filename
+        self.lineno = lineno
+        self._extra = None
+
+    def _find(self, key):
+        """Find the index of one of the other keys in the list.
+
+        Args:
+          key: A key, other than 'filename' and 'lineno'.
+        Returns:
+          An integer, the index of the key in '_extra', or -1 if it isn't set.
+        """
+        extra = self._extra
+        if extra is not None:
+            for index in range(0, len(extra), 2):
+                if extra[index] == key:
+                    return index
+        return -1
+
+    def __getitem__(self, key):
+        if key == 'filename':
+            value = self.filename
+        elif key == 'lineno':
+            value = self.lineno
+        else:
+            index = self._find(key)
+            if index < 0:
+                raise KeyError(key)
+            return self._extra[index + 1]
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        if key == 'filename':
+            value = self.filename
+        elif key == 'lineno':
+            value = self.lineno
+        elif self._extra is None:
+            return default
+        else:
+            index = self._find(key)
+            return default if index < 0 else self._extra[index + 1]
+        return default if value is _MISSING else value
+
+    def __contains__(self, key):
+        if key == 'filename':
+            return self.filename is not _MISSING
+        if key == 'lineno':
+            return self.lineno is not _MISSING
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        if self.filename is not _MISSING:
+            yield 'filename'
+        if self.lineno is not _MISSING:
+            yield 'lineno'
+        if self._extra is not None:
+            yield from self._extra[0::2]
+
+    def __len__(self):
+        return ((self.filename is not _MISSING) +
+                (self.lineno is not _MISSING) +
+                (len(self._extra) // 2 if self._extra is not None else 0))
+
+    def __setitem__(self, key, value):
+        if key == 'filename':
+            self.filename = value
+        elif key == 'lineno':
+            self.lineno = value
+        else:
+            index = self._find(key)
+            if index >= 0:
+                self._extra[index + 1] = value
+            elif self._extra is None:
+                self._extra = [key, value]
+            else:
+                self._extra.extend((key, value))
+
+    def __delitem__(self, key):
+        if key in ('filename', 'lineno'):
+            if getattr(self, key) is _MISSING:
+                raise KeyError(key)
+            setattr(self, key, _MISSING)
+        else:
+            index = self._find(key)
+            if index < 0:
+                raise KeyError(key)
+            del self._extra[index:index + 2]
+            if not self._extra:
+                self._extra = None
+
+    def copy(self):
+        """Return a shallow copy, like dict.copy().
+
+        Copies are generally made to be modified, so this returns a dict.
+
+        Returns:
+          A dict.
+        """
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def __reduce__(self):
+        if (self._extra is None and
+                self.filename is not _MISSING and self.lineno is not _MISSING):
+            return (Metadata, (self.filename, self.lineno))
+        return (dict, (self.copy(),))
+
+
 def new_metadata(filename, lineno, kvlist=None):
     """Create a new metadata container from the filename and line number.
 
@@ -414,13 +552,14 @@ def new_metadata(filename, lineno, kvlist=None):
       lineno: An integer, the line number where the directive has been created.
       kvlist: An optional container of key-values.
     Returns:
-      A metadata dict.
+      A Metadata instance, or a dict if there are other keys.
     """
-    meta = {'filename': filename,
-            'lineno': lineno}
     if kvlist:
+        meta = {'filename': filename,
+                'lineno': lineno}
         meta.update(kvlist)
-    return meta
+        return meta
+    return Metadata(filename, lineno)
 
 
 def create_simple_posting(entry, account, number, currency):
@@ -493,7 +632,7 @@ def sanity_check_types(entry, allow_none_for_tags_and_links=False):
       AssertionError: If there is anything that is unexpected, raises an exception.
     """
     assert isinstance(entry, ALL_DIRECTIVES), "Invalid directive type"
-    assert isinstance(entry.meta, dict), "Invalid type for meta"
+    assert isinstance(entry.meta, (dict, Metadata)), "Invalid type for meta"
     assert 'filename' in entry.meta, "Missing filename in metadata"
     assert 'lineno' in entry.meta, "Missing line number in metadata"
     assert isinstance(entry.date, datetime.date), "Invalid date type"
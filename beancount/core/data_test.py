@@ -308,6 +308,77 @@ class TestData(unittest.TestCase):
                                                              datetime.date(2016, 1, 30))])
 
 
+class TestMetadata(unittest.TestCase):
+
+    def test_new_metadata(self):
+        meta = data.new_metadata('file.beancount', 12)
+        self.assertIsInstance(meta, data.Metadata)
+        self.assertEqual({'filename': 'file.beancount', 'lineno': 12}, meta)
+        self.assertEqual(meta, {'filename': 'file.beancount', 'lineno': 12})
+        self.assertEqual("{'filename': 'file.beancount', 'lineno': 12}", repr(meta))
+
+        meta = data.new_metadata('file.beancount', 12, [('key', 'value')])
+        self.assertIs(type(meta), dict)
+        self.assertEqual({'filename': 'file.beancount', 'lineno': 12, 'key': 'value'},
+                         meta)
+
+    def test_mapping(self):
+        meta = data.Metadata('file.beancount', 12)
+        self.assertEqual('file.beancount', meta['filename'])
+        self.assertEqual(12, meta.get('lineno'))
+        self.assertIsNone(meta.get('key'))
+        self.assertIn('lineno', meta)
+        self.assertNotIn('key', meta)
+        with self.assertRaises(KeyError):
+            meta['key'] # pylint: disable=pointless-statement
+        self.assertEqual(['filename', 'lineno'], list(meta))
+        self.assertEqual([('filename', 'file.beancount'), ('lineno', 12)],
+                         list(meta.items()))
+        self.assertEqual(2, len(meta))
+
+    def test_mutation(self):
+        meta = data.Metadata('file.beancount', 12)
+        copy = meta.copy()
+        self.assertIs(type(copy), dict)
+        meta['key'] = 'value'
+        self.assertEqual({'filename': 'file.beancount', 'lineno': 12, 'key': 'value'},
+                         meta)
+        self.assertEqual(['filename', 'lineno', 'key'], list(meta))
+        self.assertEqual('value', meta.get('key'))
+        del meta['filename']
+        self.assertEqual({'lineno': 12, 'key': 'value'}, meta)
+        self.assertEqual({'filename': 'file.beancount', 'lineno': 12}, copy)
+        self.assertEqual({'lineno': 12, 'key': 'value'}, meta.copy())
+
+        # The location keys are stored once, and kept up to date.
+        meta['filename'] = 'other.beancount'
+        self.assertEqual('other.beancount', meta.filename)
+        self.assertEqual({'filename': 'other.beancount', 'lineno': 12, 'key': 'value'},
+                         meta)
+        self.assertEqual(['key', 'value'], meta._extra) # pylint: disable=protected-access
+        meta['key'] = 'other'
+        self.assertEqual('other', meta['key'])
+        self.assertEqual(3, len(meta))
+        del meta['lineno']
+        self.assertNotIn('lineno', meta)
+        self.assertIsNone(meta.get('lineno'))
+        with self.assertRaises(KeyError):
+            del meta['lineno']
+        meta['lineno'] = 13
+        self.assertEqual(13, meta['lineno'])
+        del meta['key']
+        self.assertEqual({'filename': 'other.beancount', 'lineno': 13}, meta)
+        with self.assertRaises(KeyError):
+            del meta['key']
+
+    def test_pickle(self):
+        meta = data.Metadata('file.beancount', 12)
+        self.assertEqual(meta, pickle.loads(pickle.dumps(meta)))
+        self.assertIsInstance(pickle.loads(pickle.dumps(meta)), data.Metadata)
+        meta['key'] = 'value'
+        self.assertEqual(meta, pickle.loads(pickle.dumps(meta)))
+
+
 class TestPickle(unittest.TestCase):
 
     def test_data_tuples_support_pickle(self):
@@ -141,16 +141,17 @@ class _CurrencyContext:
             return
 
         # Update the signs.
-        num_tuple = number.as_tuple()
-        if num_tuple.sign:
+        sign, digits, exponent = number.as_tuple()
+        if sign:
             self.has_sign = True
 
         # Update the precision.
-        self.fractional_dist.update(-num_tuple.exponent)
+        self.fractional_dist.update(-exponent)
 
         # Update the maximum number of integral digits.
-        integer_digits = len(num_tuple.digits) + num_tuple.exponent
-        self.integer_max = max(self.integer_max, integer_digits)
+        integer_digits = len(digits) + exponent
+        if integer_digits > self.integer_max:
+            self.integer_max = integer_digits
 
     def get_fractional(self, precision):
         """
@@ -198,6 +199,8 @@ class DisplayContext:
           number: An instance of Decimal to consider for this currency.
           currency: An optional string, the currency this numbers applies to.
         """
+        if number is None:
+            return
         self.ccontexts[currency].update(number)
 
     def quantize(self, number, currency, precision=Precision.MOST_COMMON):
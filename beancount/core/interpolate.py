@@ -5,6 +5,7 @@ __license__ = "GNU GPLv2"
 
 import collections
 import copy
+import functools
 
 from beancount.core.number import D
 from beancount.core.number import Decimal
@@ -89,6 +90,22 @@ def compute_residual(postings):
     return inventory
 
 
+@functools.lru_cache(maxsize=256)
+def get_tolerance(exponent, multiplier):
+    """Get the tolerance implied by the smallest digit of a number.
+
+    This is shared by the inference of the tolerances of transactions and of
+    balance assertions, and cached, as there are few distinct exponents.
+
+    Args:
+      exponent: An integer, the exponent of a Decimal number, e.g. -2 for 1.23.
+      multiplier: A Decimal, the fraction of the smallest digit to tolerate.
+    Returns:
+      A Decimal, the tolerance, e.g. 0.005.
+    """
+    return ONE.scaleb(exponent) * multiplier
+
+
 def infer_tolerances(postings, options_map, use_cost=None):
     """Infer tolerances from a list of postings.
 
@@ -144,6 +161,10 @@ def infer_tolerances(postings, options_map, use_cost=None):
     default_tolerances = options_map['inferred_tolerance_default']
     tolerances = default_tolerances.copy()
 
+    # Find the largest fractional exponent for each currency first, which
+    # implies its largest tolerance, and compute the tolerances from them once;
+    # the exponents are integers, cheaper to compare than the tolerances.
+    exponents = {}
     cost_tolerances = collections.defaultdict(D)
     for posting in postings:
         # Skip the precision on automatically inferred postings.
@@ -158,12 +179,12 @@ def infer_tolerances(postings, options_map, use_cost=None):
         expo = units.number.as_tuple().exponent
         if expo < 0:
             # Note: the exponent is a negative value.
-            tolerance = ONE.scaleb(expo) * inferred_tolerance_multiplier
-            tolerances[currency] = max(tolerance,
-                                       tolerances.get(currency, -1024))
+            if exponents.get(currency, -1024) < expo:
+                exponents[currency] = expo
 
             if not use_cost:
                 continue
+            tolerance = get_tolerance(expo, inferred_tolerance_multiplier)
 
             # Compute bounds on the smallest digit of the number implied as cost.
             cost = posting.cost
@@ -187,6 +208,10 @@ def infer_tolerances(postings, options_map, use_cost=None):
                 price_tolerance = min(tolerance * price.number, MAXIMUM_TOLERANCE)
                 cost_tolerances[price_currency] += price_tolerance
 
+    for currency, expo in exponents.items():
+        tolerance = get_tolerance(expo, inferred_tolerance_multiplier)
+        tolerances[currency] = max(tolerance, tolerances.get(currency, -1024))
+
     for currency, tolerance in cost_tolerances.items():
         tolerances[currency] = max(tolerance, tolerances.get(currency, -1024))
 
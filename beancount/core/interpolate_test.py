@@ -585,6 +585,29 @@ class TestInferTolerances(cmptest.TestCase):
           Assets:Cash     400 CAD
         """
 
+    @loader.load_doc(expect_errors=True)
+    def test_tolerances__default(self, entries, _, options_map):
+        """
+        option "inferred_tolerance_default" "CAD:0.01"
+
+        2014-02-25 *
+          Assets:Account1       5.001 USD
+          Assets:Account2      -5.00 CAD
+          Assets:Account3      -5.0000 CAD
+          Assets:Account4       4.99 EUR
+          Assets:Account4       0.0100 EUR
+        """
+        tolerances = interpolate.infer_tolerances(entries[-1].postings, options_map)
+        self.assertEqual({'USD': D('0.0005'), 'CAD': D('0.01'), 'EUR': D('0.005')},
+                         tolerances)
+
+    def test_get_tolerance(self):
+        self.assertEqual(D('0.005'), interpolate.get_tolerance(-2, D('0.5')))
+        self.assertEqual(D('0.2'), interpolate.get_tolerance(-1, D('2')))
+        self.assertIs(interpolate.get_tolerance(-3, D('0.5')),
+                      interpolate.get_tolerance(-3, D('0.5')))
+
+
 class TestQuantize(unittest.TestCase):
 
     def test_quantize_with_tolerance(self):
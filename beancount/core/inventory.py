@@ -28,6 +28,7 @@ __license__ = "GNU GPLv2"
 import collections
 from collections import Iterable
 import enum
+import os
 import re
 
 from beancount.core.number import ZERO
@@ -466,6 +467,292 @@ class Inventory(dict):
 from_string = Inventory.from_string
 
 
+class InventoryAccumulator:
+    """A mutable accumulator of positions, for summing up many of them.
+
+    Adding a position to an Inventory creates new Amount and Position instances
+    for the lot it modifies. This accumulator instead only stores the number of
+    units of each lot and creates the positions once, when converted to an
+    Inventory with to_inventory(). The resulting inventory is the same as the
+    one built by adding the same positions to an Inventory with add_position(),
+    including the order of its lots; unlike Inventory, the add methods don't
+    return how the lots were booked.
+
+    Attributes:
+      numbers: A dict of (currency, cost) lot keys to the number of units held,
+        which is never zero.
+    """
+    __slots__ = ('numbers',)
+
+    def __init__(self, positions=None):
+        """Create an accumulator.
+
+        Args:
+          positions: An optional Inventory or iterable of positions to start
+            from.
+        """
+        self.numbers = {}
+        if positions is not None:
+            for position in positions:
+                self.add_position(position)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def is_empty(self):
+        """Return true if the accumulator holds no positions.
+
+        Returns:
+          A boolean.
+        """
+        return not self.numbers
+
+    def add_amount(self, units, cost=None):
+        """Add units of a lot, like Inventory.add_amount().
+
+        Args:
+          units: An Amount instance to add.
+          cost: An instance of Cost or None, as a key to the inventory.
+        """
+        numbers = self.numbers
+        key = (units.currency, cost)
+        number = numbers.get(key, None)
+        if number is None:
+            if units.number != ZERO:
+                numbers[key] = units.number
+        else:
+            number += units.number
+            if number == ZERO:
+                del numbers[key]
+            else:
+                numbers[key] = number
+
+    def add_position(self, position):
+        """Add a position, like Inventory.add_position().
+
+        Args:
+          position: The Posting or Position to add.
+        """
+        units = position.units
+        numbers = self.numbers
+        key = (units.currency, position.cost)
+        number = numbers.get(key, None)
+        if number is None:
+            if units.number != ZERO:
+                numbers[key] = units.number
+        else:
+            number += units.number
+            if number == ZERO:
+                del numbers[key]
+            else:
+                numbers[key] = number
+
+    def add_inventory(self, other):
+        """Add all the positions of an Inventory or of another accumulator.
+
+        Args:
+          other: An instance of Inventory or InventoryAccumulator.
+        Returns:
+          This accumulator, modified.
+        """
+        if isinstance(other, ScaledInventoryAccumulator):
+            # Its numbers may be scaled integers.
+            other = other.to_inventory()
+        if isinstance(other, InventoryAccumulator):
+            for (currency, cost), number in other.numbers.items():
+                self.add_amount(Amount(number, currency), cost)
+        else:
+            for position in other.get_positions():
+                self.add_position(position)
+        return self
+
+    def to_inventory(self):
+        """Create an Inventory with the accumulated positions.
+
+        Returns:
+          A new instance of Inventory.
+        """
+        return Inventory({key: Position(Amount(number, key[0]), key[1])
+                          for key, number in self.numbers.items()})
+
+
+# The largest scaled integer held by a ScaledInventoryAccumulator, beyond which
+# numbers fall back to Decimal, well within the precision of Decimal arithmetic.
+MAX_SCALED = 10 ** 18
+
+# The finest precision of the numbers carried as scaled integers.
+MIN_SCALED_EXPONENT = -12
+
+
+class ScaledInventoryAccumulator(InventoryAccumulator):
+    """An accumulator summing up numbers as scaled integers instead of Decimals.
+
+    The number of units of each lot is carried as an integer scaled by the
+    finest precision of the numbers added to it, e.g. 12.34 USD is stored as 1234
+    with an exponent of -2. Numbers with an unusual precision, or whose sums grow
+    too large, fall back to Decimal for their lot. Converting to an Inventory
+    creates Decimals again, identical to the sums computed with Decimals,
+    including their precision.
+
+    Summing integers is much faster than summing Decimals with the pure Python
+    implementation of the decimal module, but not with the fast C one, because
+    of the conversions. This backend is opt-in; see new_accumulator().
+
+    Attributes:
+      numbers: A dict of (currency, cost) lot keys to the number of units held,
+        either a scaled integer or a Decimal. This is never zero.
+      exponents: A dict of lot keys to the exponent of their scaled integer.
+    """
+    __slots__ = ('exponents',)
+
+    def __init__(self, positions=None):
+        self.exponents = {}
+        super().__init__(positions)
+
+    def add_amount(self, units, cost=None):
+        """Add units of a lot, like Inventory.add_amount().
+
+        Args:
+          units: An Amount instance to add.
+          cost: An instance of Cost or None, as a key to the inventory.
+        """
+        numbers = self.numbers
+        exponents = self.exponents
+        key = (units.currency, cost)
+        number = units.number
+        scaled, exponent = scale_number(number)
+
+        previous = numbers.get(key, None)
+        if previous is None:
+            if scaled is not None:
+                if scaled:
+                    numbers[key] = scaled
+                    exponents[key] = exponent
+            elif number != ZERO:
+                numbers[key] = number
+
+        elif scaled is not None and isinstance(previous, int):
+            previous_exponent = exponents[key]
+            if exponent < previous_exponent:
+                previous *= 10 ** (previous_exponent - exponent)
+                exponents[key] = exponent
+            elif exponent > previous_exponent:
+                scaled *= 10 ** (exponent - previous_exponent)
+            total = previous + scaled
+            if total == 0:
+                del numbers[key]
+                del exponents[key]
+            elif -MAX_SCALED < total < MAX_SCALED:
+                numbers[key] = total
+            else:
+                numbers[key] = Decimal(total).scaleb(exponents.pop(key))
+
+        else:
+            if isinstance(previous, int):
+                previous = Decimal(previous).scaleb(exponents.pop(key))
+            total = previous + number
+            if total == ZERO:
+                del numbers[key]
+            else:
+                numbers[key] = total
+
+    def add_position(self, position):
+        """Add a position, like Inventory.add_position().
+
+        Args:
+          position: The Posting or Position to add.
+        """
+        self.add_amount(position.units, position.cost)
+
+    def add_inventory(self, other):
+        """Add all the positions of an Inventory or of another accumulator.
+
+        Args:
+          other: An instance of Inventory or InventoryAccumulator.
+        Returns:
+          This accumulator, modified.
+        """
+        if isinstance(other, InventoryAccumulator):
+            other = other.to_inventory()
+        for position in other.get_positions():
+            self.add_position(position)
+        return self
+
+    def to_inventory(self):
+        """Create an Inventory with the accumulated positions.
+
+        Returns:
+          A new instance of Inventory.
+        """
+        exponents = self.exponents
+        return Inventory({key: Position(Amount(Decimal(number).scaleb(exponents[key])
+                                               if isinstance(number, int) else
+                                               number,
+                                               key[0]),
+                                        key[1])
+                          for key, number in self.numbers.items()})
+
+
+def scale_number(number):
+    """Convert a Decimal to a scaled integer and its exponent.
+
+    This goes through the string representation of the number, which is much
+    cheaper than Decimal arithmetic with the pure Python implementation.
+
+    Args:
+      number: A Decimal instance.
+    Returns:
+      A pair of the integer and the exponent, e.g. (1234, -2) for 12.34, or
+      (None, None) if the number is not finite, or has too fine a precision or
+      an exponent which is positive.
+    """
+    integer, _, fraction = str(number).partition('.')
+    if len(fraction) > -MIN_SCALED_EXPONENT:
+        return None, None
+    try:
+        return int(integer + fraction), -len(fraction)
+    except ValueError:
+        return None, None
+
+
+def new_accumulator(positions=None):
+    """Create an accumulator of positions with the configured numeric backend.
+
+    The default backend sums Decimals with an InventoryAccumulator. Set the
+    BEANCOUNT_NUMBER_BACKEND environment variable to 'scaled' to sum scaled
+    integers with a ScaledInventoryAccumulator instead, which is faster without
+    the C implementation of decimal.
+
+    Args:
+      positions: An optional Inventory or iterable of positions to start from.
+    Returns:
+      An instance of InventoryAccumulator.
+    """
+    return ACCUMULATOR_CLASS(positions)
+
+
+def get_accumulator_class(backend=None):
+    """Get the class of accumulators for a numeric backend.
+
+    Args:
+      backend: A string, 'decimal' or 'scaled', or None for the default,
+        'decimal'.
+    Returns:
+      A subclass of InventoryAccumulator.
+    Raises:
+      ValueError: If the backend is unknown.
+    """
+    if backend is None or backend == 'decimal':
+        return InventoryAccumulator
+    elif backend == 'scaled':
+        return ScaledInventoryAccumulator
+    raise ValueError("Invalid number backend: '{}'".format(backend))
+
+
+ACCUMULATOR_CLASS = get_accumulator_class(
+    os.environ.get('BEANCOUNT_NUMBER_BACKEND', None) or None)
+
+
 def check_invariants(inv):
     """Check the invariants of the Inventory.
 
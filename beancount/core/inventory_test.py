@@ -495,3 +495,115 @@ class TestInventory(unittest.TestCase):
         inv = I('100.00 USD, 101.00 CAD, 100 HOOL {300.00 USD}')
         inv_units = inv.reduce(lambda posting: posting.units)
         self.assertEqual(I('100.00 USD, 101.00 CAD, 100 HOOL'), inv_units)
+
+
+class TestInventoryAccumulator(unittest.TestCase):
+
+    accumulator_class = inventory.InventoryAccumulator
+
+    POSITIONS = [
+        '10 USD',
+        '5 HOOL {500.00 USD, 2016-01-01}',
+        '-10 USD',
+        '7.50 CAD',
+        '0 EUR',
+        '2 HOOL {500.00 USD, 2016-01-01}',
+        '-3 HOOL {510.00 USD, 2016-02-01}',
+        '3.00 USD',
+        '-7.50 CAD',
+        '-7 HOOL {500.00 USD, 2016-01-01}',
+        '1.25 CAD',
+    ]
+
+    def test_add_position(self):
+        expected = Inventory()
+        accumulator = self.accumulator_class()
+        for string in self.POSITIONS:
+            pos = position.from_string(string)
+            expected.add_position(pos)
+            accumulator.add_position(pos)
+            # The lots are in the same order as well.
+            self.assertEqual(list(expected.items()),
+                             list(accumulator.to_inventory().items()))
+        self.assertEqual(3, len(accumulator))
+        self.assertFalse(accumulator.is_empty())
+
+    def test_add_amount(self):
+        accumulator = self.accumulator_class()
+        accumulator.add_amount(A('10 USD'))
+        accumulator.add_amount(A('2 HOOL'), Cost(D('5'), 'USD', None, None))
+        accumulator.add_amount(A('-10 USD'))
+        self.assertEqual(I('2 HOOL {5 USD}'), accumulator.to_inventory())
+
+    def test_add_inventory(self):
+        inv = I('10 USD, 2 HOOL {5 USD}')
+        accumulator = self.accumulator_class(inv)
+        self.assertEqual(inv, accumulator.to_inventory())
+        accumulator.add_inventory(I('-10 USD, 3 CAD'))
+        accumulator.add_inventory(self.accumulator_class(I('1 CAD')))
+        self.assertEqual(I('4 CAD, 2 HOOL {5 USD}'), accumulator.to_inventory())
+        self.assertTrue(self.accumulator_class().is_empty())
+        self.assertEqual(Inventory(), self.accumulator_class().to_inventory())
+
+    def test_add_inventory_mixed(self):
+        # Accumulators of both backends can be added to one another.
+        for other_class in (inventory.InventoryAccumulator,
+                            inventory.ScaledInventoryAccumulator):
+            accumulator = self.accumulator_class(I('1.50 USD'))
+            accumulator.add_inventory(other_class(I('2.25 USD, 2 HOOL {5 USD}')))
+            self.assertEqual(I('3.75 USD, 2 HOOL {5 USD}'), accumulator.to_inventory())
+
+
+class TestScaledInventoryAccumulator(TestInventoryAccumulator):
+
+    accumulator_class = inventory.ScaledInventoryAccumulator
+
+    def test_precision(self):
+        # The sums have the same precision as with Decimals.
+        for strings in [('1.10 USD', '2 USD'),
+                        ('2 USD', '1.10 USD', '-0.1 USD'),
+                        ('1E+2 USD', '5 USD'),
+                        ('5 USD', '1E+2 USD'),
+                        ('0.1234567890123456 USD', '1 USD'),
+                        ('1.5 USD', '-1.50 USD', '2 USD'),
+                        ('999999999999999999 USD', '1 USD', '-0.01 USD')]:
+            expected = Inventory()
+            accumulator = self.accumulator_class()
+            for string in strings:
+                number, currency = string.split()
+                pos = Position(amount.Amount(D(number), currency), None)
+                expected.add_position(pos)
+                accumulator.add_position(pos)
+            actual = accumulator.to_inventory()
+            self.assertEqual(expected, actual)
+            self.assertEqual(str(expected), str(actual))
+
+    def test_scaled(self):
+        accumulator = self.accumulator_class()
+        accumulator.add_amount(A('12.34 USD'))
+        accumulator.add_amount(A('0.001 USD'))
+        self.assertEqual({('USD', None): 12341}, accumulator.numbers)
+        self.assertEqual({('USD', None): -3}, accumulator.exponents)
+
+    def test_scale_number(self):
+        self.assertEqual((1234, -2), inventory.scale_number(D('12.34')))
+        self.assertEqual((-5, -1), inventory.scale_number(D('-0.5')))
+        self.assertEqual((0, -3), inventory.scale_number(D('0.000')))
+        self.assertEqual((17, 0), inventory.scale_number(D('17')))
+        self.assertEqual((None, None), inventory.scale_number(D('1E+2')))
+        self.assertEqual((None, None), inventory.scale_number(D('1E-20')))
+        self.assertEqual((None, None), inventory.scale_number(D('Infinity')))
+
+
+class TestNewAccumulator(unittest.TestCase):
+
+    def test_get_accumulator_class(self):
+        self.assertIs(inventory.InventoryAccumulator,
+                      inventory.get_accumulator_class('decimal'))
+        self.assertIs(inventory.ScaledInventoryAccumulator,
+                      inventory.get_accumulator_class('scaled'))
+        self.assertIs(inventory.InventoryAccumulator,
+                      inventory.get_accumulator_class())
+        with self.assertRaises(ValueError):
+            inventory.get_accumulator_class('float')
+        self.assertIsInstance(inventory.new_accumulator(), inventory.ACCUMULATOR_CLASS)
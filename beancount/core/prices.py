@@ -9,14 +9,16 @@ live prices online and create entries on-the-fly).
 __copyright__ = "Copyright (C) 2013-2017  Martin Blais"
 __license__ = "GNU GPLv2"
 
+import array
+import bisect
 import collections
+import datetime
 
 from beancount.core.number import ONE
 from beancount.core.number import ZERO
 from beancount.core.data import Price
 from beancount.core import data
 from beancount.utils import misc_utils
-from beancount.utils import bisect_key
 
 
 def get_last_price_entries(entries, date):
@@ -49,8 +51,32 @@ class PriceMap(dict):
 
     Atttributes:
       forward_pairs: A list of (base, quote) keys for the forward pairs.
+      graph: A dict of currency to the sorted list of currencies it has prices
+        in, or None if not computed yet. See find_route().
+      routes: An OrderedDict of (base, quote, date) to the conversion routes
+        found between these currencies, the MAX_CACHED_ROUTES most recently
+        used ones, cached by find_route().
     """
-    __slots__ = ('forward_pairs',)
+    __slots__ = ('forward_pairs', 'graph', 'routes')
+
+
+class PriceList(list):
+    """A sorted list of (date, number) price pairs, indexed by date.
+
+    This behaves like a regular list of pairs, but also maintains a parallel
+    array of the ordinals of the dates, which allows looking up prices by date
+    with a bisection implemented in C, without a Python key function. Do not
+    modify its contents.
+
+    Attributes:
+      ordinals: An array of integers, the ordinals of the dates, in the same
+        order as the pairs.
+    """
+    __slots__ = ('ordinals',)
+
+    def __init__(self, date_rates=()):
+        super().__init__(date_rates)
+        self.ordinals = array.array('l', [date.toordinal() for date, _ in self])
 
 
 def build_price_map(entries):
@@ -69,7 +95,7 @@ def build_price_map(entries):
       entries: A list of directives, hopefully including some Price and/or
       Transaction entries.
     Returns:
-      A dict of (currency, cost-currency) keys to sorted lists of (date, number)
+      A dict of (currency, cost-currency) keys to sorted PriceList lists of (date, number)
       pairs, where 'date' is the date the price occurs at and 'number' a Decimal
       that represents the price, or rate, between these two
       currencies/commodities. Each date occurs only once in the sorted list of
@@ -116,7 +142,8 @@ def build_price_map(entries):
 
     # Unzip and sort each of the entries and eliminate duplicates on the date.
     sorted_price_map = PriceMap({
-        base_quote: list(misc_utils.sorted_uniquify(date_rates, lambda x: x[0], last=True))
+        base_quote: PriceList(misc_utils.sorted_uniquify(date_rates,
+                                                         lambda x: x[0], last=True))
         for (base_quote, date_rates) in price_map.items()})
 
     # Compute and insert all the inverted rates.
@@ -124,11 +151,13 @@ def build_price_map(entries):
     for (base, quote), price_list in list(sorted_price_map.items()):
         # Note: You have to filter out zero prices for zero-cost postings, like
         # gifted options.
-        sorted_price_map[(quote, base)] = [
+        sorted_price_map[(quote, base)] = PriceList(
             (date, ONE/price) for date, price in price_list
-            if price != ZERO]
+            if price != ZERO)
 
     sorted_price_map.forward_pairs = forward_pairs
+    sorted_price_map.graph = None
+    sorted_price_map.routes = collections.OrderedDict()
     return sorted_price_map
 
 
@@ -163,20 +192,26 @@ def _lookup_price_and_inverse(price_map, base_quote):
       base_quote: A pair of strings, (base, quote) currencies.
         No normalizatin is done.
     Returns:
-      A list of price-dates, if succesful.
+      A PriceList of price-dates, if succesful. If the price map holds a regular
+      list for the pair, e.g. if it was not created by build_price_map, it is
+      replaced by an equal PriceList in the price map, so that the ordinals of
+      its dates are computed only once.
     Raises:
       KeyError: If the base_quote and its inverse both weren't able to be looked
         up.
     """
     try:
-        return price_map[base_quote]
+        prices = price_map[base_quote]
     except KeyError as exc:
         base, quote = base_quote
         prices = price_map.get((quote, base), None)
         if prices:
-            return prices
+            base_quote = (quote, base)
         else:
             raise
+    if not isinstance(prices, PriceList):
+        prices = price_map[base_quote] = PriceList(prices)
+    return prices
 
 
 def get_all_prices(price_map, base_quote):
@@ -258,10 +293,186 @@ def get_price(price_map, base_quote, date=None):
 
     try:
         price_list = _lookup_price_and_inverse(price_map, base_quote)
-        index = bisect_key.bisect_right_with_key(price_list, date, key=lambda x: x[0])
-        if index == 0:
-            return None, None
-        else:
-            return price_list[index-1]
     except KeyError:
         return None, None
+    index = bisect.bisect_right(price_list.ordinals, date.toordinal())
+    if index == 0:
+        return None, None
+    else:
+        return price_list[index-1]
+
+
+# The maximum number of routes cached in a price map by find_route().
+MAX_CACHED_ROUTES = 4096
+
+
+def _get_graph(price_map):
+    """Get the graph of the currencies connected by the pairs of a price map.
+
+    Args:
+      price_map: A price map, as created by build_price_map.
+    Returns:
+      A dict of currency to the sorted list of currencies it has prices in.
+    """
+    graph = getattr(price_map, 'graph', None)
+    if graph is None:
+        graph = collections.defaultdict(list)
+        for (base, quote), price_list in price_map.items():
+            if price_list:
+                graph[base].append(quote)
+        for quotes in graph.values():
+            quotes.sort()
+        graph = dict(graph)
+        if isinstance(price_map, PriceMap):
+            price_map.graph = graph
+    return graph
+
+
+def _search_route(price_map, base, quote, date):
+    """Search for the shortest route between two currencies.
+
+    This runs a breadth-first search over the graph of pairs, and picks the
+    freshest of the routes with the fewest hops, that is, the one whose oldest
+    price is the most recent.
+
+    Args:
+      price_map: A price map, as created by build_price_map.
+      base: A string, the currency to convert from.
+      quote: A string, the currency to convert to.
+      date: A datetime.date instance, to only consider the pairs with a price at
+        that date, or None to consider their latest prices.
+    Returns:
+      A tuple of currencies from base to quote, or None if there is no route.
+    """
+    graph = _get_graph(price_map)
+    if base not in graph:
+        return None
+
+    # A map of the currencies reached at the current number of hops to the
+    # date of their oldest price and their route.
+    layer = {base: (datetime.date.max, (base,))}
+    visited = {base}
+    while layer:
+        if quote in layer:
+            return layer[quote][1]
+        next_layer = {}
+        for currency in sorted(layer):
+            freshness, route = layer[currency]
+            for target in graph.get(currency, ()):
+                if target in visited:
+                    continue
+                price_list = price_map[(currency, target)]
+                if date is None:
+                    price_date = price_list[-1][0]
+                else:
+                    price_date, _ = get_price(price_map, (currency, target), date)
+                    if price_date is None:
+                        continue
+                candidate = (min(freshness, price_date), route + (target,))
+                best = next_layer.get(target)
+                if best is None or candidate[0] > best[0]:
+                    next_layer[target] = candidate
+        visited.update(next_layer)
+        layer = next_layer
+    return None
+
+
+def _get_route_price(price_map, route, date):
+    """Compute the price along a route of currencies.
+
+    Args:
+      price_map: A price map, as created by build_price_map.
+      route: A tuple of currencies.
+      date: A datetime.date instance, or None for the latest prices.
+    Returns:
+      A pair of (datetime.date, Decimal), the date of the oldest price of the
+      route and the product of the rates, or None if one of the legs has no
+      price at that date.
+    """
+    oldest_date = None
+    rate = ONE
+    for base_quote in zip(route, route[1:]):
+        leg_date, leg_rate = get_price(price_map, base_quote, date)
+        if leg_rate is None:
+            return None
+        rate *= leg_rate
+        if oldest_date is None or leg_date < oldest_date:
+            oldest_date = leg_date
+    return oldest_date, rate
+
+
+def find_route(price_map, base_quote, date=None):
+    """Find a route of pairs to convert between two currencies.
+
+    Routes are searched through the graph of all the pairs in the price map,
+    preferring the ones with the fewest hops, and then the freshest ones, whose
+    oldest latest price is the most recent. That route is used at any date for
+    which all of its pairs have a price; at other dates, the route is searched
+    among the pairs which do have a price at that date. The most recently used
+    routes are cached in the price map per (base, quote) and date.
+
+    Args:
+      price_map: A price map, as created by build_price_map.
+      base_quote: A pair of strings, the base currency to lookup, and the quote
+        currency to lookup, which expresses which units the base currency is
+        denominated in. This may also just be a string, with a '/' separator.
+      date: A datetime.date instance, the date at which we want to convert, or
+        None for the latest prices.
+    Returns:
+      A tuple of currencies starting with the base and ending with the quote,
+      with the intermediate currencies to convert through in between, or None if
+      no route could be found.
+    """
+    base_quote = normalize_base_quote(base_quote)
+    base, quote = base_quote
+    if quote is None or base == quote:
+        return (base,)
+
+    routes = getattr(price_map, 'routes', None)
+    key = (base, quote, date)
+    if routes is not None and key in routes:
+        routes.move_to_end(key)
+        return routes[key]
+
+    if date is None:
+        route = _search_route(price_map, base, quote, None)
+    else:
+        route = find_route(price_map, base_quote, None)
+        if route is not None and _get_route_price(price_map, route, date) is None:
+            route = _search_route(price_map, base, quote, date)
+    if routes is not None:
+        routes[key] = route
+        if len(routes) > MAX_CACHED_ROUTES:
+            routes.popitem(last=False)
+    return route
+
+
+def get_route_price(price_map, base_quote, date=None):
+    """Return the price as of the given date, converting through other currencies.
+
+    This is like get_price(), but if no price is available for the pair itself,
+    the price is implied from the prices of a route of pairs between them, as
+    found by find_route(). For example, the price of HOOL in EUR may be implied
+    from the prices of HOOL in USD and of USD in EUR.
+
+    Args:
+      price_map: A price map, as created by build_price_map.
+      base_quote: A pair of strings, the base currency to lookup, and the quote
+        currency to lookup, which expresses which units the base currency is
+        denominated in. This may also just be a string, with a '/' separator.
+      date: A datetime.date instance, the date at which we want the conversion
+        rate, or None for the latest prices.
+    Returns:
+      A triple of (datetime.date, Decimal, route), where the date is the date of
+      the oldest of the prices used, the number is the implied rate and the route
+      a tuple of the currencies converted through, from base to quote. If no
+      price could be found, return (None, None, None).
+    """
+    route = find_route(price_map, base_quote, date)
+    if route is not None:
+        if len(route) == 1:
+            return None, ONE, route
+        date_rate = _get_route_price(price_map, route, date)
+        if date_rate is not None:
+            return date_rate + (route,)
+    return None, None, None
@@ -3,6 +3,7 @@ __license__ = "GNU GPLv2"
 
 import unittest
 import datetime
+from unittest import mock
 
 from beancount.core.number import D
 from beancount.core import prices
@@ -199,6 +200,27 @@ class TestPriceMap(unittest.TestCase):
         result = prices.get_price(price_map, ('EWJ', 'JPY'))
         self.assertEqual((None, None), result)
 
+    def test_price_list(self):
+        price_list = prices.PriceList([(datetime.date(2013, 6, 1), D('1.00')),
+                                       (datetime.date(2013, 6, 10), D('1.50'))])
+        self.assertEqual([(datetime.date(2013, 6, 1), D('1.00')),
+                          (datetime.date(2013, 6, 10), D('1.50'))], price_list)
+        self.assertEqual([735020, 735029], list(price_list.ordinals))
+
+        # Price maps built by hand with regular lists are still supported.
+        price_map = {('USD', 'CAD'): list(price_list)}
+        self.assertEqual((datetime.date(2013, 6, 1), D('1.00')),
+                         prices.get_price(price_map, 'USD/CAD', datetime.date(2013, 6, 9)))
+        self.assertEqual((None, None),
+                         prices.get_price(price_map, 'USD/CAD', datetime.date(2013, 5, 1)))
+
+        # Their lists are indexed once, in place.
+        indexed_list = price_map[('USD', 'CAD')]
+        self.assertIsInstance(indexed_list, prices.PriceList)
+        self.assertEqual(price_list, indexed_list)
+        prices.get_price(price_map, 'CAD/USD', datetime.date(2013, 6, 9))
+        self.assertIs(indexed_list, price_map[('USD', 'CAD')])
+
     @loader.load_doc()
     def test_ordering_same_date(self, entries, _, __):
         """
@@ -220,3 +242,89 @@ class TestPriceMap(unittest.TestCase):
             self.assertEqual(exp_value, act_value.quantize(D('0.01')))
 
         self.assertEqual(1, len(price_map[('CAD', 'USD')]))
+
+
+class TestRoutes(unittest.TestCase):
+
+    @loader.load_doc()
+    def test_find_route(self, entries, _, __):
+        """
+        2013-01-01 price  HOOL  500 USD
+        2013-01-01 price  USD   0.80 EUR
+        2013-01-01 price  EUR   0.90 GBP
+        2013-01-01 price  JPY   0.0070 GBP
+        """
+        price_map = prices.build_price_map(entries)
+        self.assertEqual(('HOOL', 'USD', 'EUR', 'GBP'),
+                         prices.find_route(price_map, 'HOOL/GBP'))
+        self.assertEqual(('GBP', 'EUR', 'USD', 'HOOL'),
+                         prices.find_route(price_map, 'GBP/HOOL'))
+        self.assertEqual(('HOOL', 'USD'), prices.find_route(price_map, 'HOOL/USD'))
+        self.assertEqual(('HOOL',), prices.find_route(price_map, 'HOOL/HOOL'))
+        self.assertIsNone(prices.find_route(price_map, 'HOOL/CAD'))
+
+        date, rate, route = prices.get_route_price(price_map, 'HOOL/JPY')
+        self.assertEqual(('HOOL', 'USD', 'EUR', 'GBP', 'JPY'), route)
+        self.assertEqual(datetime.date(2013, 1, 1), date)
+        self.assertEqual(D('51428.57'), rate.quantize(D('0.01')))
+
+        self.assertEqual((None, None, None),
+                         prices.get_route_price(price_map, 'HOOL/CAD'))
+        self.assertEqual((None, D('1'), ('HOOL',)),
+                         prices.get_route_price(price_map, 'HOOL/HOOL'))
+
+        # Check that the routes are cached.
+        self.assertIn(('HOOL', 'JPY', None), price_map.routes)
+
+    @loader.load_doc()
+    def test_find_route_cache_size(self, entries, _, __):
+        """
+        2013-01-01 price  HOOL  500 USD
+        2013-01-01 price  USD   0.80 EUR
+        """
+        price_map = prices.build_price_map(entries)
+        with mock.patch.object(prices, 'MAX_CACHED_ROUTES', 2):
+            prices.find_route(price_map, 'HOOL/EUR')
+            prices.find_route(price_map, 'EUR/HOOL')
+            prices.find_route(price_map, 'HOOL/EUR')
+            prices.find_route(price_map, 'USD/HOOL')
+        self.assertEqual([('HOOL', 'EUR', None), ('USD', 'HOOL', None)],
+                         list(price_map.routes))
+
+    @loader.load_doc()
+    def test_find_route_freshest(self, entries, _, __):
+        """
+        2013-01-01 price  HOOL  500 USD
+        2013-01-01 price  USD   0.80 EUR
+        2014-01-01 price  HOOL  650 CAD
+        2014-01-01 price  CAD   0.60 EUR
+        2014-06-01 price  HOOL  510 USD
+        """
+        price_map = prices.build_price_map(entries)
+
+        # Both routes are as short; the oldest price of the one through CAD is
+        # the most recent.
+        self.assertEqual(('HOOL', 'CAD', 'EUR'), prices.find_route(price_map, 'HOOL/EUR'))
+        self.assertEqual((datetime.date(2014, 1, 1), D('390.00'), ('HOOL', 'CAD', 'EUR')),
+                         prices.get_route_price(price_map, 'HOOL/EUR'))
+        self.assertEqual(
+            (datetime.date(2014, 1, 1), D('390.00'), ('HOOL', 'CAD', 'EUR')),
+            prices.get_route_price(price_map, 'HOOL/EUR', datetime.date(2014, 2, 1)))
+
+        # The route through CAD has no prices yet at that date.
+        self.assertEqual(
+            (datetime.date(2013, 1, 1), D('400.00'), ('HOOL', 'USD', 'EUR')),
+            prices.get_route_price(price_map, 'HOOL/EUR', datetime.date(2013, 6, 1)))
+        self.assertEqual(
+            (None, None, None),
+            prices.get_route_price(price_map, 'HOOL/EUR', datetime.date(2012, 6, 1)))
+        self.assertEqual(('HOOL', 'USD', 'EUR'),
+                         price_map.routes[('HOOL', 'EUR', datetime.date(2013, 6, 1))])
+
+    def test_find_route_dict(self):
+        price_map = {('HOOL', 'USD'): [(datetime.date(2013, 1, 1), D('500'))],
+                     ('USD', 'HOOL'): [(datetime.date(2013, 1, 1), D('0.002'))],
+                     ('USD', 'EUR'): [(datetime.date(2013, 1, 1), D('0.8'))],
+                     ('EUR', 'USD'): [(datetime.date(2013, 1, 1), D('1.25'))]}
+        self.assertEqual((datetime.date(2013, 1, 1), D('400.0'), ('HOOL', 'USD', 'EUR')),
+                         prices.get_route_price(price_map, 'HOOL/EUR'))
@@ -20,6 +20,8 @@ __license__ = "GNU GPLv2"
 
 import io
 import collections
+import datetime
+import heapq
 import operator
 import copy
 
@@ -315,6 +317,174 @@ def postings_by_account(entries):
     return txn_postings_map
 
 
+class RealizationBuilder:
+    """A realization tree which is updated in place as directives are added.
+
+    Adding directives only visits the accounts they refer to: the new postings
+    are appended to their lists and added to their balances, and the cached
+    total balances of those accounts and their parents are invalidated. This
+    makes adding the directives of a day to a long ledger proportional to the
+    new directives, not to the history.
+
+    Directives should be added in sorted order. Directives dated up to 'window'
+    before the latest date added so far are accepted too; they are merged into
+    the lists of postings at their sorted position.
+
+    Attributes:
+      real_root: The root RealAccount instance of the tree.
+      compute_balance: A boolean, true if the balances of the accounts are
+        maintained.
+      window: A datetime.timedelta, how far before the latest date directives
+        can be added.
+      last_date: A datetime.date, the latest date of the directives added, or
+        None if none were.
+    """
+    def __init__(self, min_accounts=None, compute_balance=True,
+                 window=datetime.timedelta()):
+        """Create an empty realization.
+
+        Args:
+          min_accounts: A list of strings, account names to ensure we create.
+            See realize().
+          compute_balance: A boolean, true if we should compute the balances.
+          window: A datetime.timedelta, how far before the latest date
+            directives can be added.
+        """
+        self.real_root = RealAccount('')
+        self.compute_balance = compute_balance
+        self.window = window
+        self.last_date = None
+        self._total_balances = {}
+        for account_name in min_accounts or ():
+            get_or_create(self.real_root, account_name)
+
+    def add(self, entry):
+        """Add a single directive to the realization.
+
+        Args:
+          entry: A directive.
+        Raises:
+          ValueError: If the directive is dated before the window.
+        """
+        self.extend([entry])
+
+    def extend(self, entries):
+        """Add a list of directives to the realization.
+
+        Args:
+          entries: A sorted list of directives.
+        Raises:
+          ValueError: If a directive is dated before the window; in that case
+            none of the directives are added.
+        """
+        if not entries:
+            return
+        if self.last_date is not None:
+            min_date = self.last_date - self.window
+            for entry in entries:
+                if entry.date < min_date:
+                    raise ValueError(
+                        "Directive dated {} is before the realization window, "
+                        "which starts on {}".format(entry.date, min_date))
+            self.last_date = max(self.last_date, max(entry.date for entry in entries))
+        else:
+            self.last_date = max(entry.date for entry in entries)
+
+        for account_name, txn_postings in postings_by_account(entries).items():
+            real_account = get_or_create(self.real_root, account_name)
+            merge_txn_postings(real_account.txn_postings, txn_postings)
+            if self.compute_balance:
+                balance = real_account.balance
+                for txn_posting in txn_postings:
+                    if isinstance(txn_posting, TxnPosting):
+                        balance.add_position(txn_posting.posting)
+            for parent_name in account.parents(account_name):
+                self._total_balances.pop(parent_name, None)
+        self._total_balances.pop('', None)
+
+    def get_total_balance(self, account_name=''):
+        """Get the total balance of an account and all its subaccounts.
+
+        This is equivalent to compute_balance() on the account, but the totals
+        are cached and only recomputed for the accounts modified since.
+
+        Args:
+          account_name: A string, the name of an account, or the empty string
+            for the root of the tree.
+        Returns:
+          An Inventory, which should not be modified, or None if the account
+          does not exist.
+        """
+        try:
+            return self._total_balances[account_name]
+        except KeyError:
+            pass
+        real_account = (get(self.real_root, account_name)
+                        if account_name else
+                        self.real_root)
+        if real_account is None:
+            return None
+        total_balance = inventory.Inventory(real_account.balance)
+        for _, real_child in sorted(real_account.items()):
+            total_balance.add_inventory(self.get_total_balance(real_child.account))
+        self._total_balances[account_name] = total_balance
+        return total_balance
+
+    def snapshot(self):
+        """Copy the current state of the tree.
+
+        The lists of postings and the balances are copied, so that the returned
+        tree is not modified by the directives added afterwards.
+
+        Returns:
+          A new root RealAccount instance.
+        """
+        return _copy_tree(self.real_root)
+
+
+def _copy_tree(real_account):
+    """Copy a tree of RealAccount instances, with their lists and balances.
+
+    Args:
+      real_account: A RealAccount instance.
+    Returns:
+      A new RealAccount instance.
+    """
+    real_copy = RealAccount(real_account.account)
+    real_copy.txn_postings = list(real_account.txn_postings)
+    real_copy.balance = inventory.Inventory(real_account.balance)
+    for child_name, real_child in real_account.items():
+        real_copy[child_name] = _copy_tree(real_child)
+    return real_copy
+
+
+def merge_txn_postings(txn_postings, new_txn_postings):
+    """Merge a sorted list of postings and entries into another, in place.
+
+    Only the end of the list that sorts after the first new element is visited,
+    so appending postings in sorted order is proportional to their number.
+    Elements which sort equally keep the existing ones first.
+
+    Args:
+      txn_postings: A sorted list of TxnPosting instances and directives, which
+        is modified.
+      new_txn_postings: A sorted list of TxnPosting instances and directives.
+    """
+    if not txn_postings or not new_txn_postings:
+        txn_postings.extend(new_txn_postings)
+        return
+    first_key = data.posting_sortkey(new_txn_postings[0])
+    start = len(txn_postings)
+    while start > 0 and data.posting_sortkey(txn_postings[start - 1]) > first_key:
+        start -= 1
+    if start == len(txn_postings):
+        txn_postings.extend(new_txn_postings)
+    else:
+        tail = txn_postings[start:]
+        txn_postings[start:] = heapq.merge(tail, new_txn_postings,
+                                           key=data.posting_sortkey)
+
+
 def filter(real_account, predicate):
     """Filter a RealAccount tree of nodes by the predicate.
 
@@ -677,10 +847,10 @@ def compute_postings_balance(txn_postings):
     Returns:
       An Inventory.
     """
-    final_balance = inventory.Inventory()
+    final_balance = inventory.new_accumulator()
     for txn_posting in txn_postings:
         if isinstance(txn_posting, Posting):
             final_balance.add_position(txn_posting)
         elif isinstance(txn_posting, TxnPosting):
             final_balance.add_position(txn_posting.posting)
-    return final_balance
+    return final_balance.to_inventory()
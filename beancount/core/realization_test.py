@@ -726,3 +726,100 @@ class TestComputeBalance(unittest.TestCase):
                                                   datetime.date(2014, 5, 30), None))
         expected_balance.add_amount(A('12000 EUR'))
         self.assertEqual(expected_balance, computed_balance)
+
+
+class TestRealizationBuilder(unittest.TestCase):
+
+    @loader.load_doc()
+    def setUp(self, entries, errors, _):
+        """
+        2012-01-01 open Expenses:Restaurant
+        2012-01-01 open Expenses:Movie
+        2012-01-01 open Assets:Bank:Checking
+        2012-01-01 open Liabilities:CreditCard
+
+        2012-03-01 * "Food"
+          Expenses:Restaurant     100 CAD
+          Assets:Bank:Checking   -100 CAD
+
+        2012-03-10 * "Food again"
+          Expenses:Restaurant      80 CAD
+          Liabilities:CreditCard  -80 CAD
+
+        2012-03-15 * "Two Movies"
+          Expenses:Movie           10 CAD
+          Expenses:Movie           10 CAD
+          Liabilities:CreditCard  -20 CAD
+
+        2012-03-20 note Liabilities:CreditCard "Called Amex"
+
+        2012-04-01 balance Liabilities:CreditCard   -100 CAD
+        """
+        self.entries = entries
+
+    def test_extend(self):
+        expected = realization.realize(self.entries, ['Assets', 'Income'])
+        builder = realization.RealizationBuilder(['Assets', 'Income'])
+        for entry in self.entries:
+            builder.add(entry)
+        self.assertEqual(expected, builder.real_root)
+
+        builder = realization.RealizationBuilder(['Assets', 'Income'])
+        builder.extend(self.entries[:5])
+        builder.extend(self.entries[5:])
+        self.assertEqual(expected, builder.real_root)
+        self.assertEqual(datetime.date(2012, 4, 1), builder.last_date)
+
+    def test_window(self):
+        expected = realization.realize(self.entries)
+        txn1, txn2 = self.entries[4:6]
+        entries = [entry for entry in self.entries if entry not in (txn1, txn2)]
+
+        builder = realization.RealizationBuilder()
+        builder.extend(entries)
+        with self.assertRaises(ValueError):
+            builder.add(txn1)
+
+        builder = realization.RealizationBuilder(window=datetime.timedelta(days=31))
+        builder.extend(entries)
+        builder.add(txn2)
+        builder.add(txn1)
+        self.assertEqual(expected, builder.real_root)
+
+    def test_get_total_balance(self):
+        builder = realization.RealizationBuilder()
+        builder.extend(self.entries[:5])
+        for account_name in '', 'Expenses', 'Expenses:Restaurant', 'Assets':
+            self.assertEqual(
+                realization.compute_balance(builder.real_root if not account_name else
+                                            realization.get(builder.real_root,
+                                                            account_name)),
+                builder.get_total_balance(account_name))
+        self.assertEqual(inventory.from_string('100 CAD'),
+                         builder.get_total_balance('Expenses'))
+
+        # Only the modified accounts are recomputed.
+        total_assets = builder.get_total_balance('Assets')
+        builder.extend(self.entries[5:])
+        self.assertIs(total_assets, builder.get_total_balance('Assets'))
+        self.assertEqual(inventory.from_string('200 CAD'),
+                         builder.get_total_balance('Expenses'))
+        self.assertEqual(inventory.Inventory(), builder.get_total_balance(''))
+        self.assertIsNone(builder.get_total_balance('Income'))
+
+    def test_snapshot(self):
+        builder = realization.RealizationBuilder()
+        builder.extend(self.entries[:5])
+        snapshot = builder.snapshot()
+        self.assertEqual(builder.real_root, snapshot)
+        builder.extend(self.entries[5:])
+        self.assertEqual(realization.realize(self.entries[:5]), snapshot)
+        self.assertNotEqual(builder.real_root, snapshot)
+
+    def test_merge_txn_postings(self):
+        entries = self.entries
+        txn_postings = [entries[0], entries[2]]
+        realization.merge_txn_postings(txn_postings, [entries[1], entries[3]])
+        self.assertEqual(entries[:4], txn_postings)
+        realization.merge_txn_postings(txn_postings, [entries[8]])
+        self.assertEqual(entries[:4] + [entries[8]], txn_postings)
@@ -0,0 +1,282 @@
+"""Client for a persistent ledger daemon.
+
+A ledger daemon (see bin/bean-daemon) loads a Beancount file once, watches its
+included files and reloads them when they change, and serves requests on a
+local Unix socket. The functions in this module attach to a daemon serving a
+given file if one is running, and otherwise fall back to loading the file
+directly, so that command-line tools need not load the same file over and over
+again.
+
+The protocol is a sequence of frames, each a 8-bytes length followed by its
+contents. A request is a single frame of a JSON object whose 'command'
+attribute selects the operation. The response is a frame of a JSON object,
+followed by a frame of binary payload if its 'payload' attribute is true. A
+response with an 'error' attribute reports a failure of the request.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+from os import path
+import hashlib
+import json
+import logging
+import os
+import socket
+import struct
+import tempfile
+
+from beancount import loader
+from beancount.parser import snapshot
+from beancount.utils import misc_utils
+
+
+# The pattern of the name of the socket a daemon serves a file on, in the
+# temporary directory.
+SOCKET_FILENAME = 'beancount-{uid}-{digest}.sock'
+
+# The environment variable that disables attaching to a daemon.
+DISABLE_ENV = 'BEANCOUNT_DISABLE_DAEMON'
+
+# The format of the length prefixing each frame of the protocol.
+_FRAME_LENGTH = struct.Struct('!Q')
+
+
+class DaemonError(Exception):
+    """An error communicating with a daemon."""
+
+
+def normalize_filename(filename):
+    """Normalize a filename the way the loader does.
+
+    Args:
+      filename: A string, the name of a Beancount file.
+    Returns:
+      A string, its absolute and normalized name.
+    """
+    filename = path.expandvars(path.expanduser(filename))
+    return path.normpath(path.join(os.getcwd(), filename))
+
+
+def get_socket_filename(filename):
+    """Get the name of the socket a daemon serves a file on.
+
+    The socket is private to the current user and is located in the temporary
+    directory, because socket names are limited in length and some filesystems
+    do not support them.
+
+    Args:
+      filename: A string, the name of a Beancount file.
+    Returns:
+      A string, the absolute name of the socket.
+    """
+    digest = hashlib.md5(normalize_filename(filename).encode('utf8')).hexdigest()
+    return path.join(tempfile.gettempdir(),
+                     SOCKET_FILENAME.format(uid=os.getuid(), digest=digest[:16]))
+
+
+def send_message(sock, message, payload=None):
+    """Send a message and its optional payload over a socket.
+
+    Args:
+      sock: A connected socket.
+      message: A dict, to be serialized to JSON.
+      payload: A bytes object, or None.
+    """
+    message = dict(message, payload=payload is not None)
+    contents = json.dumps(message).encode('utf8')
+    frames = [_FRAME_LENGTH.pack(len(contents)), contents]
+    if payload is not None:
+        frames.extend([_FRAME_LENGTH.pack(len(payload)), payload])
+    sock.sendall(b''.join(frames))
+
+
+def recv_message(sock):
+    """Receive a message and its optional payload from a socket.
+
+    Args:
+      sock: A connected socket.
+    Returns:
+      A pair of the message dict and its payload, a bytes object or None.
+    Raises:
+      DaemonError: If the connection was closed before a complete message
+        could be read.
+    """
+    message = json.loads(_recv_frame(sock).decode('utf8'))
+    payload = _recv_frame(sock) if message.get('payload') else None
+    return message, payload
+
+
+def _recv_frame(sock):
+    """Receive a single frame from a socket.
+
+    Args:
+      sock: A connected socket.
+    Returns:
+      A bytes object, the contents of the frame.
+    """
+    length, = _FRAME_LENGTH.unpack(_recv_exactly(sock, _FRAME_LENGTH.size))
+    return _recv_exactly(sock, length)
+
+
+def _recv_exactly(sock, size):
+    """Receive a given number of bytes from a socket.
+
+    Args:
+      sock: A connected socket.
+      size: An integer, the number of bytes to read.
+    Returns:
+      A bytes object of the given size.
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while view:
+        nbytes = sock.recv_into(view)
+        if not nbytes:
+            raise DaemonError("Connection closed by the daemon")
+        view = view[nbytes:]
+    return bytes(buf)
+
+
+def request(filename, command, **kwargs):
+    """Send a request to the daemon serving a file, if one is running.
+
+    Failures to communicate with the daemon are logged and treated as if no
+    daemon was running, so that callers can always fall back to loading the
+    file themselves.
+
+    Args:
+      filename: A string, the name of the Beancount file.
+      command: A string, the name of the command to run.
+      **kwargs: The arguments of the command, to be serialized to JSON.
+    Returns:
+      A pair of the response dict and its payload, or None if no daemon is
+      serving this file.
+    """
+    if os.getenv(DISABLE_ENV):
+        return None
+
+    # Only talk to a daemon run by the current user.
+    socket_filename = get_socket_filename(filename)
+    try:
+        if os.stat(socket_filename).st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_filename)
+            send_message(sock, dict(kwargs, command=command))
+            response, payload = recv_message(sock)
+    except (OSError, ValueError, DaemonError) as exc:
+        logging.warning("Could not communicate with the daemon at '%s': %s",
+                        socket_filename, exc)
+        return None
+
+    if 'error' in response:
+        logging.warning("Daemon failed to run '%s': %s", command, response['error'])
+        return None
+    return response, payload
+
+
+def get_validation_names(extra_validations):
+    """Get the qualified names of validation functions, to send in a request.
+
+    Args:
+      extra_validations: A list of validation functions, or None.
+    Returns:
+      A list of strings, their fully qualified names.
+    """
+    return ['{}.{}'.format(function.__module__, function.__qualname__)
+            for function in extra_validations or []]
+
+
+def _log_errors(response, log_errors):
+    """Log the formatted errors of a response, if 'log_errors' is set.
+
+    Args:
+      response: A response dict with an 'errors' attribute, a string.
+      log_errors: A file object or function to write errors to,
+        or None, if it should remain quiet.
+    """
+    if log_errors and response['errors']:
+        if hasattr(log_errors, 'write'):
+            log_errors.write(response['errors'])
+        else:
+            log_errors(response['errors'])
+
+
+def load_file(filename, log_timings=None, log_errors=None, extra_validations=None,
+              encoding=None):
+    """Load a Beancount file from its daemon, or directly if none is running.
+
+    Args:
+      filename: See loader.load_file().
+      log_timings: See loader.load_file().
+      log_errors: See loader.load_file().
+      extra_validations: See loader.load_file().
+      encoding: See loader.load_file(). The daemon always loads files with the
+        default encoding, so it is not used if this is set.
+    Returns:
+      A triple of (entries, errors, options_map), as from loader.load_file().
+    """
+    if encoding is None:
+        with misc_utils.log_time('beancount.daemon.load_file', log_timings, indent=1):
+            result = request(filename, 'load',
+                             extra_validations=get_validation_names(extra_validations))
+            if result is not None:
+                response, payload = result
+                entries, errors, options_map = snapshot.loads(payload)
+        if result is not None:
+            _log_errors(response, log_errors)
+            return entries, errors, options_map
+
+    return loader.load_file(filename,
+                            log_timings=log_timings,
+                            log_errors=log_errors,
+                            extra_validations=extra_validations,
+                            encoding=encoding)
+
+
+def check_file(filename, log_errors=None, extra_validations=None):
+    """Get the errors of a Beancount file from its daemon, if one is running.
+
+    Args:
+      filename: A string, the name of the Beancount file.
+      log_errors: A file object or function to write errors to,
+        or None, if it should remain quiet.
+      extra_validations: A list of extra validation functions to run, or None.
+    Returns:
+      An integer, the number of errors, or None if no daemon is serving this
+      file.
+    """
+    result = request(filename, 'check',
+                     extra_validations=get_validation_names(extra_validations))
+    if result is None:
+        return None
+    response, _ = result
+    _log_errors(response, log_errors)
+    return response['num_errors']
+
+
+def query_file(filename, query, output_format='text', numberify=False, log_errors=None):
+    """Run a query on a Beancount file in its daemon, if one is running.
+
+    Args:
+      filename: A string, the name of the Beancount file.
+      query: A string, the BQL statement to run.
+      output_format: A string, the name of the output format.
+      numberify: A boolean, true if the output should be numberified.
+      log_errors: A file object or function to write the errors of the loaded
+        file to, or None, if it should remain quiet.
+    Returns:
+      A string, the rendered output of the query, or None if no daemon is
+      serving this file.
+    """
+    result = request(filename, 'query',
+                     query=query, format=output_format, numberify=numberify)
+    if result is None:
+        return None
+    response, _ = result
+    _log_errors(response, log_errors)
+    return response['output']
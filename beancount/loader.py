@@ -5,10 +5,14 @@ __license__ = "GNU GPLv2"
 
 from os import path
 import collections
+import concurrent.futures
+import contextlib
+import copy
 import functools
 import glob
 import hashlib
 import importlib
+import importlib.util
 import io
 import itertools
 import logging
@@ -19,12 +23,15 @@ import textwrap
 import time
 import warnings
 
+import beancount
 from beancount.utils import misc_utils
 from beancount.core import data
 from beancount.parser import parser
 from beancount.parser import booking
 from beancount.parser import options
 from beancount.parser import printer
+from beancount.parser import snapshot
+from beancount.ops import balance
 from beancount.ops import validation
 from beancount.utils import encryption
 from beancount.utils import file_utils
@@ -53,6 +60,23 @@ PICKLE_CACHE_FILENAME = '.{filename}.picklecache'
 # The threshold below which we don't bother creating a cache file, in seconds.
 PICKLE_CACHE_THRESHOLD = 1.0
 
+# Names of the stages whose products are stored in the load cache.
+STAGE_PARSE = 'parse'
+STAGE_BOOKING = 'booking'
+STAGE_PLUGINS = 'plugins'
+STAGE_VALIDATION = 'validation'
+STAGE_RESULT = 'result'
+
+# Not a stage, but counted like one: the balance assertions reused from the
+# previous load are hits, and those that had to be checked again misses.
+STAGE_BALANCE = 'balance'
+CACHE_STAGES = [STAGE_RESULT, STAGE_PARSE, STAGE_BOOKING, STAGE_PLUGINS, STAGE_VALIDATION,
+                STAGE_BALANCE]
+
+# The environment variable that sets the number of processes to parse included
+# files with. If set, this overrides the "parse_processes" option.
+PARSE_PROCESSES_ENV = 'BEANCOUNT_PARSE_PROCESSES'
+
 
 def load_file(filename, log_timings=None, log_errors=None, extra_validations=None,
               encoding=None):
@@ -132,6 +156,296 @@ def _log_errors(errors, log_errors):
             log_errors(error_io.getvalue())
 
 
+class LoadCache:
+    """A cache of the intermediate products of the loader, stored across loads.
+
+    Rather than an all-or-nothing memoization of the final result, this stores
+    the directives parsed from each individual source file keyed by a digest of
+    its contents, and the outputs of the booking, plugins and validation stages
+    keyed by a fingerprint of their respective inputs. When a single included
+    file is modified, only that file gets parsed again, and a later stage is
+    only run again if its input has actually changed.
+
+    Each product is stored in its serialized form, as a snapshot (see
+    beancount.parser.snapshot), as it was at the time it was produced. This is
+    much faster to read back than a pickle, and also protects the cached values
+    from in-place modifications of the directives by the later stages (e.g.,
+    booking and plugins modify some of the metadata dicts in place).
+
+    Serializing a product costs a fair fraction of the time it took to compute
+    it, so the products which take less than 'time_threshold' seconds to
+    compute are not stored; they are just computed again on the next load. The
+    final result is only serialized by set_result(), when the cache is about to
+    be persisted.
+
+    Attributes:
+      version: A string, the version of Beancount which produced this cache.
+      time_threshold: A float, the number of seconds below which the products
+        of a stage are not stored.
+      parsed: A dict of absolute filename to a pair of (digest, blob), where
+        'digest' is a hash of the file's contents and 'blob' is the serialized
+        (entries, errors, options_map) triple produced by parsing it, or None
+        if it wasn't stored.
+      stages: A dict of stage name to a pair of (key, blob), where 'key' is a
+        fingerprint of the input of the stage and 'blob' its serialized output,
+        an (entries, errors, options_map) triple.
+      options_map: The options map of the last complete result, or None. This
+        is used to check whether the input files have changed at all.
+      result_key: A string, the fingerprint of all the inputs of the last load,
+        or None. The stored result is reused as is if it is unchanged.
+      balance_checkpoints: A BalanceCheckpoints instance, the results of the
+        balance assertions checked by the plugins stage, so that only those
+        which changed are checked again when the stage has to be run again.
+        This is None unless the cache is refreshed from an existing file, as
+        recording them is only worthwhile if the cache will be persisted.
+      hits: A Counter of stage name to the number of times its cached product
+        was reused during the current load. This is not persisted.
+      misses: A Counter of stage name to the number of times its product had to
+        be computed during the current load. This is not persisted.
+    """
+
+    def __init__(self, time_threshold=0.0):
+        self.version = beancount.__version__
+        self.time_threshold = time_threshold
+        self.parsed = {}
+        self.stages = {}
+        self.options_map = None
+        self.result_key = None
+        self.balance_checkpoints = None
+        self.reset_stats()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['hits']
+        del state['misses']
+        del state['pending']
+        del state['parse_time']
+        return state
+
+    def __setstate__(self, state):
+        self.balance_checkpoints = None
+        self.__dict__.update(state)
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Reset the hit and miss counters."""
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+        self.pending = {}
+        self.parse_time = 0.0
+
+    def is_valid(self):
+        """Return true if this cache was produced by this version of Beancount."""
+        return self.version == beancount.__version__
+
+    @staticmethod
+    def dumps(value):
+        """Serialize a cached product to bytes.
+
+        Args:
+          value: An (entries, errors, options_map) triple.
+        Returns:
+          A bytes object, a snapshot of the value.
+        """
+        return snapshot.dumps(*value)
+
+    @staticmethod
+    def loads(blob):
+        """Deserialize a cached product from bytes.
+
+        Args:
+          blob: A bytes object, as produced by dumps().
+        Returns:
+          An (entries, errors, options_map) triple.
+        """
+        return snapshot.loads(blob)
+
+    def parse_file(self, filename, encoding=None):
+        """Parse a file, reusing its cached directives if its contents are unchanged.
+
+        The directives of the files which have to be parsed are only stored by
+        the following call to flush_parsed().
+
+        Args:
+          filename: A string, the absolute name of the file to parse.
+          encoding: A string or None, the encoding to decode the file with.
+        Returns:
+          The (entries, errors, options_map) triple, as from parser.parse_file().
+        """
+        digest = self.file_digest(filename, encoding)
+        result = self.get_parsed(filename, digest)
+        if result is None:
+            time_before = time.time()
+            result = parser.parse_file(filename, encoding=encoding)
+            self.parse_time += time.time() - time_before
+            # Note: The loader aggregates the options of the included files into
+            # those of the top-level file, so we hold on to a copy of them.
+            entries, errors, options_map = result
+            self.pending[filename] = (digest, (entries, errors,
+                                               copy.deepcopy(options_map)))
+            self.set_parsed(filename, digest, None)
+        return result
+
+    def flush_parsed(self):
+        """Store the directives of the files parsed since the last call.
+
+        They are only serialized if parsing all those files took longer than the
+        time threshold.
+        """
+        if self.parse_time >= self.time_threshold:
+            for filename, (digest, result) in self.pending.items():
+                self.parsed[filename] = (digest, self.dumps(result))
+        self.pending = {}
+        self.parse_time = 0.0
+
+    @staticmethod
+    def file_digest(filename, encoding=None):
+        """Compute the key under which the parsed contents of a file are cached.
+
+        Args:
+          filename: A string, the absolute name of the file to parse.
+          encoding: A string or None, the encoding to decode the file with.
+        Returns:
+          A string, a hash of the encoding and contents of the file.
+        """
+        md5 = hashlib.md5()
+        md5.update(repr(encoding).encode('utf8'))
+        with open(filename, 'rb') as file:
+            md5.update(file.read())
+        return md5.hexdigest()
+
+    def get_parsed(self, filename, digest):
+        """Fetch the cached parsed contents of a file.
+
+        Args:
+          filename: A string, the absolute name of the parsed file.
+          digest: A string, the file's digest from file_digest().
+        Returns:
+          The (entries, errors, options_map) triple, or None if the file is not
+          cached or its contents have changed.
+        """
+        cached = self.parsed.get(filename, None)
+        if cached is not None and cached[0] == digest and cached[1] is not None:
+            self.hits[STAGE_PARSE] += 1
+            return self.loads(cached[1])
+        return None
+
+    def set_parsed(self, filename, digest, blob):
+        """Store the parsed contents of a file.
+
+        Args:
+          filename: A string, the absolute name of the parsed file.
+          digest: A string, the file's digest from file_digest().
+          blob: A bytes object, the snapshot of the parsed file's contents, or
+            None, to only record its digest.
+        """
+        self.misses[STAGE_PARSE] += 1
+        self.parsed[filename] = (digest, blob)
+
+    def parse_key(self, filenames):
+        """Compute a fingerprint of the parsed contents of a set of files.
+
+        Args:
+          filenames: A list of absolute filenames which have been parsed
+            through parse_file().
+        Returns:
+          A string, a hash of the names and contents of these files.
+        """
+        md5 = hashlib.md5()
+        for filename in sorted(filenames):
+            md5.update(filename.encode('utf8'))
+            md5.update(self.parsed[filename][0].encode('ascii'))
+        return md5.hexdigest()
+
+    def prune(self, filenames):
+        """Remove the parsed products of files that are not in the given list.
+
+        Args:
+          filenames: A collection of the absolute filenames to retain.
+        """
+        filenames = set(filenames)
+        for filename in list(self.parsed):
+            if filename not in filenames:
+                del self.parsed[filename]
+
+    def run_stage(self, name, key, function, *args):
+        """Run a loader stage, reusing its cached output if its input is unchanged.
+
+        Args:
+          name: A string, the name of the stage.
+          key: A string, a fingerprint of everything the stage depends on.
+          function: A callable that computes the output of the stage, an
+            (entries, errors, options_map) triple.
+          *args: Arguments to be passed to the function.
+        Returns:
+          The return value of 'function', or an identical copy of it.
+        """
+        cached = self.stages.get(name, None)
+        if cached is not None and cached[0] == key:
+            self.hits[name] += 1
+            return self.loads(cached[1])
+
+        self.misses[name] += 1
+        time_before = time.time()
+        output = function(*args)
+        if time.time() - time_before >= self.time_threshold:
+            self.stages[name] = (key, self.dumps(output))
+        else:
+            self.stages.pop(name, None)
+        return output
+
+    def get_result(self):
+        """Return the final result if none of the input files have changed.
+
+        Returns:
+          The (entries, errors, options_map) triple of the last load, or None, if
+          there is no result or any of the input files have changed.
+        """
+        cached = self.stages.get(STAGE_RESULT, None)
+        if cached is None or needs_refresh(self.options_map):
+            return None
+        self.hits[STAGE_RESULT] += 1
+        entries, errors, options_map = self.loads(cached[1])
+        # The stored result may have been reused from an earlier load of the
+        # same files with different modification times.
+        options_map['input_hash'] = self.options_map['input_hash']
+        return entries, errors, options_map
+
+    def set_result(self, result):
+        """Store the final result of a load.
+
+        This serializes the result, unless it was produced from the same inputs
+        as the one already stored, identified by 'result_key'.
+
+        Args:
+          result: An (entries, errors, options_map) triple.
+        """
+        self.misses[STAGE_RESULT] += 1
+        _, _, options_map = result
+        self.options_map = options_map
+        cached = self.stages.get(STAGE_RESULT, None)
+        if (self.result_key is None or
+            cached is None or
+            cached[0] != self.result_key):
+            self.stages[STAGE_RESULT] = (self.result_key, self.dumps(result))
+
+
+def _log_cache_stats(cache, log_timings):
+    """Log the number of hits and misses for each of the cached stages.
+
+    Args:
+      cache: An instance of LoadCache.
+      log_timings: A function to write log messages to, or None.
+    """
+    if not log_timings:
+        return
+    for stage in CACHE_STAGES:
+        hits, misses = cache.hits[stage], cache.misses[stage]
+        if hits or misses:
+            log_timings("Cache:     {:48} Hits: {:6d}  Misses: {:6d}".format(
+                "'{}'".format(stage), hits, misses))
+
+
 def pickle_cache_function(pattern, time_threshold, function):
     """Decorate a loader function to make it loads its result from a pickle cache.
 
@@ -139,15 +453,21 @@ def pickle_cache_function(pattern, time_threshold, function):
     function to be cached returns an (entries, errors, options_map) triple. We
     use the 'include' option value in order to check whether any of the included
     files has changed. It's essentially a special case for an on-disk memoizer.
-    If any of the included files are more recent than the cache, the function is
-    recomputed and the cache refreshed.
+
+    If none of the included files have changed, the result is returned directly
+    from the cache. Otherwise, the function is called again with the previous
+    LoadCache instance as its 'cache' keyword argument, so that it can reuse the
+    products of the stages whose inputs have not changed (see _load()), and the
+    cache is refreshed. A new cache is only written if computing the result took
+    longer than the time threshold.
 
     Args:
       pattern: A string, the filename pattern for the pickled cache file.
         A {filename} in it gets replaced by the basename of the input filename.
       time_threshold: A float, the number of seconds below which we don't bother
         caching.
-      function: A function object to decorate for caching.
+      function: A function object to decorate for caching. Its second argument
+        is expected to be the 'log_timings' argument of load_file().
     Returns:
       A decorated function which will pull its result from a cache file if
       it is available.
@@ -159,13 +479,21 @@ def pickle_cache_function(pattern, time_threshold, function):
             path.dirname(abs_filename),
             pattern.format(filename=path.basename(toplevel_filename)))
 
+        log_timings = args[0] if args else kw.get('log_timings', None)
+        if hasattr(log_timings, 'write'):
+            log_timings = log_timings.write
+
         # Read the cache if it exists in order to get the list of files whose
         # timestamps to check.
+        cache = None
         exists = path.exists(cache_filename)
         if exists:
             with open(cache_filename, 'rb') as file:
                 try:
-                    result = pickle.load(file)
+                    cache = pickle.load(file)
+                    if not (isinstance(cache, LoadCache) and cache.is_valid()):
+                        raise ValueError("Invalid cache version")
+                    result = cache.get_result()
                 except Exception as exc:
                     # Note: Not a big fan of doing this, but here we handle all
                     # possible exceptions because unpickling of an old or
@@ -174,17 +502,15 @@ def pickle_cache_function(pattern, time_threshold, function):
 
                     # The cache file is corrupted; ignore it and recompute.
                     logging.error("Cache file is corrupted: %s; recomputing.", exc)
-                    result = None
+                    cache = None
 
                 else:
-                    # Check that the latest timestamp has not been written after the
-                    # cache file.
-                    entries, errors, options_map = result
-                    if not needs_refresh(options_map):
+                    if result is not None:
                         # All timestamps are legit; cache hit.
+                        _log_cache_stats(cache, log_timings)
                         return result
 
-        # We failed; recompute the value.
+        # We failed; recompute the value, reusing whatever we can.
         if exists:
             try:
                 os.remove(cache_filename)
@@ -192,17 +518,27 @@ def pickle_cache_function(pattern, time_threshold, function):
                 # Warn for errors on read-only filesystems.
                 logging.warning("Could not remove picklecache file %s: %s",
                                 cache_filename, exc)
+        if cache is None:
+            cache = LoadCache()
+        cache.time_threshold = time_threshold
+        if exists and cache.balance_checkpoints is None:
+            # The refreshed cache is always written.
+            cache.balance_checkpoints = balance.BalanceCheckpoints()
 
         time_before = time.time()
-        result = function(toplevel_filename, *args, **kw)
+        result = function(toplevel_filename, *args, cache=cache, **kw)
         time_after = time.time()
 
         # Overwrite the cache file if the time it takes to compute it
-        # justifies it.
-        if time_after - time_before > time_threshold:
+        # justifies it, or if we are refreshing an existing cache.
+        persist = exists or time_after - time_before > time_threshold
+        if persist:
+            cache.set_result(result)
+        _log_cache_stats(cache, log_timings)
+        if persist:
             try:
                 with open(cache_filename, 'wb') as file:
-                    pickle.dump(result, file)
+                    pickle.dump(cache, file, pickle.HIGHEST_PROTOCOL)
             except Exception as exc:
                 logging.warning("Could not write to picklecache file %s: %s",
                                 cache_filename, exc)
@@ -226,7 +562,7 @@ def needs_refresh(options_map):
     Returns:
       A boolean, true if the input is obsoleted by changes in the input files.
     """
-    if options_map is None:
+    if options_map is None or 'include' not in options_map:
         return True
     input_hash = compute_input_hash(options_map['include'])
     return 'input_hash' not in options_map or input_hash != options_map['input_hash']
@@ -277,7 +613,7 @@ def load_string(string, log_timings=None, log_errors=None, extra_validations=Non
     return entries, errors, options_map
 
 
-def _parse_recursive(sources, log_timings, encoding=None):
+def _parse_recursive(sources, log_timings, encoding=None, cache=None):
     """Parse Beancount input, run its transformations and validate it.
 
     Recursively parse a list of files or strings and their include files and
@@ -293,6 +629,8 @@ def _parse_recursive(sources, log_timings, encoding=None):
         paths.
       log_timings: A function to write timings to, or None, if it should remain quiet.
       encoding: A string or None, the encoding to decode the input filename with.
+      cache: An instance of LoadCache to reuse the directives of unchanged files
+        from, or None.
     Returns:
       A tuple of (entries, parse_errors, options_map).
     """
@@ -302,97 +640,129 @@ def _parse_recursive(sources, log_timings, encoding=None):
     entries, parse_errors = [], []
     options_map = None
 
-    # A stack of sources to be parsed.
+    # A queue of sources to be parsed. Included files are appended to it as
+    # they are discovered, so it is processed in breadth-first waves: the files
+    # included from one wave of sources form the next one.
     source_stack = list(sources)
 
     # A list of absolute filenames that have been parsed in the past, used to
     # detect and avoid duplicates (cycles).
     filenames_seen = set()
 
-    with misc_utils.log_time('beancount.parser.parser', log_timings, indent=1):
+    # A pool of processes to parse files in parallel, created on first use.
+    executor = None
+
+    with misc_utils.log_time('beancount.parser.parser', log_timings, indent=1), \
+         contextlib.ExitStack() as exit_stack:
         while source_stack:
-            source, is_file = source_stack.pop(0)
-            is_top_level = options_map is None
-
-            if is_file:
-                # All filenames here must be absolute.
-                assert path.isabs(source)
-                filename = path.normpath(source)
-
-                # Check for file previously parsed... detect duplicates.
-                if filename in filenames_seen:
-                    parse_errors.append(
-                        LoadError(data.new_metadata("<load>", 0),
-                                  'Duplicate filename parsed: "{}"'.format(filename),
-                                  None))
-                    continue
-
-                # Check for a file that does not exist.
-                if not path.exists(filename):
-                    parse_errors.append(
-                        LoadError(data.new_metadata("<load>", 0),
-                                  'File "{}" does not exist'.format(filename), None))
-                    continue
-
-                # Parse a file from disk directly.
-                filenames_seen.add(filename)
-                with misc_utils.log_time('beancount.parser.parser.parse_file',
-                                         log_timings, indent=2):
-                    (src_entries,
-                     src_errors,
-                     src_options_map) = parser.parse_file(filename, encoding=encoding)
-
-                cwd = path.dirname(filename)
-            else:
-                # Encode the contents if necessary.
-                if encoding:
-                    if isinstance(source, bytes):
-                        source = source.decode(encoding)
-                    source = source.encode('ascii', 'replace')
-
-                # Parse a string buffer from memory.
-                with misc_utils.log_time('beancount.parser.parser.parse_string',
-                                         log_timings, indent=2):
-                    (src_entries,
-                     src_errors,
-                     src_options_map) = parser.parse_string(source)
-
-                # If we're parsing a string, the CWD is the current process
-                # working directory.
-                cwd = os.getcwd()
-
-            # Merge the entries resulting from the parsed file.
-            entries.extend(src_entries)
-            parse_errors.extend(src_errors)
-
-            # We need the options from the very top file only (the very
-            # first file being processed). No merging of options should
-            # occur.
-            if is_top_level:
-                options_map = src_options_map
-            else:
-                aggregate_options_map(options_map, src_options_map)
-
-            # Add includes to the list of sources to process. chdir() for glob,
-            # which uses it indirectly.
-            include_expanded = []
-            with file_utils.chdir(cwd):
-                for include_filename in src_options_map['include']:
-                    matched_filenames = glob.glob(include_filename, recursive=True)
-                    if matched_filenames:
-                        include_expanded.extend(matched_filenames)
-                    else:
+            wave, source_stack = source_stack, []
+
+            # Parse the files of this wave in parallel, if enabled. The results
+            # are merged below in the same order as when parsing sequentially.
+            prefetched = {}
+            num_processes = get_parse_processes(options_map)
+            if num_processes > 1:
+                parallel_filenames = _get_new_filenames(wave, filenames_seen)
+                if len(parallel_filenames) > 1:
+                    if executor is None:
+                        executor = exit_stack.enter_context(
+                            concurrent.futures.ProcessPoolExecutor(num_processes))
+                    prefetched = _parse_files_parallel(executor, parallel_filenames,
+                                                       encoding, cache, log_timings)
+
+            for source, is_file in wave:
+                is_top_level = options_map is None
+
+                if is_file:
+                    # All filenames here must be absolute.
+                    assert path.isabs(source)
+                    filename = path.normpath(source)
+
+                    # Check for file previously parsed... detect duplicates.
+                    if filename in filenames_seen:
                         parse_errors.append(
                             LoadError(data.new_metadata("<load>", 0),
-                                      'File glob "{}" does not match any files'.format(
-                                          include_filename), None))
-            for include_filename in include_expanded:
-                if not path.isabs(include_filename):
-                    include_filename = path.join(cwd, include_filename)
-                include_filename = path.normpath(include_filename)
+                                      'Duplicate filename parsed: "{}"'.format(filename),
+                                      None))
+                        continue
 
-                # Add the include filenames to be processed later.
-                source_stack.append((include_filename, True))
+                    # Check for a file that does not exist.
+                    if not path.exists(filename):
+                        parse_errors.append(
+                            LoadError(data.new_metadata("<load>", 0),
+                                      'File "{}" does not exist'.format(filename), None))
+                        continue
+
+                    # Parse a file from disk directly.
+                    filenames_seen.add(filename)
+                    if filename in prefetched:
+                        (src_entries,
+                         src_errors,
+                         src_options_map) = prefetched.pop(filename)
+                    else:
+                        with misc_utils.log_time('beancount.parser.parser.parse_file',
+                                                 log_timings, indent=2):
+                            parse_file = (parser.parse_file
+                                          if cache is None
+                                          else cache.parse_file)
+                            (src_entries,
+                             src_errors,
+                             src_options_map) = parse_file(filename, encoding=encoding)
+
+                    cwd = path.dirname(filename)
+                else:
+                    # Encode the contents if necessary.
+                    if encoding:
+                        if isinstance(source, bytes):
+                            source = source.decode(encoding)
+                        source = source.encode('ascii', 'replace')
+
+                    # Parse a string buffer from memory.
+                    with misc_utils.log_time('beancount.parser.parser.parse_string',
+                                             log_timings, indent=2):
+                        (src_entries,
+                         src_errors,
+                         src_options_map) = parser.parse_string(source)
+
+                    # If we're parsing a string, the CWD is the current process
+                    # working directory.
+                    cwd = os.getcwd()
+
+                # Merge the entries resulting from the parsed file.
+                entries.extend(src_entries)
+                parse_errors.extend(src_errors)
+
+                # We need the options from the very top file only (the very
+                # first file being processed). No merging of options should
+                # occur.
+                if is_top_level:
+                    options_map = src_options_map
+                else:
+                    aggregate_options_map(options_map, src_options_map)
+
+                # Add includes to the list of sources to process. chdir() for glob,
+                # which uses it indirectly.
+                include_expanded = []
+                with file_utils.chdir(cwd):
+                    for include_filename in src_options_map['include']:
+                        matched_filenames = glob.glob(include_filename, recursive=True)
+                        if matched_filenames:
+                            include_expanded.extend(matched_filenames)
+                        else:
+                            parse_errors.append(
+                                LoadError(data.new_metadata("<load>", 0),
+                                          'File glob "{}" does not match any files'.format(
+                                              include_filename), None))
+                for include_filename in include_expanded:
+                    if not path.isabs(include_filename):
+                        include_filename = path.join(cwd, include_filename)
+                    include_filename = path.normpath(include_filename)
+
+                    # Add the include filenames to be processed later.
+                    source_stack.append((include_filename, True))
+
+    if cache is not None:
+        cache.flush_parsed()
 
     # Make sure we have at least a dict of valid options.
     if options_map is None:
@@ -404,6 +774,105 @@ def _parse_recursive(sources, log_timings, encoding=None):
     return entries, parse_errors, options_map
 
 
+def get_parse_processes(options_map):
+    """Get the number of processes to parse included files with.
+
+    Args:
+      options_map: The options map of the top-level file, or None if it hasn't
+        been parsed yet.
+    Returns:
+      An integer, the number of processes to use. A value below 2 means the
+      files are parsed sequentially in this process.
+    """
+    value = os.getenv(PARSE_PROCESSES_ENV)
+    if value:
+        try:
+            return int(value)
+        except ValueError:
+            logging.warning("Invalid value for %s: '%s'", PARSE_PROCESSES_ENV, value)
+            return 0
+    if options_map is None:
+        return 0
+    return options_map['parse_processes']
+
+
+def _get_new_filenames(sources, filenames_seen):
+    """Get the unique and existing files from a list of sources not yet parsed.
+
+    Args:
+      sources: A list of (filename-or-string, is-filename) tuples.
+      filenames_seen: A set of the absolute filenames already parsed.
+    Returns:
+      A list of normalized absolute filenames, in order of first appearance.
+    """
+    filenames = []
+    filenames_new = set()
+    for source, is_file in sources:
+        if not is_file:
+            continue
+        filename = path.normpath(source)
+        if (filename in filenames_seen or
+            filename in filenames_new or
+            not path.exists(filename)):
+            continue
+        filenames_new.add(filename)
+        filenames.append(filename)
+    return filenames
+
+
+def _parse_file_job(filename, encoding):
+    """Parse a single file in a worker process.
+
+    Args:
+      filename: A string, the absolute name of the file to parse.
+      encoding: A string or None, the encoding to decode the file with.
+    Returns:
+      A pair of the snapshot of the (entries, errors, options_map) triple,
+      which is much cheaper to send back than a pickle, and the parse time in
+      seconds.
+    """
+    time_before = time.time()
+    result = parser.parse_file(filename, encoding=encoding)
+    return snapshot.dumps(*result), time.time() - time_before
+
+
+def _parse_files_parallel(executor, filenames, encoding, cache, log_timings):
+    """Parse a list of files concurrently.
+
+    Args:
+      executor: A concurrent.futures.Executor to run the parser in.
+      filenames: A list of absolute filenames to parse.
+      encoding: A string or None, the encoding to decode the files with.
+      cache: An instance of LoadCache to reuse the directives of unchanged files
+        from, or None.
+      log_timings: A function to write timings to, or None.
+    Returns:
+      A dict of filename to its (entries, errors, options_map) triple.
+    """
+    results = {}
+    futures = []
+    for filename in filenames:
+        digest = None
+        if cache is not None:
+            digest = cache.file_digest(filename, encoding)
+            result = cache.get_parsed(filename, digest)
+            if result is not None:
+                results[filename] = result
+                continue
+        futures.append((filename, digest,
+                        executor.submit(_parse_file_job, filename, encoding)))
+
+    for filename, digest, future in futures:
+        blob, parse_time = future.result()
+        misc_utils.log_duration(
+            'beancount.parser.parser.parse_file({})'.format(path.basename(filename)),
+            log_timings, parse_time, indent=2)
+        if cache is not None:
+            cache.set_parsed(filename, digest, blob)
+        results[filename] = snapshot.loads(blob)
+    return results
+
+
 def aggregate_options_map(options_map, src_options_map):
     """Aggregate some of the attributes of options map.
 
@@ -422,7 +891,7 @@ def aggregate_options_map(options_map, src_options_map):
         commodities.add(currency)
 
 
-def _load(sources, log_timings, extra_validations, encoding):
+def _load(sources, log_timings, extra_validations, encoding, cache=None):
     """Parse Beancount input, run its transformations and validate it.
 
     (This is an internal method.)
@@ -442,6 +911,9 @@ def _load(sources, log_timings, extra_validations, encoding):
       extra_validations: A list of extra validation functions to run after loading
         this list of entries.
       encoding: A string or None, the encoding to decode the input filename with.
+      cache: An instance of LoadCache, or None. If provided, the products of the
+        parsing, booking, plugins and validation stages are reused from it when
+        their respective inputs have not changed, and updated otherwise.
     Returns:
       See load() or load_string().
     """
@@ -451,27 +923,60 @@ def _load(sources, log_timings, extra_validations, encoding):
         log_timings = log_timings.write
 
     # Parse all the files recursively.
-    entries, parse_errors, options_map = _parse_recursive(sources, log_timings, encoding)
+    entries, parse_errors, options_map = _parse_recursive(sources, log_timings,
+                                                          encoding, cache)
 
     # Ensure that the entries are sorted before running any processes on them.
     entries.sort(key=data.entry_sortkey)
 
-    # Run interpolation on incomplete entries.
-    entries, balance_errors = booking.book(entries, options_map)
-    parse_errors.extend(balance_errors)
+    if cache is None:
+        # Run interpolation on incomplete entries.
+        entries, balance_errors = booking.book(entries, options_map)
 
-    # Transform the entries.
-    entries, errors = run_transformations(entries, parse_errors, options_map, log_timings)
+        # Transform the entries.
+        entries, plugin_errors = run_transformations(entries, [], options_map,
+                                                     log_timings)
 
-    # Validate the list of entries.
-    with misc_utils.log_time('beancount.ops.validate', log_timings, indent=1):
-        valid_errors = validation.validate(entries, options_map, log_timings,
-                                           extra_validations)
-        errors.extend(valid_errors)
+        # Validate the list of entries.
+        with misc_utils.log_time('beancount.ops.validate', log_timings, indent=1):
+            valid_errors = validation.validate(entries, options_map, log_timings,
+                                               extra_validations)
 
-        # Note: We could go hardcore here and further verify that the entries
-        # haven't been modified by user-provided validation routines, by
-        # comparing hashes before and after. Not needed for now.
+            # Note: We could go hardcore here and further verify that the entries
+            # haven't been modified by user-provided validation routines, by
+            # comparing hashes before and after. Not needed for now.
+    else:
+        cache.prune(options_map['include'])
+
+        # Note: Each stage's key covers everything its output depends upon:
+        # the parsed directives and options, the code of the plugins, and the
+        # list of validations.
+        booking_key = cache.parse_key(options_map['include'])
+        entries, balance_errors, _ = cache.run_stage(
+            STAGE_BOOKING, booking_key,
+            _run_booking_stage, entries, options_map)
+
+        plugins_key = _combine_keys(booking_key,
+                                    compute_input_hash(_plugin_filenames(options_map)))
+        checkpoints = cache.balance_checkpoints
+        entries, plugin_errors, options_map = cache.run_stage(
+            STAGE_PLUGINS, plugins_key,
+            _run_plugins_stage, entries, options_map, log_timings, checkpoints)
+        if checkpoints is not None:
+            cache.hits[STAGE_BALANCE] += len(checkpoints.skipped)
+            cache.misses[STAGE_BALANCE] += len(checkpoints.recomputed)
+
+        validation_key = _combine_keys(plugins_key, *[
+            '{}.{}'.format(function.__module__, function.__qualname__)
+            for function in extra_validations or []])
+        with misc_utils.log_time('beancount.ops.validate', log_timings, indent=1):
+            _, valid_errors, _ = cache.run_stage(
+                STAGE_VALIDATION, validation_key,
+                _run_validation_stage, entries, options_map, log_timings,
+                extra_validations)
+        cache.result_key = validation_key
+
+    errors = parse_errors + balance_errors + plugin_errors + valid_errors
 
     # Compute the input hash.
     options_map['input_hash'] = compute_input_hash(options_map['include'])
@@ -479,7 +984,98 @@ def _load(sources, log_timings, extra_validations, encoding):
     return entries, errors, options_map
 
 
-def run_transformations(entries, parse_errors, options_map, log_timings):
+def _run_booking_stage(entries, options_map):
+    """Run booking as a cached stage.
+
+    Args:
+      entries: A list of sorted, incomplete directives.
+      options_map: An options dict.
+    Returns:
+      A triple of the booked entries, the booking errors and None.
+    """
+    entries, errors = booking.book(entries, options_map)
+    return entries, errors, None
+
+
+def _run_plugins_stage(entries, options_map, log_timings, balance_checkpoints):
+    """Run the transformations as a cached stage.
+
+    Plugins are allowed to modify the options map, so it is part of the output
+    of this stage.
+
+    Args:
+      entries: A list of booked directives.
+      options_map: An options dict.
+      log_timings: A function to write timings to, or None.
+      balance_checkpoints: A BalanceCheckpoints instance, or None.
+    Returns:
+      A triple of the transformed entries, the errors produced by the plugins,
+      and the options map.
+    """
+    # The balance checkpoints are passed to the balance plugin as its config.
+    plugin_configs = ({balance.__name__: balance_checkpoints}
+                      if balance_checkpoints is not None
+                      else None)
+    entries, errors = run_transformations(entries, [], options_map, log_timings,
+                                          plugin_configs)
+    return entries, errors, options_map
+
+
+def _run_validation_stage(entries, options_map, log_timings, extra_validations):
+    """Run the validations as a cached stage.
+
+    Args:
+      entries: A list of transformed directives.
+      options_map: An options dict.
+      log_timings: A function to write timings to, or None.
+      extra_validations: A list of extra validation functions, or None.
+    Returns:
+      A triple of an empty list, the validation errors and None.
+    """
+    errors = validation.validate(entries, options_map, log_timings,
+                                 extra_validations)
+    return [], errors, None
+
+
+def _plugin_filenames(options_map):
+    """Find the source files of the plugins that would run on a ledger.
+
+    Args:
+      options_map: An options dict, with the list of plugins to run.
+    Returns:
+      A list of the filenames of the plugin modules that could be located.
+    """
+    filenames = []
+    for plugin_name, _ in itertools.chain(DEFAULT_PLUGINS_PRE,
+                                          options_map["plugin"],
+                                          DEFAULT_PLUGINS_POST):
+        plugin_name = RENAMED_MODULES.get(plugin_name, plugin_name)
+        try:
+            spec = importlib.util.find_spec(plugin_name)
+        except (ImportError, ValueError):
+            continue
+        if spec is not None and spec.origin and path.isabs(spec.origin):
+            filenames.append(spec.origin)
+    return filenames
+
+
+def _combine_keys(*keys):
+    """Combine a number of string fingerprints into a single one.
+
+    Args:
+      *keys: Strings, fingerprints to combine, in order.
+    Returns:
+      A string, a hash of all the keys.
+    """
+    md5 = hashlib.md5()
+    for key in keys:
+        md5.update(key.encode('utf8'))
+        md5.update(b'\0')
+    return md5.hexdigest()
+
+
+def run_transformations(entries, parse_errors, options_map, log_timings,
+                        plugin_configs=None):
     """Run the various transformations on the entries.
 
     This is where entries are being synthesized, checked, plugins are run, etc.
@@ -490,6 +1086,8 @@ def run_transformations(entries, parse_errors, options_map, log_timings):
       options_map: An options dict as read from the parser.
       log_timings: A function to write timing log entries to, or None, if it
         should be quiet.
+      plugin_configs: A dict of plugin module name to the config to pass to its
+        functions instead of the one from its plugin directive, or None.
     Returns:
       A list of modified entries, and a list of errors, also possibly modified.
     """
@@ -517,6 +1115,9 @@ def run_transformations(entries, parse_errors, options_map, log_timings):
                               plugin_name, renamed_name))
             plugin_name = renamed_name
 
+        if plugin_configs and plugin_name in plugin_configs:
+            plugin_config = plugin_configs[plugin_name]
+
         # Try to import the module.
         try:
             module = importlib.import_module(plugin_name)
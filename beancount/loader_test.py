@@ -2,6 +2,7 @@ __copyright__ = "Copyright (C) 2014-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
 import logging
+import shutil
 import unittest
 import tempfile
 import textwrap
@@ -290,6 +291,91 @@ class TestLoadIncludes(unittest.TestCase):
                          list(map(path.basename, options_map['include'])))
 
 
+class TestParallelParse(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        test_utils.create_temporary_files(self.tmp, {
+            'root.beancount': """
+              option "parse_processes" "3"
+              include "accounts.beancount"
+              include "years/*.beancount"
+              include "years/2014.beancount"
+              2014-01-01 open Assets:Root
+            """,
+            'accounts.beancount': """
+              include "years/2015.beancount"
+              include "missing/*.beancount"
+              2014-01-01 open Assets:Cash
+            """,
+            'years/2014.beancount': """
+              include "../nested.beancount"
+              2014-02-01 * "2014"
+                Assets:Cash   1 USD
+                Assets:Root
+            """,
+            'years/2015.beancount': """
+              include "../other.beancount"
+              2015-02-01 * "2015"
+                Assets:Cash   2 USD
+                Assets:Root
+            """,
+            'years/2016.beancount': """
+              2016-02-01 open
+              2016-02-02 note Assets:Cash "2016"
+            """,
+            'nested.beancount': """
+              2013-02-01 note Assets:Cash "Nested"
+            """,
+            'other.beancount': """
+              2013-02-01 note Assets:Cash "Other"
+            """})
+        self.filename = path.join(self.tmp, 'root.beancount')
+
+    def parse(self, *args):
+        entries, errors, options_map = loader._parse_recursive(
+            [(self.filename, True)], *args)
+        return (entries,
+                [(error.source['filename'], error.message) for error in errors],
+                options_map['include'])
+
+    def test_parse_parallel(self):
+        with mock.patch.dict(os.environ, {loader.PARSE_PROCESSES_ENV: '1'}):
+            expected = self.parse(None)
+        # Check that the same file is merged only once and errors from
+        # duplicate, missing and invalid files are preserved, in order.
+        self.assertEqual(7, len(expected[0]))
+        self.assertEqual(7, len(expected[2]))
+        self.assertEqual(4, len(expected[1]))
+
+        logs = []
+        with mock.patch('beancount.loader._parse_files_parallel',
+                        wraps=loader._parse_files_parallel) as parse_parallel:
+            self.assertEqual(expected, self.parse(logs.append))
+        self.assertEqual(['2014.beancount', '2015.beancount', '2016.beancount',
+                          'accounts.beancount', 'nested.beancount', 'other.beancount'],
+                         sorted([path.basename(filename)
+                                 for call in parse_parallel.call_args_list
+                                 for filename in call[0][1]]))
+        self.assertEqual(2, parse_parallel.call_count)
+        self.assertTrue(any('parse_file(2016.beancount)' in line for line in logs))
+
+    def test_parse_parallel_environ(self):
+        with mock.patch.dict(os.environ, {loader.PARSE_PROCESSES_ENV: '1'}):
+            with mock.patch('beancount.loader._parse_files_parallel') as parse_parallel:
+                self.parse(None)
+        self.assertFalse(parse_parallel.called)
+
+    def test_parse_parallel_cache(self):
+        expected = self.parse(None)
+        cache = loader.LoadCache()
+        self.assertEqual(expected, self.parse(None, None, cache))
+        self.assertEqual(7, cache.misses[loader.STAGE_PARSE])
+        self.assertEqual(expected, self.parse(None, None, cache))
+        self.assertEqual(7, cache.hits[loader.STAGE_PARSE])
+
+
 class TestLoadCache(unittest.TestCase):
 
     def setUp(self):
@@ -383,6 +469,137 @@ class TestLoadCache(unittest.TestCase):
             entries, errors, options_map = loader.load_file(top_filename)
             self.assertEqual(2, self.num_calls)
 
+    def test_load_cache_stages(self):
+        # Create an initial set of files and load them, thus creating a cache.
+        with test_utils.tempdir() as tmp:
+            test_utils.create_temporary_files(tmp, {
+                'apples.beancount': """
+                  include "oranges.beancount"
+                  include "bananas.beancount"
+                  2014-01-01 open Assets:Apples
+                  2014-01-01 open Equity:Opening-Balances
+                """,
+                'oranges.beancount': """
+                  2014-01-02 open Assets:Oranges
+                """,
+                'bananas.beancount': """
+                  2014-01-02 open Assets:Bananas
+                """})
+            top_filename = path.join(tmp, 'apples.beancount')
+            log_lines = []
+            entries, errors, options_map = loader.load_file(top_filename,
+                                                            log_timings=log_lines.append)
+            self.assertFalse(errors)
+            self.assertEqual(4, len(entries))
+            self.assertIn("Cache:     'parse'", '\n'.join(log_lines))
+
+            # Modify a single included file; only that file should be parsed again.
+            with open(path.join(tmp, 'bananas.beancount'), 'a') as file:
+                file.write('2014-01-03 open Assets:Plantains\n')
+            with mock.patch('beancount.parser.parser.parse_file',
+                            side_effect=parser.parse_file) as parse_file:
+                log_lines = []
+                entries, errors, options_map = loader.load_file(
+                    top_filename, log_timings=log_lines.append)
+                self.assertEqual(5, len(entries))
+                self.assertEqual(1, parse_file.call_count)
+            self.assertRegex('\n'.join(log_lines),
+                             r"'parse'.*Hits: +2  Misses: +1")
+            self.assertRegex('\n'.join(log_lines),
+                             r"'booking'.*Hits: +0  Misses: +1")
+
+            # Touch all the files without changing their contents; nothing gets
+            # recomputed, but the result is the same.
+            for filename in options_map['include']:
+                with open(filename, 'a'):
+                    os.utime(filename, (0, 0))
+            with mock.patch('beancount.parser.booking.book') as book:
+                log_lines = []
+                new_entries, new_errors, _ = loader.load_file(
+                    top_filename, log_timings=log_lines.append)
+                self.assertFalse(book.called)
+            self.assertEqual(entries, new_entries)
+            self.assertEqual(errors, new_errors)
+            for stage in 'booking', 'plugins', 'validation':
+                self.assertRegex('\n'.join(log_lines),
+                                 r"'{}'.*Hits: +1  Misses: +0".format(stage))
+
+            # Touch them again; the stored result is not serialized again.
+            for filename in options_map['include']:
+                os.utime(filename, (1, 1))
+            with mock.patch.object(loader.LoadCache, 'dumps') as dumps:
+                new_entries, _, new_options_map = loader.load_file(top_filename)
+                self.assertFalse(dumps.called)
+            self.assertEqual(entries, new_entries)
+            self.assertFalse(loader.needs_refresh(new_options_map))
+            self.assertEqual(new_options_map['input_hash'],
+                             loader.load_file(top_filename)[2]['input_hash'])
+
+    def test_load_cache_threshold(self):
+        with test_utils.tempdir() as tmp:
+            test_utils.create_temporary_files(tmp, {
+                'apples.beancount': """
+                  include "oranges.beancount"
+                  2014-01-01 open Assets:Apples
+                """,
+                'oranges.beancount': """
+                  2014-01-02 open Assets:Oranges
+                """})
+            top_filename = path.join(tmp, 'apples.beancount')
+
+            # Nothing gets serialized for stages quicker than the threshold.
+            cache = loader.LoadCache(time_threshold=3600)
+            with mock.patch.object(loader.LoadCache, 'dumps') as dumps:
+                loader._load([(top_filename, True)], None, None, None, cache)
+                self.assertFalse(dumps.called)
+            self.assertEqual({}, cache.stages)
+            self.assertEqual([None, None], [blob for _, blob in cache.parsed.values()])
+
+            # And no cache file gets written for a quick load.
+            load_file = loader.pickle_cache_function(loader.PICKLE_CACHE_FILENAME,
+                                                     3600, loader._uncached_load_file)
+            entries, errors, _ = load_file(top_filename, None, None, None)
+            self.assertFalse(errors)
+            self.assertEqual(2, len(entries))
+            self.assertEqual({'apples.beancount', 'oranges.beancount'},
+                             set(os.listdir(tmp)))
+
+    def test_load_cache_balance_checkpoints(self):
+        with test_utils.tempdir() as tmp:
+            test_utils.create_temporary_files(tmp, {
+                'apples.beancount': """
+                  2014-01-01 open Assets:Apples
+                  2014-01-01 open Equity:Opening-Balances
+                  2014-01-02 *
+                    Assets:Apples   10 APPLE
+                    Equity:Opening-Balances
+                  2014-01-03 balance Assets:Apples  10 APPLE
+                  2014-01-04 balance Assets:Apples  10 APPLE
+                """})
+            top_filename = path.join(tmp, 'apples.beancount')
+
+            # The checkpoints are not recorded when creating a new cache.
+            log_lines = []
+            loader.load_file(top_filename, log_timings=log_lines.append)
+            self.assertNotIn("'balance'", '\n'.join(log_lines))
+
+            # They are when refreshing an existing one.
+            with open(top_filename, 'a') as file:
+                file.write('2014-01-05 balance Assets:Apples  10 APPLE\n')
+            log_lines = []
+            loader.load_file(top_filename, log_timings=log_lines.append)
+            self.assertRegex('\n'.join(log_lines),
+                             r"'balance'.*Hits: +0  Misses: +3")
+
+            # Only the appended balance assertion is checked again.
+            with open(top_filename, 'a') as file:
+                file.write('2014-01-06 balance Assets:Apples  11 APPLE\n')
+            log_lines = []
+            _, errors, _ = loader.load_file(top_filename, log_timings=log_lines.append)
+            self.assertEqual(1, len(errors))
+            self.assertRegex('\n'.join(log_lines),
+                             r"'balance'.*Hits: +3  Misses: +1")
+
     @mock.patch('os.remove', side_effect=OSError)
     @mock.patch('logging.warning')
     def test_load_cache_read_only_fs(self, remove_mock, warn_mock):
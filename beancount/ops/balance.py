@@ -1,19 +1,27 @@
-"""Automatic padding of gaps between entries.
+"""Checking of the balance assertions.
+
+The balance assertions can be checked incrementally across loads: if given a
+BalanceCheckpoints instance, check() records a digest of the postings and
+assertions which precede each assertion, along with the running balances every
+few assertions. On the next check, the assertions whose digest is unchanged are
+not computed again, and the running balances are restored from the last
+checkpoint before the first assertion which changed, rather than replayed from
+the beginning of history.
 """
 __copyright__ = "Copyright (C) 2013-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
 import collections
+import hashlib
 
-from beancount.core.number import ONE
 from beancount.core.number import ZERO
 from beancount.core.data import Transaction
 from beancount.core.data import Balance
 from beancount.core import amount
 from beancount.core import account
 from beancount.core import inventory
-from beancount.core import realization
 from beancount.core import getters
+from beancount.core import interpolate
 
 __plugins__ = ('check',)
 
@@ -21,6 +29,130 @@ __plugins__ = ('check',)
 BalanceError = collections.namedtuple('BalanceError', 'source message entry')
 
 
+# The number of assertions between checkpoints of the running balances.
+CHECKPOINT_INTERVAL = 64
+
+
+class BalanceCheckpoints:
+    """The results of the balance assertions of a previous check.
+
+    Attributes:
+      assertions: A list of the results of the balance assertions, in order,
+        pairs of a digest of the postings of the asserted accounts and of the
+        assertions up to and including it, and the accumulated balance of the
+        asserted currency, an Amount.
+      balances: A dict of assertion index to a dict of account name to its
+        balance after the postings preceding that assertion, for every
+        CHECKPOINT_INTERVAL assertions and the last one.
+      skipped: A list of the Balance directives whose result was reused by the
+        last check. This is not persisted.
+      recomputed: A list of the Balance directives which were computed by the
+        last check. This is not persisted.
+    """
+    def __init__(self):
+        self.assertions = []
+        self.balances = {}
+        self.reset_stats()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['skipped']
+        del state['recomputed']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Forget the assertions skipped and recomputed by the last check."""
+        self.skipped = []
+        self.recomputed = []
+
+
+class RunningBalances:
+    """The running balances of a few accounts, including their subaccounts.
+
+    This accumulates the postings of a set of accounts and all their
+    subaccounts, such as those which have balance assertions or are padded,
+    ignoring the postings of all the other accounts. The balance of each of
+    the accounts is the total of its subtree, so that checking the balance of
+    a parent account doesn't require summing up those of its children.
+
+    Attributes:
+      balances: A dict of account name to its Inventory, the sum of the
+        postings of the account and of its subaccounts.
+      targets: A dict of the name of an account with postings to the list of
+        the names of the accounts in 'balances' that it is a subaccount of, or
+        is.
+    """
+    def __init__(self, accounts):
+        """Create running balances.
+
+        Args:
+          accounts: An iterable of the names of the accounts to track.
+        """
+        self.balances = {account_: inventory.Inventory() for account_ in accounts}
+        self.targets = {}
+
+    def get_targets(self, account_name):
+        """Get the tracked accounts whose balance includes an account's.
+
+        Args:
+          account_name: A string, the name of an account.
+        Returns:
+          A list of account names, possibly empty.
+        """
+        try:
+            return self.targets[account_name]
+        except KeyError:
+            targets = []
+            parent_name = account_name
+            while parent_name:
+                if parent_name in self.balances:
+                    targets.append(parent_name)
+                parent_name = account.parent(parent_name)
+            self.targets[account_name] = targets
+            return targets
+
+    def add_posting(self, posting):
+        """Add a posting to the running balances it belongs to.
+
+        Args:
+          posting: A Posting instance.
+        Returns:
+          A boolean, true if the account of the posting is tracked.
+        """
+        targets = self.get_targets(posting.account)
+        balances = self.balances
+        for account_ in targets:
+            # Note: Always allow negative lots for the purpose of balancing.
+            # This error should show up somewhere else than here.
+            balances[account_].add_position(posting)
+        return bool(targets)
+
+    def snapshot(self):
+        """Copy the balances.
+
+        Returns:
+          A dict of account name to a copy of its Inventory, for the accounts
+          whose balances aren't empty.
+        """
+        return {account_: inventory.Inventory(balance)
+                for account_, balance in self.balances.items()
+                if not balance.is_empty()}
+
+    def restore(self, balances):
+        """Reset the balances to a copy made by snapshot().
+
+        Args:
+          balances: A dict of account name to its Inventory. The accounts which
+            aren't in it have an empty balance.
+        """
+        for account_ in self.balances:
+            self.balances[account_] = inventory.Inventory(balances.get(account_, ()))
+
+
 def get_balance_tolerance(balance_entry, options_map):
     """Get the tolerance amount for a single entry.
 
@@ -41,24 +173,30 @@ def get_balance_tolerance(balance_entry, options_map):
             # Pad because the user creates these and the rounding of those
             # balances may often be further off than those used within a single
             # transaction.
-            tolerance = options_map["inferred_tolerance_multiplier"] * 2
-            tolerance = ONE.scaleb(expo) * tolerance
+            tolerance = interpolate.get_tolerance(
+                expo, options_map["inferred_tolerance_multiplier"] * 2)
         else:
             tolerance = ZERO
 
     return tolerance
 
 
-def check(entries, options_map):
+def check(entries, options_map, checkpoints=None):
     """Process the balance assertion directives.
 
     For each Balance directive, check that their expected balance corresponds to
     the actual balance computed at that time and replace failing ones by new
     ones with a flag that indicates failure.
 
+    If checkpoints are provided, the balances of the assertions whose
+    preceding postings are unchanged since the previous check are reused rather
+    than computed, and the checkpoints are updated. Recording them is not free,
+    so they should only be provided if they are going to be reused.
+
     Args:
       entries: A list of directives.
       options_map: A dict of options, parsed from the input file.
+      checkpoints: A BalanceCheckpoints instance, or None.
     Returns:
       A pair of a list of directives and a list of balance check errors.
     """
@@ -68,47 +206,88 @@ def check(entries, options_map):
     # This is similar to realization, but performed in a different order, and
     # where we only accumulate inventories for accounts that have balance
     # assertions in them (this saves on time). Here we process the entries one
-    # by one along with the balance checks. We use a temporary realization in
-    # order to hold the incremental tree of balances, so that we can easily get
-    # the amounts of an account's subaccounts for making checks on parent
-    # accounts.
-    real_root = realization.RealAccount('')
-
-    # Figure out the set of accounts for which we need to compute a running
-    # inventory balance.
-    asserted_accounts = {entry.account
-                         for entry in entries
-                         if isinstance(entry, Balance)}
-
-    # Add all children accounts of an asserted account to be calculated as well,
-    # and pre-create these accounts, and only those (we're just being tight to
-    # make sure).
-    asserted_match_list = [account.parent_matcher(account_)
-                           for account_ in asserted_accounts]
-    for account_ in getters.get_accounts(entries):
-        if (account_ in asserted_accounts or
-            any(match(account_) for match in asserted_match_list)):
-            realization.get_or_create(real_root, account_)
+    # by one along with the balance checks. The balance of each asserted
+    # account includes those of its subaccounts, as we support checks for
+    # parent accounts for the total sum of their subaccounts.
+    balance_entries = [entry for entry in entries if isinstance(entry, Balance)]
+    running_balances = RunningBalances({entry.account for entry in balance_entries})
 
     # Get the Open directives for each account.
     open_close_map = getters.get_account_open_close(entries)
 
-    for entry in entries:
+    # While the postings and the assertions are the same as in the previous
+    # check, the balances are not accumulated; we only remember the last
+    # checkpoint of the balances to restore them from once they differ.
+    previous_assertions = []
+    previous_balances = {}
+    new_assertions = []
+    new_balances = {}
+    md5 = hashlib.md5()
+    digest = None
+    if checkpoints is not None:
+        checkpoints.reset_stats()
+        previous_assertions = checkpoints.assertions
+        previous_balances = checkpoints.balances
+    unchanged = bool(previous_assertions)
+    replay_index = 0
+    replay_balances = {}
+    assertion_index = -1
+
+    for index, entry in enumerate(entries):
         if isinstance(entry, Transaction):
             # For each of the postings' accounts, update the balance inventory.
             for posting in entry.postings:
-                real_account = realization.get(real_root, posting.account)
-
-                # The account will have been created only if we're meant to track it.
-                if real_account is not None:
-                    # Note: Always allow negative lots for the purpose of balancing.
-                    # This error should show up somewhere else than here.
-                    real_account.balance.add_position(posting)
+                if unchanged:
+                    if running_balances.get_targets(posting.account):
+                        update_digest(md5, posting)
+                elif (running_balances.add_posting(posting) and
+                      checkpoints is not None):
+                    update_digest(md5, posting)
 
         elif isinstance(entry, Balance):
+            expected_amount = entry.amount
+            assertion_index += 1
+            if checkpoints is not None:
+                md5.update('{}\0{}\n'.format(entry.account,
+                                             expected_amount.currency).encode('utf8'))
+                digest = md5.digest()
+
+            if (unchanged and
+                assertion_index < len(previous_assertions) and
+                previous_assertions[assertion_index][0] == digest):
+                # Reuse the balance from the previous check.
+                balance_amount = previous_assertions[assertion_index][1]
+                checkpoints.skipped.append(entry)
+                if assertion_index in previous_balances:
+                    replay_index = index
+                    replay_balances = previous_balances[assertion_index]
+                    new_balances[assertion_index] = replay_balances
+            else:
+                if unchanged:
+                    # Restore the balances from the last checkpoint and
+                    # accumulate the postings since then.
+                    unchanged = False
+                    running_balances.restore(replay_balances)
+                    for replay_entry in entries[replay_index:index]:
+                        if isinstance(replay_entry, Transaction):
+                            for posting in replay_entry.postings:
+                                running_balances.add_posting(posting)
+
+                # Get only the amount in the desired currency.
+                balance_amount = running_balances.balances[
+                    entry.account].get_currency_units(expected_amount.currency)
+
+                if checkpoints is not None:
+                    checkpoints.recomputed.append(entry)
+                    if (assertion_index % CHECKPOINT_INTERVAL == 0 or
+                        assertion_index == len(balance_entries) - 1):
+                        new_balances[assertion_index] = running_balances.snapshot()
+
+            if checkpoints is not None:
+                new_assertions.append((digest, balance_amount))
+
             # Check that the currency of the balance check is one of the allowed
             # currencies for that account.
-            expected_amount = entry.amount
             try:
                 open, _ = open_close_map[entry.account]
             except KeyError:
@@ -127,20 +306,6 @@ def check(entries, options_map):
                                      expected_amount.currency),
                                  entry))
 
-            # Check the balance against the check entry.
-            real_account = realization.get(real_root, entry.account)
-            assert real_account is not None, "Missing {}".format(entry.account)
-
-            # Sum up the current balances for this account and its
-            # sub-accounts. We want to support checks for parent accounts
-            # for the total sum of their subaccounts.
-            subtree_balance = inventory.Inventory()
-            for real_child in realization.iter_children(real_account, False):
-                subtree_balance += real_child.balance
-
-            # Get only the amount in the desired currency.
-            balance_amount = subtree_balance.get_currency_units(expected_amount.currency)
-
             # Check if the amount is within bounds of the expected amount.
             diff_amount = amount.sub(balance_amount, expected_amount)
 
@@ -170,4 +335,20 @@ def check(entries, options_map):
 
         new_entries.append(entry)
 
+    if checkpoints is not None:
+        checkpoints.assertions = new_assertions
+        checkpoints.balances = new_balances
+
     return new_entries, check_errors
+
+
+def update_digest(md5, posting):
+    """Update the digest of the postings of the asserted accounts.
+
+    Args:
+      md5: A hashlib digest object.
+      posting: A Posting instance.
+    """
+    units = posting.units
+    md5.update('{}\0{}\0{}\0{!r}\n'.format(posting.account, units.number, units.currency,
+                                           posting.cost).encode('utf8'))
@@ -1,11 +1,16 @@
 __copyright__ = "Copyright (C) 2014-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
+import pickle
+import textwrap
 import unittest
 
 from beancount.core.number import D
 from beancount.core.amount import A
+from beancount.core import data
+from beancount.core import inventory
 from beancount.ops import balance
+from beancount.parser import parser
 from beancount import loader
 
 
@@ -378,3 +383,96 @@ class TestBalancePrecision(unittest.TestCase):
         self.assertEqual(2, len(errors))
         self.assertRegex(errors[0].message, '23.022')
         self.assertRegex(errors[1].message, '23.026')
+
+
+class TestRunningBalances(unittest.TestCase):
+
+    def test_running_balances(self):
+        running_balances = balance.RunningBalances(['Assets:Bank', 'Assets:Bank:Checking'])
+        for account, string in [('Assets:Bank:Checking', '10 USD'),
+                                ('Assets:Bank:Savings', '20 USD'),
+                                ('Assets:Banks', '40 USD'),
+                                ('Assets', '80 USD')]:
+            running_balances.add_posting(
+                data.Posting(account, A(string), None, None, None, None))
+        self.assertEqual({'Assets:Bank': inventory.from_string('30 USD'),
+                          'Assets:Bank:Checking': inventory.from_string('10 USD')},
+                         running_balances.balances)
+        self.assertEqual(['Assets:Bank:Checking', 'Assets:Bank'],
+                         running_balances.get_targets('Assets:Bank:Checking:Sub'))
+        self.assertEqual([], running_balances.get_targets('Assets:Banks'))
+
+        snapshot = running_balances.snapshot()
+        running_balances.add_posting(
+            data.Posting('Assets:Bank', A('5 USD'), None, None, None, None))
+        self.assertEqual(A('35 USD'), running_balances.balances[
+            'Assets:Bank'].get_currency_units('USD'))
+        running_balances.restore(snapshot)
+        self.assertEqual(A('30 USD'), running_balances.balances[
+            'Assets:Bank'].get_currency_units('USD'))
+
+
+class TestBalanceCheckpoints(unittest.TestCase):
+
+    INPUT = """
+      2013-05-01 open Assets:Bank
+      2013-05-01 open Assets:Bank:Checking
+      2013-05-01 open Assets:Bank:Savings
+      2013-05-01 open Equity:Opening-Balances
+
+      2013-05-03 *
+        Assets:Bank:Checking              100 USD
+        Equity:Opening-Balances
+
+      2013-05-04 balance Assets:Bank:Checking   100 USD
+      2013-05-04 balance Assets:Bank            101 USD
+
+      2013-05-05 *
+        Assets:Bank:Savings                20 USD
+        Equity:Opening-Balances
+
+      2013-05-06 balance Assets:Bank:Savings     20 USD
+      2013-05-06 balance Assets:Bank            120 USD
+    """
+
+    def check(self, input_string, checkpoints):
+        entries, _, options_map = parser.parse_string(textwrap.dedent(input_string))
+        expected = balance.check(entries, options_map)
+        actual = balance.check(entries, options_map, checkpoints)
+        self.assertEqual(expected, actual)
+        return [error.entry.amount.number for error in actual[1]]
+
+    def test_checkpoints(self):
+        checkpoints = balance.BalanceCheckpoints()
+        self.assertEqual([D('101')], self.check(self.INPUT, checkpoints))
+        self.assertEqual((0, 4), (len(checkpoints.skipped), len(checkpoints.recomputed)))
+
+        # Nothing changed.
+        self.assertEqual([D('101')], self.check(self.INPUT, checkpoints))
+        self.assertEqual((4, 0), (len(checkpoints.skipped), len(checkpoints.recomputed)))
+
+        # Appended entries and changed amounts of assertions don't invalidate
+        # the previous checks.
+        input_string = self.INPUT.replace('101 USD', '100 USD') + """
+          2013-05-07 *
+            Assets:Bank:Checking              1 USD
+            Equity:Opening-Balances
+
+          2013-05-08 balance Assets:Bank            120 USD
+        """
+        self.assertEqual([D('120')], self.check(input_string, checkpoints))
+        self.assertEqual((4, 1), (len(checkpoints.skipped), len(checkpoints.recomputed)))
+
+        # Changes to the postings of asserted accounts invalidate the following
+        # checks only.
+        input_string = input_string.replace('Savings                20 USD',
+                                            'Savings                21 USD')
+        self.assertEqual([D('20'), D('120'), D('120')],
+                         self.check(input_string, checkpoints))
+        self.assertEqual((2, 3), (len(checkpoints.skipped), len(checkpoints.recomputed)))
+
+        # The checkpoints survive pickling.
+        checkpoints = pickle.loads(pickle.dumps(checkpoints))
+        self.assertEqual([D('20'), D('120'), D('120')],
+                         self.check(input_string, checkpoints))
+        self.assertEqual((5, 0), (len(checkpoints.skipped), len(checkpoints.recomputed)))
@@ -5,13 +5,10 @@ __license__ = "GNU GPLv2"
 
 import collections
 
-from beancount.core import account
 from beancount.core import amount
-from beancount.core import inventory
 from beancount.core import data
 from beancount.core import position
 from beancount.core import flags
-from beancount.core import realization
 from beancount.utils import misc_utils
 from beancount.ops import balance
 
@@ -34,6 +31,9 @@ def pad(entries, options_map):
     are specified only for one currency at a time, and pads will only be
     inserted for those currencies.
 
+    This streams through the sorted entries once, accumulating the postings of
+    the padded accounts and their children only.
+
     Args:
       entries: A list of directives.
       options_map: A parser options dict.
@@ -43,51 +43,48 @@ def pad(entries, options_map):
     """
     pad_errors = []
 
-    # Find all the pad entries and group them by account.
+    # Find all the pad entries and the accounts they pad.
     pads = list(misc_utils.filter_type(entries, data.Pad))
-    pad_dict = misc_utils.groupby(lambda x: x.account, pads)
+    pad_accounts = sorted({pad.account for pad in pads})
 
-    # Partially realize the postings, so we can iterate them by account.
-    by_account = realization.postings_by_account(entries)
+    # Accumulate only the postings of the padded accounts and their children,
+    # as we stream through the entries once.
+    running_balances = balance.RunningBalances(pad_accounts)
 
     # A dict of pad -> list of entries to be inserted.
     new_entries = {id(pad): [] for pad in pads}
 
-    # Process each account that has a padding group.
-    for account_, pad_list in sorted(pad_dict.items()):
-
-        # Last encountered / currency active pad entry.
-        active_pad = None
+    # Last encountered / currency active pad entry, for each padded account.
+    active_pads = {}
 
-        # Gather all the postings for the account and its children.
-        postings = []
-        is_child = account.parent_matcher(account_)
-        for item_account, item_postings in by_account.items():
-            if is_child(item_account):
-                postings.extend(item_postings)
-        postings.sort(key=data.posting_sortkey)
+    # A set of currencies already padded so far, for each padded account.
+    padded_lots_map = {account_: set() for account_ in pad_accounts}
 
-        # A set of currencies already padded so far in this account.
-        padded_lots = set()
+    # The errors of each padded account, reported in order of account.
+    account_errors = {account_: [] for account_ in pad_accounts}
 
-        pad_balance = inventory.Inventory()
-        for entry in postings:
+    for entry in (entries if pads else ()):
+        if isinstance(entry, data.Transaction):
+            # This is a transaction; update the running balances of the padded
+            # accounts.
+            for posting in entry.postings:
+                running_balances.add_posting(posting)
 
-            assert not isinstance(entry, data.Posting)
-            if isinstance(entry, data.TxnPosting):
-                # This is a transaction; update the running balance for this
-                # account.
-                pad_balance.add_position(entry.posting)
+        elif isinstance(entry, data.Pad):
+            # Mark this newly encountered pad as active and allow all lots
+            # to be padded heretofore.
+            active_pads[entry.account] = entry
+            padded_lots_map[entry.account] = set()
 
-            elif isinstance(entry, data.Pad):
-                if entry.account == account_:
-                    # Mark this newly encountered pad as active and allow all lots
-                    # to be padded heretofore.
-                    active_pad = entry
-                    padded_lots = set()
+        elif isinstance(entry, data.Balance):
+            check_amount = entry.amount
 
-            elif isinstance(entry, data.Balance):
-                check_amount = entry.amount
+            # Check the balance of each of the padded accounts which include
+            # the account of this check.
+            for account_ in running_balances.get_targets(entry.account):
+                pad_balance = running_balances.balances[account_]
+                active_pad = active_pads.get(account_, None)
+                padded_lots = padded_lots_map[account_]
 
                 # Compare the current balance amount to the expected one from
                 # the check entry. IMPORTANT: You need to understand that this
@@ -115,7 +112,7 @@ def pad(entries, options_map):
                                      if pos.units.currency == check_amount.currency]
                         for position_ in positions:
                             if position_.cost is not None:
-                                pad_errors.append(
+                                account_errors[account_].append(
                                     PadError(entry.meta,
                                              ("Attempt to pad an entry with cost for "
                                               "balance: {}".format(pad_balance)),
@@ -155,6 +152,9 @@ def pad(entries, options_map):
                 # Mark this lot as padded. Further checks should not pad this lot.
                 padded_lots.add(check_amount.currency)
 
+    for account_ in pad_accounts:
+        pad_errors.extend(account_errors[account_])
+
     # Insert the newly created entries right after the pad entries that created them.
     padded_entries = []
     for entry in entries:
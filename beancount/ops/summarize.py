@@ -206,7 +206,8 @@ def clamp(entries,
           conversion_currency,
           account_earnings,
           account_opening,
-          account_conversions):
+          account_conversions,
+          balance_index=None):
     """Filter entries to include only those during a specified time period.
 
     Firstly, this method will transfer all balances for the income and expense
@@ -239,6 +240,9 @@ def clamp(entries,
         opening balances account.
       account_conversions: A string, tne name of the equity account to
         book currency conversions against.
+      balance_index: An optional balance_index.BalanceIndex built from
+        'entries', to look up the balances of the income statement accounts
+        at the beginning of the period from.
     Returns:
       A new list of entries is returned, and the index that points to the first
       original transaction after the beginning date of the period. This index
@@ -249,7 +253,8 @@ def clamp(entries,
     income_statement_account_pred = (
         lambda account: is_income_statement_account(account, account_types))
     entries = transfer_balances(entries, begin_date,
-                                income_statement_account_pred, account_earnings)
+                                income_statement_account_pred, account_earnings,
+                                balance_index)
 
     # Summarize all the previous balances, after transferring the income and
     # expense balances, so all entries for those accounts before the begin date
@@ -265,7 +270,7 @@ def clamp(entries,
     return entries, index
 
 
-def clamp_opt(entries, begin_date, end_date, options_map):
+def clamp_opt(entries, begin_date, end_date, options_map, balance_index=None):
     """Clamp by getting all the parameters from an options map.
 
     See clamp() for details.
@@ -275,6 +280,7 @@ def clamp_opt(entries, begin_date, end_date, options_map):
       begin_date: See clamp().
       end_date: See clamp().
       options_map: A parser's option_map.
+      balance_index: See clamp().
     Returns:
       Same as clamp().
     """
@@ -284,7 +290,8 @@ def clamp_opt(entries, begin_date, end_date, options_map):
     return clamp(entries, begin_date, end_date,
                  account_types,
                  conversion_currency,
-                 *previous_accounts)
+                 *previous_accounts,
+                 balance_index=balance_index)
 
 
 def cap(entries,
@@ -346,7 +353,8 @@ def cap_opt(entries, options_map):
                *current_accounts)
 
 
-def transfer_balances(entries, date, account_pred, transfer_account):
+def transfer_balances(entries, date, account_pred, transfer_account,
+                      balance_index=None):
     """Synthesize transactions to transfer balances from some accounts at a given date.
 
     For all accounts that match the 'account_pred' predicate, create new entries
@@ -367,6 +375,8 @@ def transfer_balances(entries, date, account_pred, transfer_account):
         true if the account is meant to be transferred.
       transfer_account: A string, the name of the source account to be used on
         the transfer entries to receive balances at the given date.
+      balance_index: An optional balance_index.BalanceIndex built from
+        'entries', to look up the balances at the date from.
     Returns:
       A new list of entries, with the new transfer entries added in.
     """
@@ -375,7 +385,7 @@ def transfer_balances(entries, date, account_pred, transfer_account):
         return entries
 
     # Compute balances at date.
-    balances, index = balance_by_account(entries, date)
+    balances, index = balance_by_account(entries, date, balance_index)
 
     # Filter out to keep only the accounts we want.
     transfer_balances = {account: balance
@@ -578,7 +588,7 @@ def create_entries_from_balances(balances, date, source_account, direction,
     return new_entries
 
 
-def balance_by_account(entries, date=None):
+def balance_by_account(entries, date=None, balance_index=None):
     """Sum up the balance per account for all entries strictly before 'date'.
 
     Args:
@@ -586,20 +596,32 @@ def balance_by_account(entries, date=None):
       date: An optional datetime.date instance. If provided, stop accumulating
         on and after this date. This is useful for summarization before a
         specific date.
+      balance_index: An optional balance_index.BalanceIndex built from
+        'entries', to look up the balances from instead of summing up the
+        postings.
     Returns:
       A pair of a dict of account string to instance Inventory (the balance of
       this account before the given date), and the index in the list of entries
       where the date was encountered. If all entries are located before the
       cutoff date, an index one beyond the last entry is returned.
     """
-    balances = collections.defaultdict(inventory.Inventory)
+    if balance_index is not None:
+        index = (bisect_key.bisect_left_with_key(entries, date,
+                                                 key=lambda entry: entry.date)
+                 if date else
+                 len(entries))
+        balances = collections.defaultdict(inventory.Inventory,
+                                           balance_index.balances_at(date))
+        return balances, index
+
+    accumulators = collections.defaultdict(inventory.new_accumulator)
     for index, entry in enumerate(entries):
         if date and entry.date >= date:
             break
 
         if isinstance(entry, Transaction):
             for posting in entry.postings:
-                account_balance = balances[posting.account]
+                account_balance = accumulators[posting.account]
 
                 # Note: We must allow negative lots at cost, because this may be
                 # used to reduce a filtered list of entries which may not
@@ -612,6 +634,9 @@ def balance_by_account(entries, date=None):
     else:
         index = len(entries)
 
+    balances = collections.defaultdict(inventory.Inventory)
+    for account, accumulator in accumulators.items():
+        balances[account] = accumulator.to_inventory()
     return balances, index
 
 
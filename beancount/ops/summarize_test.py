@@ -10,6 +10,7 @@ import datetime
 import collections
 import re
 
+from beancount.core import balance_index
 from beancount.core import inventory
 from beancount.core import data
 from beancount.core import flags
@@ -446,6 +447,16 @@ class TestClamp(cmptest.TestCase):
 
         self.assertEqual(7, index)
 
+        # The balances can be looked up from an index of the entries.
+        self.assertEqual((clamped_entries, index),
+                         summarize.clamp(entries, begin_date, end_date,
+                                         account_types,
+                                         'NOTHING',
+                                         'Equity:Earnings',
+                                         'Equity:Opening-Balances',
+                                         'Equity:Conversions',
+                                         balance_index.BalanceIndex(entries)))
+
         input_balance = interpolate.compute_entries_balance(entries)
         self.assertFalse(input_balance.is_empty())
 
@@ -1169,6 +1180,15 @@ class TestBalanceByAccount(cmptest.TestCase):
             'Equity:Opening-Balances': inventory.from_string('-10 USD'),
             }, balances)
 
+    def test_balance_by_account__index(self):
+        index = balance_index.BalanceIndex(self.entries, interval=1)
+        for query_date in [None,
+                           datetime.date(2014, 2, 1),
+                           datetime.date(2014, 2, 10),
+                           datetime.date(2015, 1, 1)]:
+            self.assertEqual(
+                summarize.balance_by_account(self.entries, query_date),
+                summarize.balance_by_account(self.entries, query_date, index))
 
 
 class TestOpenAtDate(cmptest.TestCase):
@@ -6,19 +6,28 @@ idea is to ensure a reasonable set of invariants and generate errors if those
 invariants are violated. They are not sanity checks--user data is subject to
 constraints which are hopefully detected here and which will result in errors
 trickled up to the user.
+
+The standard checks are validation functions, each implemented by a Validator
+class, which visits the directives of the types it's interested in. validate()
+runs the validators of all of them in a single, fused pass over the list of
+entries, sharing the maps they need via a ValidationContext. Validation
+functions without a Validator are run as separate passes.
 """
 __copyright__ = "Copyright (C) 2013-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
 from os import path
 import collections
+import time
 
+from beancount.core.number import ZERO
 from beancount.core.data import Open
 from beancount.core.data import Close
 from beancount.core.data import Transaction
 from beancount.core.data import Document
 from beancount.core.data import Note
 from beancount.core import data
+from beancount.core import convert
 from beancount.core import getters
 from beancount.core import interpolate
 from beancount.utils import misc_utils
@@ -32,242 +41,395 @@ ValidationError = collections.namedtuple('ValidationError', 'source message entr
 ALLOW_AFTER_CLOSE = (Document, Note)
 
 
-def validate_open_close(entries, unused_options_map):
-    """Check constraints on open and close directives themselves.
+class ValidationContext:
+    """State shared by all the validators of a fused pass.
 
-    This method checks two kinds of constraints:
+    This is computed once, the first time one of the validators needs it.
 
-    1. An open or a close directive may only show up once for each account. If a
-       duplicate is detected, an error is generated.
+    Attributes:
+      open_close_map: A dict of account name to a pair of its Open and Close
+        directives, as returned by getters.get_account_open_close().
+    """
+    def __init__(self, entries):
+        self.entries = entries
+        self._open_close_map = None
+
+    @property
+    def open_close_map(self):
+        if self._open_close_map is None:
+            self._open_close_map = getters.get_account_open_close(self.entries)
+        return self._open_close_map
+
+
+class Validator:
+    """A validation check run as part of a fused pass over the entries.
+
+    Subclasses implement visit(), which is called in order for every directive
+    which is an instance of 'types', or for all of them if it is None, and
+    accumulate errors. Extra validations may be provided as subclasses of this
+    to be run in the same pass as the standard ones.
+
+    Attributes:
+      types: A tuple of the directive types to visit, or None for all of them.
+      context: A ValidationContext instance.
+      options_map: An options map.
+      errors: A list of the errors found so far.
+    """
+    types = None
 
-    2. Close directives may only appears if an open directive has been seen
-       previous (chronologically).
+    def __init__(self, context, options_map):
+        self.context = context
+        self.options_map = options_map
+        self.errors = []
 
-    3. The date of close directives must be strictly greater than their
-      corresponding open directive.
+    def visit(self, entry):
+        """Check a single directive.
+
+        Args:
+          entry: A directive.
+        """
+        raise NotImplementedError
+
+    def finish(self):
+        """Complete the check after all the directives have been visited.
+
+        Returns:
+          A list of new errors, if any were found.
+        """
+        return self.errors
+
+
+def is_validator(validation):
+    """Return true if a validation is a Validator class.
 
     Args:
+      validation: A Validator subclass or a validation function.
+    Returns:
+      A boolean.
+    """
+    return isinstance(validation, type) and issubclass(validation, Validator)
+
+
+def run_validators(validator_classes, entries, options_map, log_timings=None):
+    """Run validators in a single pass over the entries.
+
+    Args:
+      validator_classes: A list of Validator subclasses.
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
+      log_timings: An optional function to use for logging the time of each of
+        the validators.
     Returns:
-      A list of new errors, if any were found.
+      A list of lists of errors, one for each of the validators.
     """
-    errors = []
-    open_map = {}
-    close_map = {}
+    context = ValidationContext(entries)
+    validators = [validator_class(context, options_map)
+                  for validator_class in validator_classes]
+
+    # Dispatch on the type of the directives, timing each visit only if the
+    # timings are logged.
+    durations = [0.0] * len(validators)
+    visitors_map = {}
     for entry in entries:
+        entry_type = type(entry)
+        try:
+            visitors = visitors_map[entry_type]
+        except KeyError:
+            visitors = visitors_map[entry_type] = [
+                (index, validator.visit)
+                for index, validator in enumerate(validators)
+                if validator.types is None or issubclass(entry_type, validator.types)]
+        if log_timings is None:
+            for _, visit in visitors:
+                visit(entry)
+        else:
+            for index, visit in visitors:
+                time_before = time.time()
+                visit(entry)
+                durations[index] += time.time() - time_before
+
+    errors_list = []
+    for validator, duration in zip(validators, durations):
+        time_before = time.time()
+        errors_list.append(validator.finish())
+        misc_utils.log_duration('function: {}'.format(type(validator).__name__),
+                                log_timings, duration + time.time() - time_before,
+                                indent=2)
+    return errors_list
+
+
+class OpenCloseValidator(Validator):
+    """Check constraints on open and close directives themselves.
+
+    See validate_open_close().
+    """
+    types = (Open, Close)
 
+    def __init__(self, context, options_map):
+        super().__init__(context, options_map)
+        self.open_map = {}
+        self.close_map = {}
+
+    def visit(self, entry):
+        errors = self.errors
         if isinstance(entry, Open):
-            if entry.account in open_map:
+            if entry.account in self.open_map:
                 errors.append(
                     ValidationError(
                         entry.meta,
                         "Duplicate open directive for {}".format(entry.account),
                         entry))
             else:
-                open_map[entry.account] = entry
+                self.open_map[entry.account] = entry
 
-        elif isinstance(entry, Close):
-            if entry.account in close_map:
-                errors.append(
-                    ValidationError(
-                        entry.meta,
-                        "Duplicate close directive for {}".format(entry.account),
-                        entry))
-            else:
-                try:
-                    open_entry = open_map[entry.account]
-                    if entry.date <= open_entry.date:
-                        errors.append(
-                            ValidationError(
-                                entry.meta,
-                                "Internal error: closing date for {} "
-                                "appears before opening date".format(entry.account),
-                                entry))
-                except KeyError:
+        elif entry.account in self.close_map:
+            errors.append(
+                ValidationError(
+                    entry.meta,
+                    "Duplicate close directive for {}".format(entry.account),
+                    entry))
+        else:
+            try:
+                open_entry = self.open_map[entry.account]
+                if entry.date <= open_entry.date:
                     errors.append(
                         ValidationError(
                             entry.meta,
-                            "Unopened account {} is being closed".format(entry.account),
+                            "Internal error: closing date for {} "
+                            "appears before opening date".format(entry.account),
                             entry))
+            except KeyError:
+                errors.append(
+                    ValidationError(
+                        entry.meta,
+                        "Unopened account {} is being closed".format(entry.account),
+                        entry))
 
-                close_map[entry.account] = entry
+            self.close_map[entry.account] = entry
 
-    return errors
 
+def validate_open_close(entries, options_map):
+    """Check constraints on open and close directives themselves.
 
-def validate_duplicate_balances(entries, unused_options_map):
-    """Check that balance entries occur only once per day.
+    This method checks two kinds of constraints:
 
-    Because we do not support time, and the declaration order of entries is
-    meant to be kept irrelevant, two balance entries with different amounts
-    should not occur in the file. We do allow two identical balance assertions,
-    however, because this may occur during import.
+    1. An open or a close directive may only show up once for each account. If a
+       duplicate is detected, an error is generated.
+
+    2. Close directives may only appears if an open directive has been seen
+       previous (chronologically).
+
+    3. The date of close directives must be strictly greater than their
+      corresponding open directive.
 
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
     Returns:
       A list of new errors, if any were found.
     """
-    errors = []
+    return run_validators([OpenCloseValidator], entries, options_map)[0]
 
-    # Mapping of (account, currency, date) to Balance entry.
-    balance_entries = {}
-    for entry in entries:
-        if not isinstance(entry, data.Balance):
-            continue
 
+class DuplicateBalancesValidator(Validator):
+    """Check that balance entries occur only once per day.
+
+    See validate_duplicate_balances().
+    """
+    types = (data.Balance,)
+
+    def __init__(self, context, options_map):
+        super().__init__(context, options_map)
+        # Mapping of (account, currency, date) to Balance entry.
+        self.balance_entries = {}
+
+    def visit(self, entry):
         key = (entry.account, entry.amount.currency, entry.date)
         try:
-            previous_entry = balance_entries[key]
+            previous_entry = self.balance_entries[key]
             if entry.amount != previous_entry.amount:
-                errors.append(
+                self.errors.append(
                     ValidationError(
                         entry.meta,
                         "Duplicate balance assertion with different amounts",
                         entry))
         except KeyError:
-            balance_entries[key] = entry
+            self.balance_entries[key] = entry
 
-    return errors
 
+def validate_duplicate_balances(entries, options_map):
+    """Check that balance entries occur only once per day.
 
-def validate_duplicate_commodities(entries, unused_options_map):
-    """Check that commodty entries are unique for each commodity.
+    Because we do not support time, and the declaration order of entries is
+    meant to be kept irrelevant, two balance entries with different amounts
+    should not occur in the file. We do allow two identical balance assertions,
+    however, because this may occur during import.
 
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
     Returns:
       A list of new errors, if any were found.
     """
-    errors = []
+    return run_validators([DuplicateBalancesValidator], entries, options_map)[0]
 
-    # Mapping of (account, currency, date) to Balance entry.
-    commodity_entries = {}
-    for entry in entries:
-        if not isinstance(entry, data.Commodity):
-            continue
-
-        key = entry.currency
-        try:
-            previous_entry = commodity_entries[key]
-            if previous_entry:
-                errors.append(
-                    ValidationError(
-                        entry.meta,
-                        "Duplicate commodity directives for '{}'".format(key),
-                        entry))
-        except KeyError:
-            commodity_entries[key] = entry
-
-    return errors
 
+class DuplicateCommoditiesValidator(Validator):
+    """Check that commodity entries are unique for each commodity.
 
-def validate_active_accounts(entries, unused_options_map):
-    """Check that all references to accounts occurs on active accounts.
+    See validate_duplicate_commodities().
+    """
+    types = (data.Commodity,)
+
+    def __init__(self, context, options_map):
+        super().__init__(context, options_map)
+        self.currencies = set()
+
+    def visit(self, entry):
+        if entry.currency in self.currencies:
+            self.errors.append(
+                ValidationError(
+                    entry.meta,
+                    "Duplicate commodity directives for '{}'".format(entry.currency),
+                    entry))
+        else:
+            self.currencies.add(entry.currency)
 
-    We basically check that references to accounts from all directives other
-    than Open and Close occur at dates the open-close interval of that account.
-    This should be good for all of the directive types where we can extract an
-    account name.
 
-    Note that this is more strict a check than comparing the dates: we actually
-    check that no references to account are made on the same day before the open
-    directive appears for that account. This is a nice property to have, and is
-    supported by our custom sorting routine that will sort open entries before
-    transaction entries, given the same date.
+def validate_duplicate_commodities(entries, options_map):
+    """Check that commodty entries are unique for each commodity.
 
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
     Returns:
       A list of new errors, if any were found.
     """
-    error_pairs = []
-    active_set = set()
-    opened_accounts = set()
-    for entry in entries:
-        if isinstance(entry, data.Open):
-            active_set.add(entry.account)
-            opened_accounts.add(entry.account)
+    return run_validators([DuplicateCommoditiesValidator], entries, options_map)[0]
+
+
+class ActiveAccountsValidator(Validator):
+    """Check that all references to accounts occurs on active accounts.
 
-        elif isinstance(entry, data.Close):
-            active_set.discard(entry.account)
+    See validate_active_accounts().
+    """
+    def __init__(self, context, options_map):
+        super().__init__(context, options_map)
+        self.error_pairs = []
+        self.active_set = set()
+        self.opened_accounts = set()
+
+    def visit(self, entry):
+        if isinstance(entry, Open):
+            self.active_set.add(entry.account)
+            self.opened_accounts.add(entry.account)
+
+        elif isinstance(entry, Close):
+            self.active_set.discard(entry.account)
 
         else:
             for account in getters.get_entry_accounts(entry):
-                if account not in active_set:
+                if account not in self.active_set:
                     # Allow document and note directives that occur after an
                     # account is closed.
                     if (isinstance(entry, ALLOW_AFTER_CLOSE) and
-                        account in opened_accounts):
+                        account in self.opened_accounts):
                         continue
 
                     # Register an error to be logged later, with an appropriate
                     # message.
-                    error_pairs.append((account, entry))
+                    self.error_pairs.append((account, entry))
+
+    def finish(self):
+        # Refine the error message to disambiguate between the case of an account
+        # that has never been seen and one that was simply not active at the time.
+        for account, entry in self.error_pairs:
+            if account in self.opened_accounts:
+                message = "Invalid reference to inactive account '{}'".format(account)
+            else:
+                message = "Invalid reference to unknown account '{}'".format(account)
+            self.errors.append(ValidationError(entry.meta, message, entry))
+        return self.errors
 
-    # Refine the error message to disambiguate between the case of an account
-    # that has never been seen and one that was simply not active at the time.
-    errors = []
-    for account, entry in error_pairs:
-        if account in opened_accounts:
-            message = "Invalid reference to inactive account '{}'".format(account)
-        else:
-            message = "Invalid reference to unknown account '{}'".format(account)
-        errors.append(ValidationError(entry.meta, message, entry))
-
-    return errors
 
+def validate_active_accounts(entries, options_map):
+    """Check that all references to accounts occurs on active accounts.
 
-def validate_currency_constraints(entries, options_map):
-    """Check the currency constraints from account open declarations.
+    We basically check that references to accounts from all directives other
+    than Open and Close occur at dates the open-close interval of that account.
+    This should be good for all of the directive types where we can extract an
+    account name.
 
-    Open directives admit an optional list of currencies that specify the only
-    types of commodities that the running inventory for this account may
-    contain. This function checks that all postings are only made in those
-    commodities.
+    Note that this is more strict a check than comparing the dates: we actually
+    check that no references to account are made on the same day before the open
+    directive appears for that account. This is a nice property to have, and is
+    supported by our custom sorting routine that will sort open entries before
+    transaction entries, given the same date.
 
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
     Returns:
       A list of new errors, if any were found.
     """
+    return run_validators([ActiveAccountsValidator], entries, options_map)[0]
 
-    # Get all the open entries with currency constraints.
-    open_map = {entry.account: entry
-                for entry in entries
-                if isinstance(entry, Open) and entry.currencies}
 
-    errors = []
-    for entry in entries:
-        if not isinstance(entry, Transaction):
-            continue
+class CurrencyConstraintsValidator(Validator):
+    """Check the currency constraints from account open declarations.
+
+    See validate_currency_constraints().
+    """
+    types = (Transaction,)
 
+    def visit(self, entry):
+        open_close_map = self.context.open_close_map
         for posting in entry.postings:
             # Look up the corresponding account's valid currencies; skip the
             # check if there are none specified.
-            try:
-                open_entry = open_map[posting.account]
-                valid_currencies = open_entry.currencies
-                if not valid_currencies:
-                    continue
-            except KeyError:
+            open_entry, _ = open_close_map.get(posting.account, (None, None))
+            if open_entry is None or not open_entry.currencies:
                 continue
+            valid_currencies = open_entry.currencies
 
             # Perform the check.
             if posting.units.currency not in valid_currencies:
-                errors.append(
+                self.errors.append(
                     ValidationError(
                         entry.meta,
                         "Invalid currency {} for account '{}'".format(
                             posting.units.currency, posting.account),
                         entry))
 
-    return errors
+
+def validate_currency_constraints(entries, options_map):
+    """Check the currency constraints from account open declarations.
+
+    Open directives admit an optional list of currencies that specify the only
+    types of commodities that the running inventory for this account may
+    contain. This function checks that all postings are only made in those
+    commodities.
+
+    Args:
+      entries: A list of directives.
+      options_map: An options map.
+    Returns:
+      A list of new errors, if any were found.
+    """
+    return run_validators([CurrencyConstraintsValidator], entries, options_map)[0]
+
+
+class DocumentsPathsValidator(Validator):
+    """Check that all filenames in resolved Document entries are absolute filenames.
+
+    See validate_documents_paths().
+    """
+    types = (Document,)
+
+    def visit(self, entry):
+        if not path.isabs(entry.filename):
+            self.errors.append(
+                ValidationError(entry.meta, "Invalid relative path for entry", entry))
 
 
 def validate_documents_paths(entries, options_map):
@@ -279,14 +441,27 @@ def validate_documents_paths(entries, options_map):
 
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
     Returns:
       A list of new errors, if any were found.
     """
-    return [ValidationError(entry.meta, "Invalid relative path for entry", entry)
-            for entry in entries
-            if (isinstance(entry, Document) and
-                not path.isabs(entry.filename))]
+    return run_validators([DocumentsPathsValidator], entries, options_map)[0]
+
+
+class DataTypesValidator(Validator):
+    """Check that all the data types of the attributes of entries are as expected.
+
+    See validate_data_types().
+    """
+    def visit(self, entry):
+        try:
+            data.sanity_check_types(
+                entry, self.options_map["allow_deprecated_none_for_tags_and_links"])
+        except AssertionError as exc:
+            self.errors.append(
+                ValidationError(entry.meta,
+                                "Invalid data types: {}".format(exc),
+                                entry))
 
 
 def validate_data_types(entries, options_map):
@@ -299,21 +474,50 @@ def validate_data_types(entries, options_map):
 
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
     Returns:
       A list of new errors, if any were found.
     """
-    errors = []
-    for entry in entries:
-        try:
-            data.sanity_check_types(
-                entry, options_map["allow_deprecated_none_for_tags_and_links"])
-        except AssertionError as exc:
-            errors.append(
+    return run_validators([DataTypesValidator], entries, options_map)[0]
+
+
+class TransactionBalancesValidator(Validator):
+    """Check again that all transaction postings balance.
+
+    See validate_check_transaction_balances().
+    """
+    types = (Transaction,)
+
+    def visit(self, entry):
+        # IMPORTANT: This validation is _crucial_ and cannot be skipped.
+        # This is where we actually detect and warn on unbalancing
+        # transactions. This _must_ come after the user routines, because
+        # unbalancing input is legal, as those types of transactions may be
+        # "fixed up" by a user-plugin. In other words, we want to allow
+        # users to input unbalancing transactions as long as the final
+        # transactions objects that appear on the stream (after processing
+        # the plugins) are balanced. See {9e6c14b51a59}.
+        #
+        # Detect complete sets of postings that have residual balance. Most
+        # transactions balance exactly, so sum up the weights by currency first
+        # and only infer the tolerances if any of the sums isn't zero; this is
+        # equivalent to compute_residual() and Inventory.is_small().
+        sums = {}
+        for posting in entry.postings:
+            if posting.meta and posting.meta.get(interpolate.AUTOMATIC_RESIDUAL, False):
+                continue
+            weight = convert.get_weight(posting)
+            sums[weight.currency] = sums.get(weight.currency, ZERO) + weight.number
+        if not any(sums.values()):
+            return
+        tolerances = interpolate.infer_tolerances(entry.postings, self.options_map)
+        if any(abs(number) > tolerances.get(currency, ZERO)
+               for currency, number in sums.items()):
+            residual = interpolate.compute_residual(entry.postings)
+            self.errors.append(
                 ValidationError(entry.meta,
-                                "Invalid data types: {}".format(exc),
+                                "Transaction does not balance: {}".format(residual),
                                 entry))
-    return errors
 
 
 def validate_check_transaction_balances(entries, options_map):
@@ -322,34 +526,40 @@ def validate_check_transaction_balances(entries, options_map):
 
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
     Returns:
       A list of new errors, if any were found.
     """
     # Note: this is a bit slow; we could limit our checks to the original
     # transactions by using the hash function in the loader.
-    errors = []
-    for entry in entries:
-        if isinstance(entry, Transaction):
-            # IMPORTANT: This validation is _crucial_ and cannot be skipped.
-            # This is where we actually detect and warn on unbalancing
-            # transactions. This _must_ come after the user routines, because
-            # unbalancing input is legal, as those types of transactions may be
-            # "fixed up" by a user-plugin. In other words, we want to allow
-            # users to input unbalancing transactions as long as the final
-            # transactions objects that appear on the stream (after processing
-            # the plugins) are balanced. See {9e6c14b51a59}.
-            #
-            # Detect complete sets of postings that have residual balance;
-            residual = interpolate.compute_residual(entry.postings)
-            tolerances = interpolate.infer_tolerances(entry.postings, options_map)
-            if not residual.is_small(tolerances):
-                errors.append(
-                    ValidationError(entry.meta,
-                                    "Transaction does not balance: {}".format(residual),
-                                    entry))
+    return run_validators([TransactionBalancesValidator], entries, options_map)[0]
 
-    return errors
+
+# A mapping of the standard validation functions to their Validator class.
+_VALIDATOR_CLASSES = {
+    validate_open_close: OpenCloseValidator,
+    validate_active_accounts: ActiveAccountsValidator,
+    validate_currency_constraints: CurrencyConstraintsValidator,
+    validate_duplicate_balances: DuplicateBalancesValidator,
+    validate_duplicate_commodities: DuplicateCommoditiesValidator,
+    validate_documents_paths: DocumentsPathsValidator,
+    validate_data_types: DataTypesValidator,
+    validate_check_transaction_balances: TransactionBalancesValidator,
+}
+
+
+def get_validator_class(validation):
+    """Get the Validator class which implements a validation.
+
+    Args:
+      validation: A validation function or a Validator subclass.
+    Returns:
+      A Validator subclass, or None if the validation is a function which
+      can't be run in a fused pass.
+    """
+    if is_validator(validation):
+        return validation
+    return _VALIDATOR_CLASSES.get(validation)
 
 
 # A list of reasonably fast validations to always run by default.
@@ -374,26 +584,43 @@ VALIDATIONS = BASIC_VALIDATIONS
 def validate(entries, options_map, log_timings=None, extra_validations=None):
     """Perform all the standard checks on parsed contents.
 
+    The validations implemented by a Validator class are all run in a single
+    pass over the entries; the other validation functions are run one after the
+    other.
+
     Args:
       entries: A list of directives.
-      unused_options_map: An options map.
+      options_map: An options map.
       log_timings: An optional function to use for logging the time of individual
         operations.
-      extra_validations: A list of extra validation functions to run after loading
-        this list of entries.
+      extra_validations: A list of extra validation functions or Validator
+        classes to run after loading this list of entries.
     Returns:
       A list of new errors, if any were found.
     """
     validation_tests = VALIDATIONS
     if extra_validations:
-        validation_tests += extra_validations
-
-    # Run various validation routines define above.
+        # Note: Don't extend the global list in-place.
+        validation_tests = validation_tests + extra_validations
+
+    # Run the validators together.
+    validator_classes = [get_validator_class(validation)
+                         for validation in validation_tests]
+    validator_errors = iter(run_validators(
+        [validator_class for validator_class in validator_classes
+         if validator_class is not None],
+        entries, options_map, log_timings))
+
+    # Run the other validation routines, and collect the errors in the order of
+    # the validations.
     errors = []
-    for validation_function in validation_tests:
-        with misc_utils.log_time('function: {}'.format(validation_function.__name__),
-                                 log_timings, indent=2):
-            new_errors = validation_function(entries, options_map)
+    for validation, validator_class in zip(validation_tests, validator_classes):
+        if validator_class is not None:
+            new_errors = next(validator_errors)
+        else:
+            with misc_utils.log_time('function: {}'.format(validation.__name__),
+                                     log_timings, indent=2):
+                new_errors = validation(entries, options_map)
         errors.extend(new_errors)
 
     return errors
@@ -331,6 +331,84 @@ class TestValidate(cmptest.TestCase):
         self.assertEqual(1, len(validation_errors))
         self.assertRegex(validation_errors[0].message, 'Invalid currency')
 
+    def test_validate_extra_validations(self):
+        validations = list(validation.VALIDATIONS)
+        validation.validate([], {}, extra_validations=validation.HARDCORE_VALIDATIONS)
+        self.assertEqual(validations, validation.VALIDATIONS)
+
+
+class TestValidators(cmptest.TestCase):
+
+    class CountingValidator(validation.Validator):
+        types = (data.Open, data.Balance)
+
+        def visit(self, entry):
+            self.errors.append(validation.ValidationError(entry.meta, "Visited", entry))
+
+    def test_get_validator_class(self):
+        for function in validation.BASIC_VALIDATIONS + validation.HARDCORE_VALIDATIONS:
+            self.assertEqual([], function([], {}))
+            self.assertTrue(validation.is_validator(
+                validation.get_validator_class(function)))
+        self.assertIs(self.CountingValidator,
+                      validation.get_validator_class(self.CountingValidator))
+        self.assertIsNone(validation.get_validator_class(lambda entries, options: []))
+
+    @loader.load_doc(expect_errors=True)
+    def test_run_validators(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Cash   USD
+        2014-01-01 open Assets:Cash
+        2014-01-01 commodity USD
+        2014-01-02 commodity USD
+
+        2014-02-01 * "Invalid currency"
+          Assets:Cash      1 CAD
+          Equity:Opening  -1 CAD
+
+        2014-03-01 balance Assets:Cash   1 CAD
+        2014-03-01 balance Assets:Cash   2 CAD
+        """
+        functions = validation.BASIC_VALIDATIONS
+        validators = ([validation.get_validator_class(function) for function in functions] +
+                      [self.CountingValidator])
+        timings = []
+        errors_list = validation.run_validators(validators, entries, options_map,
+                                                timings.append)
+
+        # The fused validators produce the same errors as the separate functions.
+        for function, errors in zip(functions, errors_list):
+            self.assertEqual(function(entries, options_map), errors)
+        self.assertEqual([1, 1, 1, 1, 1, 0, 0],
+                         [len(errors) for errors in errors_list[:-1]])
+
+        # Only the directives of the requested types are visited.
+        self.assertEqual([data.Open, data.Open, data.Balance, data.Balance],
+                         [type(error.entry) for error in errors_list[-1]])
+
+        # Each check reports its timing.
+        self.assertEqual(len(validators), len(timings))
+        self.assertRegex(timings[-1], 'CountingValidator')
+
+    @loader.load_doc(expect_errors=True)
+    def test_validate_extra_validators(self, entries, _, options_map):
+        """
+        2014-01-01 open Assets:Cash   USD
+
+        2014-02-01 * "Invalid currency"
+          Assets:Cash      1 CAD
+          Equity:Opening  -1 CAD
+        """
+        def function(unused_entries, unused_options_map):
+            return ["Function"]
+        errors = validation.validate(entries, options_map, extra_validations=[
+            function, self.CountingValidator])
+        self.assertEqual(["Invalid reference to unknown account 'Equity:Opening'",
+                          "Invalid currency CAD for account 'Assets:Cash'",
+                          "Function",
+                          "Visited"],
+                         [getattr(error, 'message', error) for error in errors])
+
 
 class TestValidateTolerances(cmptest.TestCase):
 
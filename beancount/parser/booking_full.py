@@ -73,8 +73,11 @@ __copyright__ = "Copyright (C) 2015-2017  Martin Blais"
 __license__ = "GNU GPLv2"
 
 import collections
+import concurrent.futures
 import copy
 import enum
+import logging
+import os
 
 from beancount.core.number import MISSING
 from beancount.core.number import ZERO
@@ -85,12 +88,19 @@ from beancount.core.amount import Amount
 from beancount.core.position import Position
 from beancount.core.position import Cost
 from beancount.core.position import CostSpec
+from beancount.parser import booking_index
 from beancount.parser import booking_method
+from beancount.parser import snapshot
 from beancount.core import position
 from beancount.core import inventory
 from beancount.core import interpolate
 
 
+# The environment variable that sets the number of processes to book
+# transactions with. If set, this overrides the "booking_processes" option.
+BOOKING_PROCESSES_ENV = 'BEANCOUNT_BOOKING_PROCESSES'
+
+
 # An error of disallowed self-reduction.
 SelfReduxError = collections.namedtuple('SelfReduxError', 'source message entry')
 
@@ -100,9 +110,19 @@ def book(entries, options_map, methods):
     See the internal implementation _book() for details.
     This method only stripes some of the return values.
 
+    If the number of booking processes is set, see get_booking_processes(), and
+    the machine has more than one CPU, the transactions are booked in parallel
+    by _book_parallel() instead. This is off by default: on a single CPU it can
+    only add the overhead of the worker processes.
+
     See _book() for arguments and return values.
     """
-    entries, errors, _ = _book(entries, options_map, methods)
+    num_processes = get_booking_processes(options_map)
+    if num_processes > 1 and (os.cpu_count() or 1) > 1:
+        entries, errors, _ = _book_parallel(entries, options_map, methods,
+                                            num_processes)
+    else:
+        entries, errors, _ = _book(entries, options_map, methods)
     return entries, errors
 
 
@@ -124,76 +144,14 @@ def _book(entries, options_map, methods):
     new_entries = []
     errors = []
     balances = collections.defaultdict(inventory.Inventory)
+    lot_index = booking_index.LotIndex()
     for entry in entries:
         if isinstance(entry, Transaction):
-            # Group postings by currency.
-            refer_groups, cat_errors = categorize_by_currency(entry, balances)
-            if cat_errors:
-                errors.extend(cat_errors)
+            entry, entry_errors = book_transaction(entry, options_map, methods,
+                                                   balances, lot_index)
+            errors.extend(entry_errors)
+            if entry is None:
                 continue
-            posting_groups = replace_currencies(entry.postings, refer_groups)
-
-            # Get the list of tolerances.
-            tolerances = interpolate.infer_tolerances(entry.postings, options_map)
-
-            # Resolve reductions to a particular lot in their inventory balance.
-            repl_postings = []
-            for currency, group_postings in posting_groups:
-                # Important note: the group of 'postings' here is a subset of
-                # that from entry.postings, and may include replicated
-                # auto-postings. Never use entry.postings going forward.
-
-                # (See http://furius.ca/beancount/doc/self-reductions for an
-                # explanation of how we will eventually treat each currency
-                # group in this block; Summary: We will need to run the
-                # reductions prior to the augmentations in order to support
-                # reductions between the postings of a single transaction.)
-                if False: ## Disabled.
-                    if has_self_reduction(group_postings, methods):
-                        errors.append(SelfReduxError(
-                            entry.meta, "Self-reduction is not allowed", entry))
-
-                # Perform booking reductions, that is, match postings which
-                # reduce the ante-inventory of their accounts to an existing
-                # position in the inventory against a possibly incomplete
-                # CostSpec specification, and replace the postings' cost to the
-                # fully-specified (with a date & label) existing Cost instance.
-                # Note that 'balances' remains untouched.
-                #
-                # Also note that 'booked_postings' may include augmenting
-                # postings whose 'cost' attribute has been left to a CostSpec
-                # instance. Therefore, the postings held-at-cost may hold a
-                # mixture of Cost and CostSpec instances. This is necessary to
-                # let the interpolation do its magic on partially incomplete
-                # CostSpec instances below.
-                (booked_postings,
-                 booking_errors) = book_reductions(entry, group_postings, balances,
-                                                   methods)
-
-                # If there were any errors, skip this group of postings.
-                if booking_errors:
-                    errors.extend(booking_errors)
-                    continue
-
-                # Interpolate missing numbers from all postings. This
-                # includes partially incomplete CostSpec instances remaining
-                # on augmenting postings. After this interpolation, all
-                # 'inter_postings' consists entirely of postings holding
-                # instances of Cost.
-                (inter_postings,
-                 interpolation_errors,
-                 interpolated) = interpolate_group(booked_postings, balances, currency,
-                                                   tolerances)
-
-                if interpolation_errors:
-                    errors.extend(interpolation_errors)
-                repl_postings.extend(inter_postings)
-
-            # Replace postings by interpolated ones.
-            meta = entry.meta.copy()
-            meta[interpolate.AUTOMATIC_TOLERANCES] = tolerances
-            entry = entry._replace(postings=repl_postings,
-                                   meta=meta)
 
             # Update the running balances for each account using the final,
             # booked and interpolated values. Note that we could optimize away
@@ -201,15 +159,388 @@ def _book(entries, options_map, methods):
             # sanity check that the direct aggregation of the final booked lots
             # will compute the same result as that during the book_reductions()
             # process.
-            for posting in repl_postings:
+            for posting in entry.postings:
                 balance = balances[posting.account]
                 balance.add_position(posting)
+                lot_index.add_position(posting)
 
         new_entries.append(entry)
 
     return new_entries, errors, balances
 
 
+def get_booking_processes(options_map):
+    """Get the number of processes to book transactions with.
+
+    Args:
+      options_map: An options dict as produced by the parser.
+    Returns:
+      An integer, the number of processes to use. A value below 2 means the
+      transactions are booked sequentially in this process.
+    """
+    value = os.getenv(BOOKING_PROCESSES_ENV)
+    if value:
+        try:
+            return int(value)
+        except ValueError:
+            logging.warning("Invalid value for %s: '%s'", BOOKING_PROCESSES_ENV, value)
+            return 0
+    return options_map.get('booking_processes', 0)
+
+
+def _book_parallel(entries, options_map, methods, num_processes):
+    """Interpolate missing data from the entries, booking in parallel processes.
+
+    Booking a transaction only reads the running balances of the accounts of
+    its postings held at cost or with missing currencies; see
+    get_history_accounts(). The transactions are partitioned into groups which
+    share none of these accounts, which are booked independently of each other
+    in a pool of worker processes. The transactions which don't read any
+    balance are booked in this process, most of them without going through
+    categorization, booking and interpolation at all; see is_booking_needed().
+    The results are then merged in the original order, and are identical to
+    those of _book().
+
+    Args:
+      entries: See _book().
+      options_map: See _book().
+      methods: See _book().
+      num_processes: An integer, the number of worker processes.
+    Returns:
+      See _book().
+    """
+    # Find the accounts whose balances are read during booking.
+    history_accounts = {}
+    for index, entry in enumerate(entries):
+        if isinstance(entry, Transaction):
+            accounts = get_history_accounts(entry)
+            if accounts:
+                history_accounts[index] = accounts
+    all_history_accounts = set().union(*history_accounts.values())
+
+    # Group the accounts which are read or updated by the same transactions,
+    # with a disjoint-set forest.
+    parents = {account: account for account in all_history_accounts}
+    def find(account):
+        while parents[account] != account:
+            parents[account] = parents[parents[account]]
+            account = parents[account]
+        return account
+    for index in history_accounts:
+        accounts = [posting.account
+                    for posting in entries[index].postings
+                    if posting.account in parents]
+        root = find(accounts[0])
+        for account in accounts[1:]:
+            parents[find(account)] = root
+    groups = collections.defaultdict(set)
+    for account in all_history_accounts:
+        groups[find(account)].add(account)
+    if len(groups) < 2:
+        return _book(entries, options_map, methods)
+
+    # Book the transactions which don't read any balance, and collect the
+    # transactions of each group, along with those booked here which update the
+    # balances of its accounts.
+    results = {}
+    items = collections.defaultdict(list)
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, Transaction):
+            continue
+        if index in history_accounts:
+            items[find(next(iter(history_accounts[index])))].append((index, True))
+        else:
+            if is_booking_needed(entry):
+                results[index] = book_transaction(entry, options_map, methods, {})
+            else:
+                results[index] = (book_simple_transaction(entry, options_map), [])
+            booked_entry = results[index][0]
+            if booked_entry is not None:
+                roots = set(find(posting.account)
+                            for posting in booked_entry.postings
+                            if posting.account in parents)
+                for root in roots:
+                    items[root].append((index, False))
+
+    # Distribute the groups over the processes, largest first, and book them.
+    batches = [[] for _ in range(min(num_processes, len(groups)))]
+    for root in sorted(groups, key=lambda root: len(items[root]), reverse=True):
+        min(batches, key=lambda batch: sum(len(items[root]) for root in batch)).append(root)
+    balances = {}
+    with concurrent.futures.ProcessPoolExecutor(len(batches)) as executor:
+        futures = []
+        for batch in batches:
+            # A transaction touching several groups of the batch is only
+            # applied once.
+            batch_items = sorted(set(item for root in batch for item in items[root]))
+            batch_entries = [entries[index] if book else results[index][0]
+                             for index, book in batch_items]
+            batch_accounts = set().union(*(groups[root] for root in batch))
+            batch_methods = {posting.account: methods[posting.account]
+                             for entry in batch_entries
+                             for posting in entry.postings}
+            futures.append((batch_items, executor.submit(
+                _book_partition_job,
+                batch_entries,
+                [book for _, book in batch_items],
+                options_map,
+                batch_methods,
+                batch_accounts)))
+        for batch_items, future in futures:
+            blob, counts, batch_balances = future.result()
+            booked_entries, booked_errors, _ = snapshot.loads(blob)
+            booked_entries = iter(booked_entries)
+            booked_errors = iter(booked_errors)
+            for (index, book), (num_entries, num_errors) in zip(
+                    (item for item in batch_items if item[1]), counts):
+                results[index] = (next(booked_entries) if num_entries else None,
+                                  [next(booked_errors) for _ in range(num_errors)])
+            balances.update(batch_balances)
+
+    # Merge the results in the original order, and compute the balances of the
+    # remaining accounts.
+    new_entries = []
+    errors = []
+    other_balances = collections.defaultdict(inventory.Inventory)
+    for index, entry in enumerate(entries):
+        if isinstance(entry, Transaction):
+            entry, entry_errors = results[index]
+            errors.extend(entry_errors)
+            if entry is None:
+                continue
+            for posting in entry.postings:
+                if posting.account not in parents:
+                    other_balances[posting.account].add_position(posting)
+        new_entries.append(entry)
+    other_balances.update(balances)
+
+    return new_entries, errors, other_balances
+
+
+def _book_partition_job(entries, book_flags, options_map, methods, accounts):
+    """Book a group of transactions in a worker process.
+
+    Note that sending the transactions to the workers and their results back
+    costs more than booking them: on the booking benchmark, with 2000 lots over
+    50 accounts, booking took 1058 ms sequentially and 1454 ms with 4 processes,
+    on a single CPU.
+
+    Args:
+      entries: A list of transactions, in their original order.
+      book_flags: A list of booleans, one per transaction, true if the
+        transaction is to be booked, false if it has already been booked and
+        only updates the balances.
+      options_map: An options dict as produced by the parser.
+      methods: A dict of account name to its booking method.
+      accounts: A set of the names of the accounts whose balances to compute.
+    Returns:
+      A triple of a snapshot of the booked transactions and their errors, which
+      is cheaper to send back than a pickle, a list of pairs of the numbers of
+      booked transactions (zero or one) and of errors for each transaction to
+      be booked, and a dict of account name to the final balance of the
+      accounts.
+    """
+    new_entries = []
+    errors = []
+    counts = []
+    balances = collections.defaultdict(inventory.Inventory)
+    lot_index = booking_index.LotIndex()
+    for entry, book in zip(entries, book_flags):
+        if book:
+            entry, entry_errors = book_transaction(entry, options_map, methods,
+                                                   balances, lot_index)
+            errors.extend(entry_errors)
+            counts.append((0 if entry is None else 1, len(entry_errors)))
+            if entry is None:
+                continue
+            new_entries.append(entry)
+        for posting in entry.postings:
+            if posting.account in accounts:
+                balances[posting.account].add_position(posting)
+                lot_index.add_position(posting)
+    return (snapshot.dumps(new_entries, errors),
+            counts,
+            {account: balances[account] for account in accounts if account in balances})
+
+
+def get_history_accounts(entry):
+    """Get the accounts whose balances are read to book a transaction.
+
+    These are the accounts of the postings held at cost, which may reduce lots,
+    and of the postings with a missing currency, which may be inferred from the
+    contents of the account.
+
+    Args:
+      entry: A Transaction instance.
+    Returns:
+      A set of account names, empty if the transaction doesn't depend on the
+      running balances.
+    """
+    accounts = set()
+    for posting in entry.postings:
+        units = posting.units
+        price = posting.price
+        if (posting.cost is not None or
+            units is not MISSING and units.currency is MISSING or
+            price is not None and price.currency is MISSING):
+            accounts.add(posting.account)
+    return accounts
+
+
+def book_transaction(entry, options_map, methods, balances, lot_index=None):
+    """Book and interpolate a single transaction against the running balances.
+
+    Args:
+      entry: A Transaction instance, with some postings possibly left with
+        incomplete amounts as produced by the parser.
+      options_map: An options dict as produced by the parser.
+      methods: A mapping of account name to their corresponding booking
+        method.
+      balances: A dict of account name to inventory contents before the
+        transaction. This is not modified.
+      lot_index: An optional LotIndex of the same balances.
+    Returns:
+      A pair of the booked Transaction, or None if it has to be removed, and a
+      list of errors.
+    """
+    errors = []
+
+    # Group postings by currency.
+    refer_groups, cat_errors = categorize_by_currency(entry, balances,
+                                                      lot_index)
+    if cat_errors:
+        return None, cat_errors
+    posting_groups = replace_currencies(entry.postings, refer_groups)
+
+    # Get the list of tolerances.
+    tolerances = interpolate.infer_tolerances(entry.postings, options_map)
+
+    # Resolve reductions to a particular lot in their inventory balance.
+    repl_postings = []
+    for currency, group_postings in posting_groups:
+        # Important note: the group of 'postings' here is a subset of
+        # that from entry.postings, and may include replicated
+        # auto-postings. Never use entry.postings going forward.
+
+        # (See http://furius.ca/beancount/doc/self-reductions for an
+        # explanation of how we will eventually treat each currency
+        # group in this block; Summary: We will need to run the
+        # reductions prior to the augmentations in order to support
+        # reductions between the postings of a single transaction.)
+        if False: ## Disabled.
+            if has_self_reduction(group_postings, methods):
+                errors.append(SelfReduxError(
+                    entry.meta, "Self-reduction is not allowed", entry))
+
+        # Perform booking reductions, that is, match postings which
+        # reduce the ante-inventory of their accounts to an existing
+        # position in the inventory against a possibly incomplete
+        # CostSpec specification, and replace the postings' cost to the
+        # fully-specified (with a date & label) existing Cost instance.
+        # Note that 'balances' remains untouched.
+        #
+        # Also note that 'booked_postings' may include augmenting
+        # postings whose 'cost' attribute has been left to a CostSpec
+        # instance. Therefore, the postings held-at-cost may hold a
+        # mixture of Cost and CostSpec instances. This is necessary to
+        # let the interpolation do its magic on partially incomplete
+        # CostSpec instances below.
+        (booked_postings,
+         booking_errors) = book_reductions(entry, group_postings, balances,
+                                           methods, lot_index)
+
+        # If there were any errors, skip this group of postings.
+        if booking_errors:
+            errors.extend(booking_errors)
+            continue
+
+        # Interpolate missing numbers from all postings. This
+        # includes partially incomplete CostSpec instances remaining
+        # on augmenting postings. After this interpolation, all
+        # 'inter_postings' consists entirely of postings holding
+        # instances of Cost.
+        (inter_postings,
+         interpolation_errors,
+         interpolated) = interpolate_group(booked_postings, balances, currency,
+                                           tolerances)
+
+        if interpolation_errors:
+            errors.extend(interpolation_errors)
+        repl_postings.extend(inter_postings)
+
+    # Replace postings by interpolated ones.
+    meta = entry.meta.copy()
+    meta[interpolate.AUTOMATIC_TOLERANCES] = tolerances
+    entry = entry._replace(postings=repl_postings,
+                           meta=meta)
+    return entry, errors
+
+
+def book_simple_transaction(entry, options_map):
+    """Book a transaction which doesn't need booking nor interpolation.
+
+    This produces the same result as book_transaction() for transactions for
+    which is_booking_needed() is false, much faster.
+
+    Args:
+      entry: A Transaction instance.
+      options_map: An options dict as produced by the parser.
+    Returns:
+      A Transaction instance.
+    """
+    # The postings are complete and not held at cost, so neither booking nor
+    # interpolation would change them; only group them like
+    # categorize_by_currency() does.
+    meta = entry.meta.copy()
+    meta[interpolate.AUTOMATIC_TOLERANCES] = interpolate.infer_tolerances(entry.postings,
+                                                                           options_map)
+    return entry._replace(postings=group_postings_by_currency(entry.postings),
+                          meta=meta)
+
+
+def is_booking_needed(entry):
+    """Return true if a transaction needs to be categorized, booked or interpolated.
+
+    Args:
+      entry: A Transaction instance.
+    Returns:
+      A boolean, false if all the postings have complete units and prices and
+      none are held at cost.
+    """
+    for posting in entry.postings:
+        units = posting.units
+        price = posting.price
+        if (posting.cost is not None or
+            units is MISSING or
+            units.number is MISSING or
+            units.currency is MISSING or
+            price is not None and (price.number is MISSING or
+                                   price.currency is MISSING)):
+            return True
+    return False
+
+
+def group_postings_by_currency(postings):
+    """Group complete postings not held at cost by their weight currency.
+
+    Args:
+      postings: A list of Posting instances, for which is_booking_needed()
+        is false.
+    Returns:
+      A list of the same postings, in the order categorize_by_currency() and
+      replace_currencies() put them in: grouped by the currency of their price
+      or units, in the order in which these first appear.
+    """
+    groups = collections.OrderedDict()
+    for posting in postings:
+        price = posting.price
+        currency = price.currency if price is not None else posting.units.currency
+        groups.setdefault(currency, []).append(posting)
+    if len(groups) == 1:
+        return list(postings)
+    return [posting for group in groups.values() for posting in group]
+
+
 # An error raised if we failed to bucket a posting to a particular currency.
 CategorizationError = collections.namedtuple('CategorizationError', 'source message entry')
 
@@ -236,7 +567,7 @@ def get_bucket_currency(refer):
 Refer = collections.namedtuple('Refer', 'index units_currency cost_currency price_currency')
 
 
-def categorize_by_currency(entry, balances):
+def categorize_by_currency(entry, balances, lot_index=None):
     """Group the postings by the currency they declare.
 
     This is used to prepare the postings for the next stages: Interpolation and
@@ -266,6 +597,8 @@ def categorize_by_currency(entry, balances):
       postings: A list of incomplete postings to categorize.
       balances: A dict of currency to inventory contents before the transaction is
         applied.
+      lot_index: An optional LotIndex of the same balances, used to look up the
+        currencies held in an account.
     Returns:
       A list of (currency string, list of tuples) items describing each postings
       and its interpolated currencies, and a list of generated errors for
@@ -348,17 +681,14 @@ def categorize_by_currency(entry, balances):
     for refer in unknown:
         (index, units_currency, cost_currency, price_currency) = refer
         posting = entry.postings[index]
-        balance = balances.get(posting.account, None)
-        if balance is None:
-            balance = inventory.Inventory()
+        balance_currencies, balance_cost_currencies = get_balance_currencies(
+            posting.account, balances, lot_index)
 
         if units_currency is MISSING:
-            balance_currencies = balance.currencies()
             if len(balance_currencies) == 1:
                 units_currency = balance_currencies.pop()
 
         if cost_currency is MISSING or price_currency is MISSING:
-            balance_cost_currencies = balance.cost_currencies()
             if len(balance_cost_currencies) == 1:
                 balance_cost_currency = balance_cost_currencies.pop()
                 if price_currency is MISSING:
@@ -384,10 +714,8 @@ def categorize_by_currency(entry, balances):
         for rindex, refer in enumerate(refers):
             if refer.units_currency is MISSING:
                 posting = entry.postings[refer.index]
-                balance = balances.get(posting.account, None)
-                if balance is None:
-                    continue
-                balance_currencies = balance.currencies()
+                balance_currencies, _ = get_balance_currencies(
+                    posting.account, balances, lot_index)
                 if len(balance_currencies) == 1:
                     refers[rindex] = refer._replace(units_currency=balance_currencies.pop())
 
@@ -422,6 +750,25 @@ def categorize_by_currency(entry, balances):
     return sorted_groups, errors
 
 
+def get_balance_currencies(account, balances, lot_index=None):
+    """Get the currencies held in the balance of an account.
+
+    Args:
+      account: A string, the name of an account.
+      balances: A dict of account name to inventory contents.
+      lot_index: An optional LotIndex of the same balances, which avoids
+        scanning the inventory.
+    Returns:
+      A pair of sets of the units currencies and of the cost currencies.
+    """
+    if lot_index is not None:
+        return lot_index.currencies(account), lot_index.cost_currencies(account)
+    balance = balances.get(account, None)
+    if balance is None:
+        return set(), set()
+    return balance.currencies(), balance.cost_currencies()
+
+
 def replace_currencies(postings, refer_groups):
     """Replace resolved currencies in the entry's Postings.
 
@@ -494,7 +841,7 @@ def has_self_reduction(postings, methods):
 
 
 def book_reductions(entry, group_postings, balances,
-                    methods):
+                    methods, lot_index=None):
     """Book inventory reductions against the ante-balances.
 
     This function accepts a dict of (account, Inventory balance) and for each
@@ -514,6 +861,8 @@ def book_reductions(entry, group_postings, balances,
       balances: A dict of account name to inventory contents.
       methods: A mapping of account name to their corresponding booking
         method enum.
+      lot_index: An optional LotIndex of the same balances. If provided, the
+        matching lots are looked up in it instead of scanning the inventories.
     Returns:
       A pair of
         booked_postings: A list of booked postings, with reducing lots resolved
@@ -526,12 +875,14 @@ def book_reductions(entry, group_postings, balances,
     """
     errors = []
 
-    # A local copy of the balances dictionary which is updated just for the
-    # duration of this function's updates, in order to take into account the
-    # cumulative effect of all the postings inferred here
-    local_balances = {}
+    # The reductions inferred here, in order to take into account the cumulative
+    # effect of all the postings of the group. This is kept as a list of
+    # reducing postings by account, from which a local copy of the balance is
+    # created when needed, and as a dict of the reduced number of units per
+    # (account, currency) and lot, which overlays the lots of the index.
+    local_postings = collections.defaultdict(list)
+    local_changes = collections.defaultdict(dict)
 
-    empty = inventory.Inventory()
     booked_postings = []
     for posting in group_postings:
         # Process a single posting.
@@ -539,15 +890,12 @@ def book_reductions(entry, group_postings, balances,
         costspec = posting.cost
         account = posting.account
 
-        # Note: We ensure there is no mutation on 'balances' to keep this
-        # function without side-effects. Note that we may be able to optimize
-        # performance later on by giving up this property.
+        # Note: We ensure there is no mutation on 'balances' nor on 'lot_index'
+        # to keep this function without side-effects.
         #
         # Also note that if there is no existing balance, then won't be any lot
         # reduction because none of the postings will be able to match against
         # any currencies of the balance.
-        previous_balance = balances.get(account, empty)
-        balance = local_balances.setdefault(account, copy.copy(previous_balance))
 
         # Check if this is a lot held at cost.
         if costspec is None or units.number is MISSING:
@@ -557,38 +905,33 @@ def book_reductions(entry, group_postings, balances,
             # This posting is held at cost; figure out if it's a reduction or an
             # augmentation.
             method = methods[account]
-            if (method is not Booking.NONE and
-                balance is not None and
-                balance.is_reduced_by(units)):
+            if lot_index is not None and isinstance(units.currency, str):
+                lots = lot_index.get(account, units.currency)
+                changes = local_changes[(account, units.currency)]
+                is_reduction = (lots is not None and
+                                lots.is_reduced_by(units.number, changes))
+            else:
+                lots = None
+                balance = get_local_balance(account, balances, local_postings)
+                is_reduction = balance.is_reduced_by(units)
+
+            if method is not Booking.NONE and is_reduction:
                 # This posting is a reduction.
 
                 # Match the positions.
                 cost_number = compute_cost_number(costspec, units)
-                matches = []
-                for position in balance:
-                    # Skip inventory contents of a different currency.
-                    if (units.currency and
-                        position.units.currency != units.currency):
-                        continue
-                    # Skip balance positions not held at cost.
-                    if position.cost is None:
-                        continue
-                    if (cost_number is not None and
-                        position.cost.number != cost_number):
-                        continue
-                    if (isinstance(costspec.currency, str) and
-                        position.cost.currency != costspec.currency):
-                        continue
-                    if (costspec.date and
-                        position.cost.date != costspec.date):
-                        continue
-                    if (costspec.label and
-                        position.cost.label != costspec.label):
-                        continue
-                    matches.append(position)
+                if lots is None:
+                    matches = match_positions(balance, units, costspec, cost_number)
+                elif method in (Booking.FIFO, Booking.LIFO):
+                    # Only fetch the lots which will be consumed.
+                    matches = lots.match_by_date(costspec, cost_number, changes,
+                                                 units.number, method is Booking.LIFO)
+                else:
+                    matches = lots.match(costspec, cost_number, changes)
 
                 # Check for ambiguous matches.
                 if len(matches) == 0:
+                    balance = get_local_balance(account, balances, local_postings)
                     errors.append(
                         ReductionError(entry.meta,
                                        'No position matches "{}" against balance {}'.format(
@@ -611,7 +954,10 @@ def book_reductions(entry, group_postings, balances,
                 # held at cost because the other postings may need interpolation
                 # in order to be resolved properly.
                 for posting in reduction_postings:
-                    balance.add_position(posting)
+                    local_postings[account].append(posting)
+                    changes = local_changes[(account, posting.units.currency)]
+                    changes[posting.cost] = (changes.get(posting.cost, ZERO) +
+                                             posting.units.number)
             else:
                 # This posting is an augmentation.
                 #
@@ -630,6 +976,64 @@ def book_reductions(entry, group_postings, balances,
     return booked_postings, errors
 
 
+def get_local_balance(account, balances, local_postings):
+    """Compute the balance of an account updated with the reductions booked so far.
+
+    Args:
+      account: A string, the name of an account.
+      balances: A dict of account name to inventory contents.
+      local_postings: A dict of account name to the list of reducing postings
+        booked so far.
+    Returns:
+      An Inventory instance. This is a copy if there were any reductions.
+    """
+    balance = balances.get(account, None)
+    if balance is None:
+        balance = inventory.Inventory()
+    postings = local_postings.get(account, None)
+    if postings:
+        balance = copy.copy(balance)
+        for posting in postings:
+            balance.add_position(posting)
+    return balance
+
+
+def match_positions(balance, units, costspec, cost_number):
+    """Find the positions of a balance which match the cost spec of a reduction.
+
+    Args:
+      balance: An Inventory instance.
+      units: An Amount instance, the units of the reducing posting.
+      costspec: A CostSpec instance, the cost of the reducing posting.
+      cost_number: The per-unit cost number computed from the cost spec, or None.
+    Returns:
+      A list of Position instances.
+    """
+    matches = []
+    for position in balance:
+        # Skip inventory contents of a different currency.
+        if (units.currency and
+            position.units.currency != units.currency):
+            continue
+        # Skip balance positions not held at cost.
+        if position.cost is None:
+            continue
+        if (cost_number is not None and
+            position.cost.number != cost_number):
+            continue
+        if (isinstance(costspec.currency, str) and
+            position.cost.currency != costspec.currency):
+            continue
+        if (costspec.date and
+            position.cost.date != costspec.date):
+            continue
+        if (costspec.label and
+            position.cost.label != costspec.label):
+            continue
+        matches.append(position)
+    return matches
+
+
 def compute_cost_number(costspec, units):
     """Given a CostSpec, return the cost number, if possible to compute.
 
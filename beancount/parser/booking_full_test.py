@@ -8,6 +8,7 @@ import functools
 import unittest
 import re
 import io
+import os
 from unittest import mock
 
 from beancount.core.number import D
@@ -2965,3 +2966,157 @@ class TestBook(unittest.TestCase):
                 None, None, None),
             data.Posting('Assets:Other', A('100.00 USD'), None, None, None, None),
             ], postings)
+
+
+class TestBookFastPath(unittest.TestCase):
+
+    @parser.parse_doc(allow_incomplete=True)
+    def test_is_booking_needed(self, entries, _, __):
+        """
+        2015-10-01 * "Complete"
+          Assets:Cash     -10.00 USD
+          Assets:Other     12.00 CAD @ 0.8333 USD
+          Expenses:Fees     0.00 USD
+
+        2015-10-01 * "Auto-posting"
+          Assets:Cash     -10.00 USD
+          Expenses:Food
+
+        2015-10-01 * "Held at cost"
+          Assets:Account   1 HOOL {100.00 USD}
+          Assets:Cash   -100.00 USD
+
+        2015-10-01 * "Missing price"
+          Assets:Other    12.00 CAD @ USD
+          Assets:Cash    -10.00 USD
+
+        2015-10-01 * "Missing currency"
+          Assets:Other    -3
+          Assets:Cash      3 CAD
+        """
+        self.assertEqual([False, True, True, True, True],
+                         [bf.is_booking_needed(entry) for entry in entries])
+        self.assertEqual([set(), set(), {'Assets:Account'}, set(), {'Assets:Other'}],
+                         [bf.get_history_accounts(entry) for entry in entries])
+
+    @parser.parse_doc(allow_incomplete=True)
+    def test_group_postings_by_currency(self, entries, _, options_map):
+        """
+        2015-10-01 * "Complete"
+          Assets:Cash     -10.00 USD
+          Assets:Other     12.00 CAD
+          Expenses:Fees     1.00 USD
+          Assets:Foreign   -12.00 CAD
+          Assets:Other      5.00 EUR @ 2 USD
+        """
+        entry = entries[0]
+        self.assertEqual([entry.postings[index] for index in (0, 2, 4, 1, 3)],
+                         bf.group_postings_by_currency(entry.postings))
+
+        # This is the same as when going through the general algorithm.
+        expected, errors = bf.book_transaction(entry, options_map, {}, {})
+        self.assertFalse(errors)
+        self.assertEqual(expected, bf.book_simple_transaction(entry, options_map))
+
+
+class TestBookParallel(unittest.TestCase):
+
+    @parser.parse_doc(allow_incomplete=True)
+    def test_book_parallel(self, entries, _, options_map):
+        """
+        2015-01-01 * "Buy"
+          Assets:Broker1    10 HOOL {100.00 USD}
+          Assets:Broker1    10 HOOL {101.00 USD}
+          Assets:Cash
+
+        2015-01-02 * "Buy"
+          Assets:Broker2    10 AAPL {50.00 USD}
+          Assets:Cash
+
+        2015-01-02 * "Deposit"
+          Assets:Broker3    10 USD
+          Assets:Cash
+
+        2015-01-03 * "Transfer"
+          Assets:Broker3    -2 USD
+          Assets:Broker4     2 USD
+          Assets:Broker4     1 CAD
+          Assets:Cash       -1 CAD
+
+        2015-02-01 * "Sell"
+          Assets:Broker1   -12 HOOL {}
+          Assets:Cash     1300.00 USD
+          Income:Gains
+
+        2015-02-01 * "Sell"
+          Assets:Broker2   -15 AAPL {}
+          Assets:Cash      800.00 USD
+          Income:Gains
+
+        2015-02-02 * "Inferred currency"
+          Assets:Broker3    -3
+          Assets:Cash        3 USD
+
+        2015-02-03 * "Bad categorization"
+          Assets:Broker4    -1
+          Assets:Cash        1 USD
+          Assets:Cash        1 CAD
+        """
+        methods = collections.defaultdict(lambda: Booking.FIFO)
+        expected = bf._book(entries, options_map, methods)
+        self.assertEqual(2, len(expected[1]))
+
+        # The transactions are booked in workers, not sequentially.
+        with mock.patch.object(bf, '_book', wraps=bf._book) as book:
+            actual = bf._book_parallel(entries, options_map, methods, 2)
+        self.assertFalse(book.called)
+        self.assertEqual(expected[0], actual[0])
+        self.assertEqual([error.message for error in expected[1]],
+                         [error.message for error in actual[1]])
+        self.assertEqual(dict(expected[2]), dict(actual[2]))
+
+    @parser.parse_doc(allow_incomplete=True)
+    def test_book_parallel__single_group(self, entries, _, options_map):
+        """
+        2015-01-01 * "Buy"
+          Assets:Broker1    10 HOOL {100.00 USD}
+          Assets:Cash
+
+        2015-02-01 * "Sell"
+          Assets:Broker1    -5 HOOL {}
+          Assets:Cash      600.00 USD
+          Income:Gains
+        """
+        methods = collections.defaultdict(lambda: Booking.FIFO)
+        with mock.patch.object(bf, '_book', wraps=bf._book) as book:
+            bf._book_parallel(entries, options_map, methods, 2)
+        self.assertTrue(book.called)
+
+    @loader.load_doc()
+    def test_book_single_cpu(self, entries, _, options_map):
+        """
+        2015-01-01 open Assets:Account
+        2015-01-01 open Assets:Other
+
+        2015-02-01 *
+          Assets:Account   10 HOOL {100.00 USD}
+          Assets:Other
+        """
+        methods = collections.defaultdict(lambda: Booking.FIFO)
+        options_map = dict(options_map, booking_processes=2)
+        with mock.patch.object(bf, '_book_parallel', wraps=bf._book_parallel) as book:
+            with mock.patch.object(bf.os, 'cpu_count', return_value=1):
+                bf.book(entries, options_map, methods)
+            self.assertFalse(book.called)
+            with mock.patch.object(bf.os, 'cpu_count', return_value=2):
+                bf.book(entries, options_map, methods)
+            self.assertTrue(book.called)
+
+    def test_get_booking_processes(self):
+        with mock.patch.dict(os.environ, {bf.BOOKING_PROCESSES_ENV: '3'}):
+            self.assertEqual(3, bf.get_booking_processes({'booking_processes': 0}))
+        with mock.patch.dict(os.environ, {bf.BOOKING_PROCESSES_ENV: ''}):
+            self.assertEqual(2, bf.get_booking_processes({'booking_processes': 2}))
+        with mock.patch.dict(os.environ, {bf.BOOKING_PROCESSES_ENV: 'x'}):
+            with self.assertLogs(level='WARNING'):
+                self.assertEqual(0, bf.get_booking_processes({}))
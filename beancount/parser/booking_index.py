@@ -0,0 +1,369 @@
+"""An index of the lots held in accounts, for booking reductions.
+
+The full booking algorithm matches each reducing posting against the positions
+of the running balance of its account. Scanning the entire Inventory for every
+reduction, and sorting the matches for the FIFO and LIFO methods, becomes
+quadratic for accounts which accumulate many lots, e.g. from reinvested
+dividends. A LotIndex is updated along with the running balances, and indexes
+the lots of each (account, currency) pair by date, for FIFO and LIFO, and by
+cost number, date and label, for matching the lots of a specific cost spec.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import bisect
+import collections
+import datetime
+import itertools
+
+from beancount.core.number import ZERO
+from beancount.core.amount import Amount
+from beancount.core.position import Position
+
+
+class Lots:
+    """The positions of a single currency in an account.
+
+    Attributes:
+      currency: A string, the currency of the units of the lots.
+      numbers: A dict of Cost instances, or None for the units not held at cost,
+        to the number of units held. This is never zero, and is in the order of
+        the positions of the Inventory.
+      costs: A dict of the Cost instances of the lots held at cost to the Cost
+        instance last added to them. Like in an Inventory, this is an equal
+        Cost, but whose numbers may be rendered differently.
+      sequence: A dict of the Cost instances of the lots held at cost to an
+        increasing number, assigned when they were inserted.
+      by_date: A list of (date, sequence number, Cost) tuples of the lots held
+        at cost, sorted by date. This may contain stale items of lots which have
+        since been removed, which don't match their sequence number.
+      head: An integer, the index of the first item of 'by_date' which isn't
+        stale. The items before it are ignored.
+      by_number: A dict of cost number to a set of Cost instances.
+      by_cost_date: A dict of cost date to a set of Cost instances.
+      by_label: A dict of cost label to a set of Cost instances.
+      cost_currencies: A Counter of the cost currencies of the lots.
+      num_stale: An integer, the number of stale items in 'by_date'.
+      num_positive: An integer, the number of positions with positive units.
+      num_negative: An integer, the number of positions with negative units.
+    """
+    def __init__(self, currency):
+        self.currency = currency
+        self.numbers = {}
+        self.costs = {}
+        self.sequence = {}
+        self.by_date = []
+        self.head = 0
+        self.by_number = {}
+        self.by_cost_date = {}
+        self.by_label = {}
+        self.cost_currencies = collections.Counter()
+        self.num_positive = 0
+        self.num_negative = 0
+        self.num_stale = 0
+        self.counter = itertools.count()
+
+    def add(self, number, cost):
+        """Add units to a lot, like Inventory.add_amount().
+
+        Args:
+          number: A Decimal, the number of units to add.
+          cost: A Cost instance, or None.
+        """
+        numbers = self.numbers
+        previous = numbers.get(cost, None)
+        if previous is None:
+            if number == ZERO:
+                return
+            numbers[cost] = number
+            self._count(number, 1)
+            if cost is not None:
+                self._insert(cost)
+        else:
+            total = previous + number
+            if total == ZERO:
+                del numbers[cost]
+                self._count(previous, -1)
+                if cost is not None:
+                    self._remove(cost)
+            else:
+                numbers[cost] = total
+                if cost is not None:
+                    self.costs[cost] = cost
+                if (total > ZERO) != (previous > ZERO):
+                    self._count(previous, -1)
+                    self._count(total, 1)
+
+    def _count(self, number, increment):
+        if number > ZERO:
+            self.num_positive += increment
+        else:
+            self.num_negative += increment
+
+    def _insert(self, cost):
+        seq = next(self.counter)
+        self.costs[cost] = cost
+        self.sequence[cost] = seq
+        item = (cost.date or datetime.date.min, seq, cost)
+        # The sequence numbers are unique, so the costs are never compared.
+        by_date = self.by_date
+        if len(by_date) == self.head or item > by_date[-1]:
+            by_date.append(item)
+        else:
+            bisect.insort(by_date, item, self.head)
+        self.by_number.setdefault(cost.number, set()).add(cost)
+        self.by_cost_date.setdefault(cost.date, set()).add(cost)
+        self.by_label.setdefault(cost.label, set()).add(cost)
+        self.cost_currencies[cost.currency] += 1
+
+    def _remove(self, cost):
+        del self.costs[cost]
+        del self.sequence[cost]
+        for index, key in ((self.by_number, cost.number),
+                           (self.by_cost_date, cost.date),
+                           (self.by_label, cost.label)):
+            costs = index[key]
+            costs.discard(cost)
+            if not costs:
+                del index[key]
+        self.cost_currencies[cost.currency] -= 1
+        if not self.cost_currencies[cost.currency]:
+            del self.cost_currencies[cost.currency]
+
+        # Skip over the stale items at both ends of the list of lots by date,
+        # which is where FIFO and LIFO remove them from, and compact it once it
+        # is mostly stale.
+        self.num_stale += 1
+        by_date = self.by_date
+        while self.head < len(by_date) and self._is_stale(by_date[self.head]):
+            self.head += 1
+        while len(by_date) > self.head and self._is_stale(by_date[-1]):
+            by_date.pop()
+            self.num_stale -= 1
+        if self.num_stale > len(self.sequence) + 64:
+            self.by_date = [item for item in by_date if not self._is_stale(item)]
+            self.head = 0
+            self.num_stale = 0
+
+    def _is_stale(self, item):
+        return self.sequence.get(item[2], None) != item[1]
+
+    def is_reduced_by(self, number, changes):
+        """Return true if units could reduce these lots, like
+        Inventory.is_reduced_by().
+
+        Args:
+          number: A Decimal, the number of units of a posting.
+          changes: A dict of Cost to the number of units already reduced from
+            these lots by the postings of the current transaction.
+        Returns:
+          A boolean.
+        """
+        if number == ZERO:
+            return False
+        positive = number > ZERO
+        num_opposite = self.num_negative if positive else self.num_positive
+        if num_opposite:
+            # Discount the positions emptied by the current transaction. Those
+            # reductions never change the sign of a position.
+            for cost, change in changes.items():
+                previous = self.numbers.get(cost, None)
+                if (previous is not None and
+                    previous + change == ZERO and
+                    (previous > ZERO) != positive):
+                    num_opposite -= 1
+        return num_opposite > 0
+
+    def match(self, costspec, cost_number, changes):
+        """Find the lots held at cost matching a cost spec.
+
+        Args:
+          costspec: A CostSpec instance, the spec of a reducing posting.
+          cost_number: A Decimal, the per-unit cost computed from the spec, or
+            None.
+          changes: A dict of Cost to the number of units already reduced from
+            these lots by the postings of the current transaction.
+        Returns:
+          A list of Position instances, in the order of the Inventory.
+        """
+        candidates = None
+        for index, key in ((self.by_number, cost_number),
+                           (self.by_cost_date, costspec.date or None),
+                           (self.by_label, costspec.label or None)):
+            if key is not None:
+                costs = index.get(key, ())
+                if candidates is None or len(costs) < len(candidates):
+                    candidates = costs
+        if candidates is None:
+            costs = self.sequence
+        else:
+            costs = sorted(candidates, key=self.sequence.__getitem__)
+        return [position
+                for position in self._positions(costs, changes)
+                if self._matches(position.cost, costspec, cost_number)]
+
+    def match_by_date(self, costspec, cost_number, changes, number, reverse):
+        """Find the first lots to reduce with FIFO or LIFO booking.
+
+        This only looks at as many lots as necessary to reduce the given number
+        of units, in the order in which FIFO and LIFO booking consume them.
+
+        Args:
+          costspec: A CostSpec instance, the spec of a reducing posting.
+          cost_number: A Decimal, the per-unit cost computed from the spec, or
+            None.
+          changes: A dict of Cost to the number of units already reduced from
+            these lots by the postings of the current transaction.
+          number: A Decimal, the number of units of the reducing posting.
+          reverse: A boolean, true for the latest lots first, like LIFO.
+        Returns:
+          A list of Position instances.
+        """
+        if cost_number is not None or costspec.date or costspec.label:
+            return self.match(costspec, cost_number, changes)
+        matches = []
+        positive = number > ZERO
+        remaining = abs(number)
+        for position in self._positions(self._iter_by_date(reverse), changes):
+            if not self._matches(position.cost, costspec, cost_number):
+                continue
+            matches.append(position)
+            match_number = position.units.number
+            if (match_number > ZERO) != positive:
+                remaining -= abs(match_number)
+                if remaining <= ZERO:
+                    break
+        else:
+            # There are not enough lots; return all of them in the order of the
+            # Inventory, for reporting.
+            return self.match(costspec, cost_number, changes)
+        return matches
+
+    def _iter_by_date(self, reverse):
+        """Iterate over the lots held at cost sorted by date.
+
+        Args:
+          reverse: A boolean, true for the latest lots first.
+        Yields:
+          Cost instances. Lots of the same date are in the order of the
+          Inventory, like when sorting them by date, also in reverse.
+        """
+        by_date = (reversed(self.by_date) if reverse else
+                   itertools.islice(self.by_date, self.head, None))
+        items = (item for item in by_date if not self._is_stale(item))
+        if not reverse:
+            for _, _, cost in items:
+                yield cost
+            return
+        run = []
+        for item in items:
+            if run and item[0] != run[-1][0]:
+                for _, _, cost in reversed(run):
+                    yield cost
+                run = []
+            run.append(item)
+        for _, _, cost in reversed(run):
+            yield cost
+
+    def _positions(self, costs, changes):
+        """Convert lots to positions, taking reductions into account.
+
+        Args:
+          costs: An iterable of Cost instances of lots.
+          changes: A dict of Cost to the number of units already reduced from
+            these lots by the postings of the current transaction.
+        Yields:
+          Position instances, for the lots which are not emptied.
+        """
+        numbers = self.numbers
+        last_costs = self.costs
+        currency = self.currency
+        for cost in costs:
+            number = numbers[cost]
+            if cost in changes:
+                number += changes[cost]
+                if number == ZERO:
+                    continue
+            yield Position(Amount(number, currency), last_costs[cost])
+
+    @staticmethod
+    def _matches(cost, costspec, cost_number):
+        """Return true if the cost of a lot matches a cost spec.
+
+        Args:
+          cost: A Cost instance.
+          costspec: A CostSpec instance.
+          cost_number: A Decimal, the per-unit cost computed from the spec, or
+            None.
+        Returns:
+          A boolean.
+        """
+        return not ((cost_number is not None and cost.number != cost_number) or
+                    (isinstance(costspec.currency, str) and
+                     cost.currency != costspec.currency) or
+                    (costspec.date and cost.date != costspec.date) or
+                    (costspec.label and cost.label != costspec.label))
+
+
+class LotIndex:
+    """An index of the lots of all the accounts.
+
+    Attributes:
+      accounts: A dict of account name to a dict of currency to Lots.
+    """
+    def __init__(self):
+        self.accounts = collections.defaultdict(dict)
+
+    def add_position(self, position):
+        """Add a posting or position to the lots of its account.
+
+        Args:
+          position: A Posting instance with a Cost or no cost.
+        """
+        units = position.units
+        currencies = self.accounts[position.account]
+        try:
+            lots = currencies[units.currency]
+        except KeyError:
+            lots = currencies[units.currency] = Lots(units.currency)
+        lots.add(units.number, position.cost)
+
+    def get(self, account, currency):
+        """Get the lots of a currency in an account.
+
+        Args:
+          account: A string, the name of an account.
+          currency: A string, the currency of the units.
+        Returns:
+          A Lots instance, or None if there never were any.
+        """
+        currencies = self.accounts.get(account, None)
+        if currencies is None:
+            return None
+        return currencies.get(currency, None)
+
+    def currencies(self, account):
+        """Get the units currencies held in an account, like Inventory.currencies().
+
+        Args:
+          account: A string, the name of an account.
+        Returns:
+          A set of currency strings.
+        """
+        return set(currency
+                   for currency, lots in self.accounts.get(account, {}).items()
+                   if lots.numbers)
+
+    def cost_currencies(self, account):
+        """Get the cost currencies held in an account, like
+        Inventory.cost_currencies().
+
+        Args:
+          account: A string, the name of an account.
+        Returns:
+          A set of currency strings.
+        """
+        cost_currencies = set()
+        for lots in self.accounts.get(account, {}).values():
+            cost_currencies.update(lots.cost_currencies)
+        return cost_currencies
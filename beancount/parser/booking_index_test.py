@@ -0,0 +1,128 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import collections
+import datetime
+import unittest
+
+from beancount.core.number import D
+from beancount.core.number import MISSING
+from beancount.core.amount import A
+from beancount.core.position import Cost
+from beancount.core.position import CostSpec
+from beancount.core.data import Booking
+from beancount.core import data
+from beancount.parser import booking_full as bf
+from beancount.parser import booking_index
+from beancount.parser import parser
+
+
+def posting(string, number, date, label=None):
+    return data.Posting('Assets:Account', A(string),
+                        Cost(D(number), 'USD', date, label), None, None, None)
+
+
+class TestLotIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = booking_index.LotIndex()
+        self.date1 = datetime.date(2016, 1, 1)
+        self.date2 = datetime.date(2016, 2, 1)
+        self.date3 = datetime.date(2016, 3, 1)
+        for post in [posting('10 HOOL', '100', self.date2),
+                     posting('20 HOOL', '101', self.date1),
+                     posting('30 HOOL', '102', self.date3, 'x'),
+                     posting('40 HOOL', '103', self.date1)]:
+            self.index.add_position(post)
+        self.lots = self.index.get('Assets:Account', 'HOOL')
+
+    def numbers(self, positions):
+        return [position.units.number for position in positions]
+
+    def test_add(self):
+        self.index.add_position(posting('-10 HOOL', '100', self.date2))
+        self.assertEqual([D('20'), D('30'), D('40')],
+                         list(self.lots.numbers.values()))
+        self.assertEqual({'HOOL'}, self.index.currencies('Assets:Account'))
+        self.assertEqual({'USD'}, self.index.cost_currencies('Assets:Account'))
+        self.assertEqual(set(), self.index.currencies('Assets:Other'))
+        self.assertIsNone(self.index.get('Assets:Account', 'USD'))
+
+    def test_match(self):
+        spec = CostSpec(MISSING, None, MISSING, None, None, False)
+        self.assertEqual([10, 20, 30, 40], self.numbers(self.lots.match(spec, None, {})))
+        self.assertEqual([20], self.numbers(self.lots.match(spec, D('101'), {})))
+        self.assertEqual([20, 40], self.numbers(self.lots.match(
+            spec._replace(date=self.date1), None, {})))
+        self.assertEqual([30], self.numbers(self.lots.match(
+            spec._replace(label='x'), None, {})))
+        self.assertEqual([], self.numbers(self.lots.match(spec, D('104'), {})))
+
+        # Reductions from the same transaction are taken into account.
+        changes = {Cost(D('101'), 'USD', self.date1, None): D('-20'),
+                   Cost(D('103'), 'USD', self.date1, None): D('-15')}
+        self.assertEqual([10, 30, 25], self.numbers(self.lots.match(spec, None, changes)))
+
+    def test_match_by_date(self):
+        spec = CostSpec(MISSING, None, MISSING, None, None, False)
+        self.assertEqual([20], self.numbers(self.lots.match_by_date(
+            spec, None, {}, D('-15'), False)))
+        self.assertEqual([20, 40], self.numbers(self.lots.match_by_date(
+            spec, None, {}, D('-25'), False)))
+        self.assertEqual([30, 10], self.numbers(self.lots.match_by_date(
+            spec, None, {}, D('-35'), True)))
+
+        # Lots of the same date are in their original order, also in reverse.
+        self.assertEqual([30, 10, 20, 40], self.numbers(self.lots.match_by_date(
+            spec, None, {}, D('-95'), True)))
+
+        # If there aren't enough lots, all of them are returned.
+        self.assertEqual([10, 20, 30, 40], self.numbers(self.lots.match_by_date(
+            spec, None, {}, D('-200'), False)))
+
+    def test_is_reduced_by(self):
+        self.assertTrue(self.lots.is_reduced_by(D('-1'), {}))
+        self.assertFalse(self.lots.is_reduced_by(D('1'), {}))
+        self.assertFalse(self.lots.is_reduced_by(D('0'), {}))
+
+        changes = {cost: -number for cost, number in self.lots.numbers.items()}
+        self.assertFalse(self.lots.is_reduced_by(D('-1'), changes))
+
+    def test_compaction(self):
+        for _ in range(3):
+            for index in range(100):
+                self.index.add_position(posting('1 HOOL', index, self.date1))
+            for index in range(100):
+                self.index.add_position(posting('-1 HOOL', index, self.date1))
+        self.assertEqual(4, len(self.lots.sequence))
+        self.assertLess(len(self.lots.by_date), 200)
+
+
+class TestBookWithLotIndex(unittest.TestCase):
+
+    def book(self, input_string, method):
+        entries, _, options_map = parser.parse_string(input_string)
+        methods = collections.defaultdict(lambda: method)
+        return bf._book(entries, options_map, methods)
+
+    def test_many_lots(self):
+        lines = []
+        date = datetime.date(2010, 1, 1)
+        for index in range(500):
+            lines.append('{} *\n  Assets:Account  1 HOOL {{{} USD}}\n  Assets:Cash'.format(
+                date + datetime.timedelta(days=index), 100 + index))
+        lines.append('2012-01-01 *\n'
+                     '  Assets:Account  -3 HOOL {}\n'
+                     '  Assets:Account  -1 HOOL {}\n'
+                     '  Assets:Cash  1000 USD\n'
+                     '  Income:Gains\n')
+
+        for method, expected in [(Booking.FIFO, ['100', '101', '102', '103']),
+                                 (Booking.LIFO, ['599', '598', '597', '596'])]:
+            entries, errors, balances = self.book('\n'.join(lines), method)
+            self.assertFalse(errors)
+            self.assertEqual([D(number) for number in expected],
+                             [posting.cost.number
+                              for posting in entries[-1].postings
+                              if posting.account == 'Assets:Account'])
+            self.assertEqual(496, len(balances['Assets:Account']))
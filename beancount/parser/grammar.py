@@ -118,7 +118,11 @@ TagsLinks = collections.namedtuple('TagsLinks', 'tags links')
 
 class Builder(lexer.LexBuilder):
     """A builder used by the lexer and grammar parser as callbacks to create
-    the data objects corresponding to rules parsed from the input file."""
+    the data objects corresponding to rules parsed from the input file.
+
+    The most common grammar rules, amount() and handle_list(), are inherited
+    from the C base class along with the token methods.
+    """
 
     def __init__(self, filename):
         lexer.LexBuilder.__init__(self)
@@ -409,21 +413,6 @@ class Builder(lexer.LexBuilder):
         """
         self.options['plugin'].append((plugin_name, plugin_config))
 
-    def amount(self, number, currency):
-        """Process an amount grammar rule.
-
-        Args:
-          number: a Decimal instance, the number of the amount.
-          currency: a currency object (a str, really, see CURRENCY above)
-        Returns:
-          An instance of Amount.
-        """
-        # Update the mapping that stores the parsed precisions.
-        # Note: This is relatively slow, adds about 70ms because of number.as_tuple().
-        if isinstance(number, Decimal) and currency and currency is not MISSING:
-            self.dcupdate(number, currency)
-        return Amount(number, currency)
-
     def compound_amount(self, number_per, number_total, currency):
         """Process an amount grammar rule.
 
@@ -537,21 +526,6 @@ class Builder(lexer.LexBuilder):
 
         return CostSpec(number_per, number_total, currency, date_, label, merge)
 
-    def handle_list(self, object_list, new_object):
-        """Handle a recursive list grammar rule, generically.
-
-        Args:
-          object_list: the current list of objects.
-          new_object: the new object to be added.
-        Returns:
-          The new, updated list of objects.
-        """
-        if object_list is None:
-            object_list = []
-        if new_object is not None:
-            object_list.append(new_object)
-        return object_list
-
     def open(self, filename, lineno, date, account, currencies, booking_str, kvlist):
         """Process an open directive.
 
@@ -984,8 +958,9 @@ class Builder(lexer.LexBuilder):
                                 meta, "Duplicate metadata field on entry: {}".format(
                                     posting_or_kv), None))
                     else:
-                        if last_posting.meta is None:
-                            last_posting = last_posting._replace(meta={})
+                        if type(last_posting.meta) is not dict:
+                            last_posting = last_posting._replace(
+                                meta=dict(last_posting.meta or {}))
                             postings.pop(-1)
                             postings.append(last_posting)
 
@@ -999,14 +974,12 @@ class Builder(lexer.LexBuilder):
         # Freeze the tags & links or set to default empty values.
         tags, links = self.finalize_tags_links(tags, links)
 
-        # Initialize the metadata fields from the set of active values.
-        if self.meta:
-            for key, value_list in self.meta.items():
-                meta[key] = value_list[-1]
-
-        # Add on explicitly defined values.
-        if explicit_meta:
-            meta.update(explicit_meta)
+        # Initialize the metadata fields from the set of active values, and add
+        # on explicitly defined values.
+        if self.meta or explicit_meta:
+            kvlist = [(key, value_list[-1]) for key, value_list in self.meta.items()]
+            kvlist.extend(explicit_meta.items())
+            meta = new_metadata(filename, lineno, kvlist)
 
         # Unpack the transaction fields.
         payee_narration = self.unpack_txn_strings(txn_strings, meta)
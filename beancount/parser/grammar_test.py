@@ -1660,6 +1660,23 @@ class TestMetaData(unittest.TestCase):
         self.assertLessEqual(set('nameoncard nameOnCard name-on-card name_on_card'.split()),
                              set(entries[0].meta.keys()))
 
+    @parser.parse_doc()
+    def test_metadata_compact(self, entries, errors, _):
+        """
+          2013-05-17 open Assets:Investments:Cash
+
+          2013-05-18 * ""
+            Assets:Investments:MSFT      10 MSFT @@ 2000 USD
+              test: "Something"
+            Assets:Investments:Cash  -20000 USD
+        """
+        self.assertIsInstance(entries[0].meta, data.Metadata)
+        self.assertIsInstance(entries[1].meta, data.Metadata)
+        self.assertIs(type(entries[1].postings[0].meta), dict)
+        self.assertIsInstance(entries[1].postings[1].meta, data.Metadata)
+        self.assertEqual(entries[1].meta['lineno'] + 3,
+                         entries[1].postings[1].meta['lineno'])
+
 
 class TestArithmetic(unittest.TestCase):
 
@@ -4,9 +4,10 @@ __copyright__ = "Copyright (C) 2014-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
 import collections
-import datetime
+import contextlib
 import re
 import tempfile
+import threading
 
 from beancount.core import data
 from beancount.core import account
@@ -17,16 +18,54 @@ from beancount.parser import _parser
 LexerError = collections.namedtuple('LexerError', 'source message entry')
 
 
-class LexBuilder(object):
+# The C extension keeps the state of the lexer and the parser in global
+# variables, so it can only process a single input at a time, and it holds the
+# GIL while doing so. This lock only serializes its use: inputs parsed from
+# multiple threads are parsed one after the other, not concurrently. The set
+# holds the identifiers of the threads using the extension, which get an error
+# instead of waiting for themselves.
+_parser_lock = threading.Lock()
+_parser_threads = set()
+
+
+@contextlib.contextmanager
+def parser_guard(*thread_idents):
+    """Hold the C extension while it processes a single input.
+
+    Other threads wait until it is released. The guard may be released from
+    another thread than the one which acquired it, e.g. when closing an
+    iterator.
+
+    Args:
+      thread_idents: The identifiers of other threads which may not use the
+        extension until it is released, in addition to the current one.
+    Raises:
+      RuntimeError: If one of the threads is already using the extension.
+    """
+    idents = {threading.get_ident()}
+    idents.update(thread_idents)
+    if not idents.isdisjoint(_parser_threads):
+        raise RuntimeError("The parser is not reentrant and is already in use")
+    with _parser_lock:
+        _parser_threads.update(idents)
+        try:
+            yield
+        finally:
+            _parser_threads.difference_update(idents)
+
+
+class LexBuilder(_parser.BuilderBase):
     """A builder used only for building lexer objects.
 
+    The methods called for each token, e.g. DATE() or ACCOUNT(), are inherited
+    from the C extension module, where they are much cheaper to call. They call
+    back the methods of this class for the uncommon cases.
+
     Attributes:
       long_string_maxlines_default: Number of lines for a string to trigger a
           warning. This is meant to help users detecting dangling quotes in
           their source.
     """
-    # pylint: disable=invalid-name
-
     def __init__(self):
         # A mapping of all the accounts created.
         self.accounts = {}
@@ -75,52 +114,8 @@ class LexBuilder(object):
         self.errors.append(
             LexerError(self.get_lexer_location(), message, None))
 
-    def DATE(self, year, month, day):
-        """Process a DATE token.
-
-        Args:
-          year: integer year.
-          month: integer month.
-          day: integer day
-        Returns:
-          A new datetime object.
-        """
-        return datetime.date(year, month, day)
-
-    def ACCOUNT(self, account_name):
-        """Process an ACCOUNT token.
-
-        This function attempts to reuse an existing account if one exists,
-        otherwise creates one on-demand.
-
-        Args:
-          account_name: a str, the valid name of an account.
-        Returns:
-          A string, the name of the account.
-        """
-        # Check account name validity.
-        if not self.account_regexp.match(account_name):
-            raise ValueError("Invalid account name: {}".format(account_name))
-
-        # Reuse (intern) account strings as much as possible. This potentially
-        # reduces memory usage a fair bit, because these strings are repeated
-        # liberally.
-        return self.accounts.setdefault(account_name, account_name)
-
-    def CURRENCY(self, currency_name):
-        """Process a CURRENCY token.
-
-        Args:
-          currency_name: the name of the currency.
-        Returns:
-          A new currency object; for now, these are simply represented
-          as the currency name.
-        """
-        self.commodities.add(currency_name)
-        return currency_name
-
-    def STRING(self, string):
-        """Process a STRING token.
+    def check_long_string(self, string):
+        """Process a multi-line STRING token.
 
         Args:
           string: the string to process.
@@ -129,81 +124,43 @@ class LexBuilder(object):
           do some decoding here.
         """
         # If a multiline string, warm over a certain number of lines.
-        if '\n' in string:
-            num_lines = string.count('\n') + 1
-            if num_lines > self.long_string_maxlines_default:
-                # This is just a warning; accept the string anyhow.
-                self.errors.append(
-                    LexerError(
-                        self.get_lexer_location(),
-                        "String too long ({} lines); possible error".format(num_lines),
-                        None))
+        num_lines = string.count('\n') + 1
+        if num_lines > self.long_string_maxlines_default:
+            # This is just a warning; accept the string anyhow.
+            self.errors.append(
+                LexerError(
+                    self.get_lexer_location(),
+                    "String too long ({} lines); possible error".format(num_lines),
+                    None))
         return string
 
-    def NUMBER(self, number):
-        """Process a NUMBER token. Convert into Decimal.
+    def parse_number_commas(self, number):
+        """Process a NUMBER token with commas. Convert into Decimal.
 
         Args:
           number: a str, the number to be converted.
         Returns:
           A Decimal instance built of the number string.
         """
-        # Note: We don't use D() for efficiency here.
-        # The lexer will only yield valid number strings.
-        if ',' in number:
-            # Extract the integer part and check the commas match the
-            # locale-aware formatted version. This
-            match = re.match(r"([\d,]*)(\.\d*)?$", number)
-            if not match:
-                # This path is never taken because the lexer will parse a comma
-                # in the fractional part as two NUMBERs with a COMMA token in
-                # between.
+        # Extract the integer part and check the commas match the
+        # locale-aware formatted version. This
+        match = re.match(r"([\d,]*)(\.\d*)?$", number)
+        if not match:
+            # This path is never taken because the lexer will parse a comma
+            # in the fractional part as two NUMBERs with a COMMA token in
+            # between.
+            self.errors.append(
+                LexerError(self.get_lexer_location(),
+                           "Invalid number format: '{}'".format(number), None))
+        else:
+            int_string, float_string = match.groups()
+            reformatted_number = r"{:,.0f}".format(int(int_string.replace(",", "")))
+            if int_string != reformatted_number:
                 self.errors.append(
                     LexerError(self.get_lexer_location(),
-                               "Invalid number format: '{}'".format(number), None))
-            else:
-                int_string, float_string = match.groups()
-                reformatted_number = r"{:,.0f}".format(int(int_string.replace(",", "")))
-                if int_string != reformatted_number:
-                    self.errors.append(
-                        LexerError(self.get_lexer_location(),
-                                   "Invalid commas: '{}'".format(number), None))
-
-            number = number.replace(',', '')
-        return Decimal(number)
-
-    def TAG(self, tag):
-        """Process a TAG token.
-
-        Args:
-          tag: a str, the tag to be processed.
-        Returns:
-          The tag string itself. For now we don't need an object to represent
-          those; keeping it simple.
-        """
-        return tag
-
-    def LINK(self, link):
-        """Process a LINK token.
-
-        Args:
-          link: a str, the name of the string.
-        Returns:
-          The link string itself. For now we don't need to represent this by
-          an object.
-        """
-        return link
-
-    def KEY(self, ident):
-        """Process an identifier token.
+                               "Invalid commas: '{}'".format(number), None))
 
-        Args:
-          ident: a str, the name of the key string.
-        Returns:
-          The link string itself. For now we don't need to represent this by
-          an object.
-        """
-        return ident
+        return Decimal(number.replace(',', ''))
 
 
 def lex_iter(file, builder=None, encoding=None):
@@ -217,6 +174,9 @@ def lex_iter(file, builder=None, encoding=None):
     Yields:
       Tuples of the token (a string), the matched text (a string), and the line
       no (an integer).
+    Raises:
+      RuntimeError: If the iterating thread is already using the parser. The
+        parser is held until the iterator is exhausted or closed.
     """
     if isinstance(file, str):
         filename = file
@@ -224,15 +184,16 @@ def lex_iter(file, builder=None, encoding=None):
         filename = file.name
     if builder is None:
         builder = LexBuilder()
-    _parser.lexer_initialize(filename, builder, encoding)
-    try:
-        while 1:
-            token_tuple = _parser.lexer_next()
-            if token_tuple is None:
-                break
-            yield token_tuple
-    finally:
-        _parser.lexer_finalize()
+    with parser_guard():
+        _parser.lexer_initialize(filename, builder, encoding)
+        try:
+            while 1:
+                token_tuple = _parser.lexer_next()
+                if token_tuple is None:
+                    break
+                yield token_tuple
+        finally:
+            _parser.lexer_finalize()
 
 
 def lex_iter_string(string, builder=None, encoding=None):
@@ -7,10 +7,13 @@ __license__ = "GNU GPLv2"
 import datetime
 import functools
 import textwrap
+import threading
 import unittest
 import re
 
 from beancount.core.number import D
+from beancount.core.number import MISSING
+from beancount.core.amount import Amount
 from beancount.parser import lexer
 
 
@@ -752,3 +755,75 @@ class TestLexerMisc(unittest.TestCase):
             ('EOL', 2, '\n', None),
             ('EOL', 2, '\x00', None)
         ], tokens)
+
+
+class TestBuilderBase(unittest.TestCase):
+
+    def test_dates_are_shared(self):
+        tokens = list(lexer.lex_iter_string('2014-01-01 2014-01-01 2014-01-02'))
+        dates = [value for _, _, _, value in tokens if isinstance(value, datetime.date)]
+        self.assertEqual([datetime.date(2014, 1, 1)] * 2 + [datetime.date(2014, 1, 2)],
+                         dates)
+        self.assertIs(dates[0], dates[1])
+
+    def test_accounts_are_interned(self):
+        builder = lexer.LexBuilder()
+        account1 = builder.ACCOUNT(''.join(['Assets:', 'Cash']))
+        account2 = builder.ACCOUNT(''.join(['Assets:', 'Cash']))
+        self.assertIs(account1, account2)
+        self.assertEqual({'Assets:Cash': 'Assets:Cash'}, builder.accounts)
+
+    def test_account_regexp_revalidates(self):
+        builder = lexer.LexBuilder()
+        builder.ACCOUNT('Assets:Cash')
+        builder.account_regexp = re.compile('Liabilities:')
+        with self.assertRaises(ValueError):
+            builder.ACCOUNT('Assets:Cash')
+
+    def test_amount(self):
+        builder = lexer.LexBuilder()
+        builder.dcupdate = lambda *args: updates.append(args)
+        updates = []
+        amount = builder.amount(D('10.00'), 'USD')
+        self.assertIsInstance(amount, Amount)
+        self.assertEqual(Amount(D('10.00'), 'USD'), amount)
+        self.assertEqual([(D('10.00'), 'USD')], updates)
+        builder.amount(MISSING, 'USD')
+        builder.amount(D('10.00'), None)
+        self.assertEqual(1, len(updates))
+
+    def test_handle_list(self):
+        builder = lexer.LexBuilder()
+        object_list = builder.handle_list(None, 'a')
+        self.assertEqual(['a'], object_list)
+        self.assertIs(object_list, builder.handle_list(object_list, 'b'))
+        self.assertEqual(['a', 'b'], builder.handle_list(object_list, None))
+        self.assertEqual([], builder.handle_list(None, None))
+
+
+class TestParserGuard(unittest.TestCase):
+
+    def test_lex_iter_same_thread(self):
+        tokens = lexer.lex_iter_string('2014-01-01 2014-01-02')
+        next(tokens)
+        with self.assertRaises(RuntimeError):
+            list(lexer.lex_iter_string('2014-01-01'))
+        tokens.close()
+        self.assertEqual(['DATE', 'EOL'],
+                         [token for token, *_ in lexer.lex_iter_string('2014-01-01')])
+
+    def test_lex_iter_other_thread(self):
+        tokens = lexer.lex_iter_string('2014-01-01 2014-01-02')
+        next(tokens)
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            list(lexer.lex_iter_string('2014-01-01'))))
+        thread.start()
+        thread.join(0.1)
+        # The other thread waits for the tokens to be closed.
+        self.assertTrue(thread.is_alive())
+        closer = threading.Thread(target=tokens.close)
+        closer.start()
+        closer.join()
+        thread.join()
+        self.assertEqual(['DATE', 'EOL'], [token for token, *_ in results[0]])
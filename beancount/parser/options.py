@@ -408,6 +408,29 @@ PUBLIC_OPTION_GROUPS = [
       quote by warning users of unexpectedly long strings.
     """, [Opt("long_string_maxlines", 64)]),
 
+    OptGroup("""
+      The number of processes to parse included files with. When set to 2 or
+      more, the files included from the top-level file are parsed concurrently
+      in a pool of worker processes and their directives merged in the same
+      order as if they had been parsed sequentially. This speeds up loading
+      ledgers split across many files. The BEANCOUNT_PARSE_PROCESSES environment
+      variable overrides this value.
+    """, [Opt("parse_processes", 0, "4", converter=int)]),
+
+    OptGroup("""
+      The number of processes to book transactions with. When set to 2 or
+      more, the transactions which need booking are partitioned into groups of
+      accounts whose balances they don't share, which are booked concurrently in
+      a pool of worker processes, and the results are merged in their original
+      order. This is off by default, and ignored on machines with a single
+      CPU: sending the transactions to the workers and their results back
+      costs more than booking them in many cases. On the booking benchmark,
+      with 2000 lots over 50 accounts on a single CPU, booking took 1058 ms
+      sequentially and 1454 ms with 4 processes. Only enable it if it measures
+      faster on your ledger and machine. The BEANCOUNT_BOOKING_PROCESSES
+      environment variable overrides this value.
+    """, [Opt("booking_processes", 0, "4", converter=int)]),
+
     OptGroup("""
       The booking method to apply to ambiguous reductions of inventory lots.
       When a posting is matched against the contents of an account's inventory
@@ -3,6 +3,8 @@
 
 #include <Python.h>
 #include <moduleobject.h>
+#include <structmember.h>
+#include <datetime.h>
 #include <ctype.h>
 
 #include "parser.h"
@@ -19,13 +21,21 @@ extern const char* getTokenName(int token);
 extern int yy_firstline;
 
 
-/* The current builder during parsing (as a global variable for now). */
+/* The current builder during parsing (as a global variable for now). The lexer
+   and the parser keep their state in globals as well, so only a single input
+   may be parsed at a time; this is set for the duration of a parse. */
 PyObject* builder = 0;
 
 /* A reference to a Python-defined constant object used as a placeholder for
    missing cost specifications. */
 PyObject* missing_obj = 0;
 
+/* A reference to the Decimal type the numbers are built with. */
+PyObject* decimal_type = 0;
+
+/* A reference to the Amount type. */
+PyObject* amount_type = 0;
+
 
 PyDoc_STRVAR(parse_file_doc,
 "Parse the filename, calling back methods on the builder.\n\
@@ -37,6 +47,19 @@ PyDoc_STRVAR(parse_string_doc,
 Your builder is responsible to accumulating results.");
 
 
+/* Check that no other input is being parsed, e.g. from a builder method,
+   because this would clobber the state of the lexer and parser. Returns 0 and
+   sets an exception if so. */
+int check_parser_available(void)
+{
+    if ( builder != 0 ) {
+        PyErr_SetString(PyExc_RuntimeError,
+                        "The parser is not reentrant and is already in use");
+        return 0;
+    }
+    return 1;
+}
+
 /* Handle the result of yyparse() {459018e2905c}. */
 PyObject* handle_yyparse_result(int result)
 {
@@ -59,6 +82,7 @@ PyObject* parse_file(PyObject *self, PyObject *args, PyObject* kwds)
     int result;
 
     /* Unpack and validate arguments */
+    PyObject* parse_builder = 0;
     const char* filename = 0;
     const char* report_filename = 0;
     int report_firstline = 0;
@@ -68,11 +92,14 @@ PyObject* parse_file(PyObject *self, PyObject *args, PyObject* kwds)
                              "report_filename", "report_firstline",
                              "encoding", "yydebug", NULL};
     if ( !PyArg_ParseTupleAndKeywords(args, kwds, "sO|sizp", kwlist,
-                                      &filename, &builder,
+                                      &filename, &parse_builder,
                                       &report_filename, &report_firstline,
                                       &encoding, &yydebug) ) {
         return NULL;
     }
+    if ( !check_parser_available() ) {
+        return NULL;
+    }
 
     /* Open the file. */
     if ( strcmp(filename, "-") == 0 ) {
@@ -86,6 +113,7 @@ PyObject* parse_file(PyObject *self, PyObject *args, PyObject* kwds)
     }
 
     /* Initialize the lexer. */
+    builder = parse_builder;
     yylex_initialize(report_filename != NULL ? report_filename : filename,
                      encoding);
     yyin = fp;
@@ -115,6 +143,7 @@ PyObject* parse_string(PyObject *self, PyObject *args, PyObject* kwds)
     int result;
 
     /* Unpack and validate arguments */
+    PyObject* parse_builder = 0;
     const char* input_string = 0;
     Py_ssize_t input_length = 0;
     const char* report_filename = 0;
@@ -125,13 +154,17 @@ PyObject* parse_string(PyObject *self, PyObject *args, PyObject* kwds)
                              "report_filename", "report_firstline",
                              "encoding", "yydebug", NULL};
     if ( !PyArg_ParseTupleAndKeywords(args, kwds, "s#O|sizp", kwlist,
-                                      &input_string, &input_length, &builder,
+                                      &input_string, &input_length, &parse_builder,
                                       &report_filename, &report_firstline,
                                       &encoding, &yydebug) ) {
         return NULL;
     }
+    if ( !check_parser_available() ) {
+        return NULL;
+    }
 
     /* Initialize the lexer. */
+    builder = parse_builder;
     yylex_initialize(report_filename != NULL ? report_filename : "<string>",
                      encoding);
     yy_switch_to_buffer(yy_scan_string(input_string));
@@ -171,12 +204,15 @@ PyObject* lexer_initialize(PyObject *self, PyObject *args)
     FILE* fp = NULL;
 
     /* Unpack and validate arguments */
+    PyObject* lexer_builder = NULL;
     const char* filename = NULL;
     const char* encoding = NULL;
-    if ( !PyArg_ParseTuple(args, "sOz", &filename, &builder, &encoding) ) {
+    if ( !PyArg_ParseTuple(args, "sOz", &filename, &lexer_builder, &encoding) ) {
+        return NULL;
+    }
+    if ( !check_parser_available() ) {
         return NULL;
     }
-    Py_XINCREF(builder);
 
     /* Open the file. */
     fp = fopen(filename, "r");
@@ -185,6 +221,8 @@ PyObject* lexer_initialize(PyObject *self, PyObject *args)
     }
 
     /* Initialize the lexer. */
+    Py_INCREF(lexer_builder);
+    builder = lexer_builder;
     yylex_initialize(filename, encoding);
     yyin = fp;
 
@@ -196,6 +234,8 @@ PyObject* lexer_finalize(PyObject *self, PyObject *args)
 {
     /* Finalize the lexer. */
     yylex_finalize();
+    Py_XDECREF(builder);
+    builder = 0;
 
     /* /\* Close the file. *\/ */
     /* if ( fclose(yyin) != 0 ) { */
@@ -239,6 +279,414 @@ PyObject* lexer_next(PyObject *self, PyObject *args)
 }
 
 
+/*
+ * A base class for the builders, implementing the methods called back by the
+ * lexer for every token, and by the grammar for the most common rules. Calling
+ * Python methods for those is a large part of the cost of parsing. The rare
+ * cases which need more than the fast paths below call back Python methods of
+ * the derived class.
+ */
+typedef struct {
+    PyObject_HEAD
+
+    /* A dict of the account names seen, used to intern them. */
+    PyObject* accounts;
+
+    /* A set of the commodities seen. */
+    PyObject* commodities;
+
+    /* The regular expression for valid account names. */
+    PyObject* account_regexp;
+
+    /* A set of the account names which were validated against
+       'account_regexp'. This is cleared when it is replaced, e.g. when an
+       option changes the names of the root accounts. */
+    PyObject* valid_accounts;
+
+    /* A dict of packed year, month and day integers to the date objects
+       already built, to share them. */
+    PyObject* dates;
+} BuilderBaseObject;
+
+static PyObject* BuilderBase_new(PyTypeObject* type, PyObject* args, PyObject* kwds)
+{
+    BuilderBaseObject* self = (BuilderBaseObject*)type->tp_alloc(type, 0);
+    if ( self == NULL ) {
+        return NULL;
+    }
+    self->accounts = PyDict_New();
+    self->commodities = PySet_New(NULL);
+    self->valid_accounts = PySet_New(NULL);
+    self->dates = PyDict_New();
+    if ( self->accounts == NULL || self->commodities == NULL ||
+         self->valid_accounts == NULL || self->dates == NULL ) {
+        Py_DECREF(self);
+        return NULL;
+    }
+    return (PyObject*)self;
+}
+
+static int BuilderBase_traverse(BuilderBaseObject* self, visitproc visit, void* arg)
+{
+    Py_VISIT(self->accounts);
+    Py_VISIT(self->commodities);
+    Py_VISIT(self->account_regexp);
+    Py_VISIT(self->valid_accounts);
+    Py_VISIT(self->dates);
+    return 0;
+}
+
+static int BuilderBase_clear(BuilderBaseObject* self)
+{
+    Py_CLEAR(self->accounts);
+    Py_CLEAR(self->commodities);
+    Py_CLEAR(self->account_regexp);
+    Py_CLEAR(self->valid_accounts);
+    Py_CLEAR(self->dates);
+    return 0;
+}
+
+static void BuilderBase_dealloc(BuilderBaseObject* self)
+{
+    PyObject_GC_UnTrack(self);
+    BuilderBase_clear(self);
+    Py_TYPE(self)->tp_free((PyObject*)self);
+}
+
+static PyObject* BuilderBase_get_account_regexp(BuilderBaseObject* self, void* closure)
+{
+    if ( self->account_regexp == NULL ) {
+        PyErr_SetString(PyExc_AttributeError, "account_regexp");
+        return NULL;
+    }
+    Py_INCREF(self->account_regexp);
+    return self->account_regexp;
+}
+
+static int BuilderBase_set_account_regexp(BuilderBaseObject* self, PyObject* value,
+                                           void* closure)
+{
+    Py_XINCREF(value);
+    Py_XSETREF(self->account_regexp, value);
+    return PySet_Clear(self->valid_accounts);
+}
+
+PyDoc_STRVAR(BuilderBase_DATE_doc,
+"Process a DATE token.\n\
+\n\
+Args:\n\
+  year: integer year.\n\
+  month: integer month.\n\
+  day: integer day\n\
+Returns:\n\
+  A datetime.date instance, shared with the other tokens of the same date.");
+
+static PyObject* BuilderBase_DATE(BuilderBaseObject* self, PyObject* args)
+{
+    int year, month, day;
+    PyObject* key;
+    PyObject* date;
+    if ( !PyArg_ParseTuple(args, "iii", &year, &month, &day) ) {
+        return NULL;
+    }
+
+    /* The lexer only produces two-digit months and days. */
+    key = PyLong_FromLong((long)year * 10000 + month * 100 + day);
+    if ( key == NULL ) {
+        return NULL;
+    }
+    date = PyDict_GetItemWithError(self->dates, key);
+    if ( date != NULL ) {
+        Py_DECREF(key);
+        Py_INCREF(date);
+        return date;
+    }
+    if ( PyErr_Occurred() ) {
+        Py_DECREF(key);
+        return NULL;
+    }
+    date = PyDate_FromDate(year, month, day);
+    if ( date != NULL && PyDict_SetItem(self->dates, key, date) != 0 ) {
+        Py_CLEAR(date);
+    }
+    Py_DECREF(key);
+    return date;
+}
+
+PyDoc_STRVAR(BuilderBase_ACCOUNT_doc,
+"Process an ACCOUNT token.\n\
+\n\
+This validates the account name against 'account_regexp' and reuses an\n\
+existing account string if one exists.\n\
+\n\
+Args:\n\
+  account_name: a str, the name of an account.\n\
+Returns:\n\
+  A string, the name of the account.\n\
+Raises:\n\
+  ValueError: If the account name is invalid.");
+
+static PyObject* BuilderBase_ACCOUNT(BuilderBaseObject* self, PyObject* account_name)
+{
+    int valid = PySet_Contains(self->valid_accounts, account_name);
+    if ( valid < 0 ) {
+        return NULL;
+    }
+    if ( !valid ) {
+        PyObject* match;
+        if ( self->account_regexp == NULL ) {
+            PyErr_SetString(PyExc_AttributeError, "account_regexp");
+            return NULL;
+        }
+        match = PyObject_CallMethod(self->account_regexp, "match", "O", account_name);
+        if ( match == NULL ) {
+            return NULL;
+        }
+        Py_DECREF(match);
+        if ( match == Py_None ) {
+            return PyErr_Format(PyExc_ValueError, "Invalid account name: %U",
+                                account_name);
+        }
+        if ( PySet_Add(self->valid_accounts, account_name) != 0 ) {
+            return NULL;
+        }
+    }
+
+    /* Reuse (intern) account strings as much as possible. This potentially
+       reduces memory usage a fair bit, because these strings are repeated
+       liberally. */
+    if ( PyDict_CheckExact(self->accounts) ) {
+        PyObject* interned = PyDict_SetDefault(self->accounts, account_name, account_name);
+        Py_XINCREF(interned);
+        return interned;
+    }
+    return PyObject_CallMethod(self->accounts, "setdefault", "OO",
+                               account_name, account_name);
+}
+
+PyDoc_STRVAR(BuilderBase_CURRENCY_doc,
+"Process a CURRENCY token.\n\
+\n\
+Args:\n\
+  currency_name: the name of the currency.\n\
+Returns:\n\
+  A new currency object; for now, these are simply represented\n\
+  as the currency name.");
+
+static PyObject* BuilderBase_CURRENCY(BuilderBaseObject* self, PyObject* currency_name)
+{
+    if ( Py_TYPE(self->commodities) == &PySet_Type ) {
+        if ( PySet_Add(self->commodities, currency_name) != 0 ) {
+            return NULL;
+        }
+    }
+    else {
+        PyObject* rv = PyObject_CallMethod(self->commodities, "add", "O", currency_name);
+        if ( rv == NULL ) {
+            return NULL;
+        }
+        Py_DECREF(rv);
+    }
+    Py_INCREF(currency_name);
+    return currency_name;
+}
+
+PyDoc_STRVAR(BuilderBase_STRING_doc,
+"Process a STRING token.\n\
+\n\
+Multi-line strings are passed on to check_long_string().\n\
+\n\
+Args:\n\
+  string: the string to process.\n\
+Returns:\n\
+  The string.");
+
+static PyObject* BuilderBase_STRING(BuilderBaseObject* self, PyObject* string)
+{
+    Py_ssize_t index;
+    if ( !PyUnicode_Check(string) ) {
+        PyErr_SetString(PyExc_TypeError, "Expected a str");
+        return NULL;
+    }
+    index = PyUnicode_FindChar(string, '\n', 0, PyUnicode_GET_LENGTH(string), 1);
+    if ( index == -2 ) {
+        return NULL;
+    }
+    if ( index >= 0 ) {
+        return PyObject_CallMethod((PyObject*)self, "check_long_string", "O", string);
+    }
+    Py_INCREF(string);
+    return string;
+}
+
+PyDoc_STRVAR(BuilderBase_NUMBER_doc,
+"Process a NUMBER token. Convert into Decimal.\n\
+\n\
+Numbers with commas are passed on to parse_number_commas().\n\
+\n\
+Args:\n\
+  number: a str, the number to be converted.\n\
+Returns:\n\
+  A Decimal instance built of the number string.");
+
+static PyObject* BuilderBase_NUMBER(BuilderBaseObject* self, PyObject* number)
+{
+    Py_ssize_t index;
+    if ( !PyUnicode_Check(number) ) {
+        PyErr_SetString(PyExc_TypeError, "Expected a str");
+        return NULL;
+    }
+    index = PyUnicode_FindChar(number, ',', 0, PyUnicode_GET_LENGTH(number), 1);
+    if ( index == -2 ) {
+        return NULL;
+    }
+    if ( index >= 0 ) {
+        return PyObject_CallMethod((PyObject*)self, "parse_number_commas", "O", number);
+    }
+    /* The lexer will only yield valid number strings. */
+    return PyObject_CallFunctionObjArgs(decimal_type, number, NULL);
+}
+
+PyDoc_STRVAR(BuilderBase_identity_doc,
+"Process a TAG, LINK or KEY token.\n\
+\n\
+Args:\n\
+  string: a str, the name of the tag, link or key.\n\
+Returns:\n\
+  The string itself. For now we don't need an object to represent\n\
+  those; keeping it simple.");
+
+static PyObject* BuilderBase_identity(BuilderBaseObject* self, PyObject* string)
+{
+    Py_INCREF(string);
+    return string;
+}
+
+PyDoc_STRVAR(BuilderBase_amount_doc,
+"Process an amount grammar rule.\n\
+\n\
+Args:\n\
+  number: a Decimal instance, the number of the amount.\n\
+  currency: a currency object (a str, really, see CURRENCY above)\n\
+Returns:\n\
+  An instance of Amount.");
+
+static PyObject* BuilderBase_amount(BuilderBaseObject* self, PyObject* args)
+{
+    PyObject* number;
+    PyObject* currency;
+    if ( !PyArg_UnpackTuple(args, "amount", 2, 2, &number, &currency) ) {
+        return NULL;
+    }
+
+    /* Update the mapping that stores the parsed precisions. */
+    if ( PyObject_TypeCheck(number, (PyTypeObject*)decimal_type) &&
+         currency != missing_obj ) {
+        int has_currency = PyObject_IsTrue(currency);
+        if ( has_currency < 0 ) {
+            return NULL;
+        }
+        if ( has_currency ) {
+            PyObject* rv = PyObject_CallMethod((PyObject*)self, "dcupdate", "OO",
+                                               number, currency);
+            if ( rv == NULL ) {
+                return NULL;
+            }
+            Py_DECREF(rv);
+        }
+    }
+
+    /* Create the tuple directly; the grammar only produces valid types. */
+    PyObject* amount = ((PyTypeObject*)amount_type)->tp_alloc(
+        (PyTypeObject*)amount_type, 2);
+    if ( amount == NULL ) {
+        return NULL;
+    }
+    Py_INCREF(number);
+    PyTuple_SET_ITEM(amount, 0, number);
+    Py_INCREF(currency);
+    PyTuple_SET_ITEM(amount, 1, currency);
+    return amount;
+}
+
+PyDoc_STRVAR(BuilderBase_handle_list_doc,
+"Handle a recursive list grammar rule, generically.\n\
+\n\
+Args:\n\
+  object_list: the current list of objects.\n\
+  new_object: the new object to be added.\n\
+Returns:\n\
+  The new, updated list of objects.");
+
+static PyObject* BuilderBase_handle_list(BuilderBaseObject* self, PyObject* args)
+{
+    PyObject* object_list;
+    PyObject* new_object;
+    if ( !PyArg_UnpackTuple(args, "handle_list", 2, 2, &object_list, &new_object) ) {
+        return NULL;
+    }
+    if ( object_list == Py_None ) {
+        object_list = PyList_New(0);
+        if ( object_list == NULL ) {
+            return NULL;
+        }
+    }
+    else {
+        Py_INCREF(object_list);
+    }
+    if ( new_object != Py_None && PyList_Append(object_list, new_object) != 0 ) {
+        Py_DECREF(object_list);
+        return NULL;
+    }
+    return object_list;
+}
+
+static PyMethodDef BuilderBase_methods[] = {
+    {"DATE", (PyCFunction)BuilderBase_DATE, METH_VARARGS, BuilderBase_DATE_doc},
+    {"ACCOUNT", (PyCFunction)BuilderBase_ACCOUNT, METH_O, BuilderBase_ACCOUNT_doc},
+    {"CURRENCY", (PyCFunction)BuilderBase_CURRENCY, METH_O, BuilderBase_CURRENCY_doc},
+    {"STRING", (PyCFunction)BuilderBase_STRING, METH_O, BuilderBase_STRING_doc},
+    {"NUMBER", (PyCFunction)BuilderBase_NUMBER, METH_O, BuilderBase_NUMBER_doc},
+    {"TAG", (PyCFunction)BuilderBase_identity, METH_O, BuilderBase_identity_doc},
+    {"LINK", (PyCFunction)BuilderBase_identity, METH_O, BuilderBase_identity_doc},
+    {"KEY", (PyCFunction)BuilderBase_identity, METH_O, BuilderBase_identity_doc},
+    {"amount", (PyCFunction)BuilderBase_amount, METH_VARARGS, BuilderBase_amount_doc},
+    {"handle_list", (PyCFunction)BuilderBase_handle_list, METH_VARARGS,
+     BuilderBase_handle_list_doc},
+    {NULL, NULL, 0, NULL} /* Sentinel */
+};
+
+static PyMemberDef BuilderBase_members[] = {
+    {"accounts", T_OBJECT_EX, offsetof(BuilderBaseObject, accounts), 0,
+     "A dict of the account names seen, used to intern them."},
+    {"commodities", T_OBJECT_EX, offsetof(BuilderBaseObject, commodities), 0,
+     "A set of all the commodities seen."},
+    {NULL} /* Sentinel */
+};
+
+static PyGetSetDef BuilderBase_getset[] = {
+    {"account_regexp",
+     (getter)BuilderBase_get_account_regexp, (setter)BuilderBase_set_account_regexp,
+     "A compiled regular expression for valid account names.", NULL},
+    {NULL} /* Sentinel */
+};
+
+static PyTypeObject BuilderBaseType = {
+    PyVarObject_HEAD_INIT(NULL, 0)
+    .tp_name = "beancount.parser._parser.BuilderBase",
+    .tp_doc = "A base class for builders, implementing their most common methods.",
+    .tp_basicsize = sizeof(BuilderBaseObject),
+    .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE | Py_TPFLAGS_HAVE_GC,
+    .tp_new = BuilderBase_new,
+    .tp_dealloc = (destructor)BuilderBase_dealloc,
+    .tp_traverse = (traverseproc)BuilderBase_traverse,
+    .tp_clear = (inquiry)BuilderBase_clear,
+    .tp_methods = BuilderBase_methods,
+    .tp_members = BuilderBase_members,
+    .tp_getset = BuilderBase_getset,
+};
+
+
 static PyMethodDef module_functions[] = {
     {"parse_file", (PyCFunction)parse_file, METH_VARARGS|METH_KEYWORDS, parse_file_doc},
     {"parse_string", (PyCFunction)parse_string, METH_VARARGS|METH_KEYWORDS, parse_string_doc},
@@ -316,6 +764,28 @@ PyMODINIT_FUNC PyInit__parser(void)
     if ( missing_obj == NULL ) {
         Py_RETURN_NONE;
     }
+    decimal_type = PyObject_GetAttrString(number_module, "Decimal");
+    if ( decimal_type == NULL ) {
+        Py_RETURN_NONE;
+    }
+
+    /* Import the Amount type, built by the builders. */
+    PyObject* amount_module = PyImport_ImportModule("beancount.core.amount");
+    if ( amount_module == NULL ) {
+        Py_RETURN_NONE;
+    }
+    amount_type = PyObject_GetAttrString(amount_module, "Amount");
+    if ( amount_type == NULL ) {
+        Py_RETURN_NONE;
+    }
+
+    /* Add the base class of the builders. */
+    PyDateTime_IMPORT;
+    if ( PyDateTimeAPI == NULL || PyType_Ready(&BuilderBaseType) < 0 ) {
+        Py_RETURN_NONE;
+    }
+    Py_INCREF(&BuilderBaseType);
+    PyModule_AddObject(module, "BuilderBase", (PyObject*)&BuilderBaseType);
 
     return module;
 }
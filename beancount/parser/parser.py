@@ -112,11 +112,14 @@ __license__ = "GNU GPLv2"
 import functools
 import inspect
 import textwrap
+import threading
 import io
+import queue
 from os import path
 
 from beancount.parser import _parser
 from beancount.parser import grammar
+from beancount.parser import lexer
 from beancount.parser import printer
 from beancount.parser import hashsrc
 from beancount.core import data
@@ -194,10 +197,108 @@ def parse_file(filename, **kw):
     """
     abs_filename = path.abspath(filename) if filename else None
     builder = grammar.Builder(abs_filename)
-    _parser.parse_file(filename, builder, **kw)
+    with lexer.parser_guard():
+        _parser.parse_file(filename, builder, **kw)
     return builder.finalize()
 
 
+class _StreamingBuilder(grammar.Builder):
+    """A builder which hands out the directives in batches as they are built,
+    instead of accumulating them until the end of the input.
+
+    Attributes:
+      queue: A Queue of lists of directives, or of None at the end of the input.
+      batch: A list of the directives built since the last batch was handed out.
+      closed: A boolean, true if the directives should be discarded.
+    """
+    def __init__(self, filename, queue_):
+        super().__init__(filename)
+        self.queue = queue_
+        self.batch = []
+        self.closed = False
+
+    def handle_list(self, object_list, new_object):
+        """See base class. Directives are handed out instead of being added."""
+        if isinstance(new_object, data.ALL_DIRECTIVES):
+            batch = self.batch
+            batch.append(new_object)
+            if len(batch) >= STREAMING_BATCH_SIZE:
+                self.flush()
+            return object_list
+        return super().handle_list(object_list, new_object)
+
+    def flush(self):
+        """Hand out the current batch of directives."""
+        if not self.closed:
+            self.queue.put(self.batch)
+        self.batch = []
+
+
+# The number of directives handed out at once by iter_parse_file(), and the
+# maximum number of batches waiting for the caller.
+STREAMING_BATCH_SIZE = 512
+STREAMING_QUEUE_SIZE = 8
+
+
+def iter_parse_file(filename, errors=None, **kw):
+    """Parse a beancount input file, yielding its directives as they are built.
+
+    Unlike parse_file(), this never holds more than a few batches of the
+    directives in memory, for tools which process them in a single pass. The
+    directives are yielded in the order of the file, not sorted, and the
+    options aren't available. The parser runs in a separate thread, and is not
+    available for other inputs until it has reached the end of the file, which
+    may require consuming the iterator; other threads wait for it, while the
+    thread which started iterating gets an error. Closing the iterator early
+    discards the remaining directives and waits for the end of the file.
+
+    Args:
+      filename: the name of the file to be parsed.
+      errors: A list to which the errors are appended as they are found, or None.
+      kw: a dict of keywords to be applied to the C parser.
+    Yields:
+      The directives parsed from the file, which may need completion.
+    """
+    abs_filename = path.abspath(filename) if filename else None
+    batches = queue.Queue(STREAMING_QUEUE_SIZE)
+    builder = _StreamingBuilder(abs_filename, batches)
+    if errors is not None:
+        builder.errors = errors
+    exceptions = []
+
+    # The parser is held by the worker thread only while it runs, and the
+    # calling thread gets an error if it tries to parse another input until
+    # then, instead of waiting for the worker, which waits for it.
+    consumer = threading.get_ident()
+    def produce():
+        try:
+            with lexer.parser_guard(consumer):
+                _parser.parse_file(filename, builder, **kw)
+            builder.finalize()
+            builder.flush()
+        except Exception as exc: # pylint: disable=broad-except
+            exceptions.append(exc)
+        finally:
+            batches.put(None)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        for batch in iter(batches.get, None):
+            yield from batch
+        if exceptions:
+            raise exceptions[0]
+    finally:
+        # Discard the remaining directives, if the iterator was closed early.
+        builder.closed = True
+        while thread.is_alive():
+            try:
+                batches.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        thread.join()
+
+
 def parse_string(string, **kw):
     """Parse a beancount input file and return Ledger with the list of
     transactions and tree of accounts.
@@ -212,7 +313,8 @@ def parse_string(string, **kw):
     if kw.pop('dedent', None):
         string = textwrap.dedent(string)
     builder = grammar.Builder(None)
-    _parser.parse_string(string, builder, **kw)
+    with lexer.parser_guard():
+        _parser.parse_string(string, builder, **kw)
     builder.options['filename'] = '<string>'
     return builder.finalize()
 
@@ -4,14 +4,18 @@ Tests for parser.
 __copyright__ = "Copyright (C) 2014-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
+import concurrent.futures
 import unittest
 import tempfile
 import textwrap
+import threading
 import sys
 import subprocess
+from unittest import mock
 
 from beancount.core.number import D
 from beancount.core import data
+from beancount.parser import grammar
 from beancount.parser import parser
 from beancount.utils import test_utils
 
@@ -122,6 +126,98 @@ class TestParserInputs(unittest.TestCase):
         with self.assertRaises(TypeError):
             entries, errors, _ = parser.parse_string("something", None, report_filename)
 
+    def test_parse_reentrant(self):
+        def open_(builder, meta, *args):
+            return parser.parse_string(self.INPUT)
+        with mock.patch.object(grammar.Builder, 'open', open_):
+            entries, errors, _ = parser.parse_string(
+                '2013-05-01 open Assets:US:Cash\n' + textwrap.dedent(self.INPUT))
+        self.assertEqual(1, len(entries))
+        self.assertEqual(1, len(errors))
+        self.assertRegex(errors[0].message, 'not reentrant')
+
+        # The parser is still usable afterwards.
+        entries, errors, _ = parser.parse_string(self.INPUT)
+        self.assertEqual(1, len(entries))
+        self.assertEqual(0, len(errors))
+
+    def test_parse_threads(self):
+        inputs = ['\n'.join('2013-05-{:02d} open Assets:Account{}{}'.format(
+            day % 28 + 1, index, day) for day in range(500)) for index in range(8)]
+        expected = [parser.parse_string(string)[:2] for string in inputs]
+
+        # Switch threads often, including while the parser calls the builder.
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with concurrent.futures.ThreadPoolExecutor(4) as executor:
+                actual = [result[:2]
+                          for result in executor.map(parser.parse_string, inputs)]
+        finally:
+            sys.setswitchinterval(switch_interval)
+        self.assertEqual(expected, actual)
+
+
+class TestIterParseFile(unittest.TestCase):
+
+    def setUp(self):
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.beancount')
+        self.file.write(textwrap.dedent("""
+          pushtag #trip
+          2013-05-18 * "Dinner"
+            Expenses:Restaurant         100 USD
+            Assets:US:Cash
+          poptag #trip
+          2013-05-01 open Assets:US:Cash
+          2013-05-02 balance Assets:US:Cash   0 USD
+          2013-05-03 open Assets:US:Cash Bad
+        """) + '\n'.join('2014-01-01 open Assets:Account{}'.format(index)
+                          for index in range(10000)))
+        self.file.flush()
+
+    def tearDown(self):
+        self.file.close()
+
+    def test_iter_parse_file(self):
+        errors = []
+        entries = list(parser.iter_parse_file(self.file.name, errors))
+        expected_entries, expected_errors, _ = parser.parse_file(self.file.name)
+        self.assertEqual([data.Transaction, data.Open, data.Balance],
+                         [type(entry) for entry in entries[:3]])
+        self.assertEqual(expected_entries, sorted(entries, key=data.entry_sortkey))
+        self.assertEqual(1, len(errors))
+        self.assertEqual(expected_errors, errors)
+
+    def test_iter_parse_file_close(self):
+        iterator = parser.iter_parse_file(self.file.name)
+        next(iterator)
+        with self.assertRaises(RuntimeError):
+            parser.parse_string('2014-01-01 open Assets:Account')
+        iterator.close()
+        entries, _, _ = parser.parse_string('2014-01-01 open Assets:Account')
+        self.assertEqual(1, len(entries))
+
+    def test_iter_parse_file_other_threads(self):
+        iterator = parser.iter_parse_file(self.file.name)
+        next(iterator)
+        # Other threads wait for the parser, and can close the iterator.
+        results = []
+        thread = threading.Thread(target=lambda: results.append(
+            parser.parse_string('2014-01-01 open Assets:Account')))
+        thread.start()
+        thread.join(0.1)
+        self.assertTrue(thread.is_alive())
+        closer = threading.Thread(target=iterator.close)
+        closer.start()
+        closer.join()
+        thread.join()
+        entries, _, _ = results[0]
+        self.assertEqual(1, len(entries))
+
+    def test_iter_parse_file_missing(self):
+        with self.assertRaises(IOError):
+            list(parser.iter_parse_file('/path/to/missing.beancount'))
+
 
 class TestUnicodeErrors(unittest.TestCase):
 
@@ -0,0 +1,699 @@
+"""A compact binary snapshot format for lists of directives.
+
+This is an alternative to pickling a list of directives, which is dominated by
+the reconstruction of many small objects and which silently breaks when the
+data structures change across versions. The directives are flattened into a
+few arrays of 64-bit integers that reference a table of unique values:
+
+- All the strings (accounts, currencies, payees, filenames, metadata keys...)
+  are stored once, in a single table.
+
+- Dates are packed as their ordinals, and numbers as scaled integers (a
+  coefficient and an exponent). Equal dates, numbers, amounts and costs are
+  stored once and are shared between the reconstructed directives; all of
+  these are immutable.
+
+- Metadata dicts, lists and sets are created anew for each directive that
+  refers to them, because they are mutable.
+
+Any value of an unsupported type is pickled on its own. The errors and options
+map which accompany the directives are pickled as well; they are small.
+
+The file starts with a header that contains a format version, a fingerprint of
+the schema of the directives, the version of Beancount that produced it and a
+checksum of its contents. Loading a snapshot whose header does not match
+raises a SnapshotError instead of returning invalid data.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import array
+import datetime
+import decimal
+import gc
+import hashlib
+import io
+import pickle
+import struct
+import sys
+import zlib
+
+import beancount
+from beancount.core.number import Decimal
+from beancount.core.number import MISSING
+from beancount.core.amount import Amount
+from beancount.core.position import Cost
+from beancount.core.position import CostSpec
+from beancount.core import data
+
+
+# A string that identifies a snapshot file.
+MAGIC = b'BEANSNAP'
+
+# The version of the layout of the snapshot. Increase this whenever the encoding
+# below changes.
+FORMAT_VERSION = 1
+
+# The header: magic, format version, flags, schema fingerprint, payload
+# checksum, payload length and length of the Beancount version string that
+# follows.
+_HEADER = struct.Struct('<8sIH16sIQH')
+
+# Header flags.
+FLAG_COMPRESSED = 0x1
+
+# The prefix of each section of the payload: its length.
+_SECTION = struct.Struct('<Q')
+
+# The range of integers which can be stored inline in the arrays.
+_INT_MIN, _INT_MAX = -2**63, 2**63 - 1
+
+# Signed array types, from narrowest to widest.
+_INT_TYPECODES = 'bhiq'
+_INT_TYPECODES_BY_SIZE = {array.array(typecode).itemsize: typecode
+                          for typecode in reversed(_INT_TYPECODES)}
+
+# A context for the reconstruction of numbers from their scaled integers. This
+# is wide enough to never round a 64-bit coefficient.
+_DECIMAL_CONTEXT = decimal.Context(prec=30, Emin=-999999, Emax=999999)
+
+# Tags for the encoding of values.
+T_NONE = 0
+T_STR = 1
+T_INT = 2
+T_BOOL = 3
+T_DECIMAL = 4
+T_DECIMAL_STR = 5
+T_DATE = 6
+T_AMOUNT = 7
+T_COST = 8
+T_COSTSPEC = 9
+T_BOOKING = 10
+T_MISSING = 11
+T_EMPTY_SET = 12
+T_FROZENSET = 13
+T_SET = 14
+T_LIST = 15
+T_DICT = 16
+T_PICKLE = 17
+
+# The record code of a directive whose type is not one of the known directives.
+R_PICKLE = -1
+
+# Inline markers for a metadata field which is not of the usual shape, in lieu
+# of the reference to its filename.
+M_NONE = -1
+M_VALUE = -2
+
+# The types of directives, indexed by their record code.
+_DIRECTIVES = data.ALL_DIRECTIVES
+_DIRECTIVE_CODES = {cls: code for code, cls in enumerate(_DIRECTIVES)}
+_TRANSACTION_CODE = _DIRECTIVE_CODES[data.Transaction]
+
+
+class SnapshotError(ValueError):
+    """An error raised when a snapshot cannot be read."""
+
+
+def _schema_fingerprint():
+    """Compute a fingerprint of the data structures stored in snapshots.
+
+    Returns:
+      A bytes object of 16 bytes.
+    """
+    md5 = hashlib.md5()
+    for cls in _DIRECTIVES + (data.Posting, Amount, Cost, CostSpec):
+        md5.update('{}:{};'.format(cls.__name__, ','.join(cls._fields)).encode('ascii'))
+    for booking in data.Booking:
+        md5.update(booking.name.encode('ascii'))
+    return md5.digest()
+
+SCHEMA = _schema_fingerprint()
+
+
+class _Encoder:
+    """Accumulates the tables of a snapshot.
+
+    Attributes:
+      strings: A list of unique strings.
+      values: An array of integers, the encoded values, each as a tag followed
+        by its payload.
+      records: An array of integers, the encoded directives.
+      pickles: A list of pickled objects.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.values = array.array('q')
+        self.records = array.array('q')
+        self.pickles = []
+
+        # A mapping of string to its index in 'strings'.
+        self._string_index = {}
+
+        # A mapping of a key for an immutable value to its reference.
+        self._refs = {}
+
+        # The number of values encoded so far.
+        self._num_values = 0
+
+    def _string(self, string):
+        """Return the index of a string in the strings table."""
+        try:
+            return self._string_index[string]
+        except KeyError:
+            index = self._string_index[string] = len(self.strings)
+            self.strings.append(string)
+            return index
+
+    def _new(self, *ints):
+        """Append an encoded value and return its reference."""
+        self.values.extend(ints)
+        ref = self._num_values
+        self._num_values += 1
+        return ref
+
+    def _pickle(self, value):
+        """Encode a value as a pickle of its own and return its reference."""
+        index = len(self.pickles)
+        self.pickles.append(value)
+        return self._new(T_PICKLE, index)
+
+    def ref(self, value):
+        """Encode a value if necessary, and return its reference.
+
+        Args:
+          value: Any value which can appear in a directive.
+        Returns:
+          An integer, the index of the value in the values table.
+        """
+        # Note: The type is part of the key because some distinct values are
+        # equal, e.g. True and 1, and Decimal('1.0') and Decimal('1.00').
+        vtype = type(value)
+        if vtype is str:
+            key = value
+        elif vtype in (int, bool, datetime.date, type(None)):
+            key = (vtype, value)
+        elif vtype is Decimal:
+            key = (vtype, str(value))
+        elif vtype in (Amount, Cost, CostSpec):
+            key = (vtype,) + tuple(self.ref(field) for field in value)
+        elif vtype is data.Booking or value is MISSING:
+            key = value
+        elif vtype is frozenset:
+            try:
+                key = (vtype,) + tuple(self.ref(element) for element in sorted(value))
+            except TypeError:
+                key = None
+        else:
+            key = None
+        if key is not None:
+            try:
+                return self._refs[key]
+            except KeyError:
+                ref = self._refs[key] = self._encode(value, key)
+                return ref
+        return self._encode(value, key)
+
+    def _encode(self, value, key):
+        """Encode a new value and return its reference.
+
+        Args:
+          value: Any value which can appear in a directive.
+          key: The interning key computed in ref(), or None, if the value is
+            not interned.
+        Returns:
+          An integer, the index of the value in the values table.
+        """
+        # pylint: disable=too-many-return-statements
+        vtype = type(value)
+        if vtype is str:
+            return self._new(T_STR, self._string(value))
+        elif value is None:
+            return self._new(T_NONE)
+        elif vtype is bool:
+            return self._new(T_BOOL, int(value))
+        elif vtype is int:
+            if _INT_MIN <= value <= _INT_MAX:
+                return self._new(T_INT, value)
+            return self._pickle(value)
+        elif vtype is datetime.date:
+            return self._new(T_DATE, value.toordinal())
+        elif vtype is Decimal:
+            sign, digits, exponent = value.as_tuple()
+            if isinstance(exponent, int) and not (sign and not any(digits)):
+                coefficient = int(''.join(map(str, digits))) if digits else 0
+                if coefficient <= _INT_MAX:
+                    return self._new(T_DECIMAL,
+                                     -coefficient if sign else coefficient,
+                                     exponent)
+            return self._new(T_DECIMAL_STR, self._string(str(value)))
+        elif vtype in (Amount, Cost, CostSpec):
+            tag = (T_AMOUNT if vtype is Amount else
+                   T_COST if vtype is Cost else
+                   T_COSTSPEC)
+            return self._new(tag, *key[1:])
+        elif vtype is data.Booking:
+            return self._new(T_BOOKING, self._string(value.name))
+        elif value is MISSING:
+            return self._new(T_MISSING)
+        elif vtype is frozenset and key is not None:
+            if not value:
+                return self._new(T_EMPTY_SET)
+            return self._new(T_FROZENSET, len(key) - 1, *key[1:])
+        elif vtype is set:
+            try:
+                refs = [self.ref(element) for element in sorted(value)]
+            except TypeError:
+                return self._pickle(value)
+            return self._new(T_SET, len(refs), *refs)
+        elif vtype is list:
+            refs = [self.ref(element) for element in value]
+            return self._new(T_LIST, len(refs), *refs)
+        elif vtype is dict:
+            refs = []
+            for mkey, mvalue in value.items():
+                refs.append(self.ref(mkey))
+                refs.append(self.ref(mvalue))
+            return self._new(T_DICT, len(value), *refs)
+        else:
+            return self._pickle(value)
+
+    def _add_meta(self, record, meta):
+        """Encode a metadata dict inline in a record.
+
+        Metadata dicts are overwhelmingly made of a filename and a line number,
+        followed by a few user keys. Those are stored inline in the record as
+        (filename-ref, lineno, number-of-other-keys, key-ref, value-ref, ...).
+        Anything else is stored as a generic value.
+
+        Args:
+          record: A list of integers to extend.
+          meta: A metadata dict, or None.
+        """
+        if type(meta) is data.Metadata:
+            meta = meta.copy()
+        if type(meta) is dict and len(meta) >= 2:
+            items = iter(meta.items())
+            key1, filename = next(items)
+            key2, lineno = next(items)
+            if (key1 == 'filename' and key2 == 'lineno' and
+                    type(lineno) is int and _INT_MIN <= lineno <= _INT_MAX):
+                record.append(self.ref(filename))
+                record.append(lineno)
+                record.append(len(meta) - 2)
+                for key, value in items:
+                    record.append(self.ref(key))
+                    record.append(self.ref(value))
+                return
+        if meta is None:
+            record.append(M_NONE)
+        else:
+            record.append(M_VALUE)
+            record.append(self.ref(meta))
+
+    def add_entry(self, entry):
+        """Encode a directive.
+
+        Args:
+          entry: A directive instance.
+        """
+        ref = self.ref
+        code = _DIRECTIVE_CODES.get(type(entry), None)
+        if code == _TRANSACTION_CODE:
+            postings = entry.postings
+            if (type(postings) is not list or
+                    any(type(posting) is not data.Posting for posting in postings)):
+                code = None
+        if code is None:
+            self.records.extend((R_PICKLE, self._pickle(entry)))
+            return
+
+        record = [code]
+        self._add_meta(record, entry.meta)
+        if code == _TRANSACTION_CODE:
+            record.extend(ref(field) for field in entry[1:-1])
+            record.append(len(postings))
+            for posting in postings:
+                record.extend(ref(field) for field in posting[:-1])
+                self._add_meta(record, posting.meta)
+        else:
+            record.extend(ref(field) for field in entry[1:])
+        self.records.extend(record)
+
+
+def dumps(entries, errors=None, options_map=None, compress=True):
+    """Serialize a list of directives to a snapshot.
+
+    Args:
+      entries: A list of directives.
+      errors: An optional list of errors to store along with the directives.
+      options_map: An optional options map to store along with the directives.
+      compress: A boolean, true if the payload should be compressed.
+    Returns:
+      A bytes object, the contents of the snapshot.
+    """
+    encoder = _Encoder()
+    for entry in entries:
+        encoder.add_entry(entry)
+
+    string_data = '\0'.join(encoder.strings).encode('utf8', 'surrogatepass')
+    sections = [_pack_ints(array.array('q', map(len, encoder.strings))),
+                string_data,
+                _pack_ints(encoder.values),
+                _pack_ints(encoder.records),
+                pickle.dumps((encoder.pickles, errors, options_map),
+                             pickle.HIGHEST_PROTOCOL)]
+
+    payload = io.BytesIO()
+    for section in sections:
+        payload.write(_SECTION.pack(len(section)))
+        payload.write(section)
+    payload = payload.getvalue()
+    flags = 0
+    if compress:
+        # Note: The fastest level of compression already reduces the size
+        # several-fold, for a decompression time which is negligible compared
+        # to that of reconstructing the objects.
+        payload = zlib.compress(payload, 1)
+        flags |= FLAG_COMPRESSED
+
+    version = beancount.__version__.encode('utf8')
+    return b''.join([_HEADER.pack(MAGIC, FORMAT_VERSION, flags, SCHEMA,
+                                  zlib.crc32(payload), len(payload), len(version)),
+                     version,
+                     payload])
+
+
+def dump(entries, errors, options_map, file, compress=True):
+    """Write a snapshot of a list of directives to a file.
+
+    Args:
+      entries: A list of directives.
+      errors: A list of errors, or None.
+      options_map: An options map, or None.
+      file: A file object opened for writing in binary mode.
+      compress: A boolean, true if the payload should be compressed.
+    """
+    file.write(dumps(entries, errors, options_map, compress))
+
+
+def read_header(snapshot):
+    """Read and validate the header of a snapshot.
+
+    Args:
+      snapshot: A bytes object, the contents of a snapshot.
+    Returns:
+      A pair of the version of Beancount which produced the snapshot, and its
+      uncompressed payload.
+    Raises:
+      SnapshotError: If this is not a snapshot, or it was produced with an
+        incompatible format.
+    """
+    if len(snapshot) < _HEADER.size or not snapshot.startswith(MAGIC):
+        raise SnapshotError("Not a Beancount snapshot")
+    (_, format_version, flags, schema,
+     checksum, length, version_length) = _HEADER.unpack_from(snapshot)
+    if format_version != FORMAT_VERSION:
+        raise SnapshotError("Unsupported snapshot format version: {}".format(
+            format_version))
+    offset = _HEADER.size + version_length
+    version = snapshot[_HEADER.size:offset].decode('utf8')
+    if schema != SCHEMA:
+        raise SnapshotError("Snapshot from incompatible Beancount version {}".format(
+            version))
+    payload = memoryview(snapshot)[offset:]
+    if len(payload) != length or zlib.crc32(payload) != checksum:
+        raise SnapshotError("Snapshot is corrupted (invalid checksum)")
+    if flags & FLAG_COMPRESSED:
+        payload = memoryview(zlib.decompress(payload))
+    return version, payload
+
+
+def _read_sections(payload):
+    """Split the payload of a snapshot in its sections.
+
+    Args:
+      payload: A memoryview of the uncompressed payload of a snapshot.
+    Returns:
+      A list of memoryview objects, one per section.
+    """
+    sections = []
+    offset = 0
+    while offset < len(payload):
+        length, = _SECTION.unpack_from(payload, offset)
+        offset += _SECTION.size
+        sections.append(payload[offset:offset + length])
+        offset += length
+    return sections
+
+
+def _pack_ints(ints):
+    """Pack a sequence of integers in the narrowest array type which holds them.
+
+    Args:
+      ints: An array of 64-bit integers.
+    Returns:
+      A bytes object, the size of the packed integers as a single byte,
+      followed by the integers in little-endian order.
+    """
+    low, high = (min(ints), max(ints)) if ints else (0, 0)
+    for typecode in _INT_TYPECODES:
+        packed = array.array(typecode)
+        bits = 8 * packed.itemsize - 1
+        if -2**bits <= low and high < 2**bits:
+            break
+    packed.fromlist(ints.tolist())
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return bytes([packed.itemsize]) + packed.tobytes()
+
+
+def _read_ints(section):
+    """Convert a section of packed integers to a list.
+
+    Args:
+      section: A bytes-like object, as produced by _pack_ints().
+    Returns:
+      A list of integers.
+    """
+    try:
+        typecode = _INT_TYPECODES_BY_SIZE[section[0]]
+    except (IndexError, KeyError):
+        raise SnapshotError("Invalid integer array")
+    packed = array.array(typecode)
+    packed.frombytes(section[1:])
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tolist()
+
+
+def _decode_values(vals, strings, pickles):
+    """Reconstruct the table of values.
+
+    Args:
+      vals: A list of integers, the encoded values.
+      strings: A list of strings, the strings table.
+      pickles: A list of objects, the values that were pickled.
+    Returns:
+      A list of values, indexed by reference.
+    """
+    # pylint: disable=too-many-branches,too-many-statements
+    values = []
+    append = values.append
+    getv = values.__getitem__
+    fromordinal = datetime.date.fromordinal
+    new = tuple.__new__
+    context = _DECIMAL_CONTEXT
+    i, num_ints = 0, len(vals)
+    while i < num_ints:
+        tag = vals[i]
+        if tag == T_DICT:
+            size = 2 * vals[i + 1]
+            start = i + 2
+            i = start + size
+            append(dict(zip(map(getv, vals[start:i:2]),
+                            map(getv, vals[start + 1:i:2]))))
+        elif tag == T_STR:
+            append(strings[vals[i + 1]])
+            i += 2
+        elif tag == T_INT:
+            append(vals[i + 1])
+            i += 2
+        elif tag == T_DECIMAL:
+            append(Decimal(vals[i + 1]).scaleb(vals[i + 2], context))
+            i += 3
+        elif tag == T_AMOUNT:
+            append(new(Amount, (getv(vals[i + 1]), getv(vals[i + 2]))))
+            i += 3
+        elif tag == T_DATE:
+            append(fromordinal(vals[i + 1]))
+            i += 2
+        elif tag == T_NONE:
+            append(None)
+            i += 1
+        elif tag == T_EMPTY_SET:
+            append(data.EMPTY_SET)
+            i += 1
+        elif tag in (T_FROZENSET, T_SET, T_LIST):
+            start = i + 2
+            i = start + vals[i + 1]
+            elements = map(getv, vals[start:i])
+            append(frozenset(elements) if tag == T_FROZENSET else
+                   set(elements) if tag == T_SET else
+                   list(elements))
+        elif tag == T_COST:
+            append(new(Cost, map(getv, vals[i + 1:i + 5])))
+            i += 5
+        elif tag == T_COSTSPEC:
+            append(new(CostSpec, map(getv, vals[i + 1:i + 7])))
+            i += 7
+        elif tag == T_BOOL:
+            append(bool(vals[i + 1]))
+            i += 2
+        elif tag == T_DECIMAL_STR:
+            append(Decimal(strings[vals[i + 1]]))
+            i += 2
+        elif tag == T_BOOKING:
+            append(data.Booking[strings[vals[i + 1]]])
+            i += 2
+        elif tag == T_MISSING:
+            append(MISSING)
+            i += 1
+        elif tag == T_PICKLE:
+            append(pickles[vals[i + 1]])
+            i += 2
+        else:
+            raise SnapshotError("Invalid value tag: {}".format(tag))
+    return values
+
+
+def _decode_entries(records, values):
+    """Reconstruct the list of directives.
+
+    Args:
+      records: A list of integers, the encoded directives.
+      values: A list of values, indexed by reference.
+    Returns:
+      A list of directives.
+    """
+    # pylint: disable=too-many-locals
+    entries = []
+    append = entries.append
+    getv = values.__getitem__
+    new = tuple.__new__
+    Posting = data.Posting
+    Transaction = data.Transaction
+    Metadata = data.Metadata
+    txn_code = _TRANSACTION_CODE
+    num_fields = [len(cls._fields) - 1 for cls in _DIRECTIVES]
+
+    def decode_meta(i):
+        """Decode inline metadata at position i, returning it and the next position."""
+        filename = records[i]
+        if filename >= 0:
+            num_keys = records[i + 2]
+            if not num_keys:
+                return Metadata(getv(filename), records[i + 1]), i + 3
+            meta = {'filename': getv(filename), 'lineno': records[i + 1]}
+            i += 3
+            end = i + 2 * num_keys
+            meta.update(zip(map(getv, records[i:end:2]),
+                            map(getv, records[i + 1:end:2])))
+            return meta, end
+        elif filename == M_NONE:
+            return None, i + 1
+        else:
+            return getv(records[i + 1]), i + 2
+
+    i, num_ints = 0, len(records)
+    while i < num_ints:
+        code = records[i]
+        if code == R_PICKLE:
+            append(getv(records[i + 1]))
+            i += 2
+            continue
+        meta, i = decode_meta(i + 1)
+        if code == txn_code:
+            fields = [meta]
+            fields.extend(map(getv, records[i:i + 6]))
+            num_postings = records[i + 6]
+            i += 7
+            postings = []
+            for _ in range(num_postings):
+                pfields = list(map(getv, records[i:i + 5]))
+                # Note: This inlines the common case of decode_meta(), for speed.
+                filename = records[i + 5]
+                if filename >= 0 and not records[i + 7]:
+                    pfields.append(Metadata(getv(filename), records[i + 6]))
+                    i += 8
+                else:
+                    pmeta, i = decode_meta(i + 5)
+                    pfields.append(pmeta)
+                postings.append(new(Posting, pfields))
+            fields.append(postings)
+            append(new(Transaction, fields))
+        elif 0 <= code < len(_DIRECTIVES):
+            end = i + num_fields[code]
+            fields = [meta]
+            fields.extend(map(getv, records[i:end]))
+            append(new(_DIRECTIVES[code], fields))
+            i = end
+        else:
+            raise SnapshotError("Invalid record code: {}".format(code))
+    return entries
+
+
+def loads(snapshot):
+    """Reconstruct a list of directives from a snapshot.
+
+    Args:
+      snapshot: A bytes object, the contents of a snapshot.
+    Returns:
+      A triple of (entries, errors, options_map), as they were provided to
+      dumps().
+    Raises:
+      SnapshotError: If the snapshot is invalid or incompatible.
+    """
+    _, payload = read_header(snapshot)
+    sections = _read_sections(payload)
+    if len(sections) != 5:
+        raise SnapshotError("Invalid number of sections: {}".format(len(sections)))
+    (lengths_section, strings_section, values_section,
+     records_section, pickles_section) = sections
+
+    # Note: The cyclic garbage collector gets triggered over and over while
+    # creating a large number of container objects, and this ends up dominating
+    # the time to reconstruct them. None of the objects created here can be
+    # part of a cycle, so we disable it temporarily.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # Split the strings table.
+        string_data = str(strings_section, 'utf8', 'surrogatepass')
+        strings = []
+        position = 0
+        for length in _read_ints(lengths_section):
+            strings.append(string_data[position:position + length])
+            position += length + 1
+
+        pickles, errors, options_map = pickle.loads(pickles_section)
+        values = _decode_values(_read_ints(values_section), strings, pickles)
+        entries = _decode_entries(_read_ints(records_section), values)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return entries, errors, options_map
+
+
+def load(file):
+    """Read a snapshot of a list of directives from a file.
+
+    Args:
+      file: A file object opened for reading in binary mode.
+    Returns:
+      A triple of (entries, errors, options_map).
+    Raises:
+      SnapshotError: If the snapshot is invalid or incompatible.
+    """
+    return loads(file.read())
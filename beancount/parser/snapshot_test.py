@@ -0,0 +1,167 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import datetime
+import io
+import pickle
+import unittest
+from unittest import mock
+
+from beancount.core.number import D
+from beancount.core.number import MISSING
+from beancount.core import amount
+from beancount.core import data
+from beancount.parser import parser
+from beancount.parser import snapshot
+from beancount import loader
+
+
+class TestSnapshot(unittest.TestCase):
+
+    def assertRoundTrip(self, entries, errors=None, options_map=None, compress=True):
+        blob = snapshot.dumps(entries, errors, options_map, compress)
+        self.assertIsInstance(blob, bytes)
+        new_entries, new_errors, new_options_map = snapshot.loads(blob)
+        self.assertEqual(entries, new_entries)
+        # Note: The representation also checks the exponents of the numbers,
+        # the types of the values and the order of the metadata keys.
+        self.assertEqual(list(map(repr, entries)), list(map(repr, new_entries)))
+        self.assertEqual(list(map(type, entries)), list(map(type, new_entries)))
+        self.assertEqual(errors, new_errors)
+        return new_entries, new_errors, new_options_map
+
+    @loader.load_doc(expect_errors=True)
+    def test_booked(self, entries, errors, options_map):
+        """
+        option "operating_currency" "USD"
+
+        2014-01-01 open Assets:Investments   HOOL,USD  "FIFO"
+        2014-01-01 open Assets:Cash          USD
+        2014-01-01 open Income:Gains
+        2014-01-01 commodity HOOL
+          name: "Hooli Inc."
+
+        2014-02-01 * "Buy" #trip ^invoice-1
+          shares: 10
+          when: 2014-02-02
+          Assets:Investments   10 HOOL {500.00 USD, "lot1"}
+            cost-basis: 5000.00 USD
+          Assets:Cash
+
+        2014-03-01 * "Payee" "Sell"
+          Assets:Investments   -4 HOOL {} @ 510.00 USD
+          Assets:Cash          2040.00 USD
+          Income:Gains
+
+        2014-03-02 price HOOL  510.00 USD
+        2014-03-03 balance Assets:Cash  -2960.00 ~ 0.01 USD
+        2014-03-04 note Assets:Cash "Some note"
+        2014-03-05 event "location" "Paris, France"
+        2014-03-06 query "cash" "SELECT account, sum(position)"
+        2014-03-07 document Assets:Cash "/path/to/statement.pdf"
+        2014-03-08 custom "budget" Assets:Cash "monthly" 100.00 USD TRUE
+        2014-12-31 close Assets:Cash
+        """
+        new_entries, _, new_options_map = self.assertRoundTrip(
+            entries, errors, options_map)
+        self.assertEqual(options_map['operating_currency'],
+                         new_options_map['operating_currency'])
+
+        # Immutable values are shared; mutable ones aren't.
+        txn1, txn2 = [entry for entry in new_entries
+                      if isinstance(entry, data.Transaction)]
+        self.assertIs(new_entries[0].date, new_entries[1].date)
+        self.assertIsNot(txn1.meta, txn2.meta)
+        self.assertIsNot(txn1.postings[1].meta, txn2.postings[1].meta)
+        self.assertIs(data.EMPTY_SET, txn2.tags)
+
+    def test_incomplete(self):
+        entries, errors, options_map = parser.parse_string("""
+          2014-01-01 open Assets:Investments
+          2014-01-01 open Assets:Cash
+
+          2014-02-01 *
+            Assets:Investments   10 HOOL {# 2.00 USD, 2014-01-15}
+            Assets:Cash
+
+          2014-02-02 *
+            Assets:Investments   -4 HOOL {}
+            Assets:Cash
+        """, dedent=True)
+        self.assertFalse(errors)
+        new_entries, _, _ = self.assertRoundTrip(entries, errors, options_map)
+        self.assertIs(MISSING, new_entries[2].postings[1].units)
+
+    def test_errors(self):
+        entries, errors, options_map = loader.load_string("""
+          2014-01-01 open Assets:Cash
+          2014-02-01 balance Assets:Cash  100 USD
+        """, dedent=True)
+        self.assertTrue(errors)
+        self.assertRoundTrip(entries, errors, options_map, compress=False)
+
+    def test_values(self):
+        meta = data.new_metadata('<snapshot>', 1, {
+            'boolean': True,
+            'integer': 1,
+            'large': 2**70,
+            'number': D('1.00'),
+            'negative-zero': D('-0.00'),
+            'infinite': D('Infinity'),
+            'exponent': D('1E+5'),
+            'precise': D('1234567890123456789012345.0123456789'),
+            'amount': amount.Amount(D('-3.1415'), 'EUR'),
+            'datetime': datetime.datetime(2017, 1, 1, 12, 30),
+            'tuple': (1, 2),
+            'list': [1, 'a', None],
+            'dict': {'a': [D('1')]},
+            'set': {'x', 'y'},
+            'nul': 'a\0b',
+            'unicode': 'Café ☃',
+        })
+        entries = [data.Note(meta, datetime.date(2017, 1, 1), 'Assets:Cash', 'Note'),
+                   data.Note(None, datetime.date(2017, 1, 2), 'Assets:Cash', 'Note')]
+        new_entries, _, _ = self.assertRoundTrip(entries)
+        self.assertEqual('-0.00', str(new_entries[0].meta['negative-zero']))
+        self.assertEqual('1E+5', str(new_entries[0].meta['exponent']))
+        self.assertIs(True, new_entries[0].meta['boolean'])
+
+    def test_unknown_directive_type(self):
+        entries = [data.Posting('Assets:Cash', None, None, None, None, None)]
+        self.assertRoundTrip(entries)
+
+    def test_empty(self):
+        self.assertEqual(([], None, None), snapshot.loads(snapshot.dumps([])))
+
+    def test_load_dump(self):
+        entries, _, _ = parser.parse_string("2014-01-01 open Assets:Cash")
+        file = io.BytesIO()
+        snapshot.dump(entries, [], {}, file)
+        file.seek(0)
+        self.assertEqual((entries, [], {}), snapshot.load(file))
+
+    def test_invalid(self):
+        entries, _, _ = parser.parse_string("2014-01-01 open Assets:Cash")
+        blob = snapshot.dumps(entries)
+
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.loads(pickle.dumps(entries))
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.loads(blob[:-1])
+        with self.assertRaises(snapshot.SnapshotError):
+            snapshot.loads(blob[:-1] + bytes([blob[-1] ^ 0xff]))
+
+        with mock.patch.object(snapshot, 'FORMAT_VERSION', snapshot.FORMAT_VERSION + 1):
+            with self.assertRaises(snapshot.SnapshotError):
+                snapshot.loads(blob)
+        with mock.patch.object(snapshot, 'SCHEMA', b'\0' * 16):
+            with self.assertRaises(snapshot.SnapshotError):
+                snapshot.loads(blob)
+
+    def test_read_header(self):
+        version, _ = snapshot.read_header(snapshot.dumps([]))
+        self.assertIsInstance(version, str)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,319 @@
+"""A cache of the results of queries.
+
+Results are keyed by the parsed statement and a fingerprint of the ledger they
+were computed on, its 'input_hash' option, so that running the same query again
+on an unchanged ledger returns the previous result instead of executing it. The
+statement is keyed by its parsed form, which is insensitive to the whitespace and
+case of the keywords of the original query string.
+
+The cache holds a bounded amount of memory, evicting the least recently used
+results first. It can also be saved to and loaded from a file, if requested, so
+that a new shell on an unchanged ledger can reuse the results of a previous one.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import collections
+import datetime
+import logging
+import pickle
+import sys
+import threading
+
+import beancount
+from beancount.core.number import Decimal
+from beancount.query import query_compile
+from beancount.query import query_env
+
+
+# The default maximum size of the cached results, in bytes.
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# Filename pattern for the persisted cache, next to the ledger file, if enabled.
+QUERY_CACHE_FILENAME = '.{filename}.querycache'
+
+# Functions whose value is not determined by the ledger.
+VOLATILE_FUNCTIONS = (query_env.Today,)
+
+
+def is_cacheable(c_query):
+    """Return true if the result of a compiled query only depends on the ledger.
+
+    Args:
+      c_query: An instance of a compiled query, e.g. an EvalQuery.
+    Returns:
+      A boolean.
+    """
+    c_exprs = []
+    if isinstance(c_query, query_compile.EvalQuery):
+        c_exprs.extend(c_target.c_expr for c_target in c_query.c_targets)
+        c_exprs.append(c_query.c_where)
+    c_from = getattr(c_query, 'c_from', None)
+    if c_from is not None:
+        c_exprs.append(c_from.c_expr)
+    return not any(_uses_volatile_function(c_expr)
+                   for c_expr in c_exprs
+                   if c_expr is not None)
+
+
+def _uses_volatile_function(c_expr):
+    """Return true if an expression calls one of the VOLATILE_FUNCTIONS.
+
+    Args:
+      c_expr: A compiled expression tree (an EvalNode node).
+    Returns:
+      A boolean.
+    """
+    return (isinstance(c_expr, VOLATILE_FUNCTIONS) or
+            any(_uses_volatile_function(c_node) for c_node in c_expr.childnodes()))
+
+
+def get_fingerprint(options_map):
+    """Get the fingerprint of a loaded ledger.
+
+    Args:
+      options_map: A dict of options, as produced by the loader.
+    Returns:
+      A string, the 'input_hash' of the files of the ledger, or None if it
+      wasn't loaded from files, e.g. from a string, in which case its contents
+      can't be identified.
+    """
+    if not options_map.get('include'):
+        return None
+    return options_map.get('input_hash') or None
+
+
+# The number of rows of a result sampled to estimate its size.
+SAMPLED_ROWS = 256
+
+# Types of values which don't refer to other objects.
+ATOMIC_TYPES = (type(None), bool, int, float, str, bytes, Decimal, datetime.date)
+
+
+def estimate_size(result):
+    """Estimate the memory used by the result of a query.
+
+    This counts the rows and all the objects their values refer to, such as the
+    positions of an inventory and their amounts, through containers and the
+    attributes of objects. Objects shared between values, e.g. the names of
+    accounts, are counted once. The rows of large results are sampled, which
+    slightly overestimates the objects shared between them.
+
+    Args:
+      result: A pair of result types and result rows.
+    Returns:
+      An integer, a number of bytes.
+    """
+    _, result_rows = result
+    num_rows = len(result_rows)
+    if num_rows <= SAMPLED_ROWS:
+        return sys.getsizeof(result_rows) + _estimate_values_size(result_rows)
+    sample = [result_rows[index * num_rows // SAMPLED_ROWS]
+              for index in range(SAMPLED_ROWS)]
+    return (sys.getsizeof(result_rows) +
+            _estimate_values_size(sample) * num_rows // SAMPLED_ROWS)
+
+
+def _estimate_values_size(values):
+    """Estimate the memory used by a list of values and the objects they refer to.
+
+    Args:
+      values: A list of objects.
+    Returns:
+      An integer, a number of bytes.
+    """
+    size = 0
+    seen = set()
+    stack = list(values)
+    slots_map = {}
+    getsizeof = sys.getsizeof
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        size += getsizeof(value)
+        value_type = type(value)
+        try:
+            slots = slots_map[value_type]
+        except KeyError:
+            slots = slots_map[value_type] = _get_slots(value_type)
+        if slots is None:
+            continue
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (tuple, list, set, frozenset)):
+            stack.extend(value)
+        for name in slots:
+            attribute = getattr(value, name, None)
+            if attribute is not None:
+                stack.append(attribute)
+    return size
+
+
+def _get_slots(value_type):
+    """Get the names of the attributes of the values of a type to size.
+
+    Args:
+      value_type: A type.
+    Returns:
+      A list of attribute names, or None if the values of the type don't refer
+      to other objects.
+    """
+    if issubclass(value_type, ATOMIC_TYPES + (type,)):
+        return None
+    names = []
+    for cls in value_type.__mro__:
+        slots = cls.__dict__.get('__slots__', ())
+        names.extend((slots,) if isinstance(slots, str) else slots)
+        if '__dict__' in cls.__dict__ and '__dict__' not in names:
+            names.append('__dict__')
+    return names
+
+
+class ResultCache:
+    """A least-recently-used cache of query results, bounded by their size.
+
+    Attributes:
+      max_size: An integer, the maximum total estimated size of the cached
+        results, in bytes.
+      fingerprint: A string, the fingerprint of the ledger of the cached results,
+        or None if it isn't known.
+      results: An OrderedDict of key to (size, result) pairs, from the least to
+        the most recently used.
+      size: An integer, the total estimated size of the cached results.
+      lock: A lock serializing the accesses to the results, so that the cache
+        can be shared between threads.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self.fingerprint = None
+        self.results = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.results)
+
+    def clear(self):
+        """Remove all the cached results."""
+        with self.lock:
+            self.results.clear()
+            self.size = 0
+
+    def set_fingerprint(self, fingerprint):
+        """Set the fingerprint of the ledger, invalidating results from other ones.
+
+        Args:
+          fingerprint: A string, e.g. the 'input_hash' of the options of the
+            ledger, or None if there is no way to identify the ledger, in which
+            case nothing gets cached.
+        """
+        if not fingerprint or fingerprint != self.fingerprint:
+            self.clear()
+        self.fingerprint = fingerprint or None
+
+    def get(self, statement):
+        """Get the cached result of a statement.
+
+        Args:
+          statement: A parsed statement, as produced by the query parser.
+        Returns:
+          The result of the statement, or None if it isn't cached.
+        """
+        if self.fingerprint is None:
+            return None
+        key = repr(statement)
+        with self.lock:
+            try:
+                _, result = self.results[key]
+            except KeyError:
+                return None
+            self.results.move_to_end(key)
+            return result
+
+    def put(self, statement, result):
+        """Store the result of a statement.
+
+        Args:
+          statement: A parsed statement, as produced by the query parser.
+          result: A pair of result types and result rows.
+        """
+        if self.fingerprint is None:
+            return
+        key = repr(statement)
+        size = estimate_size(result)
+        if size > self.max_size:
+            return
+        with self.lock:
+            self._add(key, size, result)
+
+    def _add(self, key, size, result):
+        """Store a result and evict the least recently used ones to make room.
+
+        Args:
+          key: A string, the key of the result.
+          size: An integer, the estimated size of the result.
+          result: A pair of result types and result rows.
+        """
+        previous = self.results.pop(key, None)
+        if previous is not None:
+            self.size -= previous[0]
+        self.results[key] = (size, result)
+        self.size += size
+        while self.size > self.max_size:
+            _, (evicted_size, _) = self.results.popitem(last=False)
+            self.size -= evicted_size
+
+    def save(self, filename):
+        """Save the cached results to a file.
+
+        Args:
+          filename: A string, the name of the file to write.
+        """
+        if self.fingerprint is None:
+            return
+        # Result rows are of a namedtuple type created for each query, which
+        # can't be pickled; store them as tuples.
+        with self.lock:
+            results = [(key, (size, (result_types, [tuple(row) for row in result_rows])))
+                       for key, (size, (result_types, result_rows))
+                       in self.results.items()]
+        state = (beancount.__version__, self.fingerprint, results)
+        try:
+            with open(filename, 'wb') as file:
+                pickle.dump(state, file, pickle.HIGHEST_PROTOCOL)
+        except Exception as exc:
+            logging.warning("Could not write to query cache file %s: %s",
+                            filename, exc)
+
+    def load(self, filename):
+        """Load the results saved to a file, if they are for the current ledger.
+
+        Args:
+          filename: A string, the name of the file to read.
+        """
+        if self.fingerprint is None:
+            return
+        try:
+            with open(filename, 'rb') as file:
+                version, fingerprint, results = pickle.load(file)
+        except FileNotFoundError:
+            return
+        except Exception as exc:
+            # Unpickling an old or corrupted file manifests as a variety of
+            # exception types.
+            logging.warning("Could not read query cache file %s: %s", filename, exc)
+            return
+        if version != beancount.__version__ or fingerprint != self.fingerprint:
+            return
+        with self.lock:
+            for key, (size, (result_types, result_rows)) in results:
+                if key in self.results:
+                    continue
+                # pylint: disable=invalid-name
+                ResultRow = collections.namedtuple('ResultRow',
+                                                   [name for name, _ in result_types])
+                result = (result_types, [ResultRow._make(row) for row in result_rows])
+                self._add(key, size, result)
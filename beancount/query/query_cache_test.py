@@ -0,0 +1,148 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import collections
+import os
+import sys
+import tempfile
+from unittest import mock
+from os import path
+
+from beancount.core import inventory
+from beancount.query import query_cache
+from beancount.query import query_compile as qc
+from beancount.query import query_execute_test
+
+
+def make_result(num_rows):
+    # pylint: disable=invalid-name
+    ResultRow = collections.namedtuple('ResultRow', ['account', 'number'])
+    return ([('account', str), ('number', int)],
+            [ResultRow('Assets:Bank', number) for number in range(num_rows)])
+
+
+class TestResultCache(query_execute_test.QueryBase):
+
+    def test_get_put(self):
+        cache = query_cache.ResultCache()
+        cache.set_fingerprint('abc')
+        statement = self.parse("SELECT account;")
+        self.assertIsNone(cache.get(statement))
+        result = make_result(3)
+        cache.put(statement, result)
+        self.assertIs(result, cache.get(statement))
+
+        # The key is insensitive to the spelling of the query.
+        self.assertIs(result, cache.get(self.parse("select   account ;")))
+        self.assertIsNone(cache.get(self.parse("SELECT account, number;")))
+
+    def test_fingerprint(self):
+        cache = query_cache.ResultCache()
+        statement = self.parse("SELECT account;")
+
+        # Nothing is cached without a fingerprint.
+        cache.put(statement, make_result(1))
+        self.assertEqual(0, len(cache))
+
+        cache.set_fingerprint('abc')
+        cache.put(statement, make_result(1))
+        cache.set_fingerprint('abc')
+        self.assertIsNotNone(cache.get(statement))
+        cache.set_fingerprint('def')
+        self.assertIsNone(cache.get(statement))
+        self.assertEqual(0, len(cache))
+
+    def test_eviction(self):
+        result = make_result(10)
+        size = query_cache.estimate_size(result)
+        cache = query_cache.ResultCache(size * 2)
+        cache.set_fingerprint('abc')
+        statements = [self.parse("SELECT account LIMIT {};".format(limit))
+                      for limit in range(3)]
+        cache.put(statements[0], result)
+        cache.put(statements[1], result)
+        self.assertIsNotNone(cache.get(statements[0]))
+        cache.put(statements[2], result)
+        self.assertEqual(2, len(cache))
+        self.assertEqual(size * 2, cache.size)
+        self.assertIsNotNone(cache.get(statements[0]))
+        self.assertIsNone(cache.get(statements[1]))
+
+        # A result larger than the cache isn't stored.
+        cache.put(statements[1], make_result(100))
+        self.assertIsNone(cache.get(statements[1]))
+        self.assertEqual(2, len(cache))
+
+    def test_estimate_size(self):
+        # pylint: disable=invalid-name
+        ResultRow = collections.namedtuple('ResultRow', ['account', 'balance'])
+        balance = inventory.from_string('10 HOOL {500.00 USD}, 100.00 USD')
+        rows = [ResultRow('Assets:Bank', balance)]
+        size = query_cache.estimate_size(([], rows))
+        shallow_size = (sys.getsizeof(rows) + sys.getsizeof(rows[0]) +
+                        sys.getsizeof(rows[0].account) + sys.getsizeof(balance))
+        self.assertGreater(size, shallow_size + sum(sys.getsizeof(position.units)
+                                                    for position in balance))
+
+        # Values shared between rows are counted once.
+        self.assertEqual(size - sys.getsizeof(rows) + sys.getsizeof(rows + rows),
+                         query_cache.estimate_size(([], rows + rows)))
+
+    def test_estimate_size_sampled(self):
+        result = make_result(1000)
+        size = query_cache.estimate_size(result)
+        with mock.patch.object(query_cache, 'SAMPLED_ROWS', 100):
+            sampled_size = query_cache.estimate_size(result)
+        self.assertLess(abs(sampled_size - size), size * 0.05)
+
+    def test_save_load(self):
+        statement = self.parse("SELECT account, number;")
+        cache = query_cache.ResultCache()
+        cache.set_fingerprint('abc')
+        cache.put(statement, make_result(3))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = path.join(tmpdir, 'query.cache')
+            cache.save(filename)
+            self.assertTrue(path.exists(filename))
+
+            new_cache = query_cache.ResultCache()
+            new_cache.set_fingerprint('abc')
+            new_cache.load(filename)
+            self.assertEqual(make_result(3), new_cache.get(statement))
+            rrows = new_cache.get(statement)[1]
+            self.assertEqual(2, rrows[2].number)
+
+            # Results for another ledger are ignored.
+            other_cache = query_cache.ResultCache()
+            other_cache.set_fingerprint('def')
+            other_cache.load(filename)
+            self.assertEqual(0, len(other_cache))
+
+            # A corrupted file is ignored.
+            with open(filename, 'wb') as file:
+                file.write(b'garbage')
+            new_cache = query_cache.ResultCache()
+            new_cache.set_fingerprint('abc')
+            with self.assertLogs(level='WARNING'):
+                new_cache.load(filename)
+            self.assertEqual(0, len(new_cache))
+            os.remove(filename)
+
+    def test_is_cacheable(self):
+        for query_string, expected in [
+                ("SELECT account, sum(position) GROUP BY account;", True),
+                ("SELECT date WHERE date < today();", False),
+                ("SELECT account FROM year = year(today());", False),
+                ("SELECT today(), account;", False),
+                ("JOURNAL 'Assets';", True)]:
+            c_query = qc.compile(self.parse(query_string),
+                                 self.xcontext_targets,
+                                 self.xcontext_postings,
+                                 self.xcontext_entries)
+            self.assertEqual(expected, query_cache.is_cacheable(c_query), query_string)
+
+    def test_get_fingerprint(self):
+        self.assertEqual('abc', query_cache.get_fingerprint(
+            {'include': ['/tmp/ledger.beancount'], 'input_hash': 'abc'}))
+        self.assertIsNone(query_cache.get_fingerprint(
+            {'include': [], 'input_hash': 'abc'}))
@@ -0,0 +1,496 @@
+"""Columnar execution of SELECT queries.
+
+This is an alternative to the row-by-row interpreter in query_execute. Instead
+of evaluating the compiled expression tree once for each posting, the postings
+are first materialized into a table whose columns are computed once, and the
+WHERE clause, the GROUP BY keys and the aggregates are then evaluated a column
+at a time over the selected rows.
+
+Columns of strings, dates and integers (account, currency, payee, date, year,
+etc.) are dictionary-encoded: they are stored as a list of the distinct values
+and a list of codes into it, one per row. An expression which only depends on
+such columns, e.g. "account ~ 'Expenses'" or "year(date) = 2017", is evaluated
+only once for each distinct combination of the values of its columns instead of
+once per posting. Expressions which depend on other columns, such as 'number' or
+'position', are evaluated for each selected row. Queries which cannot be run
+this way, i.e. those using the running 'balance' column or aggregators that
+this module does not know about, are handed over to the row engine.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import collections
+import copy
+import datetime
+import itertools
+
+from beancount.core import inventory
+from beancount.query import query_compile
+from beancount.query import query_env
+from beancount.query import query_execute
+
+
+# The names of the execution engines.
+ENGINE_ROW = 'row'
+ENGINE_COLUMNAR = 'columnar'
+
+# The data types of the columns which get dictionary-encoded.
+ENCODED_TYPES = (str, datetime.date, int, bool)
+
+# Functions which access the current row by themselves, as opposed to through
+# columns. Expressions using them cannot be evaluated on distinct values.
+ROW_FUNCTIONS = (query_env.Meta, query_env.EntryMeta, query_env.AnyMeta)
+
+
+# A vector of dictionary-encoded values.
+#
+# Attributes:
+#   codes: A list of integers, one per row, indexes into 'values'.
+#   values: A list of the distinct values.
+Encoded = collections.namedtuple('Encoded', 'codes values')
+
+
+def decode(vector):
+    """Convert a vector to a plain list of values.
+
+    Args:
+      vector: An Encoded instance or a list of values.
+    Returns:
+      A list of values, one per row.
+    """
+    if isinstance(vector, Encoded):
+        return list(map(vector.values.__getitem__, vector.codes))
+    return vector
+
+
+def take(vector, rows):
+    """Select some rows of a vector.
+
+    Args:
+      vector: An Encoded instance or a list of values.
+      rows: A list of row indexes, or None to select all of them.
+    Returns:
+      A vector of the same kind as the input, for the selected rows.
+    """
+    if rows is None:
+        return vector
+    if isinstance(vector, Encoded):
+        return Encoded(list(map(vector.codes.__getitem__, rows)), vector.values)
+    return list(map(vector.__getitem__, rows))
+
+
+def encode(keys):
+    """Dictionary-encode an iterable of hashable keys.
+
+    Args:
+      keys: An iterable of hashable values.
+    Returns:
+      A pair of a list of codes, one per key, and a list of the positions of the
+      first occurrence of each distinct key.
+    """
+    index = {}
+    codes = []
+    firsts = []
+    for position, key in enumerate(keys):
+        code = index.get(key, None)
+        if code is None:
+            code = index[key] = len(firsts)
+            firsts.append(position)
+        codes.append(code)
+    return codes, firsts
+
+
+class PostingsTable:
+    """A table of the postings of a list of entries, materialized in columns.
+
+    Columns are computed on demand by evaluating a column accessor for all the
+    rows, and are cached for the lifetime of the table.
+
+    Attributes:
+      context: A RowContext instance, used for evaluating the columns.
+      entries: A list of the parent Transaction of each row.
+      postings: A list of the Posting of each row.
+      columns: A dict of column accessor type to its vector.
+    """
+    def __init__(self, postings, context):
+        """Create a table of postings.
+
+        Args:
+          postings: An iterable of (Transaction, Posting) pairs, the rows.
+          context: A RowContext instance.
+        """
+        self.context = context
+        self.entries = []
+        self.postings = []
+        for entry, posting in postings:
+            self.entries.append(entry)
+            self.postings.append(posting)
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.postings)
+
+    def evaluate_rows(self, c_expr, rows):
+        """Evaluate an expression for each of some rows.
+
+        Args:
+          c_expr: An EvalNode instance.
+          rows: An iterable of row indexes, or None for all the rows.
+        Returns:
+          A list of values, one per row.
+        """
+        if rows is None:
+            rows = range(len(self.postings))
+        context = copy.copy(self.context)
+        entries = self.entries
+        postings = self.postings
+        values = []
+        for row in rows:
+            context.entry = entries[row]
+            context.posting = postings[row]
+            values.append(c_expr(context))
+        return values
+
+    def column(self, c_column):
+        """Get the vector of a column, for all the rows.
+
+        Args:
+          c_column: An EvalColumn instance.
+        Returns:
+          An Encoded instance if the column's data type is one of ENCODED_TYPES,
+          or a list of values otherwise.
+        """
+        key = type(c_column)
+        try:
+            return self.columns[key]
+        except KeyError:
+            values = self.evaluate_rows(c_column, None)
+            if c_column.dtype in ENCODED_TYPES:
+                codes, firsts = encode(values)
+                vector = Encoded(codes, [values[first] for first in firsts])
+            else:
+                vector = values
+            self.columns[key] = vector
+            return vector
+
+
+def get_leaf_columns(c_expr):
+    """Find the column accessors of an expression.
+
+    Args:
+      c_expr: An EvalNode instance.
+    Returns:
+      A list of EvalColumn instances, or None if the expression accesses the
+      current row other than through columns.
+    """
+    if isinstance(c_expr, query_compile.EvalColumn):
+        return [c_expr]
+    if isinstance(c_expr, ROW_FUNCTIONS):
+        return None
+    columns = []
+    for c_node in c_expr.childnodes():
+        node_columns = get_leaf_columns(c_node)
+        if node_columns is None:
+            return None
+        columns.extend(node_columns)
+    return columns
+
+
+def evaluate(c_expr, table, rows):
+    """Evaluate an expression on some rows of a table.
+
+    Args:
+      c_expr: A non-aggregate EvalNode instance.
+      table: A PostingsTable instance.
+      rows: A list of row indexes, or None for all the rows of the table.
+    Returns:
+      An Encoded instance or a list of values, one per row.
+    """
+    num_rows = len(table) if rows is None else len(rows)
+
+    if isinstance(c_expr, query_compile.EvalConstant):
+        return Encoded([0] * num_rows, [c_expr.value])
+
+    if isinstance(c_expr, query_compile.EvalColumn):
+        return take(table.column(c_expr), rows)
+
+    # Combine logical operators element-wise, so that each of their sides gets
+    # evaluated on its own columns.
+    if isinstance(c_expr, (query_compile.EvalAnd, query_compile.EvalOr)):
+        return list(map(c_expr.operator,
+                        decode(evaluate(c_expr.left, table, rows)),
+                        decode(evaluate(c_expr.right, table, rows))))
+    if isinstance(c_expr, query_compile.EvalNot):
+        return list(map(c_expr.operator,
+                        decode(evaluate(c_expr.operand, table, rows))))
+
+    # Evaluate expressions over encoded columns once for each distinct
+    # combination of values, on the first row it occurs in.
+    columns = get_leaf_columns(c_expr)
+    if columns is not None:
+        vectors = [take(table.column(c_column), rows) for c_column in columns]
+        if all(isinstance(vector, Encoded) for vector in vectors):
+            if len(vectors) == 1:
+                keys = vectors[0].codes
+            elif vectors:
+                keys = zip(*[vector.codes for vector in vectors])
+            else:
+                keys = itertools.repeat(None, num_rows)
+            codes, firsts = encode(keys)
+            first_rows = firsts if rows is None else [rows[first] for first in firsts]
+            return Encoded(codes, table.evaluate_rows(c_expr, first_rows))
+
+    return table.evaluate_rows(c_expr, rows)
+
+
+def get_value_codes(vector):
+    """Get a list of keys identifying the values of a vector.
+
+    The distinct values of an encoded vector computed from an expression may
+    not be unique, e.g. the year of distinct dates. This returns codes which are
+    equal if and only if the values are.
+
+    Args:
+      vector: An Encoded instance or a list of hashable values.
+    Returns:
+      A list of hashable keys, one per row.
+    """
+    if isinstance(vector, Encoded):
+        value_codes, _ = encode(vector.values)
+        return list(map(value_codes.__getitem__, vector.codes))
+    return vector
+
+
+def select_rows(c_where, table):
+    """Compute the indexes of the rows matching a WHERE clause.
+
+    Args:
+      c_where: An EvalNode instance, or None.
+      table: A PostingsTable instance.
+    Returns:
+      A list of row indexes, or None if all the rows are selected.
+    """
+    if c_where is None:
+        return None
+    vector = evaluate(c_where, table, None)
+    if isinstance(vector, Encoded):
+        matches = list(map(bool, vector.values))
+        selectors = map(matches.__getitem__, vector.codes)
+    else:
+        selectors = vector
+    return list(itertools.compress(range(len(table)), selectors))
+
+
+# Functions that compute an aggregate for all the groups at once. Each accepts
+# the aggregator node, the list of the group numbers of the rows, the list of
+# the values of the aggregator's operand, and the number of groups, and returns
+# a list of the aggregated values, one per group. The semantics of each of those
+# replicates that of the update() method of the corresponding aggregator.
+
+def aggregate_count(unused_c_expr, groups, unused_values, num_groups):
+    counts = [0] * num_groups
+    for group, count in collections.Counter(groups).items():
+        counts[group] = count
+    return counts
+
+def aggregate_sum(c_expr, groups, values, num_groups):
+    totals = [c_expr.dtype()] * num_groups
+    for group, value in zip(groups, values):
+        if value is not None:
+            totals[group] += value
+    return totals
+
+def _aggregate_inventory(method_name):
+    def aggregate(unused_c_expr, groups, values, num_groups):
+        accumulators = [inventory.new_accumulator() for _ in range(num_groups)]
+        methods = [getattr(accumulator, method_name) for accumulator in accumulators]
+        for group, value in zip(groups, values):
+            methods[group](value)
+        return [accumulator.to_inventory() for accumulator in accumulators]
+    return aggregate
+
+def aggregate_first(unused_c_expr, groups, values, num_groups):
+    firsts = [None] * num_groups
+    for group, value in zip(groups, values):
+        if firsts[group] is None:
+            firsts[group] = value
+    return firsts
+
+def aggregate_last(unused_c_expr, groups, values, num_groups):
+    lasts = [None] * num_groups
+    for group, value in zip(groups, values):
+        lasts[group] = value
+    return lasts
+
+def aggregate_min(c_expr, groups, values, num_groups):
+    minimums = [c_expr.dtype()] * num_groups
+    for group, value in zip(groups, values):
+        if value < minimums[group]:
+            minimums[group] = value
+    return minimums
+
+def aggregate_max(c_expr, groups, values, num_groups):
+    maximums = [c_expr.dtype()] * num_groups
+    for group, value in zip(groups, values):
+        if value > maximums[group]:
+            maximums[group] = value
+    return maximums
+
+AGGREGATORS = {
+    query_env.Count: aggregate_count,
+    query_env.Sum: aggregate_sum,
+    query_env.SumAmount: _aggregate_inventory('add_amount'),
+    query_env.SumPosition: _aggregate_inventory('add_position'),
+    query_env.SumInventory: _aggregate_inventory('add_inventory'),
+    query_env.First: aggregate_first,
+    query_env.Last: aggregate_last,
+    query_env.Min: aggregate_min,
+    query_env.Max: aggregate_max,
+    }
+
+
+def get_unsupported_reason(query):
+    """Check if a query can be executed by the columnar engine.
+
+    Args:
+      query: An instance of a query_compile.Query
+    Returns:
+      None if the query is supported, or a string describing why it isn't.
+    """
+    c_exprs = [c_target.c_expr for c_target in query.c_targets]
+    if query.c_where is not None:
+        c_exprs.append(query.c_where)
+    for c_expr in c_exprs:
+        if query_execute.uses_balance_column(c_expr):
+            return "the balance column requires sequential evaluation"
+        _, aggregates = query_compile.get_columns_and_aggregates(c_expr)
+        for c_aggregate in aggregates:
+            if type(c_aggregate) not in AGGREGATORS:
+                return "aggregator {} has no columnar implementation".format(
+                    type(c_aggregate).__name__)
+    return None
+
+
+def get_engine(query, engine):
+    """Return the engine which will execute a query.
+
+    Args:
+      query: An instance of a query_compile.Query
+      engine: A string, the requested engine, ENGINE_ROW or ENGINE_COLUMNAR.
+    Returns:
+      A pair of the name of the engine which will run the query, and a string
+      explaining why the requested engine isn't used, or None.
+    """
+    if engine == ENGINE_COLUMNAR:
+        reason = get_unsupported_reason(query)
+        if reason is None:
+            return ENGINE_COLUMNAR, None
+        return ENGINE_ROW, reason
+    return ENGINE_ROW, None
+
+
+def execute_query(query, entries, options_map, index=None):
+    """Execute a compiled select statement in columns.
+
+    This falls back on the row engine for queries which are not supported. See
+    query_execute.execute_query() for the details of the arguments and return
+    values.
+
+    Args:
+      query: An instance of a query_compile.Query
+      entries: A list of directives.
+      options_map: A parser's option_map.
+      index: An optional query_index.EntriesIndex of 'entries'.
+    Returns:
+      A pair of:
+        result_types: A list of (name, data-type) item pairs.
+        result_rows: A list of ResultRow tuples of length and types described by
+          'result_types'.
+    """
+    if get_unsupported_reason(query) is not None:
+        return query_execute.execute_query(query, entries, options_map, index)
+
+    # pylint: disable=invalid-name
+    result_types, ResultRow = query_execute.create_result_types(query)
+    result_indexes = [index
+                      for index, c_target in enumerate(query.c_targets)
+                      if c_target.name]
+    order_indexes = query.order_indexes
+    c_target_exprs = [c_target.c_expr for c_target in query.c_targets]
+
+    context = query_execute.create_row_context(entries, options_map)
+
+    # Filter the entries using the FROM clause.
+    filt_entries = (query_execute.filter_entries(query.c_from, entries, options_map,
+                                                 context, index)
+                    if query.c_from is not None else
+                    entries)
+
+    table = PostingsTable(query_execute.get_postings(query, entries, filt_entries, index),
+                          context)
+    rows = select_rows(query.c_where, table)
+    num_rows = len(table) if rows is None else len(rows)
+
+    schwartz_rows = []
+    if query.group_indexes is None:
+        # This is a non-aggregated query; compute each column of the results.
+        columns = [decode(evaluate(c_expr, table, rows)) for c_expr in c_target_exprs]
+        for values in zip(*columns):
+            result = ResultRow._make(values[index] for index in result_indexes)
+            sortkey = query_execute.row_sortkey(order_indexes, values, c_target_exprs)
+            schwartz_rows.append((sortkey, result))
+        # Account for queries without any target column.
+        if not columns:
+            schwartz_rows.extend([(None, ResultRow())] * num_rows)
+    else:
+        # This is an aggregated query. Number the groups from the values of the
+        # non-aggregate expressions.
+        group_indexes = set(query.group_indexes)
+        key_vectors = {index: evaluate(c_target_exprs[index], table, rows)
+                       for index in sorted(group_indexes)}
+        key_columns = [get_value_codes(vector) for vector in key_vectors.values()]
+        keys = (zip(*key_columns)
+                if key_columns else
+                itertools.repeat((), num_rows))
+        groups, firsts = encode(keys)
+
+        # Compute the aggregates for all the groups.
+        allocator = query_execute.Allocator()
+        aggregate_values = []
+        for index, c_expr in enumerate(c_target_exprs):
+            if index in group_indexes:
+                continue
+            _, aggregate_exprs = query_compile.get_columns_and_aggregates(c_expr)
+            for c_aggregate in aggregate_exprs:
+                c_aggregate.allocate(allocator)
+                operands = ([]
+                            if isinstance(c_aggregate, query_env.Count) else
+                            decode(evaluate(c_aggregate.operands[0], table, rows)))
+                aggregate_values.append(
+                    (c_aggregate.handle,
+                     AGGREGATORS[type(c_aggregate)](c_aggregate, groups, operands,
+                                                    len(firsts))))
+
+        # Produce the schwartzian rows.
+        for group, first in enumerate(firsts):
+            store = allocator.create_store()
+            for handle, values in aggregate_values:
+                store[handle] = values[group]
+            context.store = store
+
+            values = []
+            for index, c_expr in enumerate(c_target_exprs):
+                if index in group_indexes:
+                    vector = key_vectors[index]
+                    value = (vector.values[vector.codes[first]]
+                             if isinstance(vector, Encoded) else
+                             vector[first])
+                else:
+                    value = c_expr(context)
+                values.append(value)
+
+            result = ResultRow._make(values[index] for index in result_indexes)
+            sortkey = query_execute.row_sortkey(order_indexes, values, c_target_exprs)
+            schwartz_rows.append((sortkey, result))
+
+    return query_execute.finalize_results(query, result_types, schwartz_rows)
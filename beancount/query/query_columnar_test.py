@@ -0,0 +1,175 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import datetime
+import unittest
+from os import path
+
+from beancount.core.number import D
+from beancount.core.number import Decimal
+from beancount.query import query_columnar as qcol
+from beancount.query import query_compile as qc
+from beancount.query import query_execute as qx
+from beancount.query import query_execute_test
+from beancount.utils import test_utils
+from beancount import loader
+
+
+class ColumnarQueryBase(query_execute_test.QueryBase):
+
+    execute_query = staticmethod(qcol.execute_query)
+
+
+class TestColumnarNonAggregatedQuery(ColumnarQueryBase,
+                                     query_execute_test.TestExecuteNonAggregatedQuery):
+    pass
+
+
+class TestColumnarAggregatedQuery(ColumnarQueryBase,
+                                  query_execute_test.TestExecuteAggregatedQuery):
+    pass
+
+
+class TestColumnarOptions(ColumnarQueryBase,
+                          query_execute_test.TestExecuteOptions):
+    pass
+
+
+class TestColumnarArithmeticFunctions(ColumnarQueryBase,
+                                      query_execute_test.TestArithmeticFunctions):
+    pass
+
+
+class TestColumnarFlatten(ColumnarQueryBase,
+                          query_execute_test.TestExecuteFlatten):
+    pass
+
+
+class TestEncoding(unittest.TestCase):
+
+    def test_encode(self):
+        self.assertEqual(([0, 1, 0, 2, 1], [0, 1, 3]),
+                         qcol.encode(['a', 'b', 'a', 'c', 'b']))
+        self.assertEqual(([], []), qcol.encode([]))
+
+    def test_decode_take(self):
+        vector = qcol.Encoded([0, 1, 0, 2], ['a', 'b', 'c'])
+        self.assertEqual(['a', 'b', 'a', 'c'], qcol.decode(vector))
+        self.assertEqual(qcol.Encoded([2, 0], ['a', 'b', 'c']), qcol.take(vector, [3, 2]))
+        self.assertIs(vector, qcol.take(vector, None))
+        self.assertEqual(['c', 'a'], qcol.take(['a', 'b', 'c'], [2, 0]))
+
+    def test_get_value_codes(self):
+        # The same value computed from distinct codes.
+        vector = qcol.Encoded([0, 1, 2, 1], [2014, 2014, 2015])
+        self.assertEqual([0, 0, 1, 0], qcol.get_value_codes(vector))
+        self.assertEqual([3, 4], qcol.get_value_codes([3, 4]))
+
+
+class TestColumnarEngine(query_execute_test.QueryBase):
+
+    INPUT = """
+
+      2010-01-01 open Assets:Bank:Checking
+      2010-01-01 open Expenses:Restaurant
+      2010-01-01 open Expenses:Movie
+
+      2014-02-23 * "Bla"
+        Assets:Bank:Checking       -100.00 USD
+        Expenses:Restaurant         100.00 USD
+
+      2014-05-10 * "Bla"
+        Assets:Bank:Checking        -20.00 USD
+        Expenses:Movie               20.00 USD
+
+      2015-01-04 * "Bla"
+        Assets:Bank:Checking        -50.00 USD
+        Expenses:Restaurant          50.00 USD
+
+    """
+
+    def test_table(self):
+        entries, _, options_map = loader.load_string(self.INPUT)
+        context = qx.create_row_context(entries, options_map)
+        table = qcol.PostingsTable(qx.get_postings(self.compile('SELECT *;'),
+                                                   entries, entries),
+                                   context)
+        self.assertEqual(6, len(table))
+
+        query = self.compile("SELECT account, number;")
+        c_account, c_number = [c_target.c_expr for c_target in query.c_targets]
+        accounts = table.column(c_account)
+        self.assertIsInstance(accounts, qcol.Encoded)
+        self.assertEqual(['Assets:Bank:Checking', 'Expenses:Restaurant',
+                          'Expenses:Movie'], accounts.values)
+        self.assertEqual([0, 1, 0, 2, 0, 1], accounts.codes)
+        self.assertIs(accounts, table.column(c_account))
+        self.assertEqual([D('-100.00'), D('100.00'), D('-20.00'), D('20.00'),
+                          D('-50.00'), D('50.00')], table.column(c_number))
+
+    def test_group_by_derived_key(self):
+        # The year is computed from distinct dates, but must group as one key.
+        self.check_query(
+            self.INPUT,
+            """
+            SELECT year(date) as y, sum(number) as total
+            WHERE account ~ 'Expenses' GROUP BY y;
+            """,
+            [('y', int), ('total', Decimal)],
+            [(2014, D('120.00')),
+             (2015, D('50.00'))])
+
+    def test_where_mixed(self):
+        self.check_query(
+            self.INPUT,
+            """
+            SELECT date, account WHERE account ~ 'Expenses' AND number > 30;
+            """,
+            [('date', datetime.date), ('account', str)],
+            [(datetime.date(2014, 2, 23), 'Expenses:Restaurant'),
+             (datetime.date(2015, 1, 4), 'Expenses:Restaurant')])
+
+    def test_get_engine(self):
+        query = self.compile("SELECT account, sum(position) GROUP BY account;")
+        self.assertEqual((qcol.ENGINE_COLUMNAR, None),
+                         qcol.get_engine(query, qcol.ENGINE_COLUMNAR))
+        self.assertEqual((qcol.ENGINE_ROW, None),
+                         qcol.get_engine(query, qcol.ENGINE_ROW))
+
+        query = self.compile("SELECT account, balance;")
+        engine, reason = qcol.get_engine(query, qcol.ENGINE_COLUMNAR)
+        self.assertEqual(qcol.ENGINE_ROW, engine)
+        self.assertRegex(reason, 'balance')
+
+
+class TestColumnarExample(query_execute_test.QueryBase):
+
+    QUERIES = [
+        "SELECT account, sum(position) GROUP BY account ORDER BY account;",
+        "SELECT year, month, account, sum(cost(position)) "
+        "WHERE account ~ 'Expenses' GROUP BY 1, 2, 3 ORDER BY 1, 2, 3;",
+        "SELECT date, narration, account, position "
+        "WHERE currency = 'VBMPX' AND number > 1 ORDER BY date;",
+        "SELECT root(account, 2) as r, count(position), first(date), last(date), "
+        "min(number), max(number) GROUP BY r ORDER BY r;",
+        "SELECT DISTINCT payee ORDER BY payee LIMIT 10;",
+        "SELECT units(sum(position)) FROM year = 2015 WHERE account ~ 'Income';",
+        "SELECT date, description, position, weight "
+        "WHERE account = 'Assets:US:BofA:Checking';",
+        "BALANCES AT cost;",
+    ]
+
+    def test_example(self):
+        filename = path.join(test_utils.find_repository_root(__file__),
+                             'examples', 'example.beancount')
+        entries, errors, options_map = loader.load_file(filename)
+        self.assertFalse(errors)
+        for query_string in self.QUERIES:
+            query = qc.compile(self.parse(query_string),
+                               self.xcontext_targets,
+                               self.xcontext_postings,
+                               self.xcontext_entries)
+            self.assertIsNone(qcol.get_unsupported_reason(query))
+            self.assertEqual(qx.execute_query(query, entries, options_map),
+                             qcol.execute_query(query, entries, options_map),
+                             query_string)
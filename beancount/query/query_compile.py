@@ -244,6 +244,11 @@ class EvalFunction(EvalNode):
     # Type constraints on the input arguments.
     __intypes__ = []
 
+    # The name of the attribute of an index that can be looked up to find the
+    # rows for which this function is true, given a constant regular expression
+    # argument. See get_index_restrictions().
+    index_key = None
+
     def __init__(self, operands, dtype):
         super().__init__(dtype)
         assert isinstance(operands, list), "Internal error: invalid type for operands."
@@ -270,6 +275,10 @@ class EvalFunction(EvalNode):
 class EvalColumn(EvalNode):
     "Base class for all column accessors."
 
+    # The name of the attribute of an index that can be looked up to find the
+    # rows with a particular value of this column. See get_index_restrictions().
+    index_key = None
+
 class EvalAggregator(EvalFunction):
     "Base class for all aggregator evaluator types."
 
@@ -793,6 +802,81 @@ def compile_from(from_clause, environ):
     return c_from
 
 
+# A restriction of the rows of a query which can be looked up in an index,
+# instead of evaluating a predicate on every row.
+#
+# Attributes:
+#   key: A string, the name of the indexed attribute, e.g. 'account' or 'date'.
+#     See the index_key attribute of EvalColumn and EvalFunction.
+#   operator: A string, the comparison of the attribute to the value. This is
+#     one of '=', '<', '<=', '>', '>=', '~' for a regular expression match and
+#     'in' for the value being a member of the attribute.
+#   value: The constant to compare the attribute to.
+IndexRestriction = collections.namedtuple('IndexRestriction', 'key operator value')
+
+# Comparison nodes and their operators, for columns on the left and on the right
+# of the comparison.
+_INDEX_OPERATORS = {
+    EvalEqual: ('=', '='),
+    EvalLess: ('<', '>'),
+    EvalLessEq: ('<=', '>='),
+    EvalGreater: ('>', '<'),
+    EvalGreaterEq: ('>=', '<='),
+    }
+
+def get_index_restrictions(c_expr):
+    """Plan the lookups in an index which find the rows matching a predicate.
+
+    Only the terms of the top-level conjunction of the predicate are considered,
+    and only those which compare an indexed column to a constant. The rows found
+    from the restrictions are a superset of those matching the predicate, which
+    still needs to be evaluated on them.
+
+    Args:
+      c_expr: A compiled expression tree (an EvalNode node), or None.
+    Returns:
+      A list of IndexRestriction instances. The rows matching the predicate
+      are in the intersection of the rows matching each of the restrictions.
+    """
+    if c_expr is None:
+        return []
+    if isinstance(c_expr, EvalAnd):
+        return (get_index_restrictions(c_expr.left) +
+                get_index_restrictions(c_expr.right))
+
+    restriction = None
+    if type(c_expr) in _INDEX_OPERATORS:
+        left_operator, right_operator = _INDEX_OPERATORS[type(c_expr)]
+        if (isinstance(c_expr.left, EvalColumn) and c_expr.left.index_key and
+            isinstance(c_expr.right, EvalConstant)):
+            restriction = IndexRestriction(c_expr.left.index_key, left_operator,
+                                           c_expr.right.value)
+        elif (isinstance(c_expr.right, EvalColumn) and c_expr.right.index_key and
+              isinstance(c_expr.left, EvalConstant)):
+            restriction = IndexRestriction(c_expr.right.index_key, right_operator,
+                                           c_expr.left.value)
+
+    elif isinstance(c_expr, EvalMatch):
+        if (isinstance(c_expr.left, EvalColumn) and c_expr.left.index_key and
+            isinstance(c_expr.right, EvalConstant)):
+            restriction = IndexRestriction(c_expr.left.index_key, '~',
+                                           c_expr.right.value)
+
+    elif isinstance(c_expr, EvalContains):
+        if (isinstance(c_expr.right, EvalColumn) and c_expr.right.index_key and
+            isinstance(c_expr.left, EvalConstant)):
+            restriction = IndexRestriction(c_expr.right.index_key, 'in',
+                                           c_expr.left.value)
+
+    elif isinstance(c_expr, EvalFunction) and c_expr.index_key:
+        if (len(c_expr.operands) == 1 and
+            isinstance(c_expr.operands[0], EvalConstant)):
+            restriction = IndexRestriction(c_expr.index_key, '~',
+                                           c_expr.operands[0].value)
+
+    return [restriction] if restriction is not None else []
+
+
 # A compiled query, ready for execution.
 #
 # Attributes:
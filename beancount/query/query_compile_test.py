@@ -753,3 +753,32 @@ class TestCompilePrint(CompileSelectBase):
             qc.EvalFrom(qc.EvalEqual(qe.YearEntryColumn(), qc.EvalConstant(2014)),
                         None, None, None)
             ), "PRINT FROM year = 2014;")
+
+
+class TestIndexRestrictions(CompileSelectBase):
+
+    def test_where(self):
+        query = self.compile("""
+          SELECT * WHERE account ~ 'Assets:' AND 2014-01-01 <= date
+                     AND (year = 2014 OR year = 2015) AND currency = 'USD'
+                     AND 'trip' IN tags AND number > 0;
+        """)
+        self.assertEqual([qc.IndexRestriction('account', '~', 'Assets:'),
+                          qc.IndexRestriction('date', '>=', datetime.date(2014, 1, 1)),
+                          qc.IndexRestriction('currency', '=', 'USD'),
+                          qc.IndexRestriction('tags', 'in', 'trip')],
+                         qc.get_index_restrictions(query.c_where))
+
+    def test_from(self):
+        query = self.compile("""
+          SELECT * FROM has_account('Broker') AND year < 2015 AND payee = 'Bank';
+        """)
+        self.assertEqual([qc.IndexRestriction('account', '~', 'Broker'),
+                          qc.IndexRestriction('year', '<', 2015),
+                          qc.IndexRestriction('payee', '=', 'Bank')],
+                         qc.get_index_restrictions(query.c_from.c_expr))
+
+    def test_none(self):
+        self.assertEqual([], qc.get_index_restrictions(None))
+        query = self.compile("SELECT * WHERE NOT account ~ 'Assets:';")
+        self.assertEqual([], qc.get_index_restrictions(query.c_where))
@@ -877,7 +877,10 @@ class SumBase(query_compile.EvalAggregator):
         self.handle = allocator.allocate()
 
     def initialize(self, store):
-        store[self.handle] = inventory.Inventory()
+        store[self.handle] = inventory.new_accumulator()
+
+    def finalize(self, store):
+        store[self.handle] = store[self.handle].to_inventory()
 
     def __call__(self, context):
         return context.store[self.handle]
@@ -1053,6 +1056,7 @@ class DateEntryColumn(query_compile.EvalColumn):
     "The date of the directive."
     __equivalent__ = 'entry.date'
     __intypes__ = [data.Transaction]
+    index_key = 'date'
 
     def __init__(self):
         super().__init__(datetime.date)
@@ -1064,6 +1068,7 @@ class YearEntryColumn(query_compile.EvalColumn):
     "The year of the date of the directive."
     __equivalent__ = 'entry.date.year'
     __intypes__ = [data.Transaction]
+    index_key = 'year'
 
     def __init__(self):
         super().__init__(int)
@@ -1110,6 +1115,7 @@ class PayeeEntryColumn(query_compile.EvalColumn):
     "The payee of the transaction."
     __equivalent__ = 'entry.payee'
     __intypes__ = [data.Transaction]
+    index_key = 'payee'
 
     def __init__(self):
         super().__init__(str)
@@ -1155,6 +1161,7 @@ class TagsEntryColumn(query_compile.EvalColumn):
     "The set of tags of the transaction."
     __equivalent__ = 'entry.tags'
     __intypes__ = [data.Transaction]
+    index_key = 'tags'
 
     def __init__(self):
         super().__init__(set)
@@ -1168,6 +1175,7 @@ class LinksEntryColumn(query_compile.EvalColumn):
     "The set of links of the transaction."
     __equivalent__ = 'entry.links'
     __intypes__ = [data.Transaction]
+    index_key = 'links'
 
     def __init__(self):
         super().__init__(set)
@@ -1183,6 +1191,7 @@ class MatchAccount(query_compile.EvalFunction):
     """A predicate, true if the transaction has at least one posting matching
     the regular expression argument."""
     __intypes__ = [str]
+    index_key = 'account'
 
     def __init__(self, operands):
         super().__init__(operands, bool)
@@ -1293,6 +1302,7 @@ class DateColumn(query_compile.EvalColumn):
     "The date of the parent transaction for this posting."
     __equivalent__ = 'entry.date'
     __intypes__ = [data.Posting]
+    index_key = 'date'
 
     def __init__(self):
         super().__init__(datetime.date)
@@ -1304,6 +1314,7 @@ class YearColumn(query_compile.EvalColumn):
     "The year of the date of the parent transaction for this posting."
     __equivalent__ = 'entry.date.year'
     __intypes__ = [data.Posting]
+    index_key = 'year'
 
     def __init__(self):
         super().__init__(int)
@@ -1348,6 +1359,7 @@ class PayeeColumn(query_compile.EvalColumn):
     "The payee of the parent transaction for this posting."
     __equivalent__ = 'entry.payee'
     __intypes__ = [data.Posting]
+    index_key = 'payee'
 
     def __init__(self):
         super().__init__(str)
@@ -1385,6 +1397,7 @@ class TagsColumn(query_compile.EvalColumn):
     "The set of tags of the parent transaction for this posting."
     __equivalent__ = 'entry.tags'
     __intypes__ = [data.Posting]
+    index_key = 'tags'
 
     def __init__(self):
         super().__init__(set)
@@ -1396,6 +1409,7 @@ class LinksColumn(query_compile.EvalColumn):
     "The set of links of the parent transaction for this posting."
     __equivalent__ = 'entry.links'
     __intypes__ = [data.Posting]
+    index_key = 'links'
 
     def __init__(self):
         super().__init__(set)
@@ -1418,6 +1432,7 @@ class AccountColumn(query_compile.EvalColumn):
     "The account of the posting."
     __equivalent__ = 'posting.account'
     __intypes__ = [data.Posting]
+    index_key = 'account'
 
     def __init__(self):
         super().__init__(str)
@@ -1453,6 +1468,7 @@ class CurrencyColumn(query_compile.EvalColumn):
     "The currency of the posting."
     __equivalent__ = 'posting.units.currency'
     __intypes__ = [data.Posting]
+    index_key = 'currency'
 
     def __init__(self):
         super().__init__(str)
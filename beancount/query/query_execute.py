@@ -6,6 +6,7 @@ __license__ = "GNU GPLv2"
 import copy
 import collections
 import datetime
+import heapq
 import itertools
 import operator
 
@@ -24,7 +25,7 @@ from beancount.core import prices
 from beancount.utils import misc_utils
 
 
-def filter_entries(c_from, entries, options_map, context):
+def filter_entries(c_from, entries, options_map, context, index=None):
     """Filter the entries by the given compiled FROM clause.
 
     Args:
@@ -32,6 +33,8 @@ def filter_entries(c_from, entries, options_map, context):
       entries: A list of directives.
       options_map: A parser's option_map.
       context: A prototype of RowContext to use for evaluation.
+      index: An optional query_index.EntriesIndex of 'entries', used to look up
+        the candidate entries for the FROM expression.
     Returns:
       A list of filtered entries.
     """
@@ -47,27 +50,33 @@ def filter_entries(c_from, entries, options_map, context):
     if c_from.open is not None:
         assert isinstance(c_from.open, datetime.date)
         open_date = c_from.open
-        entries, index = summarize.open_opt(entries, open_date, options_map)
+        entries, _ = summarize.open_opt(entries, open_date, options_map)
 
     # Process the CLOSE clause.
     if c_from.close is not None:
         if isinstance(c_from.close, datetime.date):
             close_date = c_from.close
-            entries, index = summarize.close_opt(entries, close_date, options_map)
+            entries, _ = summarize.close_opt(entries, close_date, options_map)
         elif c_from.close is True:
-            entries, index = summarize.close_opt(entries, None, options_map)
+            entries, _ = summarize.close_opt(entries, None, options_map)
 
     # Process the CLEAR clause.
     if c_from.clear is not None:
-        entries, index = summarize.clear_opt(entries, None, options_map)
+        entries, _ = summarize.clear_opt(entries, None, options_map)
 
     # Filter the entries with the FROM clause's expression.
     c_expr = c_from.c_expr
     if c_expr is not None:
         # A simple function receives a context; how come close_date() is
         # accepted in the context of a FROM clause? It shouldn't be.
+        candidates = entries
+        if index is not None and index.entries is entries:
+            offsets = index.select_entries(query_compile.get_index_restrictions(c_expr))
+            if offsets is not None:
+                candidates = [entries[offset] for offset in offsets]
+
         new_entries = []
-        for entry in entries:
+        for entry in candidates:
             context.entry = entry
             if c_expr(context):
                 new_entries.append(entry)
@@ -208,30 +217,83 @@ def create_row_context(entries, options_map):
     return context
 
 
-def execute_query(query, entries, options_map):
+def get_postings(query, entries, filt_entries, index=None):
+    """Get the postings to evaluate the WHERE clause of a query on.
+
+    Args:
+      query: An instance of a query_compile.Query
+      entries: A list of directives.
+      filt_entries: The list of directives selected by the FROM clause of the query.
+      index: An optional query_index.EntriesIndex of 'entries', used to look up
+        the candidate postings for the WHERE clause.
+    Returns:
+      An iterable of (Transaction, Posting) pairs, in the order of the entries.
+    """
+    # Look up the candidate postings, unless the FROM clause created entries
+    # that are not in the index.
+    c_from = query.c_from
+    if (index is not None and index.entries is entries and
+        (c_from is None or
+         (c_from.open is None and c_from.close is None and c_from.clear is None))):
+        ordinals = index.select_postings(
+            query_compile.get_index_restrictions(query.c_where))
+        if ordinals is not None:
+            postings = map(index.get_posting, ordinals)
+            if filt_entries is not entries:
+                filt_ids = set(map(id, filt_entries))
+                postings = (entry_posting
+                            for entry_posting in postings
+                            if id(entry_posting[0]) in filt_ids)
+            return postings
+
+    return ((entry, posting)
+            for entry in misc_utils.filter_type(filt_entries, data.Transaction)
+            for posting in entry.postings)
+
+
+def execute_query(query, entries, options_map, index=None):
     """Given a compiled select statement, execute the query.
 
     Args:
       query: An instance of a query_compile.Query
       entries: A list of directives.
       options_map: A parser's option_map.
+      index: An optional query_index.EntriesIndex of 'entries', used to only
+        visit the candidate entries and postings of the FROM and WHERE clauses.
+        This can be shared between queries on the same entries.
     Returns:
       A pair of:
         result_types: A list of (name, data-type) item pairs.
         result_rows: A list of ResultRow tuples of length and types described by
           'result_types'.
     """
-    # Figure out the result types that describe what we return.
-    result_types = [(target.name, target.c_expr.dtype)
-                    for target in query.c_targets
-                    if target.name is not None]
+    result_types, result_rows = execute_query_iter(query, entries, options_map, index)
+    return result_types, list(result_rows)
 
-    # Create a class for each final result.
+
+def execute_query_iter(query, entries, options_map, index=None):
+    """Given a compiled select statement, execute the query lazily.
+
+    The rows of non-aggregated queries are computed as they are consumed, so
+    that a query with a LIMIT and without an ORDER BY clause stops visiting
+    the postings once it has produced enough rows. Note that the rows are
+    computed from shared state; consume them before running another query.
+
+    Args:
+      query: An instance of a query_compile.Query
+      entries: A list of directives.
+      options_map: A parser's option_map.
+      index: An optional query_index.EntriesIndex of 'entries', used to only
+        visit the candidate entries and postings of the FROM and WHERE clauses.
+        This can be shared between queries on the same entries.
+    Returns:
+      A pair of:
+        result_types: A list of (name, data-type) item pairs.
+        result_rows: An iterator of ResultRow tuples of length and types
+          described by 'result_types'.
+    """
     # pylint: disable=invalid-name
-    ResultRow = collections.namedtuple('ResultRow',
-                                       [target.name
-                                        for target in query.c_targets
-                                        if target.name is not None])
+    result_types, ResultRow = create_result_types(query)
 
     # Pre-compute lists of the expressions to evaluate.
     group_indexes = (set(query.group_indexes)
@@ -253,9 +315,10 @@ def execute_query(query, entries, options_map):
     context = create_row_context(entries, options_map)
 
     # Filter the entries using the FROM clause.
-    filt_entries = (filter_entries(query.c_from, entries, options_map, context)
+    filt_entries = (filter_entries(query.c_from, entries, options_map, context, index)
                     if query.c_from is not None else
                     entries)
+    postings = get_postings(query, entries, filt_entries, index)
 
     # Dispatch between the non-aggregated queries and aggregated queries.
     c_where = query.c_where
@@ -267,15 +330,14 @@ def execute_query(query, entries, options_map):
     if query.group_indexes is None:
         # This is a non-aggregated query.
 
-        # Iterate over all the postings once and produce schwartzian rows.
-        for entry in misc_utils.filter_type(filt_entries, data.Transaction):
-            context.entry = entry
-            for posting in entry.postings:
-                context.posting = posting
+        # Iterate over all the postings once and produce schwartzian rows, as
+        # they are consumed.
+        def iterate_rows():
+            for context.entry, context.posting in postings:
                 if c_where is None or c_where(context):
                     # Compute the balance.
                     if uses_balance:
-                        context.balance.add_position(posting)
+                        context.balance.add_position(context.posting)
 
                     # Evaluate all the values.
                     values = [c_expr(context) for c_expr in c_target_exprs]
@@ -284,7 +346,8 @@ def execute_query(query, entries, options_map):
                     result = ResultRow._make(values[index]
                                              for index in result_indexes)
                     sortkey = row_sortkey(order_indexes, values, c_target_exprs)
-                    schwartz_rows.append((sortkey, result))
+                    yield (sortkey, result)
+        schwartz_rows = iterate_rows()
     else:
         # This is an aggregated query.
 
@@ -309,32 +372,29 @@ def execute_query(query, entries, options_map):
 
         # Iterate over all the postings to evaluate the aggregates.
         agg_store = {}
-        for entry in misc_utils.filter_type(filt_entries, data.Transaction):
-            context.entry = entry
-            for posting in entry.postings:
-                context.posting = posting
-                if c_where is None or c_where(context):
-                    # Compute the balance.
-                    if uses_balance:
-                        context.balance.add_position(posting)
-
-                    # Compute the non-aggregate expressions.
-                    row_key = tuple(c_expr(context)
-                                    for c_expr in c_nonaggregate_exprs)
-
-                    # Get an appropriate store for the unique key of this row.
-                    try:
-                        store = agg_store[row_key]
-                    except KeyError:
-                        # This is a row; create a new store.
-                        store = allocator.create_store()
-                        for c_expr in c_aggregate_exprs:
-                            c_expr.initialize(store)
-                        agg_store[row_key] = store
-
-                    # Update the aggregate expressions.
+        for context.entry, context.posting in postings:
+            if c_where is None or c_where(context):
+                # Compute the balance.
+                if uses_balance:
+                    context.balance.add_position(context.posting)
+
+                # Compute the non-aggregate expressions.
+                row_key = tuple(c_expr(context)
+                                for c_expr in c_nonaggregate_exprs)
+
+                # Get an appropriate store for the unique key of this row.
+                try:
+                    store = agg_store[row_key]
+                except KeyError:
+                    # This is a row; create a new store.
+                    store = allocator.create_store()
                     for c_expr in c_aggregate_exprs:
-                        c_expr.update(store, context)
+                        c_expr.initialize(store)
+                    agg_store[row_key] = store
+
+                # Update the aggregate expressions.
+                for c_expr in c_aggregate_exprs:
+                    c_expr.update(store, context)
 
         # Iterate over all the aggregations to produce the schwartzian rows.
         for key, store in agg_store.items():
@@ -359,27 +419,97 @@ def execute_query(query, entries, options_map):
             sortkey = row_sortkey(order_indexes, values, c_target_exprs)
             schwartz_rows.append((sortkey, result))
 
-    # Order results if requested.
-    if order_indexes is not None:
-        schwartz_rows.sort(key=operator.itemgetter(0),
-                           reverse=(query.ordering == 'DESC'))
+    return iterate_results(query, result_types, schwartz_rows)
+
+
+def create_result_types(query):
+    """Compute the result types and the row type of a compiled query.
+
+    Args:
+      query: An instance of a query_compile.Query
+    Returns:
+      A pair of:
+        result_types: A list of (name, data-type) item pairs.
+        ResultRow: A namedtuple class for the result rows.
+    """
+    # Figure out the result types that describe what we return.
+    result_types = [(target.name, target.c_expr.dtype)
+                    for target in query.c_targets
+                    if target.name is not None]
+
+    # Create a class for each final result.
+    # pylint: disable=invalid-name
+    ResultRow = collections.namedtuple('ResultRow',
+                                       [target.name
+                                        for target in query.c_targets
+                                        if target.name is not None])
+    return result_types, ResultRow
+
+
+def finalize_results(query, result_types, schwartz_rows):
+    """Order, uniquify, limit and flatten the rows computed for a query.
+
+    Args:
+      query: An instance of a query_compile.Query
+      result_types: A list of (name, data-type) item pairs.
+      schwartz_rows: An iterable of (sortkey, ResultRow) pairs.
+    Returns:
+      A pair of:
+        result_types: A list of (name, data-type) item pairs.
+        result_rows: A list of ResultRow tuples of length and types described by
+          'result_types'.
+    """
+    result_types, result_rows = iterate_results(query, result_types, schwartz_rows)
+    return result_types, list(result_rows)
+
+
+def iterate_results(query, result_types, schwartz_rows):
+    """Order, uniquify, limit and flatten the rows computed for a query, lazily.
+
+    Rows are pulled from 'schwartz_rows' only as far as the result needs them:
+    without ordering, a limited query stops consuming them once it has enough
+    rows, and an ordered and limited query only keeps the top rows in a bounded
+    heap instead of sorting all of them.
+
+    Args:
+      query: An instance of a query_compile.Query
+      result_types: A list of (name, data-type) item pairs.
+      schwartz_rows: An iterable of (sortkey, ResultRow) pairs.
+    Returns:
+      A pair of:
+        result_types: A list of (name, data-type) item pairs.
+        result_rows: An iterator of ResultRow tuples of length and types
+          described by 'result_types'.
+    """
+    sortkey = operator.itemgetter(0)
+    reverse = query.ordering == 'DESC'
+    limit = query.limit
+
+    # Order results if requested. Note that both of the heap functions are
+    # stable, like sorting.
+    if query.order_indexes is not None:
+        if limit is not None and not query.distinct:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            schwartz_rows = select(limit, schwartz_rows, key=sortkey)
+        else:
+            schwartz_rows = sorted(schwartz_rows, key=sortkey, reverse=reverse)
 
     # Extract final results, in sorted order at this point.
-    result_rows = [x[1] for x in schwartz_rows]
+    result_rows = map(operator.itemgetter(1), schwartz_rows)
 
     # Apply distinct.
     if query.distinct:
-        result_rows = list(misc_utils.uniquify(result_rows))
+        result_rows = misc_utils.uniquify(result_rows)
 
     # Apply limit.
-    if query.limit is not None:
-        result_rows = result_rows[:query.limit]
+    if limit is not None:
+        result_rows = itertools.islice(result_rows, limit)
 
     # Flatten inventories if requested.
     if query.flatten:
-        result_types, result_rows = flatten_results(result_types, result_rows)
+        result_types, result_rows = iterate_flattened(result_types, result_rows)
 
-    return (result_types, result_rows)
+    return (result_types, iter(result_rows))
 
 
 def flatten_results(result_types, result_rows):
@@ -399,28 +529,46 @@ def flatten_results(result_types, result_rows):
           'result_types'. All inventories from the input should have been converted
           to Position types.
     """
+    output_types, output_rows = iterate_flattened(result_types, result_rows)
+    if output_types is result_types:
+        return (result_types, result_rows)
+    return output_types, list(output_rows)
+
+
+def iterate_flattened(result_types, result_rows):
+    """Convert inventories in result types to have a row for each, lazily.
+
+    Args:
+        result_types: A list of (name, data-type) item pairs.
+        result_rows: An iterable of ResultRow tuples of length and types
+          described by 'result_types'.
+    Returns:
+        result_types: A list of (name, data-type) item pairs, the same list if
+          there were no Inventory types to convert.
+        result_rows: An iterable of ResultRow tuples of length and types
+          described by 'result_types'.
+    """
     indexes = set(index
                   for index, (name, result_type) in enumerate(result_types)
                   if result_type is inventory.Inventory)
     if not indexes:
         return (result_types, result_rows)
 
-    # pylint: disable=invalid-name
-    ResultRow = type(result_rows[0])
-
     # We have to make at least some conversions.
     num_columns = len(result_types)
-    output_rows = []
-    for result_row in result_rows:
-        max_rows = max(len(result_row[icol]) for icol in indexes)
-        for irow in range(max_rows):
-            output_row = []
-            for icol in range(num_columns):
-                value = result_row[icol]
-                if icol in indexes:
-                    value = value[irow] if irow < len(value) else None
-                output_row.append(value)
-            output_rows.append(ResultRow._make(output_row))
+    def iterate_rows():
+        for result_row in result_rows:
+            # pylint: disable=invalid-name
+            ResultRow = type(result_row)
+            max_rows = max(len(result_row[icol]) for icol in indexes)
+            for irow in range(max_rows):
+                output_row = []
+                for icol in range(num_columns):
+                    value = result_row[icol]
+                    if icol in indexes:
+                        value = value[irow] if irow < len(value) else None
+                    output_row.append(value)
+                yield ResultRow._make(output_row)
 
     # Convert the types.
     output_types = [(name, (position.Position
@@ -428,4 +576,4 @@ def flatten_results(result_types, result_rows):
                             else result_type))
                     for name, result_type in result_types]
 
-    return output_types, output_rows
+    return output_types, iterate_rows()
@@ -1,6 +1,7 @@
 __copyright__ = "Copyright (C) 2014-2017  Martin Blais"
 __license__ = "GNU GPLv2"
 
+import collections
 import datetime
 import decimal
 import io
@@ -23,6 +24,9 @@ class QueryBase(cmptest.TestCase):
 
     maxDiff = 8192
 
+    # The function executing the compiled queries.
+    execute_query = staticmethod(qx.execute_query)
+
     # Default execution contexts.
     xcontext_entries = qe.FilterEntriesEnvironment()
     xcontext_targets = qe.TargetsEnvironment()
@@ -63,7 +67,7 @@ class QueryBase(cmptest.TestCase):
 
         entries, _, options_map = loader.load_string(input_string)
         query = self.compile(bql_string)
-        result_types, result_rows = qx.execute_query(query, entries, options_map)
+        result_types, result_rows = self.execute_query(query, entries, options_map)
 
         if debug:
             with misc_utils.box('result_types'):
@@ -843,6 +847,118 @@ class TestExecuteOptions(QueryBase):
                 ('Assets:AssetD', D('2.00')),
                 ])
 
+    def test_limit_desc(self):
+        self.check_query(
+            self.INPUT,
+            """
+            SELECT account, number ORDER BY number DESC LIMIT 2;
+            """,
+            [
+                ('account', str),
+                ('number', Decimal),
+                ],
+            [
+                ('Assets:AssetA', D('5.00')),
+                ('Assets:AssetB', D('4.00')),
+                ])
+
+    def test_limit_ties(self):
+        # Equal sort keys keep the order of the postings, as when sorting.
+        self.check_query(
+            self.INPUT,
+            """
+            SELECT account ORDER BY currency LIMIT 2;
+            """,
+            [
+                ('account', str),
+                ],
+            [
+                ('Assets:AssetA',),
+                ('Assets:AssetD',),
+                ])
+        self.check_query(
+            self.INPUT,
+            """
+            SELECT account ORDER BY currency DESC LIMIT 2;
+            """,
+            [
+                ('account', str),
+                ],
+            [
+                ('Assets:AssetA',),
+                ('Assets:AssetD',),
+                ])
+
+    def test_limit_unordered(self):
+        self.check_query(
+            self.INPUT,
+            """
+            SELECT account LIMIT 2;
+            """,
+            [
+                ('account', str),
+                ],
+            [
+                ('Assets:AssetA',),
+                ('Assets:AssetD',),
+                ])
+
+    def test_distinct_limit(self):
+        self.check_query(
+            self.INPUT,
+            """
+            SELECT DISTINCT currency ORDER BY currency LIMIT 2;
+            """,
+            [
+                ('currency', str),
+                ],
+            [
+                ('USD',),
+                ])
+
+
+class TestStreaming(QueryBase):
+
+    INPUT = TestExecuteOptions.INPUT
+
+    def iterate_schwartz_rows(self, values, consumed):
+        # pylint: disable=invalid-name
+        ResultRow = collections.namedtuple('ResultRow', ['number'])
+        for value in values:
+            consumed.append(value)
+            yield ((value,), ResultRow(value))
+
+    def test_iterate_results_limit(self):
+        query = self.compile("SELECT number LIMIT 2;")
+        consumed = []
+        result_types, result_rows = qx.iterate_results(
+            query, [('number', int)],
+            self.iterate_schwartz_rows(range(100), consumed))
+        self.assertEqual([(0,), (1,)], list(result_rows))
+        self.assertEqual([0, 1], consumed)
+
+    def test_iterate_results_top(self):
+        values = [5, 3, 9, 1, 7, 3]
+        for ordering, expected in [('ASC', [(1,), (3,), (3,)]),
+                                   ('DESC', [(9,), (7,), (5,)])]:
+            query = self.compile("SELECT number ORDER BY number {} LIMIT 3;".format(
+                ordering))
+            consumed = []
+            _, result_rows = qx.iterate_results(
+                query, [('number', int)],
+                self.iterate_schwartz_rows(values, consumed))
+            self.assertEqual(expected, list(result_rows))
+            self.assertEqual(values, consumed)
+
+    def test_execute_query_iter(self):
+        entries, _, options_map = loader.load_string(self.INPUT)
+        query = self.compile("SELECT account, number;")
+        result_types, result_rows = qx.execute_query_iter(query, entries, options_map)
+        self.assertEqual([('account', str), ('number', Decimal)], result_types)
+        self.assertEqual(('Assets:AssetA', D('5.00')), next(result_rows))
+        self.assertEqual(qx.execute_query(query, entries, options_map)[1][1:],
+                         list(result_rows))
+
 
 class TestArithmeticFunctions(QueryBase):
 
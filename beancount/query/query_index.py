@@ -0,0 +1,264 @@
+"""Secondary indexes over a list of entries, for looking up the rows of queries.
+
+An EntriesIndex is built once for a list of entries, and maps the values of a
+few attributes (accounts, currencies, dates, payees, tags and links) to the
+offsets of the entries and postings which have them. Restrictions planned from
+the FROM and WHERE clauses of a query by query_compile.get_index_restrictions()
+are looked up in it, so that the query only visits candidate entries and
+postings instead of scanning all of them.
+
+Postings are numbered in the order they appear in the list of entries; each
+posting is identified by its ordinal in that sequence.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import array
+import bisect
+import collections
+import datetime
+import itertools
+import re
+
+from beancount.core import data
+from beancount.core import getters
+
+
+def _new_offsets():
+    return array.array('l')
+
+
+class EntriesIndex:
+    """Indexes of the entries and postings of a list of entries.
+
+    Attributes:
+      entries: The list of entries this indexes.
+      dates: An array of the date ordinals of the entries.
+      dates_sorted: A boolean, true if the entries are sorted by date. Dates are
+        only looked up if this is true.
+      posting_starts: An array of the ordinal of the first posting of each entry,
+        with one extra element for the total number of postings.
+      posting_entries: An array of the offset of the entry of each posting.
+      entry_accounts: A dict of account to the offsets of the entries which
+        refer to it.
+      posting_accounts: A dict of account to the ordinals of its postings.
+      posting_currencies: A dict of currency to the ordinals of the postings of
+        units in it.
+      payees: A dict of payee to the offsets of the transactions with it. The
+        transactions without a payee are indexed under the empty string.
+      tags: A dict of tag to the offsets of the transactions with it.
+      links: A dict of link to the offsets of the transactions with it.
+    """
+    def __init__(self, entries):
+        self.entries = entries
+        self.dates = array.array('l', [entry.date.toordinal() for entry in entries])
+        self.dates_sorted = all(date1 <= date2
+                                for date1, date2 in zip(self.dates, self.dates[1:]))
+        self.posting_starts = array.array('l')
+        self.posting_entries = array.array('l')
+        self.entry_accounts = collections.defaultdict(_new_offsets)
+        self.posting_accounts = collections.defaultdict(_new_offsets)
+        self.posting_currencies = collections.defaultdict(_new_offsets)
+        self.payees = collections.defaultdict(_new_offsets)
+        self.tags = collections.defaultdict(_new_offsets)
+        self.links = collections.defaultdict(_new_offsets)
+
+        for offset, entry in enumerate(entries):
+            self.posting_starts.append(len(self.posting_entries))
+            for account in getters.get_entry_accounts(entry):
+                self.entry_accounts[account].append(offset)
+            if not isinstance(entry, data.Transaction):
+                continue
+            self.payees[entry.payee or ''].append(offset)
+            for tag in entry.tags or ():
+                self.tags[tag].append(offset)
+            for link in entry.links or ():
+                self.links[link].append(offset)
+            for posting in entry.postings:
+                ordinal = len(self.posting_entries)
+                self.posting_entries.append(offset)
+                self.posting_accounts[posting.account].append(ordinal)
+                self.posting_currencies[posting.units.currency].append(ordinal)
+        self.posting_starts.append(len(self.posting_entries))
+
+    def get_posting(self, ordinal):
+        """Get a posting from its ordinal.
+
+        Args:
+          ordinal: An integer, the ordinal of a posting.
+        Returns:
+          A pair of its parent Transaction and the Posting instance.
+        """
+        entry_offset = self.posting_entries[ordinal]
+        entry = self.entries[entry_offset]
+        return entry, entry.postings[ordinal - self.posting_starts[entry_offset]]
+
+    def select_entries(self, restrictions):
+        """Look up the entries matching some restrictions.
+
+        Args:
+          restrictions: A list of IndexRestriction instances.
+        Returns:
+          A sorted sequence of the offsets of the entries matching all of the
+          restrictions which could be looked up, or None if none of them could.
+        """
+        selections = []
+        for restriction in restrictions:
+            selection = self._lookup_entries(restriction, self.entry_accounts)
+            if selection is not None:
+                selections.append(selection)
+        return intersect(selections) if selections else None
+
+    def select_postings(self, restrictions):
+        """Look up the postings matching some restrictions.
+
+        Args:
+          restrictions: A list of IndexRestriction instances.
+        Returns:
+          A sorted sequence of the ordinals of the postings matching all of the
+          restrictions which could be looked up, or None if none of them could.
+        """
+        selections = []
+        for key, operator, value in restrictions:
+            if key == 'account':
+                selection = lookup_values(self.posting_accounts, operator, value)
+            elif key == 'currency':
+                selection = lookup_values(self.posting_currencies, operator, value)
+            else:
+                offsets = self._lookup_entries((key, operator, value), None)
+                if offsets is None:
+                    selection = None
+                elif isinstance(offsets, range):
+                    selection = range(self.posting_starts[offsets.start],
+                                      self.posting_starts[offsets.stop])
+                else:
+                    starts = self.posting_starts
+                    selection = list(itertools.chain.from_iterable(
+                        range(starts[offset], starts[offset+1])
+                        for offset in offsets))
+            if selection is not None:
+                selections.append(selection)
+        return intersect(selections) if selections else None
+
+    def _lookup_entries(self, restriction, accounts):
+        """Look up the entries matching a single restriction.
+
+        Args:
+          restriction: An IndexRestriction instance.
+          accounts: A dict of account to entry offsets, or None if accounts
+            can't be looked up.
+        Returns:
+          A sorted sequence of entry offsets, or None if the restriction can't
+          be looked up.
+        """
+        key, operator, value = restriction
+        if key == 'date':
+            if isinstance(value, datetime.date) and self.dates_sorted:
+                return self._lookup_dates(operator, value.toordinal())
+        elif key == 'year':
+            if isinstance(value, int) and self.dates_sorted:
+                return self._lookup_years(operator, value)
+        elif key == 'payee':
+            return lookup_values(self.payees, operator, value)
+        elif key == 'tags':
+            if operator == 'in':
+                return self.tags.get(value, ())
+        elif key == 'links':
+            if operator == 'in':
+                return self.links.get(value, ())
+        elif key == 'account' and accounts is not None:
+            return lookup_values(accounts, operator, value)
+        return None
+
+    def _lookup_dates(self, operator, ordinal):
+        """Look up the range of entries whose date compares to a date.
+
+        Args:
+          operator: A string, one of '=', '<', '<=', '>', '>='.
+          ordinal: An integer, the ordinal of the date to compare to.
+        Returns:
+          A range of entry offsets, or None if the operator isn't supported.
+        """
+        dates = self.dates
+        if operator == '=':
+            return range(bisect.bisect_left(dates, ordinal),
+                         bisect.bisect_right(dates, ordinal))
+        elif operator == '<':
+            return range(0, bisect.bisect_left(dates, ordinal))
+        elif operator == '<=':
+            return range(0, bisect.bisect_right(dates, ordinal))
+        elif operator == '>':
+            return range(bisect.bisect_right(dates, ordinal), len(dates))
+        elif operator == '>=':
+            return range(bisect.bisect_left(dates, ordinal), len(dates))
+        return None
+
+    def _lookup_years(self, operator, year):
+        """Look up the range of entries whose year compares to a year.
+
+        Args:
+          operator: A string, one of '=', '<', '<=', '>', '>='.
+          year: An integer, the year to compare to.
+        Returns:
+          A range of entry offsets, or None if the operator isn't supported.
+        """
+        if not datetime.MINYEAR < year < datetime.MAXYEAR:
+            return None
+        start = datetime.date(year, 1, 1).toordinal()
+        end = datetime.date(year + 1, 1, 1).toordinal()
+        dates = self.dates
+        if operator == '=':
+            return range(bisect.bisect_left(dates, start),
+                         bisect.bisect_left(dates, end))
+        elif operator == '<':
+            return range(0, bisect.bisect_left(dates, start))
+        elif operator == '<=':
+            return range(0, bisect.bisect_left(dates, end))
+        elif operator == '>':
+            return range(bisect.bisect_left(dates, end), len(dates))
+        elif operator == '>=':
+            return range(bisect.bisect_left(dates, start), len(dates))
+        return None
+
+
+def lookup_values(index, operator, value):
+    """Look up the offsets for values of a string attribute.
+
+    Args:
+      index: A dict of string value to sorted arrays of offsets.
+      operator: A string, '=' for an equal value or '~' for a value matching a
+        regular expression, case-insensitively.
+      value: A string, the value or regular expression to look up.
+    Returns:
+      A sorted sequence of offsets, or None if the operator isn't supported.
+    """
+    if not isinstance(value, str):
+        return None
+    if operator == '=':
+        return index.get(value, ())
+    elif operator == '~':
+        try:
+            search = re.compile(value, re.IGNORECASE).search
+        except re.error:
+            return None
+        matches = [offsets for key, offsets in index.items() if search(key)]
+        if len(matches) == 1:
+            return matches[0]
+        return sorted(set(itertools.chain.from_iterable(matches)))
+    return None
+
+
+def intersect(selections):
+    """Intersect sorted sequences of offsets.
+
+    Args:
+      selections: A non-empty list of sorted sequences of integers.
+    Returns:
+      A sorted sequence of the integers present in all the sequences.
+    """
+    selections = sorted(selections, key=len)
+    result = selections[0]
+    for selection in selections[1:]:
+        members = selection if isinstance(selection, range) else set(selection)
+        result = [offset for offset in result if offset in members]
+    return result
@@ -0,0 +1,139 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import datetime
+import unittest
+from os import path
+
+from beancount.query import query_columnar as qcol
+from beancount.query import query_compile as qc
+from beancount.query import query_execute as qx
+from beancount.query import query_index as qi
+from beancount.query import query_execute_test
+from beancount.utils import test_utils
+from beancount import loader
+
+
+class TestEntriesIndex(unittest.TestCase):
+
+    @loader.load_doc()
+    def setUp(self, entries, _, __):
+        """
+        2014-01-01 open Assets:Bank:Checking
+        2014-01-01 open Assets:Broker:Cash
+        2014-01-01 open Expenses:Restaurant
+
+        2014-02-01 * "Bistro" "Dinner" #trip
+          Assets:Bank:Checking       -100.00 USD
+          Expenses:Restaurant         100.00 USD
+
+        2015-03-01 * "Transfer" ^transfer-1
+          Assets:Bank:Checking       -500.00 USD
+          Assets:Broker:Cash          400.00 EUR @ 1.25 USD
+
+        2015-04-01 balance Assets:Broker:Cash   400.00 EUR
+
+        2016-05-01 * "Bistro" "Lunch" #trip
+          Assets:Bank:Checking        -20.00 USD
+          Expenses:Restaurant          20.00 USD
+        """
+        self.entries = entries
+        self.index = qi.EntriesIndex(entries)
+
+    def select_postings(self, *restrictions):
+        return [(entry.date, posting.account)
+                for entry, posting in map(self.index.get_posting,
+                                          self.index.select_postings(
+                                              [qc.IndexRestriction(*restriction)
+                                               for restriction in restrictions]))]
+
+    def select_entries(self, *restrictions):
+        return list(self.index.select_entries([qc.IndexRestriction(*restriction)
+                                               for restriction in restrictions]))
+
+    def test_postings(self):
+        self.assertEqual(6, len(self.index.posting_entries))
+        self.assertEqual([(datetime.date(2015, 3, 1), 'Assets:Broker:Cash')],
+                         self.select_postings(('account', '~', 'broker')))
+        self.assertEqual([(datetime.date(2014, 2, 1), 'Expenses:Restaurant'),
+                          (datetime.date(2016, 5, 1), 'Expenses:Restaurant')],
+                         self.select_postings(('account', '=', 'Expenses:Restaurant')))
+        self.assertEqual([(datetime.date(2015, 3, 1), 'Assets:Broker:Cash')],
+                         self.select_postings(('currency', '=', 'EUR')))
+        self.assertEqual([(datetime.date(2015, 3, 1), 'Assets:Bank:Checking'),
+                          (datetime.date(2016, 5, 1), 'Assets:Bank:Checking')],
+                         self.select_postings(('account', '~', 'Checking'),
+                                              ('year', '>=', 2015)))
+        self.assertEqual([(datetime.date(2016, 5, 1), 'Assets:Bank:Checking'),
+                          (datetime.date(2016, 5, 1), 'Expenses:Restaurant')],
+                         self.select_postings(('tags', 'in', 'trip'),
+                                              ('date', '>', datetime.date(2015, 3, 1))))
+        self.assertEqual([(datetime.date(2015, 3, 1), 'Assets:Bank:Checking'),
+                          (datetime.date(2015, 3, 1), 'Assets:Broker:Cash')],
+                         self.select_postings(('links', 'in', 'transfer-1')))
+        self.assertEqual([], self.select_postings(('payee', '=', 'Unknown')))
+
+    def test_postings_unsupported(self):
+        self.assertIsNone(self.index.select_postings([]))
+        self.assertIsNone(self.index.select_postings(
+            [qc.IndexRestriction('account', '<', 'Assets')]))
+        self.assertIsNone(self.index.select_postings(
+            [qc.IndexRestriction('date', '=', 'not-a-date')]))
+
+    def test_entries(self):
+        # The balance entry refers to the account too.
+        self.assertEqual([1, 4, 5],
+                         self.select_entries(('account', '~', 'Broker')))
+        self.assertEqual([4, 5, 6],
+                         self.select_entries(('year', '>', 2014)))
+        self.assertEqual([3, 6],
+                         self.select_entries(('payee', '~', '^bis')))
+        self.assertEqual([4, 5],
+                         self.select_entries(('year', '=', 2015)))
+        self.assertEqual([0, 1, 2, 3],
+                         self.select_entries(('date', '<', datetime.date(2015, 3, 1))))
+        self.assertIsNone(self.index.select_entries(
+            [qc.IndexRestriction('currency', '=', 'USD')]))
+
+    def test_intersect(self):
+        self.assertEqual([2, 3], qi.intersect([range(0, 4), [2, 3, 5]]))
+        self.assertEqual([], qi.intersect([[1, 2], [3]]))
+
+
+class TestIndexedQueries(query_execute_test.QueryBase):
+
+    QUERIES = [
+        "SELECT date, account, position WHERE account ~ 'Assets:US:ETrade';",
+        "SELECT account, sum(position) WHERE year = 2015 AND currency = 'USD' "
+        "GROUP BY account ORDER BY account;",
+        "SELECT date, narration, position, balance "
+        "WHERE account = 'Assets:US:BofA:Checking' AND date >= 2015-06-01;",
+        "SELECT date, payee, position FROM has_account('Restaurant') AND year >= 2015 "
+        "WHERE account ~ 'Liabilities' ORDER BY date;",
+        "SELECT payee, count(position) WHERE 'trip-new-york-2014' IN tags "
+        "GROUP BY payee ORDER BY payee;",
+        "SELECT date, account, number FROM year = 2014 OPEN ON 2014-06-01 "
+        "WHERE account ~ 'Assets' AND year = 2014;",
+        "JOURNAL 'Assets:US:Vanguard' FROM year = 2015;",
+        "BALANCES FROM has_account('Hoogle');",
+    ]
+
+    def test_example(self):
+        filename = path.join(test_utils.find_repository_root(__file__),
+                             'examples', 'example.beancount')
+        entries, errors, options_map = loader.load_file(filename)
+        self.assertFalse(errors)
+        index = qi.EntriesIndex(entries)
+        for query_string in self.QUERIES:
+            query = qc.compile(self.parse(query_string),
+                               self.xcontext_targets,
+                               self.xcontext_postings,
+                               self.xcontext_entries)
+            expected = qx.execute_query(query, entries, options_map)
+            self.assertTrue(expected[1], query_string)
+            self.assertEqual(expected,
+                             qx.execute_query(query, entries, options_map, index),
+                             query_string)
+            self.assertEqual(expected,
+                             qcol.execute_query(query, entries, options_map, index),
+                             query_string)
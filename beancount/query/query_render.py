@@ -470,7 +470,8 @@ def render_rows(result_types, result_rows, dcontext,
     Args:
       result_types: A list of items describing the names and data types of the items in
         each column.
-      result_rows: A list of ResultRow instances.
+      result_rows: A list or an iterable of ResultRow instances. Columns are
+        aligned over all the rows, so an iterable is consumed entirely first.
       dcontext: A DisplayContext object prepared for rendering numbers.
       expand: A boolean, if true, expand columns that render to lists on multiple rows.
       spaced: If true, leave an empty line between each of the rows. This is useful if the
@@ -485,6 +486,8 @@ def render_rows(result_types, result_rows, dcontext,
     #   formats in order to be importable in a spreadsheet in a way that numbers
     #   are usable.
 
+    if not isinstance(result_rows, list):
+        result_rows = list(result_rows)
     if result_rows:
         assert len(result_types) == len(result_rows[0])
 
@@ -243,6 +243,20 @@ class TestQueryRender(unittest.TestCase):
         # with box():
         #     print(oss.getvalue())
 
+    def test_render_iterator(self):
+        types = [('account', str), ('number', Decimal)]
+        Row = collections.namedtuple('TestRow', [name for name, type in types])
+        rows = [
+            Row('Assets:US:Babble:Vacation', D('1.5')),
+            Row('Expenses:Vacation', D('123.25')),
+        ]
+        for render in query_render.render_text, query_render.render_csv:
+            oss = io.StringIO()
+            render(types, rows, self.dcontext, oss)
+            iter_oss = io.StringIO()
+            render(types, iter(rows), self.dcontext, iter_oss)
+            self.assertEqual(oss.getvalue(), iter_oss.getvalue())
+
     def test_render_Decimal(self):
         types = [('number', Decimal)]
         Row = collections.namedtuple('TestRow', [name for name, type in types])
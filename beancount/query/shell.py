@@ -25,6 +25,9 @@ from beancount.query import query_parser
 from beancount.query import query_compile
 from beancount.query import query_env
 from beancount.query import query_execute
+from beancount.query import query_columnar
+from beancount.query import query_index
+from beancount.query import query_cache
 from beancount.query import query_render
 from beancount.query import numberify
 from beancount.parser import printer
@@ -32,7 +35,7 @@ from beancount.core import data
 from beancount.utils import misc_utils
 from beancount.utils import pager
 from beancount.utils import version
-from beancount import loader
+from beancount import daemon
 
 
 HISTORY_FILENAME = "~/.bean-shell-history"
@@ -126,6 +129,8 @@ class DispatchingShell(cmd.Cmd):
             'spaced': convert_bool,
             'expand': convert_bool,
             'numberify': convert_bool,
+            'engine': str,
+            'cache': convert_bool,
             }
         self.vars = {
             'pager': os.environ.get('PAGER', None),
@@ -134,6 +139,8 @@ class DispatchingShell(cmd.Cmd):
             'spaced': False,
             'expand': False,
             'numberify': do_numberify,
+            'engine': query_columnar.ENGINE_ROW,
+            'cache': True,
             }
 
     def add_help(self):
@@ -295,7 +302,7 @@ class BQLShell(DispatchingShell):
     prompt = 'beancount> '
 
     def __init__(self, is_interactive, loadfun, outfile,
-                 default_format='text', do_numberify=False):
+                 default_format='text', do_numberify=False, cache_filename=None):
         super().__init__(is_interactive, query_parser.Parser(), outfile,
                          default_format, do_numberify)
 
@@ -303,6 +310,9 @@ class BQLShell(DispatchingShell):
         self.entries = None
         self.errors = None
         self.options_map = None
+        self.index = None
+        self.result_cache = query_cache.ResultCache()
+        self.cache_filename = cache_filename
 
         self.env_targets = query_env.TargetsEnvironment()
         self.env_entries = query_env.FilterEntriesEnvironment()
@@ -313,9 +323,28 @@ class BQLShell(DispatchingShell):
         Reload the input file without restarting the shell.
         """
         self.entries, self.errors, self.options_map = self.loadfun()
+        self.index = None
+        self.result_cache.set_fingerprint(query_cache.get_fingerprint(self.options_map))
+        if self.cache_filename:
+            self.result_cache.load(self.cache_filename)
         if self.is_interactive:
             print_statistics(self.entries, self.options_map, self.outfile)
 
+    def get_index(self):
+        """Get the index of the entries, shared by all the queries until a reload.
+
+        Returns:
+          An instance of query_index.EntriesIndex.
+        """
+        if self.index is None:
+            self.index = query_index.EntriesIndex(self.entries)
+        return self.index
+
+    def save_cache(self):
+        """Save the cached query results to the cache file, if there is one."""
+        if self.cache_filename:
+            self.result_cache.save(self.cache_filename)
+
     def on_Errors(self, errors_statement):
         """
         Print the errors that occurred during parsing.
@@ -413,10 +442,20 @@ class BQLShell(DispatchingShell):
             print('ERROR: {}.'.format(str(exc).rstrip('.')), file=self.outfile)
             return
 
-        # Execute it to obtain the result rows.
-        rtypes, rrows = query_execute.execute_query(c_query,
-                                                    self.entries,
-                                                    self.options_map)
+        # Execute it to obtain the result rows, unless the same statement was
+        # already run on this ledger.
+        use_cache = self.vars['cache'] and query_cache.is_cacheable(c_query)
+        result = self.result_cache.get(statement) if use_cache else None
+        if result is None:
+            engine, _ = query_columnar.get_engine(c_query, self.vars['engine'])
+            execute_query = (query_columnar.execute_query
+                             if engine == query_columnar.ENGINE_COLUMNAR else
+                             query_execute.execute_query)
+            result = execute_query(c_query, self.entries, self.options_map,
+                                   self.get_index())
+            if use_cache:
+                self.result_cache.put(statement, result)
+        rtypes, rrows = result
 
         # Output the resulting rows.
         if not rrows:
@@ -517,6 +556,12 @@ class BQLShell(DispatchingShell):
                 c_target.c_expr.dtype.__name__))
         pr()
 
+        if isinstance(query, query_compile.EvalQuery):
+            engine, reason = query_columnar.get_engine(query, self.vars['engine'])
+            pr("Engine:")
+            pr("  {}{}".format(engine, ' ({})'.format(reason) if reason else ''))
+            pr()
+
     def on_RunCustom(self, run_stmt):
         """
         Run a custom query instead of a SQL command.
@@ -786,6 +831,11 @@ def main():
     parser.add_argument('-q', '--no-errors', action='store_true',
                         help='Do not report errors')
 
+    parser.add_argument('-C', '--persist-cache', action='store_true',
+                        help=("Save the results of queries to a file next to the "
+                              "input file, and reuse them on later runs on the "
+                              "unchanged input file"))
+
     parser.add_argument('filename', metavar='FILENAME.beancount',
                         help='The Beancount input filename to load')
 
@@ -794,20 +844,44 @@ def main():
 
     args = parser.parse_args()
 
-    # Parse the input file.
+    # Parse the input file, or get it from a running daemon.
+    errors_file = None if args.no_errors else sys.stderr
     def load():
-        errors_file = None if args.no_errors else sys.stderr
         with misc_utils.log_time('beancount.loader (total)', logging.info):
-            return loader.load_file(args.filename,
+            return daemon.load_file(args.filename,
                                     log_timings=logging.info,
                                     log_errors=errors_file)
 
     # Create a receiver for output.
     outfile = sys.stdout if args.output is None else open(args.output, 'w')
 
-    # Create the shell.
     is_interactive = sys.stdin.isatty() and not args.query
-    shell_obj = BQLShell(is_interactive, load, outfile, args.format, args.numberify)
+    if not is_interactive:
+        if args.query:
+            # We have a query to run.
+            query = ' '.join(args.query)
+        else:
+            # If we have no query and we're not a TTY, read the BQL command from
+            # standard input.
+            query = sys.stdin.read()
+
+        # Run the query in a daemon serving the file if one is running, which
+        # avoids loading the file altogether.
+        output = daemon.query_file(args.filename, query, args.format, args.numberify,
+                                   log_errors=errors_file)
+        if output is not None:
+            outfile.write(output)
+            return 0
+
+    # Create the shell.
+    cache_filename = None
+    if args.persist_cache:
+        cache_filename = path.join(
+            path.dirname(path.abspath(args.filename)),
+            query_cache.QUERY_CACHE_FILENAME.format(
+                filename=path.basename(args.filename)))
+    shell_obj = BQLShell(is_interactive, load, outfile, args.format, args.numberify,
+                         cache_filename)
     shell_obj.on_Reload()
 
     # Run interactively if we're a TTY and no query is supplied.
@@ -818,15 +892,8 @@ def main():
             print('\nExit')
     else:
         # Run in batch mode (Non-interactive).
-        if args.query:
-            # We have a query to run.
-            query = ' '.join(args.query)
-        else:
-            # If we have no query and we're not a TTY, read the BQL command from
-            # standard input.
-            query = sys.stdin.read()
-
         shell_obj.onecmd(query)
+    shell_obj.save_cache()
 
     return 0
 
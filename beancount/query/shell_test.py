@@ -1,6 +1,8 @@
 __copyright__ = "Copyright (C) 2014-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
+import io
+import os
 import re
 import sys
 import unittest
@@ -156,6 +158,13 @@ class TestUseCases(unittest.TestCase):
         """
         ## FIXME: Here we need to finally support FLATTEN to make this happen properly.
 
+    @runshell
+    def test_explain_engine(self, output):
+        """
+        EXPLAIN SELECT account, sum(position) GROUP BY account;
+        """
+        self.assertRegex(output, "Engine:\n  row\n")
+
 
 class TestRun(unittest.TestCase):
 
@@ -227,5 +236,48 @@ class TestShell(test_utils.TestCase):
             test_utils.run_with_args(shell.main, [filename, "SELECT 1;"])
         self.assertTrue(stdout.getvalue())
 
+    @test_utils.docfile
+    def test_result_cache(self, filename):
+        """
+        2013-01-01 open Assets:Account1
+        2013-01-01 open Equity:Unknown
+
+        2013-04-05 *
+          Equity:Unknown
+          Assets:Account1     5000 USD
+        """
+        cache_filename = path.join(path.dirname(filename), '.{}.querycache'.format(
+            path.basename(filename)))
+        query = "SELECT account, sum(position) GROUP BY account;"
+        try:
+            # The results are not saved by default.
+            with test_utils.capture('stdout', 'stderr') as (stdout, _):
+                test_utils.run_with_args(shell.main, [filename, query])
+            self.assertFalse(path.exists(cache_filename))
+
+            with test_utils.capture('stdout', 'stderr') as (stdout, _):
+                test_utils.run_with_args(shell.main, ['-C', filename, query])
+            self.assertTrue(path.exists(cache_filename))
+            with test_utils.capture('stdout', 'stderr') as (cached_stdout, _):
+                test_utils.run_with_args(shell.main, ['-C', filename, query])
+            self.assertEqual(stdout.getvalue(), cached_stdout.getvalue())
+        finally:
+            if path.exists(cache_filename):
+                os.remove(cache_filename)
+
+    def test_result_cache_statements(self):
+        shell_obj = shell.BQLShell(False, lambda: (entries, errors, options_map),
+                                   io.StringIO())
+        shell_obj.on_Reload()
+        shell_obj.onecmd("SELECT count(position);")
+        self.assertEqual(1, len(shell_obj.result_cache))
+        shell_obj.onecmd("select  count(position) ;")
+        self.assertEqual(1, len(shell_obj.result_cache))
+        shell_obj.onecmd("SELECT count(position) WHERE date < today();")
+        self.assertEqual(1, len(shell_obj.result_cache))
+        shell_obj.onecmd("set cache false")
+        shell_obj.onecmd("SELECT account;")
+        self.assertEqual(1, len(shell_obj.result_cache))
+
 
 __incomplete__ = True
@@ -12,7 +12,7 @@ import re
 import sys
 import textwrap
 
-from beancount import loader
+from beancount import daemon
 from beancount.ops import validation
 from beancount.reports import base
 from beancount.reports import table
@@ -237,10 +237,10 @@ def main():
     logging.basicConfig(level=logging.INFO if args.timings else logging.WARNING,
                         format='%(levelname)-8s: %(message)s')
 
-    # Parse the input file.
+    # Parse the input file, or get it from a running daemon.
     errors_file = None if args.no_errors else sys.stderr
     with misc_utils.log_time('beancount.loader (total)', logging.info):
-        entries, errors, options_map = loader.load_file(args.filename,
+        entries, errors, options_map = daemon.load_file(args.filename,
                                                         log_timings=logging.info,
                                                         log_errors=errors_file,
                                                         extra_validations=extra_validations)
@@ -8,6 +8,7 @@ __license__ = "GNU GPLv2"
 import logging
 import sys
 
+from beancount import daemon
 from beancount import loader
 from beancount.ops import validation
 from beancount.utils import misc_utils
@@ -30,18 +31,27 @@ def main():
                             format='%(levelname)-8s: %(message)s')
 
     with misc_utils.log_time('beancount.loader (total)', logging.info):
-        # Load up the file, print errors, checking and validation are invoked
-        # automatically.
-        entries, errors, _ = loader.load_file(
+        # Attach to a running daemon for this file if there is one; it has the
+        # file already loaded.
+        num_errors = daemon.check_file(
             opts.filename,
-            log_timings=logging.info,
             log_errors=sys.stderr,
-            # Force slow and hardcore validations, just for check.
             extra_validations=validation.HARDCORE_VALIDATIONS)
 
+        if num_errors is None:
+            # Load up the file, print errors, checking and validation are invoked
+            # automatically.
+            _, errors, _ = loader.load_file(
+                opts.filename,
+                log_timings=logging.info,
+                log_errors=sys.stderr,
+                # Force slow and hardcore validations, just for check.
+                extra_validations=validation.HARDCORE_VALIDATIONS)
+            num_errors = len(errors)
+
     # Exit with an error code if there were any errors, so this can be used in a
     # shell conditional.
-    return 1 if errors else 0
+    return 1 if num_errors else 0
 
 
 if __name__ == '__main__':
@@ -0,0 +1,497 @@
+"""Run a persistent ledger daemon for a Beancount file.
+
+The daemon loads the file once and keeps it in memory, watches its included
+files for changes and reloads them in the background, reusing the products of
+the loader for unchanged files. It serves requests on a local Unix socket, to
+which bean-check, bean-query and bean-report attach automatically when they are
+invoked on the same file, avoiding the cost of loading it every time.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+from os import path
+import ctypes
+import ctypes.util
+import importlib
+import io
+import logging
+import os
+import select
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+from beancount import daemon
+from beancount import loader
+from beancount.ops import validation
+from beancount.parser import printer
+from beancount.parser import snapshot
+from beancount.query import query_cache
+from beancount.query import query_index
+from beancount.query import shell
+from beancount.utils import encryption
+from beancount.utils import version
+
+
+# The number of seconds between checks for changes in the included files, when
+# they cannot be watched for change notifications.
+POLL_INTERVAL = 1.0
+
+
+class PollingWatcher:
+    """A watcher which checks the included files periodically."""
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def watch(self, filenames):
+        """Set the files to watch.
+
+        Args:
+          filenames: A list of absolute filenames.
+        """
+
+    def wait(self):
+        """Wait until the watched files may have changed, or a timeout.
+
+        Returns:
+          A boolean, true if the files may have changed.
+        """
+        return not self.stopped.wait(self.interval)
+
+    def stop(self):
+        """Wake up a thread waiting on the watcher, and make it return false."""
+        self.stopped.set()
+
+    def close(self):
+        """Release the resources of the watcher."""
+
+
+class InotifyWatcher(PollingWatcher):
+    """A watcher which gets notified of changes by inotify, on Linux.
+
+    The directories of the files are watched rather than the files themselves,
+    in order to catch editors replacing files by renaming them.
+    """
+
+    # The inotify events which may signal a change of a file: IN_MODIFY,
+    # IN_ATTRIB, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_DELETE_SELF
+    # and IN_MOVE_SELF.
+    MASK = 0x002 | 0x004 | 0x040 | 0x080 | 0x100 | 0x200 | 0x400 | 0x800
+
+    def __init__(self, interval=POLL_INTERVAL):
+        super().__init__(interval)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = None
+        self.dirnames = None
+        # A pipe to wake up a waiting thread with.
+        self.wakeup_fds = os.pipe()
+
+    @staticmethod
+    def is_available():
+        """Return true if inotify is supported on this platform."""
+        if not sys.platform.startswith('linux'):
+            return False
+        libc_filename = ctypes.util.find_library('c')
+        return bool(libc_filename and
+                    hasattr(ctypes.CDLL(libc_filename), 'inotify_init1'))
+
+    def watch(self, filenames):
+        dirnames = sorted(set(path.dirname(filename) for filename in filenames))
+        if dirnames == self.dirnames:
+            return
+        self.close_watches()
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1() failed")
+        for dirname in dirnames:
+            if self.libc.inotify_add_watch(self.fd, os.fsencode(dirname), self.MASK) < 0:
+                logging.warning("Could not watch directory '%s'", dirname)
+        self.dirnames = dirnames
+
+    def wait(self):
+        readable, _, _ = select.select([self.fd, self.wakeup_fds[0]], [], [],
+                                       self.interval)
+        if self.stopped.is_set() or not readable:
+            return False
+        # Let a burst of events settle, then consume them all.
+        time.sleep(0.05)
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def stop(self):
+        super().stop()
+        if self.wakeup_fds:
+            os.write(self.wakeup_fds[1], b'\0')
+
+    def close_watches(self):
+        """Stop watching the current directories."""
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.dirnames = None
+
+    def close(self):
+        self.close_watches()
+        for fd in self.wakeup_fds:
+            os.close(fd)
+        self.wakeup_fds = ()
+
+
+def get_watcher(interval=POLL_INTERVAL, use_inotify=True):
+    """Create the best watcher available on this platform.
+
+    Args:
+      interval: A float, the number of seconds between checks of the files if
+        polling, or between wake ups otherwise.
+      use_inotify: A boolean, false to force polling.
+    Returns:
+      An instance of PollingWatcher or one of its subclasses.
+    """
+    if use_inotify and InotifyWatcher.is_available():
+        return InotifyWatcher(interval)
+    return PollingWatcher(interval)
+
+
+def import_function(name, plugin_modules=()):
+    """Import a validation function from its fully qualified name.
+
+    The names come from the clients of the daemon, so only functions from the
+    Beancount package or from the plugin modules already loaded for the file can
+    be imported; no other module is imported on a client's behalf.
+
+    Args:
+      name: A string, a module name followed by the qualified name of the
+        function in it, separated by a period.
+      plugin_modules: A collection of the names of the plugin modules which may
+        also be imported from.
+    Returns:
+      A function object.
+    Raises:
+      ValueError: If the function cannot be found or is not allowed.
+    """
+    module_name, _, function_name = name.rpartition('.')
+    if not (module_name.startswith('beancount.') or
+            (module_name in plugin_modules and module_name in sys.modules)):
+        raise ValueError("Invalid function: '{}'".format(name))
+    try:
+        return getattr(importlib.import_module(module_name), function_name)
+    except (ImportError, AttributeError, ValueError):
+        raise ValueError("Invalid function: '{}'".format(name))
+
+
+class LedgerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """A server which keeps a loaded Beancount file and serves requests on it.
+
+    The file is reloaded by a background thread when the watcher signals that
+    it may have changed. Every request also verifies that the files haven't
+    changed before it is served, so that clients never see stale results.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, filename, socket_filename=None, watcher=None, log_timings=None):
+        """Load the file and bind the server's socket.
+
+        Args:
+          filename: A string, the name of the Beancount file to serve.
+          socket_filename: A string, the name of the socket to serve on, or
+            None for the default one for this file.
+          watcher: A watcher of the included files, or None to create the best
+            one available.
+          log_timings: A function to write timings to, or None.
+        Raises:
+          daemon.DaemonError: If another daemon is already serving this file.
+        """
+        self.filename = daemon.normalize_filename(filename)
+        self.watcher = watcher or get_watcher()
+        self.log_timings = log_timings
+        self.cache = loader.LoadCache()
+        self.lock = threading.RLock()
+        self.stopped = threading.Event()
+        self.watch_thread = None
+
+        # Remove a socket left behind by a daemon that died.
+        self.socket_filename = (socket_filename or
+                                daemon.get_socket_filename(self.filename))
+        if path.exists(self.socket_filename):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                try:
+                    sock.connect(self.socket_filename)
+                except OSError:
+                    os.remove(self.socket_filename)
+                else:
+                    raise daemon.DaemonError("A daemon is already running on '{}'".format(
+                        self.socket_filename))
+
+        # The loaded file and the products derived from it, cleared on reload.
+        self.ledger = None
+        self.derived = {}
+        self.generation = 0
+        self.load_time = None
+        self.reload()
+
+        # Make the socket accessible to the current user only.
+        old_umask = os.umask(0o077)
+        try:
+            super().__init__(self.socket_filename, RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def load(self):
+        """Load the file, reusing the products of the previous load.
+
+        Returns:
+          A triple of (entries, errors, options_map).
+        """
+        if encryption.is_encrypted_file(self.filename):
+            return loader.load_file(self.filename, self.log_timings)
+        # pylint: disable=protected-access
+        return loader._load([(self.filename, True)], self.log_timings,
+                            None, None, cache=self.cache)
+
+    def reload(self):
+        """Reload the file if any of its included files has changed.
+
+        Returns:
+          A boolean, true if the file was reloaded.
+        """
+        with self.lock:
+            if self.ledger is not None and not loader.needs_refresh(self.ledger[2]):
+                return False
+            time_before = time.time()
+            self.ledger = self.load()
+            self.derived = {}
+            self.generation += 1
+            self.load_time = time.time()
+            logging.info("Loaded '%s' in %.0f ms (%d directives, %d errors)",
+                         self.filename, (self.load_time - time_before) * 1000,
+                         len(self.ledger[0]), len(self.ledger[1]))
+            return True
+
+    def get_derived(self, key, function):
+        """Get a product of the loaded file, computing it only once per load.
+
+        Args:
+          key: A hashable key identifying the product.
+          function: A function of the (entries, errors, options_map) triple that
+            computes it.
+        Returns:
+          The value of the product.
+        """
+        with self.lock:
+            self.reload()
+            try:
+                return self.derived[key]
+            except KeyError:
+                value = self.derived[key] = function(*self.ledger)
+                return value
+
+    def get_ledger(self, validation_names=()):
+        """Get the loaded file, with errors from extra validations.
+
+        Args:
+          validation_names: A list of the qualified names of extra validation
+            functions to run.
+        Returns:
+          A triple of (entries, errors, options_map).
+        """
+        if not validation_names:
+            with self.lock:
+                self.reload()
+                return self.ledger
+        with self.lock:
+            self.reload()
+            plugin_modules = {name for name, _ in self.ledger[2]['plugin']}
+        extra_validations = [import_function(name, plugin_modules)
+                             for name in validation_names]
+        def load_validated(entries, errors, options_map):
+            # Replace the errors of the standard validations, which come last, by
+            # those of all the validations.
+            errors = [error for error in errors
+                      if not isinstance(error, validation.ValidationError)]
+            errors.extend(validation.validate(entries, options_map,
+                                              extra_validations=extra_validations))
+            return entries, errors, options_map
+        return self.get_derived(('ledger',) + tuple(validation_names), load_validated)
+
+    def watch(self):
+        """Watch the included files and reload them when they change."""
+        while not self.stopped.is_set():
+            self.watcher.watch(self.ledger[2]['include'])
+            if self.watcher.wait() and not self.stopped.is_set():
+                try:
+                    self.reload()
+                except Exception as exc:  # pylint: disable=broad-except
+                    logging.error("Could not reload '%s': %s", self.filename, exc)
+
+    def serve_forever(self, poll_interval=0.5):
+        self.watch_thread = threading.Thread(target=self.watch, daemon=True)
+        self.watch_thread.start()
+        super().serve_forever(poll_interval)
+
+    def server_close(self):
+        super().server_close()
+        self.stopped.set()
+        self.watcher.stop()
+        if self.watch_thread is not None:
+            self.watch_thread.join()
+        self.watcher.close()
+        if path.exists(self.socket_filename):
+            os.remove(self.socket_filename)
+
+    def dispatch(self, message):
+        """Run the command of a request.
+
+        Args:
+          message: A dict, the request.
+        Returns:
+          A pair of the response dict and its payload, or None.
+        """
+        method = getattr(self, 'on_{}'.format(message.get('command')), None)
+        if method is None:
+            raise ValueError("Invalid command: '{}'".format(message.get('command')))
+        return method(message)
+
+    def on_status(self, unused_message):
+        """Describe the loaded file."""
+        entries, errors, _ = self.get_ledger()
+        return {'filename': self.filename,
+                'pid': os.getpid(),
+                'generation': self.generation,
+                'load_time': self.load_time,
+                'num_entries': len(entries),
+                'num_errors': len(errors)}, None
+
+    def on_load(self, message):
+        """Send the loaded file, as a snapshot."""
+        names = tuple(message.get('extra_validations', ()))
+        with self.lock:
+            payload = self.get_derived(('snapshot',) + names,
+                                       lambda *_: snapshot.dumps(*self.get_ledger(names)))
+            return self.get_errors_response(names), payload
+
+    def on_check(self, message):
+        """Send the errors of the loaded file."""
+        names = tuple(message.get('extra_validations', ()))
+        return self.get_errors_response(names), None
+
+    def on_query(self, message):
+        """Run a query and send its rendered output."""
+        with self.lock:
+            entries, errors, options_map = self.get_ledger()
+            response = self.get_errors_response(())
+            index = self.get_derived(('query_index',),
+                                     lambda entries, *_: query_index.EntriesIndex(entries))
+            result_cache = self.get_derived(('query_cache',),
+                                            lambda *_: query_cache.ResultCache())
+        oss = io.StringIO()
+        shell_obj = shell.BQLShell(False, lambda: (entries, errors, options_map), oss,
+                                   message.get('format', 'text'),
+                                   message.get('numberify', False))
+        shell_obj.result_cache = result_cache
+        shell_obj.on_Reload()
+        shell_obj.index = index
+        shell_obj.onecmd(message['query'])
+        response['output'] = oss.getvalue()
+        return response, None
+
+    def on_stop(self, unused_message):
+        """Stop the server."""
+        threading.Thread(target=self.shutdown).start()
+        return {}, None
+
+    def get_errors_response(self, names):
+        """Build a response with the formatted errors of the loaded file.
+
+        Args:
+          names: A tuple of the qualified names of extra validation functions.
+        Returns:
+          A dict with the number of errors and their formatted text.
+        """
+        def format_errors(*_):
+            _, errors, _ = self.get_ledger(names)
+            oss = io.StringIO()
+            printer.print_errors(errors, file=oss)
+            return {'num_errors': len(errors), 'errors': oss.getvalue()}
+        return dict(self.get_derived(('errors',) + names, format_errors))
+
+
+class RequestHandler(socketserver.BaseRequestHandler):
+    """A handler for a single request to a LedgerServer."""
+
+    def handle(self):
+        try:
+            message, _ = daemon.recv_message(self.request)
+            response, payload = self.server.dispatch(message)
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.exception("Error handling request")
+            response, payload = {'error': str(exc)}, None
+        try:
+            daemon.send_message(self.request, response, payload)
+        except OSError as exc:
+            logging.warning("Could not send response: %s", exc)
+
+
+def main():
+    parser = version.ArgumentParser(description=__doc__)
+
+    parser.add_argument('filename', help='Beancount input filename to serve.')
+
+    parser.add_argument('--status', action='store_true',
+                        help='Print the status of the daemon serving the file and exit.')
+
+    parser.add_argument('--stop', action='store_true',
+                        help='Stop the daemon serving the file and exit.')
+
+    parser.add_argument('--poll', action='store_true',
+                        help='Poll the files for changes instead of using inotify.')
+
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL,
+                        help='The number of seconds between checks for changes.')
+
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Print timings.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(levelname)-8s: %(message)s')
+
+    if args.status or args.stop:
+        result = daemon.request(args.filename, 'stop' if args.stop else 'status')
+        if result is None:
+            logging.error("No daemon is serving '%s'", args.filename)
+            return 1
+        response, _ = result
+        for key, value in sorted(response.items()):
+            if key != 'payload':
+                print('{}: {}'.format(key, value))
+        return 0
+
+    try:
+        server = LedgerServer(args.filename,
+                              watcher=get_watcher(args.interval, not args.poll),
+                              log_timings=logging.info if args.verbose else None)
+    except daemon.DaemonError as exc:
+        logging.error(str(exc))
+        return 1
+    logging.info("Serving '%s' on '%s'", server.filename, server.socket_filename)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+from os import path
+import os
+import shutil
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from unittest import mock
+
+from beancount import daemon as daemon_client
+from beancount import loader
+from beancount.ops import validation
+from beancount.parser import cmptest
+from beancount.query import shell
+from beancount.reports import report
+from beancount.scripts import check
+from beancount.scripts import daemon
+from beancount.utils import test_utils
+
+
+INPUT = """
+  2013-01-01 open Expenses:Restaurant
+  2013-01-01 open Assets:Cash
+
+  2014-03-02 * "Something"
+    Expenses:Restaurant   50.02 USD
+    Assets:Cash
+"""
+
+
+class TestLedgerServer(cmptest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        self.filename = path.join(tmp, 'input.beancount')
+        self.write(INPUT)
+
+        self.server = daemon.LedgerServer(self.filename,
+                                          watcher=daemon.PollingWatcher(0.01))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        def stop():
+            self.server.shutdown()
+            self.thread.join()
+            self.server.server_close()
+        self.addCleanup(stop)
+
+    def write(self, contents):
+        with open(self.filename, 'w') as file:
+            file.write(textwrap.dedent(contents))
+        # Make sure the modification time changes.
+        mtime = time.time() + getattr(self, 'num_writes', 0)
+        os.utime(self.filename, (mtime, mtime))
+        self.num_writes = getattr(self, 'num_writes', 0) + 1
+
+    def test_status(self):
+        response, payload = daemon_client.request(self.filename, 'status')
+        self.assertIsNone(payload)
+        self.assertEqual(self.filename, response['filename'])
+        self.assertEqual(3, response['num_entries'])
+        self.assertEqual(0, response['num_errors'])
+
+    def test_load_file(self):
+        with mock.patch('beancount.loader.load_file') as load_file:
+            entries, errors, options_map = daemon_client.load_file(self.filename)
+        self.assertFalse(load_file.called)
+        expected_entries, expected_errors, _ = loader.load_file(self.filename)
+        self.assertEqualEntries(expected_entries, entries)
+        self.assertEqual(expected_errors, errors)
+        self.assertEqual(self.filename, options_map['filename'])
+
+    def test_check_file(self):
+        self.write(INPUT + """
+          2014-03-07 balance Assets:Cash  100 USD
+        """)
+        errors = []
+        num_errors = daemon_client.check_file(
+            self.filename, errors.append, validation.HARDCORE_VALIDATIONS)
+        self.assertEqual(1, num_errors)
+        self.assertRegex(errors[0], "Balance failed")
+
+    def test_get_ledger_extra_validations(self):
+        self.write(INPUT + """
+          2014-03-07 balance Assets:Cash  100 USD
+
+          2014-03-08 * "Unknown"
+            Expenses:Unknown   1.00 USD
+            Assets:Cash
+        """)
+        _, errors, _ = self.server.get_ledger()
+        _, expected_errors, _ = loader.load_file(
+            self.filename, extra_validations=validation.HARDCORE_VALIDATIONS)
+        names = daemon_client.get_validation_names(validation.HARDCORE_VALIDATIONS)
+        with mock.patch.object(self.server, 'load') as load:
+            _, validated_errors, _ = self.server.get_ledger(names)
+        self.assertFalse(load.called)
+        self.assertEqual(expected_errors, validated_errors)
+        self.assertIs(errors, self.server.get_ledger()[1])
+
+    def test_query_file(self):
+        output = daemon_client.query_file(
+            self.filename, "SELECT account, sum(position) GROUP BY account")
+        self.assertRegex(output, r"Assets:Cash\s+-50.02 USD")
+        self.assertRegex(output, r"Expenses:Restaurant\s+50.02 USD")
+
+    def test_reload_on_request(self):
+        self.server.watcher.interval = 3600
+        self.write(INPUT + """
+          2014-03-03 open Assets:Other
+        """)
+        response, _ = daemon_client.request(self.filename, 'status')
+        self.assertEqual(4, response['num_entries'])
+        self.assertEqual(2, response['generation'])
+
+    def test_reload_on_watch(self):
+        self.write(INPUT + """
+          2014-03-03 open Assets:Other
+        """)
+        for _ in range(500):
+            if self.server.generation > 1:
+                break
+            time.sleep(0.01)
+        self.assertEqual(2, self.server.generation)
+        self.assertEqual(4, len(self.server.ledger[0]))
+
+    def test_invalid_command(self):
+        with test_utils.capture('stderr'):
+            self.assertIsNone(daemon_client.request(self.filename, 'invalid'))
+
+    def test_already_running(self):
+        with self.assertRaises(daemon_client.DaemonError):
+            daemon.LedgerServer(self.filename, watcher=daemon.PollingWatcher())
+
+    def test_disabled(self):
+        with mock.patch.dict(os.environ, {daemon_client.DISABLE_ENV: '1'}):
+            self.assertIsNone(daemon_client.request(self.filename, 'status'))
+
+    def test_scripts_attach(self):
+        with mock.patch('beancount.loader.load_file') as load_file:
+            with test_utils.capture('stdout', 'stderr') as (stdout, _):
+                self.assertEqual(0, test_utils.run_with_args(check.main, [self.filename]))
+            with test_utils.capture('stdout', 'stderr') as (stdout, _):
+                self.assertEqual(0, test_utils.run_with_args(shell.main, [
+                    self.filename, "SELECT account WHERE account ~ 'Cash'"]))
+            self.assertRegex(stdout.getvalue(), 'Assets:Cash')
+            with test_utils.capture('stdout', 'stderr') as (stdout, _):
+                self.assertEqual(0, test_utils.run_with_args(report.main, [
+                    self.filename, 'accounts']))
+            self.assertRegex(stdout.getvalue(), 'Expenses:Restaurant')
+        self.assertFalse(load_file.called)
+
+    def test_main_stop(self):
+        with test_utils.capture('stdout'):
+            self.assertEqual(0, test_utils.run_with_args(daemon.main, [
+                '--stop', self.filename]))
+        self.thread.join(10)
+        self.assertFalse(self.thread.is_alive())
+        self.server.server_close()
+        self.assertFalse(path.exists(self.server.socket_filename))
+        self.assertIsNone(daemon_client.request(self.filename, 'status'))
+
+
+class TestDaemon(unittest.TestCase):
+
+    def test_no_daemon(self):
+        with test_utils.tempdir() as tmp:
+            filename = path.join(tmp, 'input.beancount')
+            with open(filename, 'w') as file:
+                file.write(textwrap.dedent(INPUT))
+            self.assertIsNone(daemon_client.request(filename, 'status'))
+            self.assertIsNone(daemon_client.check_file(filename))
+            entries, _, _ = daemon_client.load_file(filename)
+            self.assertEqual(3, len(entries))
+            with test_utils.capture('stderr'):
+                self.assertEqual(1, test_utils.run_with_args(daemon.main, [
+                    '--status', filename]))
+
+    def test_socket_filename(self):
+        socket_filename = daemon_client.get_socket_filename('/tmp/input.beancount')
+        self.assertEqual(socket_filename,
+                         daemon_client.get_socket_filename('/tmp/../tmp/input.beancount'))
+        self.assertNotEqual(socket_filename,
+                            daemon_client.get_socket_filename('/tmp/other.beancount'))
+
+    @unittest.skipIf(not daemon.InotifyWatcher.is_available(), "inotify not available")
+    def test_inotify_watcher(self):
+        with test_utils.tempdir() as tmp:
+            filename = path.join(tmp, 'input.beancount')
+            open(filename, 'w').close()
+            watcher = daemon.InotifyWatcher(0.01)
+            try:
+                watcher.watch([filename])
+                self.assertFalse(watcher.wait())
+                with open(filename, 'w') as file:
+                    file.write('\n')
+                self.assertTrue(watcher.wait())
+                self.assertFalse(watcher.wait())
+            finally:
+                watcher.close()
+
+    def test_import_function(self):
+        self.assertIs(validation.validate_data_types,
+                      daemon.import_function(
+                          daemon_client.get_validation_names(
+                              [validation.validate_data_types])[0]))
+        with self.assertRaises(ValueError):
+            daemon.import_function('beancount.ops.validation.nonexistent')
+        with self.assertRaises(ValueError):
+            daemon.import_function('os.system')
+        with self.assertRaises(ValueError):
+            daemon.import_function('unittest.main')
+        with self.assertRaises(ValueError):
+            daemon.import_function('nonexistent_plugin.validate', {'nonexistent_plugin'})
+        self.assertIs(unittest.main, daemon.import_function('unittest.main', {'unittest'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -43,7 +43,8 @@ def do_parse(filename, unused_args):
       filename: A string, the Beancount input filename.
     """
     from beancount.parser import parser
-    entries, errors, _ = parser.parse_file(filename, yydebug=1)
+    for _ in parser.iter_parse_file(filename, yydebug=1):
+        pass
 
 
 def do_roundtrip(filename, unused_args):
@@ -0,0 +1,93 @@
+"""Export a Beancount ledger to a binary snapshot, or import one back.
+
+A snapshot contains the fully processed list of directives of a ledger, along
+with its errors and options, in a compact binary format which is much faster to
+read than parsing the input files again. Importing a snapshot prints its
+directives back in Beancount syntax.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import logging
+import sys
+
+from beancount import loader
+from beancount.parser import printer
+from beancount.parser import snapshot
+from beancount.utils import misc_utils
+from beancount.utils import version
+
+
+def do_export(opts):
+    """Load a ledger and write its snapshot.
+
+    Args:
+      opts: The parsed command-line options.
+    Returns:
+      An integer, the exit code.
+    """
+    entries, errors, options_map = loader.load_file(opts.filename,
+                                                    log_timings=logging.info,
+                                                    log_errors=sys.stderr)
+    with misc_utils.log_time('beancount.parser.snapshot.dump', logging.info):
+        with open(opts.snapshot, 'wb') as file:
+            snapshot.dump(entries, errors, options_map, file,
+                          compress=opts.compress)
+    return 0
+
+
+def do_import(opts):
+    """Read a snapshot and print its directives.
+
+    Args:
+      opts: The parsed command-line options.
+    Returns:
+      An integer, the exit code.
+    """
+    with misc_utils.log_time('beancount.parser.snapshot.load', logging.info):
+        try:
+            with open(opts.snapshot, 'rb') as file:
+                entries, errors, options_map = snapshot.load(file)
+        except snapshot.SnapshotError as exc:
+            logging.error("Could not read snapshot %s: %s", opts.snapshot, exc)
+            return 1
+
+    outfile = open(opts.output, 'w') if opts.output else sys.stdout
+    dcontext = options_map['dcontext'] if options_map else None
+    printer.print_entries(entries, dcontext, file=outfile)
+    if errors:
+        printer.print_errors(errors, file=sys.stderr)
+    return 0
+
+
+def main():
+    parser = version.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Print timings.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    export_parser = subparsers.add_parser('export', help=do_export.__doc__.splitlines()[0])
+    export_parser.add_argument('filename', help='Beancount input filename')
+    export_parser.add_argument('snapshot', help='Snapshot filename to write')
+    export_parser.add_argument('--no-compress', dest='compress', action='store_false',
+                               default=True,
+                               help="Don't compress the snapshot.")
+    export_parser.set_defaults(function=do_export)
+
+    import_parser = subparsers.add_parser('import', help=do_import.__doc__.splitlines()[0])
+    import_parser.add_argument('snapshot', help='Snapshot filename to read')
+    import_parser.add_argument('-o', '--output', action='store',
+                               help="Output file (stdout if not specified)")
+    import_parser.set_defaults(function=do_import)
+
+    opts = parser.parse_args()
+    if not hasattr(opts, 'function'):
+        parser.error("A command is required: export or import.")
+
+    logging.basicConfig(level=logging.INFO if opts.verbose else logging.WARNING,
+                        format='%(levelname)-8s: %(message)s')
+    return opts.function(opts)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+from os import path
+
+from beancount.utils import test_utils
+from beancount.parser import cmptest
+from beancount.parser import parser
+from beancount.scripts import snapshot
+
+
+class TestScriptSnapshot(cmptest.TestCase):
+
+    @test_utils.docfile
+    def test_export_import(self, filename):
+        """
+        2013-01-01 open Expenses:Restaurant
+        2013-01-01 open Assets:Cash
+
+        2014-03-02 * "Something"
+          Expenses:Restaurant   50.02 USD
+          Assets:Cash
+        """
+        with test_utils.tempdir() as tmp:
+            snapshot_filename = path.join(tmp, 'ledger.snapshot')
+            with test_utils.capture('stdout', 'stderr'):
+                result = test_utils.run_with_args(
+                    snapshot.main, ['export', filename, snapshot_filename])
+            self.assertEqual(0, result)
+            self.assertTrue(path.exists(snapshot_filename))
+
+            with test_utils.capture('stdout', 'stderr') as (stdout, _):
+                result = test_utils.run_with_args(
+                    snapshot.main, ['import', snapshot_filename])
+            self.assertEqual(0, result)
+
+        entries, _, _ = parser.parse_string(stdout.getvalue())
+        self.assertEqualEntries("""
+          2013-01-01 open Expenses:Restaurant
+          2013-01-01 open Assets:Cash
+
+          2014-03-02 * "Something"
+            Expenses:Restaurant   50.02 USD
+            Assets:Cash          -50.02 USD
+        """, entries)
+
+    def test_import_invalid(self):
+        with test_utils.tempdir() as tmp:
+            snapshot_filename = path.join(tmp, 'ledger.snapshot')
+            with open(snapshot_filename, 'wb') as file:
+                file.write(b'Not a snapshot')
+            with test_utils.capture('stdout', 'stderr') as (_, stderr):
+                result = test_utils.run_with_args(
+                    snapshot.main, ['import', snapshot_filename])
+            self.assertEqual(1, result)
+            self.assertRegex(stderr.getvalue(), 'Not a Beancount snapshot')
@@ -30,9 +30,24 @@ def log_time(operation_name, log_timings, indent=0):
     time1 = time()
     yield time1
     time2 = time()
+    log_duration(operation_name, log_timings, time2 - time1, indent)
+
+
+def log_duration(operation_name, log_timings, duration, indent=0):
+    """Log the time an operation took, in the same format as log_time().
+
+    This is useful for operations timed elsewhere, e.g., in another process.
+
+    Args:
+      operation_name: A string, a label for the name of the operation.
+      log_timings: A function to write log messages to, or None.
+      duration: A float, the duration of the operation, in seconds.
+      indent: An integer, the indentation level for the format of the timing
+        line.
+    """
     if log_timings:
         log_timings("Operation: {:48} Time: {}{:6.0f} ms".format(
-            "'{}'".format(operation_name), '      '*indent, (time2 - time1) * 1000))
+            "'{}'".format(operation_name), '      '*indent, duration * 1000))
 
 
 @contextlib.contextmanager
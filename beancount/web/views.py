@@ -80,15 +80,18 @@ class View:
         # the current period's net income, closing the period.
         self.closing_entries = summarize.cap_opt(self.entries, options_map)
 
-        # Realize the three sets of entries.
+        # Realize the three sets of entries. The opening entries are a prefix
+        # of the entries of the view, so the realization of the view continues
+        # from a snapshot of the opening one.
         account_types = options.get_account_types(options_map)
+        builder = realization.RealizationBuilder(account_types)
         with misc_utils.log_time('realize_opening', logging.info):
-            self.opening_real_accounts = realization.realize(self.opening_entries,
-                                                             account_types)
+            builder.extend(self.opening_entries)
+            self.opening_real_accounts = builder.snapshot()
 
         with misc_utils.log_time('realize', logging.info):
-            self.real_accounts = realization.realize(self.entries,
-                                                     account_types)
+            builder.extend(self.entries[len(self.opening_entries):])
+            self.real_accounts = builder.real_root
 
         with misc_utils.log_time('realize_closing', logging.info):
             self.closing_real_accounts = realization.realize(self.closing_entries,
@@ -146,7 +149,8 @@ class AllView(View):
 class YearView(View):
     """A view of the entries for a single year."""
 
-    def __init__(self, entries, options_map, title, year, first_month=1):
+    def __init__(self, entries, options_map, title, year, first_month=1,
+                 balance_index=None):
         """Create a view clamped to one year.
 
         Note: this is the only view where the entries are summarized and
@@ -158,9 +162,12 @@ class YearView(View):
           title: A string, the title of this view.
           year: An integer, the year of the exercise period.
           first_month: The calendar month (starting with 1) with which the year opens.
+          balance_index: An optional BalanceIndex built from 'entries', to
+            compute the balances at the beginning of the year with.
         """
         self.year = year
         self.first_month = first_month
+        self.balance_index = balance_index
         if not (1 <= first_month <= 12):
             raise ValueError("Invalid month: {}".format(first_month))
         View.__init__(self, entries, options_map, title)
@@ -174,14 +181,16 @@ class YearView(View):
         with misc_utils.log_time('clamp', logging.info):
             entries, index = summarize.clamp_opt(entries,
                                                  begin_date, end_date,
-                                                 options_map)
+                                                 options_map,
+                                                 self.balance_index)
         return entries, index, end_date
 
 
 class MonthView(View):
     """A view of the entries for a single month."""
 
-    def __init__(self, entries, options_map, title, year, month):
+    def __init__(self, entries, options_map, title, year, month,
+                 balance_index=None):
         """Create a view clamped to one month.
 
         Args:
@@ -190,9 +199,12 @@ class MonthView(View):
           title: A string, the title of this view.
           year: An integer, the year of period.
           month: An integer, the month to be used as year end.
+          balance_index: An optional BalanceIndex built from 'entries', to
+            compute the balances at the beginning of the month with.
         """
         self.year = year
         self.month = month
+        self.balance_index = balance_index
         View.__init__(self, entries, options_map, title)
 
         self.monthly = MonthNavigation.FULL
@@ -205,7 +217,8 @@ class MonthView(View):
         with misc_utils.log_time('clamp', logging.info):
             entries, index = summarize.clamp_opt(entries,
                                                  begin_date, end_date,
-                                                 options_map)
+                                                 options_map,
+                                                 self.balance_index)
         return entries, index, end_date
 
 
@@ -5,6 +5,7 @@ import unittest
 
 from beancount import loader
 from beancount.parser import options
+from beancount.core import balance_index
 from beancount.core import realization
 from beancount.web import views
 
@@ -122,6 +123,22 @@ class TestViews(unittest.TestCase):
         with self.assertRaises(ValueError):
             view = views.YearView(self.entries, self.options_map, 'Year', 2013, 13)
 
+    def test_YearView_balance_index(self):
+        index = balance_index.BalanceIndex(self.entries)
+        for year, month in [(2012, 1), (2013, 1), (2013, 5), (2014, 1)]:
+            expected = views.YearView(self.entries, self.options_map, 'Year',
+                                      year, month)
+            view = views.YearView(self.entries, self.options_map, 'Year',
+                                  year, month, index)
+            self.assertEqual(expected.entries, view.entries)
+            self.assertEqual(expected.opening_entries, view.opening_entries)
+
+            expected = views.MonthView(self.entries, self.options_map, 'Month',
+                                       year, month)
+            view = views.MonthView(self.entries, self.options_map, 'Month',
+                                   year, month, index)
+            self.assertEqual(expected.entries, view.entries)
+
     def test_TagView(self):
         view = views.TagView(self.entries, self.options_map, 'Tag', {'trip1'})
         self.assertNotEqual([], view.entries)
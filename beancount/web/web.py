@@ -23,6 +23,7 @@ from beancount.core import data
 from beancount.core import getters
 from beancount.core import account
 from beancount.core import account_types
+from beancount.core import balance_index
 from beancount.core import compare
 from beancount.core import convert
 from beancount.ops import basicops
@@ -382,9 +383,10 @@ def link(link=None):
 def context_(ehash=None):
     "Render the before & after context around a transaction entry."
 
-    matching_entries = [entry
-                        for entry in app.entries
-                        if ehash == compare.hash_entry(entry)]
+    # Index the entries by hash on the first lookup since the last reload.
+    if app.entries_by_hash is None:
+        app.entries_by_hash = compare.index_entries(app.entries)
+    matching_entries = app.entries_by_hash.get(ehash, [])
 
     oss = io.StringIO()
     if len(matching_entries) == 0:
@@ -960,6 +962,20 @@ def url_restrict_generator(url_prefix):
     return url_restrict_handler
 
 
+def get_balance_index(app):
+    """Return the index of the balances of the accounts at any date.
+
+    This is built on the first call after each load, and shared by all the
+    views clamped to a period.
+
+    Returns:
+      An instance of BalanceIndex, built from all the entries.
+    """
+    if app.balance_index is None:
+        app.balance_index = balance_index.BalanceIndex(app.entries)
+    return app.balance_index
+
+
 def get_all_view(app):
     """Return a view of all transactions.
 
@@ -982,7 +998,8 @@ def month(year=None, month=None, path=None):
     month = int(month)
     date = datetime.date(year, month, 1)
     text = date.strftime('%B %Y')
-    return views.MonthView(app.entries, app.options, text, year, month)
+    return views.MonthView(app.entries, app.options, text, year, month,
+                           get_balance_index(app))
 
 @app.route(r'/view/year/<year:re:\d\d\d\d>/<path:re:.*>', name='year')
 @handle_view(3)
@@ -990,7 +1007,7 @@ def year(year=None, path=None):
     year = int(year)
     first_month = app.args.first_month
     return views.YearView(app.entries, app.options, 'Year {:4d}'.format(year),
-                          year, first_month)
+                          year, first_month, get_balance_index(app))
 
 @app.route(r'/view/tag/<tag:re:[^/]*>/<path:re:.*>', name='tag')
 @handle_view(3)
@@ -1049,6 +1066,10 @@ def auto_reload_input_file(callback):
             # Pre-compute the list of active years.
             app.active_years = list(getters.get_active_years(entries))
 
+            # The indexes of entries by hash and of balances are built on demand.
+            app.entries_by_hash = None
+            app.balance_index = None
+
             # Reset the view cache.
             app.views.clear()
 
@@ -1109,6 +1130,8 @@ def run_app(args, quiet=None):
         app_installs.append(url_restrictor)
 
     app.options = None
+    app.entries_by_hash = None
+    app.balance_index = None
 
     # Add an account transformer.
     app.account_xform = account.AccountTransformer('__' if args.no_colons else None)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Benchmark checking the balance assertions of a ledger incrementally.
+
+This generates accounts with daily transactions and monthly balance assertions
+on each account and on their common parent, and checks them from scratch, and
+then with the checkpoints of a previous check, for an unchanged ledger, one
+with a month of entries appended, and one modified halfway through.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import datetime
+import logging
+import random
+import time
+
+from beancount.core import data
+from beancount.ops import balance
+from beancount.parser import parser
+
+
+def generate_ledger(num_accounts, num_days):
+    """Generate the text of a ledger with many balance assertions.
+
+    Args:
+      num_accounts: An integer, the number of asset accounts.
+      num_days: An integer, the number of days of transactions.
+    Returns:
+      A string, Beancount input.
+    """
+    rnd = random.Random(0)
+    accounts = ['Assets:Bank:Account{:03d}'.format(index) for index in range(num_accounts)]
+    lines = ['2000-01-01 open Expenses:Misc']
+    lines.extend('2000-01-01 open {}'.format(account) for account in accounts)
+    balances = dict.fromkeys(accounts, 0)
+    date = datetime.date(2000, 1, 2)
+    for _ in range(num_days):
+        for account in rnd.sample(accounts, min(10, num_accounts)):
+            number = rnd.randrange(-100, 200)
+            balances[account] += number
+            lines.append('{} *\n  {}  {} USD\n  Expenses:Misc\n'.format(
+                date, account, number))
+        date += datetime.timedelta(days=1)
+        if date.day == 1:
+            for account in accounts:
+                lines.append('{} balance {}  {} USD'.format(date, account,
+                                                             balances[account]))
+            lines.append('{} balance Assets:Bank  {} USD'.format(
+                date, sum(balances.values())))
+    return '\n'.join(lines)
+
+
+def timed(name, function, *args):
+    """Run a function and log the time it took.
+
+    Args:
+      name: A string, the name of the operation.
+      function: A function to call.
+      *args: Its arguments.
+    Returns:
+      The function's return value.
+    """
+    time_before = time.time()
+    result = function(*args)
+    logging.info("%-48s %8.0f ms", name, (time.time() - time_before) * 1000)
+    return result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser_ = argparse.ArgumentParser(description=__doc__.strip())
+    parser_.add_argument('--accounts', type=int, default=100,
+                         help="Number of asset accounts.")
+    parser_.add_argument('--days', type=int, default=3650,
+                         help="Number of days of transactions.")
+    args = parser_.parse_args()
+
+    entries, errors, options_map = timed('parse', parser.parse_string,
+                                         generate_ledger(args.accounts, args.days))
+    assert not errors, errors
+
+    # The same ledger, a month later.
+    appended_entries, errors, _ = parser.parse_string(
+        generate_ledger(args.accounts, args.days + 30))
+    assert not errors, errors
+    logging.info("%d directives, %d balance assertions", len(entries),
+                 sum(isinstance(entry, data.Balance) for entry in entries))
+
+    expected = timed('check', balance.check, entries, options_map, None)
+    checkpoints = balance.BalanceCheckpoints()
+    actual = timed('check, recording checkpoints', balance.check, entries, options_map,
+                   checkpoints)
+    assert actual == expected
+
+    for name, new_entries in [
+            ('unchanged', entries),
+            ('appended', appended_entries),
+            ('modified halfway', (entries[:len(entries) // 2] +
+                                  entries[len(entries) // 2 + 1:]))]:
+        expected = balance.check(new_entries, options_map)
+        previous_checkpoints = balance.BalanceCheckpoints()
+        balance.check(entries, options_map, previous_checkpoints)
+        actual = timed('check with checkpoints, {}'.format(name),
+                       balance.check, new_entries, options_map, previous_checkpoints)
+        assert actual == expected
+        logging.info("%d skipped, %d recomputed", len(previous_checkpoints.skipped),
+                     len(previous_checkpoints.recomputed))
+
+
+if __name__ == '__main__':
+    main()
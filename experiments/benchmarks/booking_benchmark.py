@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Benchmark booking reductions against accounts holding many lots.
+
+This generates brokerage accounts accumulating a lot for every purchase, e.g.
+from reinvested dividends, with periodic sales reduced with FIFO or LIFO, along
+with simple expenses, and books them with the full booking algorithm, with and
+without the index of lots, and in parallel processes.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import collections
+import datetime
+import logging
+import random
+import time
+from unittest import mock
+
+from beancount.core.data import Booking
+from beancount.parser import booking_full
+from beancount.parser import parser
+
+
+def generate_ledger(num_lots, sell_every, num_accounts=1, expenses_every=0):
+    """Generate the text of a ledger with many lots.
+
+    Args:
+      num_lots: An integer, the number of lots to purchase.
+      sell_every: An integer, the number of purchases between sales.
+      num_accounts: An integer, the number of brokerage accounts.
+      expenses_every: An integer, the number of expenses for each purchase.
+    Returns:
+      A string, Beancount input.
+    """
+    rnd = random.Random(0)
+    accounts = ['Assets:Broker{}'.format(index) for index in range(num_accounts)]
+    lines = ['2000-01-01 open Assets:Cash',
+             '2000-01-01 open Expenses:Food',
+             '2000-01-01 open Income:Gains']
+    lines.extend('2000-01-01 open {}'.format(account) for account in accounts)
+    date = datetime.date(2000, 1, 2)
+    for index in range(num_lots):
+        date += datetime.timedelta(days=rnd.randrange(2))
+        account = rnd.choice(accounts)
+        lines.append('{} * "Buy"\n'
+                     '  {}   {}.{:03d} HOOL {{{}.{:02d} USD}}\n'
+                     '  Assets:Cash\n'.format(date, account, rnd.randrange(1, 10),
+                                              rnd.randrange(1000),
+                                              rnd.randrange(50, 150),
+                                              rnd.randrange(100)))
+        if index % sell_every == sell_every - 1:
+            lines.append('{} * "Sell"\n'
+                         '  {}   -{} HOOL {{}}\n'
+                         '  Assets:Cash      100.00 USD\n'
+                         '  Income:Gains\n'.format(date, account, rnd.randrange(1, 5)))
+        for _ in range(expenses_every):
+            lines.append('{} * "Lunch"\n'
+                         '  Expenses:Food     {}.{:02d} USD\n'
+                         '  Assets:Cash      -{}.{:02d} USD\n'.format(
+                             date, *([rnd.randrange(5, 30), rnd.randrange(100)] * 2)))
+    return '\n'.join(lines)
+
+
+def book(entries, options_map, method, use_index):
+    """Book the entries.
+
+    Args:
+      entries: A list of unbooked directives.
+      options_map: An options map.
+      method: A Booking enum, the booking method of all the accounts.
+      use_index: A boolean, false to book against the inventories only.
+    Returns:
+      A list of booked directives.
+    """
+    methods = collections.defaultdict(lambda: method)
+    if use_index:
+        booked_entries, errors, _ = booking_full._book(entries, options_map, methods)
+    else:
+        book_reductions = booking_full.book_reductions
+        categorize_by_currency = booking_full.categorize_by_currency
+        with mock.patch.object(booking_full, 'book_reductions',
+                               lambda *args: book_reductions(*args[:4])), \
+             mock.patch.object(booking_full, 'categorize_by_currency',
+                               lambda *args: categorize_by_currency(*args[:2])):
+            booked_entries, errors, _ = booking_full._book(entries, options_map, methods)
+    assert not errors, errors
+    return booked_entries
+
+
+def timed(name, function, *args):
+    """Run a function and log the time it took.
+
+    Args:
+      name: A string, the name of the operation.
+      function: A function to call.
+      *args: Its arguments.
+    Returns:
+      The function's return value.
+    """
+    time_before = time.time()
+    result = function(*args)
+    logging.info("%-48s %8.0f ms", name, (time.time() - time_before) * 1000)
+    return result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser_ = argparse.ArgumentParser(description=__doc__.strip())
+    parser_.add_argument('--lots', type=int, default=10000,
+                         help="Number of lots to purchase.")
+    parser_.add_argument('--sell-every', type=int, default=10,
+                         help="Number of purchases between sales.")
+    parser_.add_argument('--accounts', type=int, default=50,
+                         help="Number of brokerage accounts for parallel booking.")
+    parser_.add_argument('--expenses-every', type=int, default=10,
+                         help="Number of expenses per purchase for parallel booking.")
+    parser_.add_argument('--processes', type=int, default=4,
+                         help="Number of processes for parallel booking.")
+    args = parser_.parse_args()
+
+    entries, errors, options_map = timed('parse', parser.parse_string,
+                                         generate_ledger(args.lots, args.sell_every))
+    assert not errors, errors
+    for method in Booking.FIFO, Booking.LIFO:
+        expected = timed('{} without index'.format(method.name),
+                         book, entries, options_map, method, False)
+        actual = timed('{} with index'.format(method.name),
+                       book, entries, options_map, method, True)
+        assert actual == expected
+
+    entries, errors, options_map = timed('parse', parser.parse_string,
+                                         generate_ledger(args.lots, args.sell_every,
+                                                         args.accounts,
+                                                         args.expenses_every))
+    assert not errors, errors
+    methods = collections.defaultdict(lambda: Booking.FIFO)
+    expected = timed('FIFO sequential', booking_full._book,
+                     entries, options_map, methods)
+    actual = timed('FIFO in {} processes'.format(args.processes),
+                   booking_full._book_parallel,
+                   entries, options_map, methods, args.processes)
+    assert actual[0] == expected[0]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Benchmark the stable hashing of entries and looking them up by hash.
+
+This generates transactions with tags and links, hashes all of them, and looks
+up entries by hash, scanning the entries like the web interface used to and with
+an index of the entries by hash.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import datetime
+import logging
+import random
+import time
+
+from beancount.core import compare
+from beancount.parser import parser
+
+
+def generate_ledger(num_entries):
+    """Generate the text of a ledger with many transactions.
+
+    Args:
+      num_entries: An integer, the number of transactions.
+    Returns:
+      A string, Beancount input.
+    """
+    rnd = random.Random(0)
+    lines = ['2000-01-01 open Assets:Cash',
+             '2000-01-01 open Expenses:Food']
+    date = datetime.date(2000, 1, 2)
+    for index in range(num_entries):
+        date += datetime.timedelta(days=rnd.randrange(2))
+        number = '{}.{:02d}'.format(rnd.randrange(1, 100), rnd.randrange(100))
+        lines.append('{} * "Store {}" "Lunch" #tag{} ^link{}\n'
+                     '  Expenses:Food   {} USD\n'
+                     '  Assets:Cash    -{} USD\n'.format(
+                         date, rnd.randrange(100), rnd.randrange(10), index,
+                         number, number))
+    return '\n'.join(lines)
+
+
+def scan(entries, hashes):
+    """Look up entries by hash by hashing all the entries for each of them.
+
+    Args:
+      entries: A list of directives.
+      hashes: A list of hash strings.
+    Returns:
+      A list of lists of matching directives.
+    """
+    return [[entry for entry in entries if hash_ == compare.hash_entry(entry)]
+            for hash_ in hashes]
+
+
+def lookup(entries, hashes):
+    """Look up entries by hash with an index of the entries.
+
+    Args:
+      entries: A list of directives.
+      hashes: A list of hash strings.
+    Returns:
+      A list of lists of matching directives.
+    """
+    index = compare.index_entries(entries)
+    return [index.get(hash_, []) for hash_ in hashes]
+
+
+def timed(name, function, *args):
+    """Run a function and log the time it took.
+
+    Args:
+      name: A string, the name of the operation.
+      function: A function to call.
+      *args: Its arguments.
+    Returns:
+      The function's return value.
+    """
+    time_before = time.time()
+    result = function(*args)
+    logging.info("%-48s %8.0f ms", name, (time.time() - time_before) * 1000)
+    return result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser_ = argparse.ArgumentParser(description=__doc__.strip())
+    parser_.add_argument('--entries', type=int, default=50000,
+                         help="Number of transactions.")
+    parser_.add_argument('--lookups', type=int, default=20,
+                         help="Number of lookups by hash.")
+    args = parser_.parse_args()
+
+    entries, errors, _ = timed('parse', parser.parse_string,
+                               generate_ledger(args.entries))
+    assert not errors, errors
+
+    hashes = timed('hash', lambda: [compare.stable_hash_namedtuple(
+        entry, compare.IGNORED_FIELD_NAMES) for entry in entries])
+
+    hashes = random.Random(0).sample(hashes, args.lookups)
+    expected = timed('{} lookups by scanning'.format(args.lookups),
+                     scan, entries, hashes)
+    actual = timed('{} lookups with an index'.format(args.lookups),
+                   lookup, entries, hashes)
+    assert actual == expected
+
+
+if __name__ == '__main__':
+    main()
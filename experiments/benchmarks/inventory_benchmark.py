@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Benchmark summing up a large stream of postings into inventories.
+
+This compares adding postings to an Inventory with add_position() against
+accumulating them with an InventoryAccumulator and with a
+ScaledInventoryAccumulator and converting them to an Inventory at the end, on a
+stream mixing cash postings and lots held at cost, spread over a number of
+accounts like a realistic ledger. It then times booking and realizing the
+example ledger with each of the two numeric backends.
+
+Run with --pydecimal to measure the pure Python implementation of the decimal
+module, which is what Beancount gets on installations without the C one.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import collections
+import datetime
+import io
+import logging
+import random
+import sys
+import time
+
+if __name__ == '__main__' and '--pydecimal' in sys.argv:
+    import _pydecimal
+    sys.modules['decimal'] = _pydecimal
+
+# pylint: disable=wrong-import-position
+from beancount.core.amount import Amount
+from beancount.core.number import D
+from beancount.core import number
+from beancount.core.position import Cost
+from beancount.core import data
+from beancount.core import inventory
+from beancount.core import realization
+from beancount.parser import booking
+from beancount.parser import parser
+from beancount.scripts import example
+
+
+def generate_postings(num_postings, num_accounts):
+    """Generate a list of postings.
+
+    Args:
+      num_postings: An integer, the number of postings to generate.
+      num_accounts: An integer, the number of accounts to spread them over.
+    Returns:
+      A list of Posting instances.
+    """
+    rnd = random.Random(0)
+    accounts = ['Assets:Account{:03d}'.format(index) for index in range(num_accounts)]
+    currencies = ['USD', 'CAD', 'EUR']
+    start_date = datetime.date(2000, 1, 1)
+    costs = [Cost(D('{}.{:02d}'.format(rnd.randrange(10, 500), rnd.randrange(100))),
+                  'USD', start_date + datetime.timedelta(days=day), None)
+             for day in range(50)]
+    postings = []
+    for _ in range(num_postings):
+        account = rnd.choice(accounts)
+        if rnd.random() < 0.8:
+            units = Amount(D('{}.{:02d}'.format(rnd.randrange(-1000, 1000),
+                                                rnd.randrange(100))),
+                           rnd.choice(currencies))
+            cost = None
+        else:
+            units = Amount(D(rnd.randrange(-20, 20)), 'HOOL')
+            cost = rnd.choice(costs)
+        postings.append(data.Posting(account, units, cost, None, None, None))
+    return postings
+
+
+def sum_inventories(postings):
+    """Sum up postings by account with Inventory.add_position()."""
+    balances = collections.defaultdict(inventory.Inventory)
+    for posting in postings:
+        balances[posting.account].add_position(posting)
+    return balances
+
+
+def sum_accumulators(postings, accumulator_class):
+    """Sum up postings by account with an accumulator's add_position()."""
+    accumulators = collections.defaultdict(accumulator_class)
+    for posting in postings:
+        accumulators[posting.account].add_position(posting)
+    return {account: accumulator.to_inventory()
+            for account, accumulator in accumulators.items()}
+
+
+def generate_ledger(num_years):
+    """Generate the text of the example ledger.
+
+    Args:
+      num_years: An integer, the number of years of transactions.
+    Returns:
+      A string, Beancount input.
+    """
+    random.seed(0)
+    date_end = datetime.date(2017, 1, 1)
+    oss = io.StringIO()
+    example.write_example_file(datetime.date(1980, 5, 12),
+                               date_end.replace(year=date_end.year - num_years),
+                               date_end, False, oss)
+    return oss.getvalue()
+
+
+def book_and_realize(string, backend, repeat=5):
+    """Time booking and realizing a ledger with a numeric backend.
+
+    Args:
+      string: A string, Beancount input.
+      backend: A string, the name of the numeric backend.
+      repeat: An integer, the number of runs to log the best times of.
+    Returns:
+      The realization of the booked entries.
+    """
+    inventory.ACCUMULATOR_CLASS = inventory.get_accumulator_class(backend)
+    book_times, realize_times = [], []
+    for _ in range(repeat):
+        entries, _, options_map = parser.parse_string(string)
+        time_before = time.time()
+        entries, _ = booking.book(entries, options_map)
+        book_times.append(time.time() - time_before)
+        time_before = time.time()
+        real_root = realization.realize(entries)
+        realize_times.append(time.time() - time_before)
+    logging.info("%-48s %8.0f ms", 'book, {}'.format(backend), min(book_times) * 1000)
+    logging.info("%-48s %8.0f ms", 'realize, {}'.format(backend),
+                 min(realize_times) * 1000)
+    return real_root
+
+
+def timed(name, function, *args):
+    """Run a function and log the time it took.
+
+    Args:
+      name: A string, the name of the operation.
+      function: A function to call.
+      *args: Its arguments.
+    Returns:
+      The function's return value.
+    """
+    time_before = time.time()
+    result = function(*args)
+    logging.info("%-48s %8.0f ms", name, (time.time() - time_before) * 1000)
+    return result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--postings', type=int, default=1000000,
+                        help="Number of postings to generate.")
+    parser.add_argument('--accounts', type=int, default=200,
+                        help="Number of accounts to spread the postings over.")
+    parser.add_argument('--years', type=int, default=10,
+                        help="Number of years of the example ledger.")
+    parser.add_argument('--pydecimal', action='store_true',
+                        help="Use the pure Python implementation of decimal.")
+    args = parser.parse_args()
+    logging.info("fast C decimal: %s", number.is_fast_decimal(number.decimal))
+
+    postings = timed('generate postings', generate_postings,
+                     args.postings, args.accounts)
+    expected = timed('Inventory.add_position', sum_inventories, postings)
+    for accumulator_class in (inventory.InventoryAccumulator,
+                              inventory.ScaledInventoryAccumulator):
+        name = '{}.add_position'.format(accumulator_class.__name__)
+        actual = timed(name, sum_accumulators, postings, accumulator_class)
+        assert actual == expected
+
+    logging.getLogger().setLevel(logging.WARNING)
+    string = generate_ledger(args.years)
+    logging.getLogger().setLevel(logging.INFO)
+    expected = book_and_realize(string, 'decimal')
+    actual = book_and_realize(string, 'scaled')
+    assert actual == expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Benchmark the memory used by the metadata of the directives and postings.
+
+This generates the example ledger over many years, and measures the memory
+allocated for parsing it and for loading it, with the compact Metadata
+containers, and with a dict for the metadata of every directive and posting, as
+before them.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import collections
+import datetime
+import gc
+import io
+import logging
+import random
+import time
+import tracemalloc
+from unittest import mock
+
+from beancount.core import data
+from beancount.parser import grammar
+from beancount.parser import parser
+from beancount.scripts import example
+from beancount import loader
+
+
+def new_metadata_dict(filename, lineno, kvlist=None):
+    """Create a metadata dict, like new_metadata() did before Metadata."""
+    meta = {'filename': filename,
+            'lineno': lineno}
+    if kvlist:
+        meta.update(kvlist)
+    return meta
+
+
+def generate_ledger(num_years):
+    """Generate the text of the example ledger.
+
+    Args:
+      num_years: An integer, the number of years of transactions.
+    Returns:
+      A string, Beancount input.
+    """
+    random.seed(0)
+    date_end = datetime.date(2017, 1, 1)
+    oss = io.StringIO()
+    example.write_example_file(datetime.date(1980, 5, 12),
+                               date_end.replace(year=date_end.year - num_years),
+                               date_end, False, oss)
+    return oss.getvalue()
+
+
+def measure(name, function, *args):
+    """Run a function and log the memory still allocated by its return value.
+
+    Args:
+      name: A string, the name of the operation.
+      function: A function to call.
+      *args: Its arguments.
+    Returns:
+      The function's return value.
+    """
+    gc.collect()
+    tracemalloc.start()
+    time_before = time.time()
+    result = function(*args)
+    elapsed = time.time() - time_before
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    logging.info("%-40s %8.1f MB %8.0f ms (traced)", name, size / 1024 / 1024,
+                 elapsed * 1000)
+    return result
+
+
+def count_metadata(entries):
+    """Count the metadata containers of the directives and postings by type."""
+    counter = collections.Counter()
+    for entry in entries:
+        counter[type(entry.meta).__name__] += 1
+        if isinstance(entry, data.Transaction):
+            for posting in entry.postings:
+                counter[type(posting.meta).__name__] += 1
+    return counter
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser_ = argparse.ArgumentParser(description=__doc__.strip())
+    parser_.add_argument('--years', type=int, default=20,
+                         help="Number of years of the example ledger.")
+    args = parser_.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    string = generate_ledger(args.years)
+    logging.getLogger().setLevel(logging.INFO)
+    logging.info("%d lines", string.count('\n'))
+
+    with mock.patch.object(grammar, 'new_metadata', new_metadata_dict), \
+         mock.patch.object(data, 'new_metadata', new_metadata_dict):
+        result = measure('parse, dicts', parser.parse_string, string)
+        logging.info("%s", dict(count_metadata(result[0])))
+        del result
+        result = measure('load, dicts', loader.load_string, string)
+        logging.info("%s", dict(count_metadata(result[0])))
+        del result
+
+    result = measure('parse, compact', parser.parse_string, string)
+    logging.info("%s", dict(count_metadata(result[0])))
+    del result
+    result = measure('load, compact', loader.load_string, string)
+    logging.info("%s", dict(count_metadata(result[0])))
+    del result
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Benchmark the methods of the builders called back by the lexer and grammar.
+
+This generates a ledger of transactions with metadata, tags and links, and lexes
+and parses it with the builders, whose token methods and most common grammar
+methods are implemented in C, and with reference builders overriding them with
+their former pure Python implementations.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import datetime
+import gc
+import logging
+import random
+import time
+
+from beancount.core.number import Decimal
+from beancount.core.number import MISSING
+from beancount.core.amount import Amount
+from beancount.parser import grammar
+from beancount.parser import lexer
+from beancount.parser import _parser
+
+
+def generate_ledger(num_transactions):
+    """Generate the text of a ledger of transactions.
+
+    Args:
+      num_transactions: An integer, the number of transactions.
+    Returns:
+      A string, Beancount input.
+    """
+    rnd = random.Random(0)
+    accounts = ['Expenses:Category{:02d}'.format(index) for index in range(50)]
+    lines = ['2000-01-01 open Assets:Bank:Checking',
+             '2000-01-01 open Liabilities:CreditCard']
+    lines.extend('2000-01-01 open {}'.format(account) for account in accounts)
+    date = datetime.date(2000, 1, 2)
+    for index in range(num_transactions):
+        date += datetime.timedelta(days=rnd.randrange(2))
+        lines.append('{} * "Payee {}" "Purchase number {}" #tag{} ^link{}\n'
+                     '  invoice: "{:06d}"\n'
+                     '  {}   {}.{:02d} USD\n'
+                     '  {}\n'.format(date, rnd.randrange(100), index,
+                                     rnd.randrange(10), index, index,
+                                     rnd.choice(accounts),
+                                     rnd.randrange(1, 1000), rnd.randrange(100),
+                                     rnd.choice(['Assets:Bank:Checking',
+                                                 'Liabilities:CreditCard'])))
+    return '\n'.join(lines)
+
+
+class PythonMethods:
+    """The pure Python implementations of the methods of the builders' base."""
+    # pylint: disable=invalid-name
+
+    def DATE(self, year, month, day):
+        return datetime.date(year, month, day)
+
+    def ACCOUNT(self, account_name):
+        if not self.account_regexp.match(account_name):
+            raise ValueError("Invalid account name: {}".format(account_name))
+        return self.accounts.setdefault(account_name, account_name)
+
+    def CURRENCY(self, currency_name):
+        self.commodities.add(currency_name)
+        return currency_name
+
+    def STRING(self, string):
+        if '\n' in string:
+            return self.check_long_string(string)
+        return string
+
+    def NUMBER(self, number):
+        if ',' in number:
+            return self.parse_number_commas(number)
+        return Decimal(number)
+
+    def TAG(self, tag):
+        return tag
+
+    def LINK(self, link):
+        return link
+
+    def KEY(self, ident):
+        return ident
+
+    def amount(self, number, currency):
+        if isinstance(number, Decimal) and currency and currency is not MISSING:
+            self.dcupdate(number, currency)
+        return Amount(number, currency)
+
+    def handle_list(self, object_list, new_object):
+        if object_list is None:
+            object_list = []
+        if new_object is not None:
+            object_list.append(new_object)
+        return object_list
+
+
+class PythonLexBuilder(PythonMethods, lexer.LexBuilder):
+    """A lexer builder with the pure Python token methods."""
+
+
+class PythonBuilder(PythonMethods, grammar.Builder):
+    """A builder with the pure Python token and grammar methods."""
+
+
+def lex(string, builder):
+    """Lex a string, returning the number of tokens."""
+    return sum(1 for _ in lexer.lex_iter_string(string, builder))
+
+
+def parse(string, builder):
+    """Parse a string, returning the number of directives."""
+    _parser.parse_string(string, builder)
+    return len(builder.entries)
+
+
+def timed(name, unit, function, *args):
+    """Run a function a few times and log the best rate of items it processed.
+
+    The garbage collector is disabled while timing, as its passes over the many
+    objects created while parsing otherwise dominate the differences.
+
+    Args:
+      name: A string, the name of the operation.
+      unit: A string, the name of the items counted by the function.
+      function: A function to call, returning a number of items.
+      *args: Its arguments.
+    """
+    times = []
+    for _ in range(10):
+        gc.collect()
+        gc.disable()
+        try:
+            time_before = time.time()
+            count = function(*args)
+            times.append(time.time() - time_before)
+        finally:
+            gc.enable()
+    logging.info("%-40s %8.0f ms %10.0f %s/sec", name, min(times) * 1000,
+                 count / min(times), unit)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser_ = argparse.ArgumentParser(description=__doc__.strip())
+    parser_.add_argument('--transactions', type=int, default=20000,
+                         help="Number of transactions.")
+    args = parser_.parse_args()
+
+    string = generate_ledger(args.transactions)
+    timed('lex, Python token methods', 'tokens', lex, string, PythonLexBuilder())
+    timed('lex', 'tokens', lex, string, lexer.LexBuilder())
+    timed('parse, Python token and grammar methods', 'directives',
+          lambda: parse(string, PythonBuilder(None)))
+    timed('parse', 'directives', lambda: parse(string, grammar.Builder(None)))
+
+    # Check that both produce the same directives.
+    expected, actual = PythonBuilder(None), grammar.Builder(None)
+    parse(string, expected)
+    parse(string, actual)
+    assert actual.entries == expected.entries
+    assert not actual.errors
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Benchmark building and querying a price map over a large price history.
+
+This compares looking up prices by date with the date-indexed price lists
+against a bisection over the (date, number) pairs with a Python key function,
+which is how prices used to be looked up.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import datetime
+import logging
+import random
+import time
+
+from beancount.core.amount import Amount
+from beancount.core.number import D
+from beancount.core import data
+from beancount.core import prices
+from beancount.utils import bisect_key
+
+
+def generate_prices(num_pairs, num_days):
+    """Generate a list of daily Price directives.
+
+    Args:
+      num_pairs: An integer, the number of commodities priced.
+      num_days: An integer, the number of consecutive days for each of them.
+    Returns:
+      A list of Price directives, sorted by date.
+    """
+    start_date = datetime.date(1950, 1, 1)
+    dates = [start_date + datetime.timedelta(days=days) for days in range(num_days)]
+    entries = []
+    for index in range(num_pairs):
+        currency = 'C{:03d}'.format(index)
+        for day, date in enumerate(dates):
+            number = D('{}.{:02d}'.format(10 + day % 1000, day % 100))
+            entries.append(data.Price(None, date, currency, Amount(number, 'USD')))
+    entries.sort(key=lambda entry: entry.date)
+    return entries
+
+
+def get_price_reference(price_map, base_quote, date):
+    """Look up a price by bisecting with a key function, as a reference."""
+    price_list = prices.get_all_prices(price_map, base_quote)
+    index = bisect_key.bisect_right_with_key(price_list, date, key=lambda x: x[0])
+    return price_list[index-1] if index else (None, None)
+
+
+def timed(name, function, *args):
+    """Run a function and log the time it took.
+
+    Args:
+      name: A string, the name of the operation.
+      function: A function to call.
+      *args: Its arguments.
+    Returns:
+      The function's return value.
+    """
+    time_before = time.time()
+    result = function(*args)
+    logging.info("%-48s %8.0f ms", name, (time.time() - time_before) * 1000)
+    return result
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('--pairs', type=int, default=40,
+                        help="Number of commodities to generate prices for.")
+    parser.add_argument('--days', type=int, default=25000,
+                        help="Number of daily prices for each commodity.")
+    parser.add_argument('--lookups', type=int, default=200000,
+                        help="Number of prices to look up.")
+    args = parser.parse_args()
+
+    entries = timed('generate prices', generate_prices, args.pairs, args.days)
+    logging.info("%d price points", len(entries))
+    price_map = timed('prices.build_price_map', prices.build_price_map, entries)
+
+    rnd = random.Random(0)
+    base_quotes = [('C{:03d}'.format(rnd.randrange(args.pairs)), 'USD')
+                   for _ in range(args.lookups)]
+    first_date, last_date = entries[0].date, entries[-1].date
+    span = (last_date - first_date).days + 30
+    dates = [first_date + datetime.timedelta(days=rnd.randrange(-10, span))
+             for _ in range(args.lookups)]
+
+    expected = timed('reference get_price (bisect with key)',
+                     lambda: [get_price_reference(price_map, base_quote, date)
+                              for base_quote, date in zip(base_quotes, dates)])
+    actual = timed('prices.get_price',
+                   lambda: [prices.get_price(price_map, base_quote, date)
+                            for base_quote, date in zip(base_quotes, dates)])
+    assert actual == expected
+    timed('prices.get_latest_price',
+          lambda: [prices.get_latest_price(price_map, base_quote)
+                   for base_quote in base_quotes])
+
+    # Price maps built by hand hold regular lists, which are indexed in place
+    # by the first lookup of each pair.
+    list_price_map = {base_quote: list(price_list)
+                      for base_quote, price_list in price_map.items()}
+    actual = timed('prices.get_price, regular lists',
+                   lambda: [prices.get_price(list_price_map, base_quote, date)
+                            for base_quote, date in zip(base_quotes, dates)])
+    assert actual == expected
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Benchmark parsing a large file in a single pass, streaming the directives.
+
+This writes a synthetic ledger of the given size to a temporary file, and counts
+its directives with iter_parse_file(), which yields them as they are built.
+Optionally, it also counts them with parse_file(), which accumulates all of them
+and needs about fifteen times the size of the input in memory. Each runs in
+its own process, to report its peak memory usage.
+"""
+__copyright__ = "Copyright (C) 2017  Martin Blais"
+__license__ = "GNU GPLv2"
+
+import argparse
+import datetime
+import logging
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+
+from beancount.parser import parser
+
+
+def write_ledger(file, size):
+    """Write a synthetic ledger of transactions.
+
+    Args:
+      file: A file object to write to.
+      size: An integer, the approximate size of the ledger in bytes.
+    """
+    rnd = random.Random(0)
+    accounts = ['Expenses:Category{:02d}'.format(index) for index in range(50)]
+    file.write('2000-01-01 open Assets:Bank:Checking\n')
+    for account in accounts:
+        file.write('2000-01-01 open {}\n'.format(account))
+    date = datetime.date(2000, 1, 2)
+    while file.tell() < size:
+        lines = []
+        for _ in range(100):
+            lines.append('{} * "Payee {}" "Purchase"\n'
+                         '  {}   {}.{:02d} USD\n'
+                         '  Assets:Bank:Checking\n\n'.format(
+                             date, rnd.randrange(100), rnd.choice(accounts),
+                             rnd.randrange(1, 1000), rnd.randrange(100)))
+        file.write(''.join(lines))
+        date += datetime.timedelta(days=1)
+
+
+def count(filename, streaming):
+    """Count the directives of a file and report the time and peak memory.
+
+    Args:
+      filename: A string, the name of the file to parse.
+      streaming: A boolean, true to use iter_parse_file().
+    Returns:
+      A tuple of the number of directives, the time in seconds and the peak
+      resident memory in megabytes.
+    """
+    time_before = time.time()
+    if streaming:
+        num_entries = sum(1 for _ in parser.iter_parse_file(filename))
+    else:
+        num_entries = len(parser.parse_file(filename)[0])
+    elapsed = time.time() - time_before
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return num_entries, elapsed, maxrss
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)-8s: %(message)s')
+    parser_ = argparse.ArgumentParser(description=__doc__.strip())
+    parser_.add_argument('--size', type=int, default=500,
+                         help="Size of the ledger, in megabytes.")
+    parser_.add_argument('--parse-file', action='store_true',
+                         help="Also count the directives with parse_file().")
+    args = parser_.parse_args()
+
+    with tempfile.NamedTemporaryFile('w', suffix='.beancount') as file:
+        write_ledger(file, args.size * 1024 * 1024)
+        file.flush()
+        logging.info("%.0f MB ledger", os.path.getsize(file.name) / 1024 / 1024)
+
+        methods = [('iter_parse_file', True)]
+        if args.parse_file:
+            methods.insert(0, ('parse_file', False))
+        for name, streaming in methods:
+            with multiprocessing.Pool(1) as pool:
+                num_entries, elapsed, maxrss = pool.apply(count, (file.name, streaming))
+            logging.info("%-16s %10d directives %8.1f s %10.0f directives/sec "
+                         "%8.0f MB peak",
+                         name, num_entries, elapsed, num_entries / elapsed, maxrss)
+
+
+if __name__ == '__main__':
+    main()
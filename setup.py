@@ -128,6 +128,8 @@ binaries = [
     ('bean-price', 'beancount.prices.price'),
     ('bean-query', 'beancount.query.shell'),
     ('bean-report', 'beancount.reports.report'),
+    ('bean-snapshot', 'beancount.scripts.snapshot'),
+    ('bean-daemon', 'beancount.scripts.daemon'),
     ('bean-sql', 'beancount.scripts.sql'),
     ('bean-web', 'beancount.web.web'),
     ('bean-identify', 'beancount.ingest.identify'),